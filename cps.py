@@ -14,8 +14,6 @@ import sys
 path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, path)
 
-from cps.main import main
-
 
 def hide_console_windows():
     import ctypes
@@ -31,6 +29,8 @@ def hide_console_windows():
 
 
 if __name__ == '__main__':
+    # Imported here, spawned worker processes (thumbnail rendering) re-run this file without the app
+    from cps.main import main
     if os.name == "nt":
         hide_console_windows()
     main()
@@ -10,6 +10,7 @@ import concurrent.futures
 from typing import List, Optional, Dict, Any
 
 from cps import logger, ub
+from cps.metadata_search_service import metadata_search_service
 from cps.search_metadata import cl
 from cps.string_helper import strip_whitespaces
 
@@ -119,11 +120,9 @@ def fetch_metadata_for_book(book_title: str, book_authors: str = "", user_id: Op
             log.debug(f"Trying metadata provider: {provider.__name__}")
             
             try:
-                # Use ThreadPoolExecutor for timeout control
-                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(provider.search, query, "", "en")
-                    results = future.result(timeout=15)  # 15 second timeout
-                    
+                # Runs on the shared metadata search pool, repeated lookups come from its cache
+                results = metadata_search_service.search_one(provider, query, "", "en", timeout=15)
+
                 if results and len(results) > 0:
                     # Return the first (best) result
                     metadata = results[0]
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+from . import logger
+
+try:
+    from natsort import natsorted as sort
+except ImportError:
+    sort = sorted  # Just use regular sort then, may cause issues with badly named pages in cbz/cbr files
+
+try:
+    import rarfile
+    use_rarfile = True
+except (ImportError, SyntaxError):
+    use_rarfile = False
+
+try:
+    from wand.image import Image
+    use_IM = True
+except (ImportError, RuntimeError):
+    use_IM = False
+
+log = logger.create()
+
+PAGE_MIMETYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bmp': 'image/bmp',
+    'avif': 'image/avif',
+}
+
+COMIC_FORMATS = ('cbz', 'zip', 'cbt', 'tar', 'cbr', 'rar')
+
+
+class ComicArchiveError(Exception):
+    pass
+
+
+class _OpenArchive:
+    """An opened comic archive with its natural sorted list of image pages."""
+
+    def __init__(self, file_path, book_format, rar_executable=None):
+        self.file_path = file_path
+        self.book_format = book_format.lower()
+        self.rar_executable = rar_executable
+        self.closed = False
+        names = self._open()
+        self.pages = sort([name for name in names if page_extension(name) in PAGE_MIMETYPES])
+        self.lock = threading.Lock()
+
+    def _open(self):
+        if self.book_format in ('cbz', 'zip'):
+            self.handle = zipfile.ZipFile(self.file_path)
+            names = self.handle.namelist()
+            self._read = self.handle.read
+        elif self.book_format in ('cbt', 'tar'):
+            self.handle = tarfile.TarFile(self.file_path)
+            names = [member.name for member in self.handle.getmembers() if member.isfile()]
+            self._read = lambda name: self.handle.extractfile(name).read()
+        elif self.book_format in ('cbr', 'rar'):
+            if not use_rarfile:
+                raise ComicArchiveError('Unrar is not supported please install python rarfile extension')
+            if self.rar_executable:
+                rarfile.UNRAR_TOOL = self.rar_executable
+            try:
+                self.handle = rarfile.RarFile(self.file_path)
+            except rarfile.Error as ex:
+                raise ComicArchiveError('Unrar binary not found, or unable to decompress file: {}'.format(ex))
+            names = self.handle.namelist()
+            self._read = self.handle.read
+        else:
+            raise ComicArchiveError('unsupported comic format {}'.format(self.book_format))
+        return names
+
+    def read(self, page):
+        # zip, tar and rar handles share one file position, so reads are serialized per archive
+        with self.lock:
+            if not self.closed:
+                return self._read(self.pages[page])
+            # Evicted while the request still held it, read this page from a short lived handle
+            self._open()
+            try:
+                return self._read(self.pages[page])
+            finally:
+                self._close_handle()
+
+    def close(self):
+        # Waits for a running read, an evicted archive is never closed below a reader
+        with self.lock:
+            self.closed = True
+            self._close_handle()
+
+    def _close_handle(self):
+        try:
+            self.handle.close()
+        except Exception:
+            pass
+
+
+class ComicArchiveCache:
+    """Small LRU of opened comic archives, so page turns don't reopen and re-sort the archive.
+
+    Entries are keyed on path, size and mtime, a replaced file therefore gets a fresh index.
+    """
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._archives = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path, book_format, rar_executable=None):
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            archive = self._archives.get(key)
+            if archive:
+                self._archives.move_to_end(key)
+                return archive, key
+        archive = _OpenArchive(file_path, book_format, rar_executable)
+        evicted = list()
+        with self._lock:
+            existing = self._archives.get(key)
+            if existing:
+                # Another request opened it in the meantime
+                evicted.append(archive)
+                archive = existing
+            else:
+                for old_key in [k for k in self._archives if k[0] == file_path]:
+                    evicted.append(self._archives.pop(old_key))
+                self._archives[key] = archive
+                while len(self._archives) > self.max_size:
+                    evicted.append(self._archives.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return archive, key
+
+    def clear(self):
+        with self._lock:
+            archives = list(self._archives.values())
+            self._archives.clear()
+        for archive in archives:
+            archive.close()
+
+
+archive_cache = ComicArchiveCache()
+
+
+def page_extension(name):
+    return name.rpartition('.')[-1].lower() if '.' in name else ''
+
+
+def get_page_index(file_path, book_format, rar_executable=None):
+    archive, __ = archive_cache.get(file_path, book_format, rar_executable)
+    return archive.pages
+
+
+def get_page(file_path, book_format, page, max_width=None, rar_executable=None):
+    """Return (data, mimetype, etag, page_count) for one page of a comic archive.
+
+    With max_width the page is downscaled for the client's viewport, pages that are already narrower are
+    returned unchanged.
+    """
+    archive, key = archive_cache.get(file_path, book_format, rar_executable)
+    if page < 0 or page >= len(archive.pages):
+        raise IndexError(page)
+    name = archive.pages[page]
+    data = archive.read(page)
+    mimetype = PAGE_MIMETYPES[page_extension(name)]
+    if max_width and use_IM:
+        try:
+            with Image(blob=data) as img:
+                if img.width > max_width:
+                    img.transform(resize='{}x'.format(max_width))
+                    img.format = 'jpeg'
+                    data = img.make_blob()
+                    mimetype = 'image/jpeg'
+                else:
+                    max_width = None
+        except Exception as ex:
+            log.debug('Could not downscale comic page %s: %s', name, ex)
+            max_width = None
+    else:
+        max_width = None
+    etag = '{:x}-{:x}-{}-{}'.format(key[1], key[2], page, max_width or 0)
+    return data, mimetype, etag, len(archive.pages)
@@ -187,6 +187,13 @@ NIGHTLY_VERSION[1] = '2024-11-16T07:21:28+01:00'
 
 # CACHE
 CACHE_TYPE_THUMBNAILS    = 'thumbnails'
+CACHE_TYPE_DOWNLOADS     = 'downloads'
+
+# Size cap of the cache of downloads with embedded metadata
+DOWNLOAD_CACHE_MAX_MB    = int(os.environ.get('DOWNLOAD_CACHE_MAX_MB', 1024))
+
+# Worker processes rendering cover thumbnails, 1 renders in the worker thread
+THUMBNAIL_WORKERS        = int(os.environ.get('THUMBNAIL_WORKERS', max(1, min(4, (os.cpu_count() or 1) - 1))))
 
 # Thumbnail Types
 THUMBNAIL_TYPE_COVER     = 1
@@ -34,6 +34,7 @@ from .web import cwa_get_num_books_in_library
 import sys
 sys.path.insert(1, '/app/calibre-web-automated/scripts/')
 from cwa_db import CWA_DB
+from .cwa_stats_service import stats_service
 from .services.background_scheduler import BackgroundScheduler, DateTrigger
 from .services.worker import WorkerThread, STAT_FINISH_SUCCESS, STAT_FAIL, STAT_ENDED, STAT_CANCELLED
 from .tasks.database import TaskReconnectDatabase
@@ -444,6 +445,32 @@ def cwa_internal_run_duplicate_scan():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@csrf.exempt
+@cwa_internal.route('/cwa-internal/queue-epub-facts', methods=["POST"])
+def cwa_internal_queue_epub_facts():
+    """Queue indexing of EPUB layout/size facts used by Kobo sync.
+
+    Security: Limited to localhost callers (within container/host).
+    Payload JSON: {book_ids:[int]} (optional, all books with missing or stale facts otherwise)
+    """
+    try:
+        remote = request.headers.get('X-Forwarded-For', request.remote_addr)
+        if remote not in (None, '127.0.0.1', '::1'):
+            abort(403)
+
+        data = request.get_json(force=True, silent=True) or {}
+        book_ids = _coerce_book_ids(data.get('book_ids'))
+        if WorkerThread.get_instance().has_active_task_of_type("TaskBackfillEpubFacts"):
+            return jsonify({"success": True, "skipped": True, "reason": "already_queued"}), 200
+
+        from .tasks.epub_facts import TaskBackfillEpubFacts
+        WorkerThread.add('System', TaskBackfillEpubFacts(book_ids=book_ids), hidden=True)
+        return jsonify({"success": True, "queued": True}), 200
+    except Exception as e:
+        log.error("Failed to queue EPUB facts indexing: %s", str(e))
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @csrf.exempt
 @cwa_internal.route('/cwa-internal/duplicate-scan-status', methods=["GET", "POST"])
 def cwa_internal_duplicate_scan_status():
@@ -730,7 +757,7 @@ def set_cwa_settings():
     boolean_settings = []
     string_settings = []
     list_settings = []
-    integer_settings = ['ingest_timeout_minutes', 'ingest_stale_temp_minutes', 'ingest_stale_temp_interval', 'auto_send_delay_minutes', 'hardcover_auto_fetch_batch_size', 'hardcover_auto_fetch_schedule_hour', 'duplicate_scan_hour', 'duplicate_scan_chunk_size', 'duplicate_scan_debounce_seconds', 'duplicate_auto_resolve_cooldown_minutes', 'archived_cleanup_schedule_hour', 'cover_download_max_mb']  # Special handling for integer settings
+    integer_settings = ['ingest_timeout_minutes', 'ingest_stale_temp_minutes', 'ingest_stale_temp_interval', 'auto_send_delay_minutes', 'hardcover_auto_fetch_batch_size', 'hardcover_auto_fetch_schedule_hour', 'duplicate_scan_hour', 'duplicate_scan_chunk_size', 'duplicate_scan_debounce_seconds', 'duplicate_detection_similarity', 'duplicate_auto_resolve_cooldown_minutes', 'archived_cleanup_schedule_hour', 'cover_download_max_mb', 'activity_raw_retention_days']  # Special handling for integer settings
     float_settings = ['hardcover_auto_fetch_min_confidence', 'hardcover_auto_fetch_rate_limit']  # Special handling for float settings
     json_settings = ['metadata_provider_hierarchy', 'metadata_providers_enabled', 'duplicate_format_priority']  # Special handling for JSON settings
     skip_settings = ['auto_convert_ignored_formats', 'auto_ingest_ignored_formats', 'auto_convert_retained_formats']  # Handled through individual format checkboxes
@@ -834,8 +861,12 @@ def set_cwa_settings():
                             int_value = max(500, min(50000, int_value))
                         elif setting == 'duplicate_scan_debounce_seconds':
                             int_value = max(5, min(600, int_value))
+                        elif setting == 'duplicate_detection_similarity':
+                            int_value = 0 if int_value <= 0 else max(70, min(100, int_value))  # 0 keeps exact matching
                         elif setting == 'cover_download_max_mb':
                             int_value = max(1, min(200, int_value))
+                        elif setting == 'activity_raw_retention_days':
+                            int_value = max(0, min(3650, int_value))  # 0 keeps raw activity forever
                         result[setting] = int_value
                     except (ValueError, TypeError):
                         # Use current value if conversion fails
@@ -855,8 +886,12 @@ def set_cwa_settings():
                             result[setting] = cwa_db.cwa_settings.get(setting, 3)  # Default to 3 AM
                         elif setting == 'duplicate_scan_debounce_seconds':
                             result[setting] = cwa_db.cwa_settings.get(setting, 60)
+                        elif setting == 'duplicate_detection_similarity':
+                            result[setting] = cwa_db.cwa_settings.get(setting, 0)
                         elif setting == 'cover_download_max_mb':
                             result[setting] = cwa_db.cwa_settings.get(setting, 15)  # Default to 15 MB
+                        elif setting == 'activity_raw_retention_days':
+                            result[setting] = cwa_db.cwa_settings.get(setting, 0)
                 else:
                     if setting == 'ingest_timeout_minutes':
                         result[setting] = cwa_db.cwa_settings.get(setting, 15)  # Default to 15 minutes
@@ -874,8 +909,12 @@ def set_cwa_settings():
                         result[setting] = cwa_db.cwa_settings.get(setting, 3)  # Default to 3 AM
                     elif setting == 'duplicate_scan_debounce_seconds':
                         result[setting] = cwa_db.cwa_settings.get(setting, 60)
+                    elif setting == 'duplicate_detection_similarity':
+                        result[setting] = cwa_db.cwa_settings.get(setting, 0)
                     elif setting == 'cover_download_max_mb':
                         result[setting] = cwa_db.cwa_settings.get(setting, 15)  # Default to 15 MB
+                    elif setting == 'activity_raw_retention_days':
+                        result[setting] = cwa_db.cwa_settings.get(setting, 0)
 
             # Handle float settings
             for setting in float_settings:
@@ -1224,73 +1263,9 @@ def cwa_stats_show():
     if user_id == -1:
         user_id_filter = list(unknown_user_ids)
     
-    # Get user activity dashboard stats with date range and optional user filter
-    if start_date and end_date:
-        dashboard_stats = cwa_db.get_dashboard_stats(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        hourly_heatmap = cwa_db.get_hourly_activity_heatmap(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        reading_velocity = cwa_db.get_reading_velocity(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        format_preferences = cwa_db.get_format_preferences(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        discovery_sources = cwa_db.get_discovery_sources(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        device_breakdown = cwa_db.get_device_breakdown(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        failed_logins = cwa_db.get_failed_logins(start_date=start_date, end_date=end_date)
-    else:
-        dashboard_stats = cwa_db.get_dashboard_stats(days=days, user_id=user_id_filter)
-        hourly_heatmap = cwa_db.get_hourly_activity_heatmap(days=days, user_id=user_id_filter)
-        reading_velocity = cwa_db.get_reading_velocity(days=days, user_id=user_id_filter)
-        format_preferences = cwa_db.get_format_preferences(days=days, user_id=user_id_filter)
-        discovery_sources = cwa_db.get_discovery_sources(days=days, user_id=user_id_filter)
-        device_breakdown = cwa_db.get_device_breakdown(days=days, user_id=user_id_filter)
-        failed_logins = cwa_db.get_failed_logins(days=days)
-    
-    # Get library stats (for Library tab)
-    if start_date and end_date:
-        library_growth = cwa_db.get_library_growth(start_date=start_date, end_date=end_date)
-        library_formats = cwa_db.get_library_formats(start_date=start_date, end_date=end_date)
-        conversion_stats = cwa_db.get_conversion_success_rate(start_date=start_date, end_date=end_date)
-        books_added_stats = cwa_db.get_books_added_count(start_date=start_date, end_date=end_date)
-    else:
-        library_growth = cwa_db.get_library_growth(days=days)
-        library_formats = cwa_db.get_library_formats(days=days)
-        conversion_stats = cwa_db.get_conversion_success_rate(days=days)
-        books_added_stats = cwa_db.get_books_added_count(days=days)
-    
-    # Get additional library stats (not time-dependent)
-    series_completion = cwa_db.get_series_completion_stats(limit=10)
-    publication_years = cwa_db.get_publication_year_distribution()
-    most_fixed_books = cwa_db.get_most_fixed_books(limit=10)
-    
-    # Get Sprint 6 advanced library metrics
-    if start_date and end_date:
-        rating_statistics = cwa_db.get_rating_statistics(start_date=start_date, end_date=end_date)
-    else:
-        rating_statistics = cwa_db.get_rating_statistics(days=days)
-    
-    top_enforced_books = cwa_db.get_top_enforced_books(limit=10)
-    import_source_flows = cwa_db.get_import_source_flows(limit=15)
-    
-    # Get Sprint 5 user activity enhancements
-    if start_date and end_date:
-        session_duration = cwa_db.get_session_duration_stats(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        search_success = cwa_db.get_search_success_rate(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        shelf_activity = cwa_db.get_shelf_activity_stats(start_date=start_date, end_date=end_date, user_id=user_id_filter, limit=10)
-        api_usage_breakdown = cwa_db.get_api_usage_breakdown(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-        endpoint_frequency = cwa_db.get_endpoint_frequency_grouped(start_date=start_date, end_date=end_date, user_id=user_id_filter, limit=20)
-        api_timing = cwa_db.get_api_timing_heatmap(start_date=start_date, end_date=end_date, user_id=user_id_filter)
-    else:
-        session_duration = cwa_db.get_session_duration_stats(days=days, user_id=user_id_filter)
-        search_success = cwa_db.get_search_success_rate(days=days, user_id=user_id_filter)
-        shelf_activity = cwa_db.get_shelf_activity_stats(days=days, user_id=user_id_filter, limit=10)
-        api_usage_breakdown = cwa_db.get_api_usage_breakdown(days=days, user_id=user_id_filter)
-        endpoint_frequency = cwa_db.get_endpoint_frequency_grouped(days=days, user_id=user_id_filter, limit=20)
-        api_timing = cwa_db.get_api_timing_heatmap(days=days, user_id=user_id_filter)
-    
-    # Get system logs data
-    data_enforcement = cwa_db.enforce_show(paths=False, verbose=False, web_ui=True)
-    data_enforcement_with_paths = cwa_db.enforce_show(paths=True, verbose=False, web_ui=True)
-    data_imports = cwa_db.get_import_history(verbose=False)
-    data_conversions = cwa_db.get_conversion_history(verbose=False)
-    data_epub_fixer = cwa_db.get_epub_fixer_history(fixes=False, verbose=False)
-    data_epub_fixer_with_fixes = cwa_db.get_epub_fixer_history(fixes=True, verbose=False)
+    # All stat queries of the page run concurrently and are cached briefly per date range and user filter
+    stats = stats_service.get('page', days=days, start_date=start_date, end_date=end_date, user_id=user_id_filter,
+                              cwa_db=cwa_db, refresh=request.args.get('refresh') == '1')
 
     # Get Hardcover auto-fetch stats
     hardcover_stats = None
@@ -1318,7 +1293,8 @@ def cwa_stats_show():
             'total_processed': total_processed[0][0] if total_processed and total_processed[0][0] else 0,
             'total_auto_matched': total_auto_matched[0][0] if total_auto_matched and total_auto_matched[0][0] else 0,
             'pending_review': pending_review,
-            'manually_reviewed': manually_reviewed
+            'manually_reviewed': manually_reviewed,
+            'sync_queue': cwa_db.get_hardcover_outbox_stats()
         }
     except Exception as e:
         log.debug(f"Error fetching Hardcover stats: {e}")
@@ -1327,29 +1303,29 @@ def cwa_stats_show():
     return render_title_template("cwa_stats_tabs.html", title=_("Calibre-Web Automated Stats & Activity"),
                                 page="cwa-stats",
                                 active_tab=active_tab,
-                                dashboard_stats=dashboard_stats,
-                                hourly_heatmap=hourly_heatmap,
-                                reading_velocity=reading_velocity,
-                                format_preferences=format_preferences,
-                                discovery_sources=discovery_sources,
-                                device_breakdown=device_breakdown,
-                                failed_logins=failed_logins,
-                                session_duration=session_duration,
-                                search_success=search_success,
-                                shelf_activity=shelf_activity,
-                                api_usage_breakdown=api_usage_breakdown,
-                                endpoint_frequency=endpoint_frequency,
-                                api_timing=api_timing,
-                                library_growth=library_growth,
-                                library_formats=library_formats,
-                                conversion_stats=conversion_stats,
-                                books_added_stats=books_added_stats,
-                                series_completion=series_completion,
-                                publication_years=publication_years,
-                                most_fixed_books=most_fixed_books,
-                                rating_statistics=rating_statistics,
-                                top_enforced_books=top_enforced_books,
-                                import_source_flows=import_source_flows,
+                                dashboard_stats=stats['dashboard_stats'],
+                                hourly_heatmap=stats['hourly_heatmap'],
+                                reading_velocity=stats['reading_velocity'],
+                                format_preferences=stats['format_preferences'],
+                                discovery_sources=stats['discovery_sources'],
+                                device_breakdown=stats['device_breakdown'],
+                                failed_logins=stats['failed_logins'],
+                                session_duration=stats['session_duration'],
+                                search_success=stats['search_success'],
+                                shelf_activity=stats['shelf_activity'],
+                                api_usage_breakdown=stats['api_usage_breakdown'],
+                                endpoint_frequency=stats['endpoint_frequency'],
+                                api_timing=stats['api_timing'],
+                                library_growth=stats['library_growth'],
+                                library_formats=stats['library_formats'],
+                                conversion_stats=stats['conversion_stats'],
+                                books_added_stats=stats['books_added_stats'],
+                                series_completion=stats['series_completion'],
+                                publication_years=stats['publication_years'],
+                                most_fixed_books=stats['most_fixed_books'],
+                                rating_statistics=stats['rating_statistics'],
+                                top_enforced_books=stats['top_enforced_books'],
+                                import_source_flows=stats['import_source_flows'],
                                 date_range_label=date_range_label,
                                 show_warning=show_warning,
                                 start_date=start_date,
@@ -1361,12 +1337,12 @@ def cwa_stats_show():
                                 selected_user_id=user_id,
                                 cwa_stats=get_cwa_stats(),
                                 hardcover_stats=hardcover_stats,
-                                data_enforcement=data_enforcement, headers_enforcement=headers["enforcement"]["no_paths"], 
-                                data_enforcement_with_paths=data_enforcement_with_paths, headers_enforcement_with_paths=headers["enforcement"]["with_paths"], 
-                                data_imports=data_imports, headers_import=headers["imports"],
-                                data_conversions=data_conversions, headers_conversion=headers["conversions"],
-                                data_epub_fixer=data_epub_fixer, headers_epub_fixer=headers["epub_fixer"]["no_fixes"],
-                                data_epub_fixer_with_fixes=data_epub_fixer_with_fixes, headers_epub_fixer_with_fixes=headers["epub_fixer"]["with_fixes"])
+                                data_enforcement=stats['data_enforcement'], headers_enforcement=headers["enforcement"]["no_paths"], 
+                                data_enforcement_with_paths=stats['data_enforcement_with_paths'], headers_enforcement_with_paths=headers["enforcement"]["with_paths"], 
+                                data_imports=stats['data_imports'], headers_import=headers["imports"],
+                                data_conversions=stats['data_conversions'], headers_conversion=headers["conversions"],
+                                data_epub_fixer=stats['data_epub_fixer'], headers_epub_fixer=headers["epub_fixer"]["no_fixes"],
+                                data_epub_fixer_with_fixes=stats['data_epub_fixer_with_fixes'], headers_epub_fixer_with_fixes=headers["epub_fixer"]["with_fixes"])
 
 @cwa_stats.route("/cwa-stats-export-csv/<tab_name>", methods=["GET"])
 @login_required_if_no_ano
@@ -1391,6 +1367,8 @@ def export_stats_csv(tab_name):
         days = int(days_param) if days_param else 30
     
     cwa_db = CWA_DB()
+    stats = stats_service.get(tab_name, days=days, start_date=start_date, end_date=end_date, user_id=user_id,
+                              cwa_db=cwa_db)
     output = StringIO()
     writer = csv.writer(output)
     
@@ -1401,10 +1379,7 @@ def export_stats_csv(tab_name):
             writer.writerow([])
             
             # Dashboard stats
-            if start_date and end_date:
-                dashboard_stats = cwa_db.get_dashboard_stats(start_date=start_date, end_date=end_date, user_id=user_id)
-            else:
-                dashboard_stats = cwa_db.get_dashboard_stats(days=days, user_id=user_id)
+            dashboard_stats = stats['dashboard_stats']
             
             writer.writerow(['Metric', 'Value'])
             for key, value in dashboard_stats.get('totals', {}).items():
@@ -1435,10 +1410,7 @@ def export_stats_csv(tab_name):
             # Discovery sources
             writer.writerow(['=== DISCOVERY SOURCES ==='])
             writer.writerow(['Source', 'Access Count'])
-            if start_date and end_date:
-                discovery = cwa_db.get_discovery_sources(start_date=start_date, end_date=end_date, user_id=user_id)
-            else:
-                discovery = cwa_db.get_discovery_sources(days=days, user_id=user_id)
+            discovery = stats['discovery']
             for source, count in discovery:
                 writer.writerow([source, count])
             writer.writerow([])
@@ -1446,10 +1418,7 @@ def export_stats_csv(tab_name):
             # Device breakdown
             writer.writerow(['=== DEVICE BREAKDOWN ==='])
             writer.writerow(['Device', 'Access Count'])
-            if start_date and end_date:
-                devices = cwa_db.get_device_breakdown(start_date=start_date, end_date=end_date, user_id=user_id)
-            else:
-                devices = cwa_db.get_device_breakdown(days=days, user_id=user_id)
+            devices = stats['devices']
             for device, count in devices:
                 writer.writerow([device, count])
             
@@ -1461,12 +1430,8 @@ def export_stats_csv(tab_name):
             # Summary stats
             cwa_stats = get_cwa_stats()
             writer.writerow(['Total Books', cwa_stats['total_books']])
-            if start_date and end_date:
-                books_added = cwa_db.get_books_added_count(start_date=start_date, end_date=end_date)
-                conversions = cwa_db.get_conversion_success_rate(start_date=start_date, end_date=end_date)
-            else:
-                books_added = cwa_db.get_books_added_count(days=days)
-                conversions = cwa_db.get_conversion_success_rate(days=days)
+            books_added = stats['books_added']
+            conversions = stats['conversions']
             writer.writerow(['Books Added', books_added.get('total', 0)])
             writer.writerow(['Conversions', conversions.get('total', 0)])
             writer.writerow([])
@@ -1474,10 +1439,7 @@ def export_stats_csv(tab_name):
             # Library growth
             writer.writerow(['=== LIBRARY GROWTH ==='])
             writer.writerow(['Date', 'Books Added'])
-            if start_date and end_date:
-                growth = cwa_db.get_library_growth(start_date=start_date, end_date=end_date)
-            else:
-                growth = cwa_db.get_library_growth(days=days)
+            growth = stats['growth']
             for date, count in growth:
                 writer.writerow([date, count])
             writer.writerow([])
@@ -1485,10 +1447,7 @@ def export_stats_csv(tab_name):
             # Format distribution
             writer.writerow(['=== FORMAT DISTRIBUTION ==='])
             writer.writerow(['Format', 'Book Count'])
-            if start_date and end_date:
-                formats = cwa_db.get_library_formats(start_date=start_date, end_date=end_date)
-            else:
-                formats = cwa_db.get_library_formats(days=days)
+            formats = stats['formats']
             for format_name, count in formats:
                 writer.writerow([format_name, count])
             writer.writerow([])
@@ -1496,17 +1455,14 @@ def export_stats_csv(tab_name):
             # Series completion
             writer.writerow(['=== SERIES STATISTICS ==='])
             writer.writerow(['Series Name', 'Book Count', 'Highest Index'])
-            series = cwa_db.get_series_completion_stats(limit=50)
+            series = stats['series']
             for series_name, book_count, highest_index in series:
                 writer.writerow([series_name, book_count, highest_index])
             writer.writerow([])
             
             # Rating statistics
             writer.writerow(['=== RATING STATISTICS ==='])
-            if start_date and end_date:
-                ratings = cwa_db.get_rating_statistics(start_date=start_date, end_date=end_date)
-            else:
-                ratings = cwa_db.get_rating_statistics(days=days)
+            ratings = stats['ratings']
             writer.writerow(['Average Rating', ratings.get('average_rating', 0)])
             writer.writerow(['Unrated Percentage', ratings.get('unrated_percentage', 0)])
             writer.writerow([])
@@ -1518,7 +1474,7 @@ def export_stats_csv(tab_name):
             # Top enforced books
             writer.writerow(['=== TOP ENFORCED BOOKS ==='])
             writer.writerow(['Book Title', 'Enforcement Count', 'Last Enforced'])
-            top_enforced = cwa_db.get_top_enforced_books(limit=20)
+            top_enforced = stats['top_enforced']
             for book_id, title, count, last_enforced in top_enforced:
                 writer.writerow([title, count, last_enforced])
             
@@ -1530,10 +1486,7 @@ def export_stats_csv(tab_name):
             # API usage breakdown
             writer.writerow(['=== USAGE BREAKDOWN ==='])
             writer.writerow(['Category', 'Access Count'])
-            if start_date and end_date:
-                breakdown = cwa_db.get_api_usage_breakdown(start_date=start_date, end_date=end_date, user_id=user_id)
-            else:
-                breakdown = cwa_db.get_api_usage_breakdown(days=days, user_id=user_id)
+            breakdown = stats['breakdown']
             for category, count in breakdown:
                 writer.writerow([category, count])
             writer.writerow([])
@@ -1541,10 +1494,7 @@ def export_stats_csv(tab_name):
             # Endpoint frequency
             writer.writerow(['=== ENDPOINT ACCESS FREQUENCY ==='])
             writer.writerow(['Endpoint', 'Category', 'Access Count', 'Last Accessed'])
-            if start_date and end_date:
-                endpoints = cwa_db.get_endpoint_frequency_grouped(start_date=start_date, end_date=end_date, user_id=user_id, limit=50)
-            else:
-                endpoints = cwa_db.get_endpoint_frequency_grouped(days=days, user_id=user_id, limit=50)
+            endpoints = stats['endpoints']
             for endpoint, category, count, last_accessed in endpoints:
                 writer.writerow([endpoint, category, count, last_accessed])
         
@@ -1661,6 +1611,7 @@ def debug_stats_data():
         return jsonify({
             'event_counts': event_counts,
             'json_stats': json_stats,
+            'query_timings': stats_service.debug_info(),
             'sample_records': records[:20]  # Only return first 20 to keep response size manageable
         })
         
@@ -0,0 +1,271 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Runs the CWA stats page queries concurrently and caches the assembled results.
+
+Every query of a tab runs on a worker thread with its own read-only cwa.db connection, the
+results are cached per (tab, date range, user filter) for a short time.
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import logger
+
+sys.path.insert(1, '/app/calibre-web-automated/scripts/')
+from cwa_db import CWA_DB
+
+log = logger.create()
+
+
+def _ranged(method, user=False, empty=list, **extra):
+    """Query taking the selected date range, and optionally the user filter.
+
+    empty builds the result used when the query fails, matching what the query returns.
+    """
+    def run(db, days, start_date, end_date, user_id):
+        kwargs = dict(extra)
+        if start_date and end_date:
+            kwargs.update(start_date=start_date, end_date=end_date)
+        else:
+            kwargs['days'] = days
+        if user:
+            kwargs['user_id'] = user_id
+        return getattr(db, method)(**kwargs)
+    run.empty = empty
+    return run
+
+
+def _fixed(method, empty=list, **extra):
+    """Query independent of the selected date range and user."""
+    def run(db, days, start_date, end_date, user_id):
+        return getattr(db, method)(**extra)
+    run.empty = empty
+    return run
+
+
+
+# Results of the queries returning a dict when they fail, the same as the queries return on an error
+def _empty_dashboard():
+    return {
+        'timeline': [],
+        'top_users': [],
+        'top_books': [],
+        'recent_searches': [],
+        'format_distribution': [],
+        'event_breakdown': [],
+        'totals': {
+            'total_events': 0,
+            'active_users': 0,
+            'unique_downloads': 0,
+            'unique_reads': 0,
+            'total_logins': 0,
+            'total_downloads': 0,
+            'total_reads': 0,
+            'total_searches': 0,
+        },
+    }
+
+
+def _empty_conversions():
+    return {'total': 0, 'successful': 0, 'failed': 0, 'success_rate': 0, 'trend': 0}
+
+
+def _empty_books_added():
+    return {'total': 0, 'trend': 0}
+
+
+def _empty_ratings():
+    return {'average_rating': 0.0, 'rating_distribution': [], 'unrated_percentage': 0.0, 'trend': 0.0,
+            'total_books': 0, 'rated_books': 0}
+
+
+def _empty_sessions():
+    return {'average_minutes': 0, 'median_minutes': 0, 'distribution': []}
+
+
+def _empty_searches():
+    return {'total_searches': 0, 'successful_searches': 0, 'success_rate': 0, 'trend': 0}
+
+STATS_TABS = {
+    # Everything rendered by the stats page, all tabs are part of one page
+    'page': {
+        'dashboard_stats': _ranged('get_dashboard_stats', user=True, empty=_empty_dashboard),
+        'hourly_heatmap': _ranged('get_hourly_activity_heatmap', user=True),
+        'reading_velocity': _ranged('get_reading_velocity', user=True),
+        'format_preferences': _ranged('get_format_preferences', user=True),
+        'discovery_sources': _ranged('get_discovery_sources', user=True),
+        'device_breakdown': _ranged('get_device_breakdown', user=True),
+        'failed_logins': _ranged('get_failed_logins'),
+        'library_growth': _ranged('get_library_growth'),
+        'library_formats': _ranged('get_library_formats'),
+        'conversion_stats': _ranged('get_conversion_success_rate', empty=_empty_conversions),
+        'books_added_stats': _ranged('get_books_added_count', empty=_empty_books_added),
+        'series_completion': _fixed('get_series_completion_stats', limit=10),
+        'publication_years': _fixed('get_publication_year_distribution'),
+        'most_fixed_books': _fixed('get_most_fixed_books', limit=10),
+        'rating_statistics': _ranged('get_rating_statistics', empty=_empty_ratings),
+        'top_enforced_books': _fixed('get_top_enforced_books', limit=10),
+        'import_source_flows': _fixed('get_import_source_flows', limit=15),
+        'session_duration': _ranged('get_session_duration_stats', user=True, empty=_empty_sessions),
+        'search_success': _ranged('get_search_success_rate', user=True, empty=_empty_searches),
+        'shelf_activity': _ranged('get_shelf_activity_stats', user=True, limit=10),
+        'api_usage_breakdown': _ranged('get_api_usage_breakdown', user=True),
+        'endpoint_frequency': _ranged('get_endpoint_frequency_grouped', user=True, limit=20),
+        'api_timing': _ranged('get_api_timing_heatmap', user=True),
+        'data_enforcement': _fixed('enforce_show', paths=False, verbose=False, web_ui=True),
+        'data_enforcement_with_paths': _fixed('enforce_show', paths=True, verbose=False, web_ui=True),
+        'data_imports': _fixed('get_import_history', verbose=False),
+        'data_conversions': _fixed('get_conversion_history', verbose=False),
+        'data_epub_fixer': _fixed('get_epub_fixer_history', fixes=False, verbose=False),
+        'data_epub_fixer_with_fixes': _fixed('get_epub_fixer_history', fixes=True, verbose=False),
+    },
+    # CSV exports
+    'activity': {
+        'dashboard_stats': _ranged('get_dashboard_stats', user=True, empty=_empty_dashboard),
+        'discovery': _ranged('get_discovery_sources', user=True),
+        'devices': _ranged('get_device_breakdown', user=True),
+    },
+    'library': {
+        'books_added': _ranged('get_books_added_count', empty=_empty_books_added),
+        'conversions': _ranged('get_conversion_success_rate', empty=_empty_conversions),
+        'growth': _ranged('get_library_growth'),
+        'formats': _ranged('get_library_formats'),
+        'series': _fixed('get_series_completion_stats', limit=50),
+        'ratings': _ranged('get_rating_statistics', empty=_empty_ratings),
+        'top_enforced': _fixed('get_top_enforced_books', limit=20),
+    },
+    'api': {
+        'breakdown': _ranged('get_api_usage_breakdown', user=True),
+        'endpoints': _ranged('get_endpoint_frequency_grouped', user=True, limit=50),
+    },
+}
+
+
+class StatsService:
+    def __init__(self, tabs=None, ttl=30, max_workers=4, max_entries=64, reader_factory=None):
+        self.tabs = tabs if tabs is not None else STATS_TABS
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._reader_factory = reader_factory or CWA_DB.reader
+        self._cache = dict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._local = threading.local()
+        self._runs = deque(maxlen=20)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(tab, days=None, start_date=None, end_date=None, user_id=None):
+        if isinstance(user_id, (list, tuple, set)):
+            user_id = tuple(sorted(user_id))
+        if start_date and end_date:
+            return tab, None, start_date, end_date, user_id
+        return tab, days, None, None, user_id
+
+    def get(self, tab, days=None, start_date=None, end_date=None, user_id=None, cwa_db=None, refresh=False):
+        """Returns {query name: result} for a tab, from the cache while it is fresh.
+
+        cwa_db is a regular CWA_DB used to roll up pending activity before the readers run.
+        """
+        queries = self.tabs.get(tab)
+        if queries is None:
+            return {}
+        key = self.make_key(tab, days, start_date, end_date, user_id)
+        now = time.monotonic()
+        if not refresh:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry and entry[0] > now:
+                    self.hits += 1
+                    return entry[1]
+        with self._lock:
+            self.misses += 1
+
+        if cwa_db is not None:
+            cwa_db.rollup_activity()
+        results, timings, wall = self._run(queries, days, start_date, end_date, user_id)
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+                if len(self._cache) >= self.max_entries:
+                    self._cache.clear()
+            self._cache[key] = (time.monotonic() + self.ttl, results)
+            self._runs.append({
+                'tab': tab,
+                'days': key[1],
+                'start_date': key[2],
+                'end_date': key[3],
+                'user_id': list(key[4]) if isinstance(key[4], tuple) else key[4],
+                'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'wall_ms': round(wall * 1000, 1),
+                'query_ms': {name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+            })
+        return results
+
+    def invalidate(self, tab=None):
+        """Drops cached results, of one tab or all of them."""
+        with self._lock:
+            if tab is None:
+                self._cache.clear()
+            else:
+                self._cache = {k: v for k, v in self._cache.items() if k[0] != tab}
+
+    def debug_info(self):
+        with self._lock:
+            return {
+                'ttl_seconds': self.ttl,
+                'workers': self.max_workers,
+                'cached_entries': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'recent_runs': list(reversed(self._runs)),
+            }
+
+    def _reader(self):
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            try:
+                reader = self._reader_factory()
+            except Exception as ex:
+                log.warning("Read-only stats connection unavailable, using a regular one: %s", ex)
+                reader = CWA_DB()
+            self._local.reader = reader
+        return reader
+
+    def _timed(self, query, days, start_date, end_date, user_id):
+        start = time.perf_counter()
+        result = query(self._reader(), days, start_date, end_date, user_id)
+        return result, time.perf_counter() - start
+
+    def _run(self, queries, days, start_date, end_date, user_id):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='cwa-stats')
+        start = time.perf_counter()
+        futures = {name: self._executor.submit(self._timed, query, days, start_date, end_date, user_id)
+                   for name, query in queries.items()}
+        results = dict()
+        timings = dict()
+        for name, future in futures.items():
+            try:
+                results[name], timings[name] = future.result()
+            except Exception as ex:
+                log.error("Stats query %s failed: %s", name, ex)
+                # Consumers iterate the results, an empty one renders as "no data"
+                results[name] = queries[name].empty()
+                timings[name] = 0.0
+        return results, timings, time.perf_counter() - start
+
+
+stats_service = StatsService()
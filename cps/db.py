@@ -10,6 +10,7 @@ import re
 import json
 import time
 import threading
+from functools import lru_cache
 from datetime import datetime, timezone
 from urllib.parse import quote
 import unidecode
@@ -18,7 +19,7 @@ from uuid import uuid4
 
 from sqlite3 import OperationalError as sqliteOperationalError
 import sqlite3
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy import Table, Column, ForeignKey, CheckConstraint
 from sqlalchemy import String, Integer, Boolean, TIMESTAMP, Float
 from sqlalchemy.orm import relationship, sessionmaker, scoped_session, joinedload, object_session
@@ -553,6 +554,9 @@ class CalibreDB:
     # instances alive once they reach the end of their respective scopes
     instances = WeakSet()
     _reconnect_lock = threading.RLock()  # Reentrant lock to prevent concurrent reconnect operations
+    # (user, restriction set) -> (library change marker, count) for the book table
+    _visible_count_cache = dict()
+    _visible_count_lock = threading.Lock()
 
     def __init__(self, expire_on_commit=True, init=False):
         """ Initialize a new CalibreDB session
@@ -774,6 +778,8 @@ class CalibreDB:
                                            isolation_level="SERIALIZABLE",
                                            connect_args={'check_same_thread': False, 'timeout': 30},
                                            poolclass=StaticPool)
+                # Register the user defined functions once per DBAPI connection instead of per query
+                event.listen(cls.engine, "connect", _on_connect)
                 with cls.engine.begin() as connection:
                     connection.execute(text("attach database '{}' as calibre;".format(dbpath)))
                     connection.execute(text("attach database '{}' as app_settings;".format(app_db_path)))
@@ -1135,8 +1141,6 @@ class CalibreDB:
     def get_typeahead(self, database, query, replace=('', ''), tag_filter=true()):
         self.ensure_session()
         query = query or ''
-        self.create_functions()
-        # self.session.connection().connection.connection.create_function("lower", 1, lcase)
         entries = self.session.query(database).filter(tag_filter). \
             filter(func.lower(database.name).ilike("%" + query + "%")).all()
         # json_dumps = json.dumps([dict(name=escape(r.name.replace(*replace))) for r in entries])
@@ -1145,8 +1149,6 @@ class CalibreDB:
 
     def check_exists_book(self, authr, title):
         self.ensure_session()
-        self.create_functions()
-        # self.session.connection().connection.connection.create_function("lower", 1, lcase)
         q = list()
         author_terms = re.split(r'\s*&\s*', authr)
         for author_term in author_terms:
@@ -1158,8 +1160,6 @@ class CalibreDB:
     def search_query(self, term, config, *join):
         self.ensure_session()
         strip_whitespaces(term).lower()
-        self.create_functions()
-        # self.session.connection().connection.connection.create_function("lower", 1, lcase)
         q = list()
         author_terms = re.split("[, ]+", term)
         for author_term in author_terms:
@@ -1207,6 +1207,116 @@ class CalibreDB:
 
         return cc
 
+    def library_change_marker(self):
+        """Return a cheap marker that changes whenever metadata.db is written.
+
+        data_version moves on commits from other connections (calibredb, ingest), total_changes counts rows
+        modified through our own shared connection. Both are O(1), unlike counting the books table.
+        """
+        self.ensure_session()
+        data_version = self.session.execute(text("PRAGMA calibre.data_version")).scalar()
+        local_changes = self.session.execute(text("SELECT total_changes()")).scalar()
+        return data_version, local_changes
+
+    def count_visible_books(self, allow_show_archived=True):
+        """Count the books visible to the current user, cached per user and restriction set."""
+        self.ensure_session()
+        key = (int(current_user.id),
+               allow_show_archived,
+               current_user.filter_language(),
+               tuple(current_user.list_allowed_tags()),
+               tuple(current_user.list_denied_tags()),
+               current_user.allowed_column_value or "",
+               current_user.denied_column_value or "",
+               self.config.config_restricted_column)
+        marker = self.library_change_marker()
+        with self._visible_count_lock:
+            cached = self._visible_count_cache.get(key)
+        if cached and cached[0] == marker:
+            return cached[1]
+        count = self.session.query(Books).filter(self.common_filters(allow_show_archived=allow_show_archived)).count()
+        with self._visible_count_lock:
+            if len(self._visible_count_cache) > 256:
+                self._visible_count_cache.clear()
+            self._visible_count_cache[key] = (marker, count)
+        return count
+
+    def get_book_table_rows(self, entries, cc, batch_size=500):
+        """Yield dicts with only the fields shown in the book table.
+
+        entries is an iterable of (book_id, is_archived, read_status) in display order. Values are loaded with
+        a handful of column-only IN queries per batch instead of serializing ORM objects with AlchemyEncoder.
+        """
+        self.ensure_session()
+        entries = list(entries)
+        locale = get_locale()
+        language_names = dict()
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            book_ids = [entry[0] for entry in batch]
+            books = {row.id: row for row in
+                     self.session.query(Books.id, Books.title, Books.sort, Books.author_sort, Books.series_index,
+                                        Comments.text)
+                     .outerjoin(Comments, Comments.book == Books.id)
+                     .filter(Books.id.in_(book_ids))}
+            authors = self._table_values(books_authors_link.c.book, Authors, books_authors_link.c.author, book_ids,
+                                         Authors.id, Authors.name, Authors.sort)
+            tags = self._table_values(books_tags_link.c.book, Tags, books_tags_link.c.tag, book_ids,
+                                      Tags.name, order=Tags.name)
+            series = self._table_values(books_series_link.c.book, Series, books_series_link.c.series, book_ids,
+                                        Series.name)
+            publishers = self._table_values(books_publishers_link.c.book, Publishers,
+                                            books_publishers_link.c.publisher, book_ids, Publishers.name)
+            languages = self._table_values(books_languages_link.c.book, Languages, books_languages_link.c.lang_code,
+                                           book_ids, Languages.lang_code)
+            custom_values = dict()
+            for c in cc:
+                column = 'custom_column_' + str(c.id)
+                custom_values[column] = dict()
+                for book_id, value in (self.session.query(Books.id, cc_classes[c.id].value)
+                                       .join(getattr(Books, column))
+                                       .filter(Books.id.in_(book_ids))):
+                    if isinstance(value, datetime):
+                        value = value.date().isoformat()
+                    custom_values[column].setdefault(book_id, []).append(str(value))
+
+            for book_id, is_archived, read_status in batch:
+                book = books.get(book_id)
+                if book is None:
+                    continue
+                book_languages = list()
+                for (lang_code,) in languages.get(book_id, []):
+                    if lang_code not in language_names:
+                        language_names[lang_code] = isoLanguages.get_language_name(locale, lang_code)
+                    book_languages.append(language_names[lang_code])
+                row = {'id': book.id,
+                       'title': book.title,
+                       'sort': book.sort,
+                       'author_sort': book.author_sort,
+                       'authors': " & ".join(_order_author_names(book.author_sort, authors.get(book_id, []))),
+                       'tags': ",".join(name for (name,) in tags.get(book_id, [])),
+                       'series': ",".join(name for (name,) in series.get(book_id, [])),
+                       'series_index': book.series_index,
+                       'languages': ",".join(book_languages),
+                       'publishers': ",".join(name for (name,) in publishers.get(book_id, [])),
+                       'comments': book.text or "",
+                       'is_archived': is_archived is True,
+                       'read_status': read_status}
+                for column, values in custom_values.items():
+                    row[column] = ",".join(values.get(book_id, []))
+                yield row
+
+    def _table_values(self, link_book, table, link_value, book_ids, *columns, order=None):
+        query = (self.session.query(link_book, *columns)
+                 .join(table, table.id == link_value)
+                 .filter(link_book.in_(book_ids)))
+        if order is not None:
+            query = query.order_by(order)
+        values = dict()
+        for row in query:
+            values.setdefault(row[0], []).append(tuple(row[1:]))
+        return values
+
     # read search results from calibre-database and return it (function is used for feed and simple search
     def get_search_results(self, term, config, offset=None, order=None, limit=None, *join):
         self.ensure_session()
@@ -1263,21 +1373,17 @@ class CalibreDB:
             return sorted(languages, key=lambda x: x.name, reverse=reverse_order)
 
     def create_functions(self, config=None):
+        """Re-register the user defined functions on the current connection.
+
+        The functions are registered automatically whenever the engine opens a connection, and title_sort
+        always reads the active config, so this is only needed for connections created outside setup_db.
+        """
         self.ensure_session()
         if self.session is None:
             log.error("create_functions: Cannot create functions because session is None")
             return
-        
-        # user defined sort function for calibre databases (Series, etc.)
         if config:
-            def _title_sort(title):
-                # calibre sort stuff
-                title_pat = re.compile(config.config_title_regex, re.IGNORECASE)
-                match = title_pat.search(title)
-                if match:
-                    prep = match.group(1)
-                    title = title[len(prep):] + ', ' + prep
-                return strip_whitespaces(title)
+            self.update_config(config)
 
         try:
             # sqlalchemy <1.4.24 and sqlalchemy 2.0
@@ -1285,13 +1391,7 @@ class CalibreDB:
         except AttributeError:
             # sqlalchemy >1.4.24
             conn = self.session.connection().connection.connection
-        try:
-            if config:
-                conn.create_function("title_sort", 1, _title_sort)
-            conn.create_function('uuid4', 0, lambda: str(uuid4()))
-            conn.create_function("lower", 1, lcase)
-        except sqliteOperationalError:
-            pass
+        register_functions(conn)
 
     @classmethod
     def dispose(cls):
@@ -1349,15 +1449,73 @@ class CalibreDB:
             self.update_config(config)
 
 
+def _order_author_names(author_sort, authors):
+    # Same ordering as CalibreDB.order_authors, but on preloaded (id, name, sort) tuples
+    remaining = list(authors)
+    ordered = list()
+    for auth in (author_sort or "").split('&'):
+        auth = strip_whitespaces(auth)
+        if not auth:
+            continue
+        matches = [author for author in remaining if (author[2] or "").lower() == auth.lower()]
+        if not matches:
+            break
+        for author in matches:
+            ordered.append(author)
+            remaining.remove(author)
+    return [author[1] for author in ordered + remaining]
+
+
+@lru_cache(maxsize=32)
+def _compile_title_regex(pattern):
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def title_sort(title):
+    # calibre sort stuff, the regex is compiled once per distinct config_title_regex value
+    if title is None:
+        return None
+    config = CalibreDB.config
+    if config and config.config_title_regex:
+        match = _compile_title_regex(config.config_title_regex).search(title)
+        if match:
+            prep = match.group(1)
+            title = title[len(prep):] + ', ' + prep
+    return strip_whitespaces(title)
+
+
+@lru_cache(maxsize=8192)
+def _unidecode_lower(s):
+    return unidecode.unidecode(s.lower())
+
+
 def lcase(s):
+    if s is None:
+        return None
+    # Plain ASCII needs no transliteration, skip unidecode and the memo table entirely
+    if s.isascii():
+        return s.lower()
     try:
-        return unidecode.unidecode(s.lower())
+        return _unidecode_lower(s)
     except Exception as ex:
         _log = logger.create()
         _log.error_or_exception(ex)
         return s.lower()
 
 
+def register_functions(conn):
+    try:
+        conn.create_function("title_sort", 1, title_sort)
+        conn.create_function('uuid4', 0, lambda: str(uuid4()))
+        conn.create_function("lower", 1, lcase, deterministic=True)
+    except sqliteOperationalError:
+        pass
+
+
+def _on_connect(dbapi_connection, _connection_record):
+    register_functions(dbapi_connection)
+
+
 class Category:
     name = None
     id = None
@@ -19,6 +19,9 @@ import importlib
 
 from . import logger, config
 from .about import collect_stats
+from .hardcover_outbox import hardcover_outbox
+from .http_client import http_metrics
+from .metadata_search_service import metadata_search_service
 
 log = logger.create()
 
@@ -59,6 +62,9 @@ def send_debug():
     with zipfile.ZipFile(memory_zip, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
         zf.writestr('settings.txt', json.dumps(config.to_dict(), sort_keys=True, indent=2))
         zf.writestr('libs.txt', json.dumps(collect_stats(), sort_keys=True, indent=2, cls=lazyEncoder))
+        zf.writestr('metadata_search.txt', json.dumps(metadata_search_service.debug_info(), indent=2))
+        zf.writestr('http_metrics.txt', json.dumps(http_metrics.snapshot(), indent=2))
+        zf.writestr('hardcover_outbox.txt', json.dumps(hardcover_outbox.debug_info(), indent=2))
         for fp in file_list:
             zf.write(fp, os.path.basename(fp))
     memory_zip.seek(0)
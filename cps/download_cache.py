@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Disk cache of downloads with embedded metadata.
+
+Embedding metadata runs calibredb export or rewrites the epub on every download. The produced files are
+kept here, named after the book and a digest of everything they were made from (format, last modified,
+source file, cover, embedder), and evicted least recently used first once the cache exceeds its size cap.
+Variants made from the same source, like kepubs for different locales, share the first part of the digest.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from uuid import uuid4
+
+from . import logger
+
+log = logger.create()
+
+
+def artifact_digest(book_id, book_format, last_modified, metadata_hash, variant=None):
+    source = repr((book_id, book_format.lower(), str(last_modified), metadata_hash))
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:20]
+    if variant is not None:
+        digest += '-' + hashlib.sha1(str(variant).encode('utf-8')).hexdigest()[:8]
+    return digest
+
+
+class DownloadArtifactCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def artifact_name(book_id, book_format, digest):
+        return "{}_{}.{}".format(book_id, digest, book_format.lower())
+
+    def _entries(self):
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                return [entry for entry in entries if entry.is_file() and not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return []
+
+    def get(self, book_id, book_format, digest):
+        """Returns the path of a cached artifact and marks it as recently used, or None."""
+        path = os.path.join(self.cache_dir, self.artifact_name(book_id, book_format, digest))
+        try:
+            # The mtime is the last use, it survives restarts and orders the eviction
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def store(self, book_id, book_format, digest, source_path):
+        """Moves a produced file into the cache, replacing artifacts of the same book format made from an older
+        source. Other variants of the same source stay."""
+        name = self.artifact_name(book_id, book_format, digest)
+        path = os.path.join(self.cache_dir, name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = os.path.join(self.cache_dir, '.' + uuid4().hex)
+        shutil.move(source_path, tmp_path)
+        os.replace(tmp_path, path)
+        prefix = "{}_".format(book_id)
+        suffix = ".{}".format(book_format.lower())
+        current = "{}{}".format(prefix, digest.partition('-')[0])
+        with self._lock:
+            for entry in self._entries():
+                if (entry.name.startswith(prefix) and entry.name.endswith(suffix)
+                        and entry.name[:-len(suffix)].partition('-')[0] != current):
+                    self._remove(entry.path)
+            self._evict(keep=path)
+        return path
+
+    def cached_formats(self, book_id):
+        prefix = "{}_".format(book_id)
+        return sorted({entry.name.rpartition('.')[2] for entry in self._entries() if entry.name.startswith(prefix)})
+
+    def invalidate(self, book_id=None):
+        prefix = "{}_".format(book_id) if book_id is not None else ''
+        with self._lock:
+            for entry in self._entries():
+                if entry.name.startswith(prefix):
+                    self._remove(entry.path)
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self, keep=None):
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._entries()]
+        total = sum(size for __, size, __ in entries)
+        for __, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError as ex:
+            log.debug("Could not remove cached download %s: %s", path, ex)
+
+
+_artifact_cache = None
+
+
+def get_artifact_cache():
+    global _artifact_cache
+    if _artifact_cache is None:
+        from . import fs
+        from .constants import CACHE_TYPE_DOWNLOADS, DOWNLOAD_CACHE_MAX_MB
+        _artifact_cache = DownloadArtifactCache(fs.FileSystem().get_cache_dir(CACHE_TYPE_DOWNLOADS),
+                                                DOWNLOAD_CACHE_MAX_MB * 1024 * 1024)
+    return _artifact_cache
@@ -4,18 +4,30 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
+import functools
 import hashlib
 import json
 import os
 import sys
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Iterable
+from urllib.parse import quote
 
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 
 from . import calibre_db, db, logger
+from .duplicate_similarity import (
+    LSH_BANDS,
+    MIN_SIMILARITY,
+    DisjointSet,
+    is_near_duplicate,
+    lsh_buckets,
+    minhash_signature,
+    shingle_book,
+)
 from .duplicates import (
     _AWARE_MIN,
     _timestamp_or_default,
@@ -24,6 +36,7 @@ from .duplicates import (
     get_common_filters,
     normalize_title_for_duplicates,
 )
+from .string_helper import strip_whitespaces
 
 sys.path.insert(1, "/app/calibre-web-automated/scripts/")
 from cwa_db import CWA_DB
@@ -91,13 +104,41 @@ def get_effective_duplicate_criteria(settings):
     return criteria
 
 
+def get_similarity_threshold(settings):
+    """Returns the title/author similarity threshold of the approximate mode, None for exact keys.
+
+    The mode only applies when title or author is a criterion, the remaining criteria still have to
+    match exactly.
+    """
+    try:
+        percent = int(settings.get("duplicate_detection_similarity", 0) or 0)
+    except (TypeError, ValueError):
+        percent = 0
+    if percent <= 0:
+        return None
+    criteria = get_effective_duplicate_criteria(settings)
+    if not (criteria["title"] or criteria["author"]):
+        return None
+    return max(MIN_SIMILARITY, min(1.0, percent / 100))
+
+
+def content_matching_enabled(settings):
+    """Books sharing a file (format and partial MD5) are duplicates regardless of their metadata."""
+    return _setting_enabled(settings, "duplicate_detection_content", 0)
+
+
 def get_criteria_fingerprint(settings):
-    return _hash_json(
-        {
-            "normalization_version": NORMALIZATION_VERSION,
-            "criteria": get_effective_duplicate_criteria(settings),
-        }
-    )
+    payload = {
+        "normalization_version": NORMALIZATION_VERSION,
+        "criteria": get_effective_duplicate_criteria(settings),
+    }
+    # Optional modes only enter the payload when enabled so existing indexes remain valid
+    threshold = get_similarity_threshold(settings)
+    if threshold is not None:
+        payload["similarity"] = threshold
+    if content_matching_enabled(settings):
+        payload["content"] = True
+    return _hash_json(payload)
 
 
 def _primary_author(book):
@@ -110,39 +151,35 @@ def _primary_author(book):
 
 
 def build_book_key_parts(book, settings):
-    primary_author = _primary_author(book)
-    title = book.title if getattr(book, "title", None) else "untitled"
+    return _key_parts(
+        _primary_author(book),
+        getattr(book, "title", None),
+        [language.lang_code for language in getattr(book, "languages", None) or []],
+        [series.name for series in getattr(book, "series", None) or []],
+        [publisher.name for publisher in getattr(book, "publishers", None) or []],
+        [data.format for data in getattr(book, "data", None) or []],
+    )
 
-    if getattr(book, "languages", None):
-        language = book.languages[0].lang_code if book.languages[0].lang_code else "unknown"
-    else:
-        language = "unknown"
 
-    if getattr(book, "series", None):
-        series = book.series[0].name if book.series[0].name else "no_series"
-    else:
-        series = "no_series"
+def _normalize_value(value, default):
+    return (value or default).lower().strip()
 
-    if getattr(book, "publishers", None):
-        publisher = book.publishers[0].name if book.publishers[0].name else "unknown_publisher"
-    else:
-        publisher = "unknown_publisher"
 
-    if getattr(book, "data", None):
-        formats = sorted([data.format.lower() for data in book.data if data.format])
-        format_signature = ",".join(formats) if formats else "no_format"
-    else:
-        format_signature = "no_format"
+def _format_signature(formats):
+    formats = sorted([book_format.lower() for book_format in formats if book_format])
+    return ",".join(formats) if formats else "no_format"
 
+
+def _key_parts(primary_author, title, languages, series, publishers, formats):
     # Keep title normalization stable across criteria: even title-only keys strip a
     # leading primary-author prefix, unlike the old Python fallback's no-author mode.
     return BookKeyParts(
-        normalized_title=normalize_title_for_duplicates(title, primary_author),
-        normalized_author=primary_author.lower().strip() if primary_author else "unknown",
-        normalized_language=language.lower().strip(),
-        normalized_series=series.lower().strip(),
-        normalized_publisher=publisher.lower().strip(),
-        format_signature=format_signature,
+        normalized_title=normalize_title_for_duplicates(title or "untitled", primary_author),
+        normalized_author=_normalize_value(primary_author, "unknown"),
+        normalized_language=_normalize_value(languages[0] if languages else None, "unknown"),
+        normalized_series=_normalize_value(series[0] if series else None, "no_series"),
+        normalized_publisher=_normalize_value(publishers[0] if publishers else None, "unknown_publisher"),
+        format_signature=_format_signature(formats),
     )
 
 
@@ -168,6 +205,26 @@ def build_duplicate_key(book, settings):
     return _hash_json(_enabled_key_values(build_book_key_parts(book, settings), settings))
 
 
+def _similarity_shingles(normalized_title, normalized_author, settings):
+    criteria = get_effective_duplicate_criteria(settings)
+    return shingle_book(
+        normalized_title if criteria["title"] else None,
+        normalized_author if criteria["author"] else None,
+    )
+
+
+def _exact_criteria_values(row, settings):
+    """Values of the criteria that still match exactly in approximate mode, row is a key table row."""
+    criteria = get_effective_duplicate_criteria(settings)
+    __, __, __, language, series, publisher, format_signature = row
+    return (
+        language if criteria["language"] else None,
+        series if criteria["series"] else None,
+        publisher if criteria["publisher"] else None,
+        format_signature if criteria["format"] else None,
+    )
+
+
 def _book_query(book_ids=None):
     query = (
         calibre_db.session.query(db.Books)
@@ -227,36 +284,20 @@ def upsert_book_keys(book_ids: Iterable[int], settings):
         return {"updated": 0, "missing": 0, "missing_ids": [], "fingerprint": get_criteria_fingerprint(settings)}
 
     fingerprint = get_criteria_fingerprint(settings)
-    books = _load_books_by_ids(book_ids)
-    loaded_book_ids = {int(book.id) for book in books}
     cwa_db = CWA_DB()
-    updated = 0
-    for book in books:
-        parts = build_book_key_parts(book, settings)
-        duplicate_key = _hash_json(_enabled_key_values(parts, settings))
+    params = {"book_ids": json.dumps(sorted(book_ids))}
+    with _attached_calibre_library(cwa_db, settings):
+        updated = _write_key_rows(cwa_db, "", "books.id IN (SELECT value FROM json_each(:book_ids))", params, settings)
         cwa_db.cur.execute(
-            """
-            INSERT INTO cwa_duplicate_book_keys (
-                book_id, normalized_title, normalized_author, normalized_language,
-                normalized_series, normalized_publisher, format_signature,
-                duplicate_key, criteria_fingerprint, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(book_id) DO UPDATE SET
-                normalized_title = excluded.normalized_title,
-                normalized_author = excluded.normalized_author,
-                normalized_language = excluded.normalized_language,
-                normalized_series = excluded.normalized_series,
-                normalized_publisher = excluded.normalized_publisher,
-                format_signature = excluded.format_signature,
-                duplicate_key = excluded.duplicate_key,
-                criteria_fingerprint = excluded.criteria_fingerprint,
-                updated_at = CURRENT_TIMESTAMP
-            """,
-            (book.id, *parts.as_db_tuple(), duplicate_key, fingerprint),
+            "SELECT value FROM json_each(:book_ids) WHERE value NOT IN (SELECT id FROM calibre.books)", params
         )
-        updated += 1
-    cwa_db.con.commit()
-    missing_ids = sorted(book_ids - loaded_book_ids)
+        missing_ids = sorted(int(row[0]) for row in cwa_db.cur.fetchall())
+        cwa_db.cur.execute(
+            "DELETE FROM cwa_duplicate_book_bands WHERE book_id IN (SELECT value FROM json_each(:book_ids))", params
+        )
+        if get_similarity_threshold(settings) is not None:
+            _write_band_rows(cwa_db, "", "keys.book_id IN (SELECT value FROM json_each(:book_ids))", params)
+        cwa_db.con.commit()
     return {"updated": updated, "missing": len(missing_ids), "missing_ids": missing_ids, "fingerprint": fingerprint}
 
 
@@ -268,49 +309,243 @@ def delete_book_keys(book_ids: Iterable[int]):
     placeholders = ",".join("?" for _ in book_ids)
     cwa_db.cur.execute(f"DELETE FROM cwa_duplicate_book_keys WHERE book_id IN ({placeholders})", tuple(book_ids))
     deleted = cwa_db.cur.rowcount
+    cwa_db.cur.execute(f"DELETE FROM cwa_duplicate_book_bands WHERE book_id IN ({placeholders})", tuple(book_ids))
     cwa_db.con.commit()
     return deleted
 
 
+# Keys are computed in one INSERT ... SELECT over metadata.db attached to cwa.db. Linked values are taken
+# in link table order, the order the ORM relationships load them in, and the normalization runs in the
+# same Python helpers as build_book_key_parts, registered as SQL functions.
+_KEY_ROWS_SQL = """
+    INSERT INTO cwa_duplicate_book_keys{suffix} (
+        book_id, normalized_title, normalized_author, normalized_language,
+        normalized_series, normalized_publisher, format_signature,
+        duplicate_key, criteria_fingerprint, updated_at
+    )
+    SELECT book_id, normalized_title, normalized_author, normalized_language,
+           normalized_series, normalized_publisher, format_signature,
+           cwa_duplicate_key(normalized_title, normalized_author, normalized_language,
+                             normalized_series, normalized_publisher, format_signature),
+           :fingerprint, CURRENT_TIMESTAMP
+    FROM (
+        SELECT book_id,
+               cwa_normalize_title(title, primary_author) AS normalized_title,
+               cwa_normalize(primary_author, 'unknown') AS normalized_author,
+               cwa_normalize(language, 'unknown') AS normalized_language,
+               cwa_normalize(series, 'no_series') AS normalized_series,
+               cwa_normalize(publisher, 'unknown_publisher') AS normalized_publisher,
+               format_signature
+        FROM (
+            SELECT books.id AS book_id,
+                   books.title AS title,
+                   cwa_primary_author(books.author_sort, (
+                       SELECT json_group_array(json_array(id, name, sort)) FROM (
+                           SELECT authors.id, authors.name, authors.sort
+                           FROM calibre.books_authors_link AS link
+                           JOIN calibre.authors AS authors ON authors.id = link.author
+                           WHERE link.book = books.id ORDER BY link.rowid
+                       )
+                   )) AS primary_author,
+                   (SELECT languages.lang_code FROM calibre.books_languages_link AS link
+                    JOIN calibre.languages AS languages ON languages.id = link.lang_code
+                    WHERE link.book = books.id ORDER BY link.rowid LIMIT 1) AS language,
+                   (SELECT series.name FROM calibre.books_series_link AS link
+                    JOIN calibre.series AS series ON series.id = link.series
+                    WHERE link.book = books.id ORDER BY link.rowid LIMIT 1) AS series,
+                   (SELECT publishers.name FROM calibre.books_publishers_link AS link
+                    JOIN calibre.publishers AS publishers ON publishers.id = link.publisher
+                    WHERE link.book = books.id ORDER BY link.rowid LIMIT 1) AS publisher,
+                   (SELECT cwa_format_signature(json_group_array(data.format)) FROM calibre.data AS data
+                    WHERE data.book = books.id) AS format_signature
+            FROM calibre.books AS books
+            WHERE {where}
+        )
+    )
+    WHERE true
+    ON CONFLICT(book_id) DO UPDATE SET
+        normalized_title = excluded.normalized_title,
+        normalized_author = excluded.normalized_author,
+        normalized_language = excluded.normalized_language,
+        normalized_series = excluded.normalized_series,
+        normalized_publisher = excluded.normalized_publisher,
+        format_signature = excluded.format_signature,
+        duplicate_key = excluded.duplicate_key,
+        criteria_fingerprint = excluded.criteria_fingerprint,
+        updated_at = CURRENT_TIMESTAMP
+"""
+_BAND_ROWS_SQL = """
+    INSERT INTO cwa_duplicate_book_bands{suffix} (book_id, band, bucket)
+    SELECT keys.book_id, bands.value, cwa_band_bucket(keys.normalized_title, keys.normalized_author, bands.value)
+    FROM cwa_duplicate_book_keys{suffix} AS keys
+    JOIN json_each(:bands) AS bands
+    WHERE {where}
+"""
+_REBUILD_TABLES = ("cwa_duplicate_book_keys", "cwa_duplicate_book_bands")
+_SHADOW_SUFFIX = "_rebuild"
+# SQLite NOCASE only folds ASCII letters
+_NOCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _metadata_db_path():
+    return os.path.join(calibre_db.config.config_calibre_dir, "metadata.db")
+
+
+def _primary_author_from_columns(author_sort, authors, sort_exists):
+    """Picks the first author the way CalibreDB.order_authors orders them, authors are (id, name, sort)."""
+    if not authors:
+        return "unknown"
+    primary = None
+    for sort_name in (author_sort or "").split("&"):
+        sort_name = strip_whitespaces(sort_name)
+        if not sort_name:
+            continue
+        folded = sort_name.translate(_NOCASE)
+        matches = sorted(author for author in authors if (author[2] or "").translate(_NOCASE) == folded)
+        if matches:
+            primary = matches[0]
+            break
+        # order_authors stops at a sort name no author has and falls back to the link order
+        if not sort_exists(sort_name):
+            break
+    if primary is None:
+        primary = authors[0]
+    return primary[1] or "unknown"
+
+
+def _register_key_functions(connection, settings):
+    def sort_exists(sort_name):
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM calibre.authors WHERE sort = ? LIMIT 1", (sort_name,))
+        return cursor.fetchone() is not None
+
+    @functools.lru_cache(maxsize=256)
+    def primary_author(author_sort, authors_json):
+        return _primary_author_from_columns(author_sort, json.loads(authors_json or "[]"), sort_exists)
+
+    @functools.lru_cache(maxsize=256)
+    def band_buckets(normalized_title, normalized_author):
+        shingles = _similarity_shingles(normalized_title, normalized_author, settings)
+        return dict(lsh_buckets(minhash_signature(shingles)))
+
+    connection.create_function("cwa_primary_author", 2, primary_author)
+    connection.create_function("cwa_normalize", 2, _normalize_value, deterministic=True)
+    connection.create_function(
+        "cwa_normalize_title", 2,
+        lambda title, author: normalize_title_for_duplicates(title or "untitled", author),
+        deterministic=True,
+    )
+    connection.create_function(
+        "cwa_format_signature", 1, lambda formats: _format_signature(json.loads(formats or "[]")), deterministic=True
+    )
+    connection.create_function(
+        "cwa_duplicate_key", 6, lambda *parts: _hash_json(_enabled_key_values(BookKeyParts(*parts), settings))
+    )
+    connection.create_function(
+        "cwa_band_bucket", 3, lambda title, author, band: band_buckets(title, author)[band]
+    )
+
+
+@contextmanager
+def _attached_calibre_library(cwa_db, settings):
+    """Attaches metadata.db read-only as "calibre" to the cwa.db connection for one key pass."""
+    cwa_db.con.commit()
+    uri = "file:{}?mode=ro".format(quote(_metadata_db_path()))
+    cwa_db.cur.execute("ATTACH DATABASE ? AS calibre", (uri,))
+    try:
+        _register_key_functions(cwa_db.con, settings)
+        yield
+    finally:
+        cwa_db.con.rollback()
+        cwa_db.cur.execute("DETACH DATABASE calibre")
+
+
+def _write_key_rows(cwa_db, suffix, where, params, settings):
+    cwa_db.cur.execute(
+        _KEY_ROWS_SQL.format(suffix=suffix, where=where),
+        {**params, "fingerprint": get_criteria_fingerprint(settings)},
+    )
+    return cwa_db.cur.rowcount
+
+
+def _write_band_rows(cwa_db, suffix, where, params):
+    cwa_db.cur.execute(
+        _BAND_ROWS_SQL.format(suffix=suffix, where=where),
+        {**params, "bands": json.dumps(list(range(LSH_BANDS)))},
+    )
+
+
+def _create_shadow_tables(cwa_db):
+    for table in _REBUILD_TABLES:
+        cwa_db.cur.execute(f"DROP TABLE IF EXISTS {table}{_SHADOW_SUFFIX}")
+        cwa_db.cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = cwa_db.cur.fetchone()[0]
+        cwa_db.cur.execute(create_sql.replace(table, table + _SHADOW_SUFFIX, 1))
+    cwa_db.con.commit()
+
+
+def _swap_shadow_tables(cwa_db):
+    """Replaces the live index tables with their shadows in one transaction and recreates the indexes."""
+    placeholders = ",".join("?" for _ in _REBUILD_TABLES)
+    cwa_db.cur.execute(
+        f"SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        _REBUILD_TABLES,
+    )
+    index_sql = [row[0] for row in cwa_db.cur.fetchall()]
+    cwa_db.con.commit()
+    cwa_db.cur.execute("BEGIN IMMEDIATE")
+    try:
+        for table in _REBUILD_TABLES:
+            cwa_db.cur.execute(f"DROP TABLE {table}")
+            cwa_db.cur.execute(f"ALTER TABLE {table}{_SHADOW_SUFFIX} RENAME TO {table}")
+        for statement in index_sql:
+            cwa_db.cur.execute(statement)
+        cwa_db.con.commit()
+    except Exception:
+        cwa_db.con.rollback()
+        raise
+
+
 def rebuild_duplicate_index(settings, progress_callback=None):
+    """Rebuilds the key and band tables from scratch.
+
+    Keys are computed page by page into shadow tables, one commit per page, so memory stays flat for
+    any library size. Readers keep using the previous index until the shadows are swapped in.
+    """
     fingerprint = get_criteria_fingerprint(settings)
-    book_ids = sorted(_current_library_book_ids())
-    total_books = len(book_ids)
-    key_rows = []
+    track_similarity = get_similarity_threshold(settings) is not None
+    cwa_db = CWA_DB()
+    _create_shadow_tables(cwa_db)
 
     indexed_count = 0
-    if progress_callback:
-        progress_callback(indexed_count, total_books)
-    for batch_ids in _chunks(book_ids, DUPLICATE_INDEX_REBUILD_BATCH_SIZE):
-        books_by_id = {int(book.id): book for book in _load_books_by_ids(batch_ids)}
-        for book_id in batch_ids:
-            book = books_by_id.get(int(book_id))
-            if book is None:
-                continue
-            parts = build_book_key_parts(book, settings)
-            duplicate_key = _hash_json(_enabled_key_values(parts, settings))
-            key_rows.append(
-                (book.id, *parts.as_db_tuple(), duplicate_key, fingerprint)
+    with _attached_calibre_library(cwa_db, settings):
+        cwa_db.cur.execute("SELECT COUNT(*), MAX(id) FROM calibre.books")
+        total_books, max_book_id = cwa_db.cur.fetchone()
+        if progress_callback:
+            progress_callback(indexed_count, total_books)
+        low = 0
+        while True:
+            cwa_db.cur.execute(
+                "SELECT MAX(id) FROM (SELECT id FROM calibre.books WHERE id > ? ORDER BY id LIMIT ?)",
+                (low, DUPLICATE_INDEX_REBUILD_BATCH_SIZE),
+            )
+            high = cwa_db.cur.fetchone()[0]
+            if high is None:
+                break
+            params = {"low": low, "high": high}
+            indexed_count += _write_key_rows(
+                cwa_db, _SHADOW_SUFFIX, "books.id > :low AND books.id <= :high", params, settings
             )
-            indexed_count += 1
-            if progress_callback and (indexed_count % 25 == 0 or indexed_count == total_books):
+            if track_similarity:
+                _write_band_rows(cwa_db, _SHADOW_SUFFIX, "keys.book_id > :low AND keys.book_id <= :high", params)
+            cwa_db.con.commit()
+            if progress_callback:
                 progress_callback(indexed_count, total_books)
+            low = high
 
-    cwa_db = CWA_DB()
-    cwa_db.cur.execute("DELETE FROM cwa_duplicate_book_keys")
-    cwa_db.cur.executemany(
-        """
-        INSERT OR REPLACE INTO cwa_duplicate_book_keys (
-            book_id, normalized_title, normalized_author, normalized_language,
-            normalized_series, normalized_publisher, format_signature,
-            duplicate_key, criteria_fingerprint, updated_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        """,
-        key_rows,
-    )
-    cwa_db.con.commit()
+    _swap_shadow_tables(cwa_db)
     return {
-        "max_book_id": max(book_ids, default=0),
+        "max_book_id": int(max_book_id or 0),
         "indexed_count": indexed_count,
         "fingerprint": fingerprint,
     }
@@ -346,10 +581,171 @@ def _duplicate_key_rows(settings, candidate_book_ids=None):
     return cwa_db.cur.fetchall()
 
 
+_KEY_ROW_COLUMNS = (
+    "book_id, normalized_title, normalized_author, normalized_language, "
+    "normalized_series, normalized_publisher, format_signature"
+)
+
+
+def _similarity_key_rows(cwa_db, fingerprint, book_ids=None):
+    if book_ids is None:
+        cwa_db.cur.execute(
+            f"SELECT {_KEY_ROW_COLUMNS} FROM cwa_duplicate_book_keys WHERE criteria_fingerprint = ?",
+            (fingerprint,),
+        )
+        return {int(row[0]): row for row in cwa_db.cur.fetchall()}
+    rows = {}
+    for chunk in _chunks(book_ids, DUPLICATE_INDEX_REBUILD_BATCH_SIZE):
+        placeholders = ",".join("?" for _ in chunk)
+        cwa_db.cur.execute(
+            f"SELECT {_KEY_ROW_COLUMNS} FROM cwa_duplicate_book_keys "
+            f"WHERE criteria_fingerprint = ? AND book_id IN ({placeholders})",
+            (fingerprint, *chunk),
+        )
+        rows.update((int(row[0]), row) for row in cwa_db.cur.fetchall())
+    return rows
+
+
+def _bucket_mates(cwa_db, book_ids):
+    """Pairs of books sharing an LSH bucket with any of book_ids."""
+    pairs = set()
+    for chunk in _chunks(book_ids, DUPLICATE_INDEX_REBUILD_BATCH_SIZE):
+        placeholders = ",".join("?" for _ in chunk)
+        cwa_db.cur.execute(
+            f"""
+            SELECT DISTINCT own.book_id, other.book_id
+            FROM cwa_duplicate_book_bands own
+            JOIN cwa_duplicate_book_bands other
+              ON other.band = own.band AND other.bucket = own.bucket AND other.book_id != own.book_id
+            WHERE own.book_id IN ({placeholders})
+            """,
+            tuple(chunk),
+        )
+        pairs.update((int(first), int(second)) for first, second in cwa_db.cur.fetchall())
+    return pairs
+
+
+def _approximate_group_book_ids(settings, candidate_book_ids=None):
+    """Groups of near-duplicate book ids found through the LSH buckets and verified by similarity.
+
+    Without candidates every bucket holding more than one book is checked. With candidates the
+    groups containing them are followed bucket by bucket until no further book joins.
+    """
+    threshold = get_similarity_threshold(settings)
+    fingerprint = get_criteria_fingerprint(settings)
+    cwa_db = CWA_DB()
+    groups = DisjointSet()
+    shingles = {}
+    key_rows = {}
+    rejected = set()
+
+    def joins(first, second):
+        """True if the pair is a verified near-duplicate not already in the same group."""
+        pair = (min(first, second), max(first, second))
+        if groups.find(first) == groups.find(second) or pair in rejected:
+            return False
+        if first not in key_rows or second not in key_rows:
+            return False
+        if _exact_criteria_values(key_rows[first], settings) == _exact_criteria_values(key_rows[second], settings):
+            for book_id in (first, second):
+                if book_id not in shingles:
+                    row = key_rows[book_id]
+                    shingles[book_id] = _similarity_shingles(row[1], row[2], settings)
+            if is_near_duplicate(shingles[first], shingles[second], threshold):
+                return True
+        rejected.add(pair)
+        return False
+
+    if candidate_book_ids is None:
+        key_rows = _similarity_key_rows(cwa_db, fingerprint)
+        cwa_db.cur.execute(
+            """
+            SELECT GROUP_CONCAT(book_id)
+            FROM cwa_duplicate_book_bands
+            GROUP BY band, bucket
+            HAVING COUNT(*) > 1
+            """
+        )
+        for (book_ids_str,) in cwa_db.cur.fetchall():
+            bucket = [int(book_id) for book_id in book_ids_str.split(",") if book_id]
+            for index, first in enumerate(bucket):
+                for second in bucket[index + 1:]:
+                    if joins(first, second):
+                        groups.union(first, second)
+        return groups.groups()
+
+    candidate_ids = {int(book_id) for book_id in candidate_book_ids if book_id is not None}
+    seen = set(candidate_ids)
+    frontier = set(candidate_ids)
+    while frontier:
+        pairs = _bucket_mates(cwa_db, frontier)
+        new_ids = {book_id for pair in pairs for book_id in pair} - key_rows.keys()
+        key_rows.update(_similarity_key_rows(cwa_db, fingerprint, new_ids | (frontier - key_rows.keys())))
+        frontier = set()
+        for first, second in sorted(pairs):
+            if joins(first, second):
+                groups.union(first, second)
+                for book_id in (first, second):
+                    if book_id not in seen:
+                        seen.add(book_id)
+                        frontier.add(book_id)
+    candidate_roots = {groups.find(book_id) for book_id in candidate_ids}
+    return [group for group in groups.groups() if groups.find(group[0]) in candidate_roots]
+
+
+def _key_group_book_id_lists(settings, candidate_book_ids=None):
+    if get_similarity_threshold(settings) is not None:
+        return _approximate_group_book_ids(settings, candidate_book_ids=candidate_book_ids)
+    return [
+        [int(book_id) for book_id in book_ids_str.split(",") if book_id]
+        for _duplicate_key, book_ids_str, _count in _duplicate_key_rows(settings, candidate_book_ids=candidate_book_ids)
+    ]
+
+
+def _content_group_book_id_lists(candidate_book_ids=None):
+    from .progress_syncing.checksums import get_shared_checksum_groups
+
+    return get_shared_checksum_groups(candidate_book_ids=candidate_book_ids)
+
+
+def _group_book_id_lists(settings, candidate_book_ids=None):
+    if not content_matching_enabled(settings):
+        return _key_group_book_id_lists(settings, candidate_book_ids=candidate_book_ids)
+
+    groups = DisjointSet()
+    if candidate_book_ids is None:
+        for book_ids in _key_group_book_id_lists(settings) + _content_group_book_id_lists():
+            for book_id in book_ids[1:]:
+                groups.union(book_ids[0], book_id)
+        return groups.groups()
+
+    # A shared file can join two metadata groups, follow both kinds until no further book joins
+    candidate_ids = {int(book_id) for book_id in candidate_book_ids if book_id is not None}
+    seen = set(candidate_ids)
+    pending = set(candidate_ids)
+    while pending:
+        found = set()
+        lists = _key_group_book_id_lists(settings, candidate_book_ids=pending)
+        lists += _content_group_book_id_lists(candidate_book_ids=pending)
+        for book_ids in lists:
+            for book_id in book_ids[1:]:
+                groups.union(book_ids[0], book_id)
+            found.update(book_ids)
+        pending = found - seen
+        seen |= found
+    candidate_roots = {groups.find(book_id) for book_id in candidate_ids}
+    return [group for group in groups.groups() if groups.find(group[0]) in candidate_roots]
+
+
 def _indexed_group_book_ids_for_books(settings, book_ids):
     book_ids = {int(book_id) for book_id in book_ids if book_id is not None}
     if not book_ids:
         return set()
+    if get_similarity_threshold(settings) is not None or content_matching_enabled(settings):
+        affected_ids = set()
+        for group in _group_book_id_lists(settings, candidate_book_ids=book_ids):
+            affected_ids.update(group)
+        return affected_ids
 
     fingerprint = get_criteria_fingerprint(settings)
     placeholders = ",".join("?" for _ in book_ids)
@@ -406,8 +802,7 @@ def _group_from_books(books):
 
 def get_duplicate_groups_from_index(settings, include_dismissed=False, user_id=None, candidate_book_ids=None):
     duplicate_groups = []
-    for _duplicate_key, book_ids_str, _count in _duplicate_key_rows(settings, candidate_book_ids=candidate_book_ids):
-        book_ids = [int(book_id) for book_id in book_ids_str.split(",") if book_id]
+    for book_ids in _group_book_id_lists(settings, candidate_book_ids=candidate_book_ids):
         books = _load_books_by_ids(book_ids, user_id=user_id)
         if len(books) < 2:
             continue
@@ -471,9 +866,8 @@ def merge_affected_groups_into_cache(candidate_book_ids, settings):
     missing_ids = upsert_result.get("missing_ids", [])
     if missing_ids:
         delete_book_keys(missing_ids)
-    affected_rows = _duplicate_key_rows(settings, candidate_book_ids=candidate_book_ids)
-    for _duplicate_key, book_ids_str, _count in affected_rows:
-        affected_ids.update(int(book_id) for book_id in book_ids_str.split(",") if book_id)
+    for book_ids in _group_book_id_lists(settings, candidate_book_ids=candidate_book_ids):
+        affected_ids.update(book_ids)
 
     cwa_db = CWA_DB()
     cache_data = cwa_db.get_duplicate_cache() or {}
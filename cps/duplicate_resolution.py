@@ -0,0 +1,499 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+import json
+import os
+import shutil
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import calibre_db, config, db, helper, logger, ub
+
+
+log = logger.create()
+
+DUPLICATE_RESOLUTION_BATCH_SIZE = 50
+DUPLICATE_RESOLUTION_WORKERS = 4
+DUPLICATE_RESOLUTION_BACKUP_DIR = "/config/processed_books/duplicate_resolutions"
+DUPLICATE_RESOLUTION_CHECKPOINT_FILE = "/config/cwa_duplicate_resolution_checkpoint.json"
+# ioctl number of FICLONE on Linux, clones a whole file on filesystems with shared extents (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+@dataclass(frozen=True)
+class FileCopy:
+    """A format of a duplicate copied into the kept book by the merge strategy."""
+    source_book_id: int
+    book_format: str
+    source: str
+    target: str
+    uncompressed_size: int
+    name: str
+
+
+@dataclass(frozen=True)
+class DeletedBook:
+    id: int
+    path: str
+
+
+@dataclass(frozen=True)
+class GroupResolution:
+    """Keep/delete/merge decision of one duplicate group, computed before anything is changed."""
+    group_hash: str
+    title: str
+    author: str
+    keep_id: int
+    deletions: tuple
+    copies: tuple = ()
+
+    @property
+    def checkpoint_key(self):
+        return f"{self.group_hash}:{self.keep_id}"
+
+
+@dataclass
+class _Batch:
+    plans: list
+    books: dict
+    failed: dict = field(default_factory=dict)
+    copied: dict = field(default_factory=dict)
+
+
+def plan_group_resolution(group, book_to_keep, books_to_delete, strategy):
+    """Builds the resolution of a group from the books it was scanned with."""
+    copies = []
+    if strategy == 'merge':
+        existing_formats = [data.format for data in book_to_keep.data or []]
+        author_name = book_to_keep.authors[0].name if book_to_keep.authors else "unknown"
+        to_name = (helper.get_valid_filename(book_to_keep.title, chars=96) + ' - '
+                   + helper.get_valid_filename(author_name, chars=96))
+        for book in books_to_delete:
+            for data in book.data or []:
+                if data.format in existing_formats:
+                    continue
+                copies.append(FileCopy(
+                    source_book_id=book.id,
+                    book_format=data.format,
+                    source=os.path.normpath(os.path.join(config.get_book_path(), book.path,
+                                                         data.name + "." + data.format.lower())),
+                    target=os.path.normpath(os.path.join(config.get_book_path(), book_to_keep.path,
+                                                         to_name + "." + data.format.lower())),
+                    uncompressed_size=data.uncompressed_size,
+                    name=to_name,
+                ))
+                existing_formats.append(data.format)
+    return GroupResolution(
+        group_hash=group['group_hash'],
+        title=group['title'],
+        author=group['author'],
+        keep_id=book_to_keep.id,
+        deletions=tuple(DeletedBook(book.id, book.path) for book in books_to_delete),
+        copies=tuple(copies),
+    )
+
+
+def clone_file(source, target, hardlink=True):
+    """Copies source to target sharing its blocks where the filesystem allows.
+
+    Tries a reflink first, then a hard link unless hardlink is False, then falls back to a plain copy.
+    Returns the mode used.
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    if fcntl is not None:
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            os.remove(target)
+    if hardlink:
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
+    return 'copy'
+
+
+def _load_checkpoint():
+    try:
+        with open(DUPLICATE_RESOLUTION_CHECKPOINT_FILE) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except FileNotFoundError:
+        checkpoint = {}
+    except (OSError, ValueError) as ex:
+        log.warning("[cwa-duplicates] Ignoring unreadable resolution checkpoint: %s", ex)
+        checkpoint = {}
+    checkpoint.setdefault('completed', [])
+    checkpoint.setdefault('pending_removals', [])
+    checkpoint.setdefault('pending_after_commit', [])
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint):
+    temp_path = DUPLICATE_RESOLUTION_CHECKPOINT_FILE + ".tmp"
+    try:
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_path, DUPLICATE_RESOLUTION_CHECKPOINT_FILE)
+    except OSError as ex:
+        log.warning("[cwa-duplicates] Could not write resolution checkpoint: %s", ex)
+
+
+def _clear_checkpoint():
+    try:
+        os.remove(DUPLICATE_RESOLUTION_CHECKPOINT_FILE)
+    except FileNotFoundError:
+        pass
+    except OSError as ex:
+        log.warning("[cwa-duplicates] Could not remove resolution checkpoint: %s", ex)
+
+
+def _plan_to_checkpoint(plan):
+    return {
+        'group_hash': plan.group_hash,
+        'title': plan.title,
+        'author': plan.author,
+        'keep_id': plan.keep_id,
+        'deletions': [{'id': deletion.id, 'path': deletion.path} for deletion in plan.deletions],
+    }
+
+
+def _plan_from_checkpoint(entry):
+    return GroupResolution(entry['group_hash'], entry['title'], entry['author'], entry['keep_id'],
+                           tuple(DeletedBook(**deletion) for deletion in entry['deletions']))
+
+
+class DuplicateResolver:
+    """Applies planned group resolutions in batches.
+
+    Per batch the merge copies and the backups of the deleted books run on a thread pool, the
+    database changes of all groups are staged without committing and committed together, and only
+    then the folders of the deleted books are removed, one after the other. Progress is checkpointed
+    after every commit, so an interrupted run resumes with the pending folder removals and the
+    pending index, thumbnail and audit cleanup, and skips the groups it already resolved.
+    """
+
+    def __init__(self, cwa_db, strategy, trigger_type='manual', user_id=None,
+                 batch_size=None, workers=None):
+        self.cwa_db = cwa_db
+        self.strategy = strategy
+        self.trigger_type = trigger_type
+        self.user_id = user_id
+        self.batch_size = batch_size or DUPLICATE_RESOLUTION_BATCH_SIZE
+        self.workers = workers or DUPLICATE_RESOLUTION_WORKERS
+        self.checkpoint = _load_checkpoint()
+        self.result = {'resolved_count': 0, 'deleted_count': 0, 'kept_count': 0, 'errors': []}
+        self.copy_modes = Counter()
+        self.bytes_copied = 0
+        self.timings = Counter()
+        self.batches = 0
+        self.executor = None
+
+    def resolve(self, plans):
+        start_time = time.time()
+        resumed = bool(self.checkpoint['completed'] or self.checkpoint['pending_removals']
+                       or self.checkpoint['pending_after_commit'])
+        completed = set(self.checkpoint['completed'])
+        plans = [plan for plan in plans if plan.checkpoint_key not in completed]
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='duplicate-resolve') as executor:
+            self.executor = executor
+            if self.checkpoint['pending_removals']:
+                log.info("[cwa-duplicates] Resuming %d folder removal(s) of an interrupted resolution",
+                         len(self.checkpoint['pending_removals']))
+                self._remove_folders([DeletedBook(**entry) for entry in self.checkpoint['pending_removals']])
+            if self.checkpoint['pending_after_commit']:
+                self._finish_after_commit([_plan_from_checkpoint(entry)
+                                           for entry in self.checkpoint['pending_after_commit']])
+            for offset in range(0, len(plans), self.batch_size):
+                self._resolve_batch(plans[offset:offset + self.batch_size])
+
+        if self.checkpoint['pending_removals'] or self.checkpoint['pending_after_commit']:
+            self._save()
+        else:
+            _clear_checkpoint()
+        self.result['report'] = self._report(time.time() - start_time, len(plans), resumed)
+        return self.result
+
+    def _resolve_batch(self, plans):
+        self.batches += 1
+        batch = self._load_batch(plans)
+        if not batch.plans:
+            return
+
+        started = time.time()
+        self._run_file_phase(batch)
+        self.timings['files'] += time.time() - started
+
+        started = time.time()
+        committed = self._apply_database_changes(batch)
+        self.timings['database'] += time.time() - started
+
+        started = time.time()
+        deleted = [deletion for plan in committed for deletion in plan.deletions]
+        self.checkpoint['pending_removals'].extend(
+            {'id': deletion.id, 'path': deletion.path} for deletion in deleted
+        )
+        self.checkpoint['completed'].extend(plan.checkpoint_key for plan in committed)
+        self.checkpoint['pending_after_commit'].extend(_plan_to_checkpoint(plan) for plan in committed)
+        self._save()
+        self._remove_folders(deleted)
+        self._finish_after_commit(committed)
+        self.timings['cleanup'] += time.time() - started
+
+    def _load_batch(self, plans):
+        """Drops the groups whose kept book is gone and the deleted books that no longer exist."""
+        book_ids = {plan.keep_id for plan in plans}
+        book_ids.update(deletion.id for plan in plans for deletion in plan.deletions)
+        books = {book.id: book for book in
+                 calibre_db.session.query(db.Books).filter(db.Books.id.in_(book_ids)).all()}
+        current = []
+        for plan in plans:
+            if plan.keep_id not in books:
+                self.result['errors'].append(f"Book to keep (ID {plan.keep_id}) no longer exists")
+                continue
+            deletions = tuple(deletion for deletion in plan.deletions if deletion.id in books)
+            if not deletions:
+                continue
+            copies = tuple(copy for copy in plan.copies if copy.source_book_id in books)
+            current.append(GroupResolution(plan.group_hash, plan.title, plan.author, plan.keep_id,
+                                           deletions, copies))
+        return _Batch(plans=current, books=books)
+
+    def _run_file_phase(self, batch):
+        futures = []
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for plan in batch.plans:
+            backup_dir = os.path.join(DUPLICATE_RESOLUTION_BACKUP_DIR, f"{stamp}_group_{plan.group_hash[:8]}")
+            for copy in plan.copies:
+                futures.append((plan, copy, self.executor.submit(clone_file, copy.source, copy.target)))
+            for deletion in plan.deletions:
+                futures.append((plan, None, self.executor.submit(self._backup_book, deletion, backup_dir)))
+        for plan, copy, future in futures:
+            try:
+                mode = future.result()
+            except Exception as ex:
+                operation = "merge" if copy else "backup"
+                log.error("[cwa-duplicates] %s failed for group '%s': %s", operation, plan.title, ex)
+                batch.failed.setdefault(plan.checkpoint_key, f"Group '{plan.title}': {operation} failed: {str(ex)}")
+                continue
+            if copy:
+                batch.copied.setdefault(plan.checkpoint_key, []).append(copy.target)
+                self.copy_modes[mode] += 1
+                self.bytes_copied += copy.uncompressed_size or 0
+
+        for plan in batch.plans:
+            if plan.checkpoint_key in batch.failed:
+                self.result['errors'].append(batch.failed[plan.checkpoint_key])
+                self._discard_copies(batch, plan)
+
+    @staticmethod
+    def _backup_book(deletion, backup_dir):
+        # A hard link would share its inode with the library file, so the backup is a reflink or a copy
+        book_path = os.path.join(config.config_calibre_dir, deletion.path)
+        if os.path.exists(book_path):
+            os.makedirs(backup_dir, exist_ok=True)
+            shutil.copytree(book_path, os.path.join(backup_dir, f"book_{deletion.id}"),
+                            copy_function=partial(clone_file, hardlink=False), dirs_exist_ok=True)
+
+    def _apply_database_changes(self, batch):
+        """Commits the batch in one transaction, falls back to one transaction per group on errors."""
+        plans = [plan for plan in batch.plans if plan.checkpoint_key not in batch.failed]
+        if not plans:
+            return []
+        try:
+            for plan in plans:
+                self._stage_group(plan, batch.books)
+            self._delete_dirty_metadata(plans)
+            self._commit()
+            return plans
+        except Exception as ex:
+            self._rollback()
+            if len(plans) == 1:
+                log.error("[cwa-duplicates] Error resolving duplicate group '%s': %s", plans[0].title, ex)
+                self.result['errors'].append(f"Group '{plans[0].title}': {str(ex)}")
+                self._discard_copies(batch, plans[0])
+                return []
+            log.warning("[cwa-duplicates] Batched resolution failed, retrying %d groups one by one: %s",
+                        len(plans), ex)
+
+        committed = []
+        for plan in plans:
+            books = {book.id: book for book in calibre_db.session.query(db.Books).filter(
+                db.Books.id.in_([plan.keep_id] + [deletion.id for deletion in plan.deletions])).all()}
+            try:
+                self._stage_group(plan, books)
+                self._delete_dirty_metadata([plan])
+                self._commit()
+                committed.append(plan)
+            except Exception as ex:
+                self._rollback()
+                log.error("[cwa-duplicates] Error resolving duplicate group '%s': %s", plan.title, ex)
+                self.result['errors'].append(f"Group '{plan.title}': {str(ex)}")
+                self._discard_copies(batch, plan)
+        return committed
+
+    @staticmethod
+    def _stage_group(plan, books):
+        from cps.editbooks import delete_whole_book
+        book_to_keep = books[plan.keep_id]
+        for copy in plan.copies:
+            book_to_keep.data.append(db.Data(book_to_keep.id, copy.book_format, copy.uncompressed_size, copy.name))
+        for deletion in plan.deletions:
+            delete_whole_book(deletion.id, books[deletion.id], commit=False)
+
+    @staticmethod
+    def _commit():
+        # metadata.db first: if app.db fails afterwards, only shelf and read entries of deleted books stay
+        calibre_db.session.commit()
+        try:
+            ub.session.commit()
+        except Exception as ex:
+            ub.session.rollback()
+            log.warning("[cwa-duplicates] Could not remove shelf and read entries of deleted books: %s", ex)
+
+    @staticmethod
+    def _rollback():
+        calibre_db.session.rollback()
+        ub.session.rollback()
+
+    @staticmethod
+    def _delete_dirty_metadata(plans):
+        book_ids = [deletion.id for plan in plans for deletion in plan.deletions]
+        calibre_db.session.query(db.Metadata_Dirtied).filter(
+            db.Metadata_Dirtied.book.in_(book_ids)).delete(synchronize_session=False)
+
+    def _discard_copies(self, batch, plan):
+        for target in batch.copied.pop(plan.checkpoint_key, []):
+            try:
+                os.remove(target)
+            except OSError as ex:
+                log.warning("[cwa-duplicates] Could not remove merged copy %s: %s", target, ex)
+
+    def _remove_folders(self, deletions):
+        """Removes the folders of books already deleted from the database, keeps failures pending.
+
+        Runs serially, deleting a book also removes its author folder once it is empty, which races
+        with the removal of another book of the same author.
+        """
+        calibre_path = config.get_book_path()
+        removed = set()
+        for deletion in deletions:
+            try:
+                if config.config_use_google_drive:
+                    success, error = helper.delete_book_gdrive(deletion, None)
+                else:
+                    success, error = helper.delete_book_file(deletion, calibre_path)
+            except Exception as ex:
+                success, error = False, str(ex)
+            if success:
+                removed.add(deletion.id)
+                if error:
+                    log.warning("[cwa-duplicates] %s", error)
+            else:
+                log.error("[cwa-duplicates] Removing folder of deleted book %s failed: %s", deletion.id, error)
+        self.checkpoint['pending_removals'] = [entry for entry in self.checkpoint['pending_removals']
+                                               if entry['id'] not in removed]
+
+    def _finish_after_commit(self, plans):
+        try:
+            self._after_commit(plans)
+        except Exception as ex:
+            # Stays in the checkpoint, the next run does the cleanup again
+            log.error("[cwa-duplicates] Cleanup after resolving %d group(s) failed: %s", len(plans), ex)
+            self._save()
+            return
+        done = {plan.checkpoint_key for plan in plans}
+        self.checkpoint['pending_after_commit'] = [
+            entry for entry in self.checkpoint['pending_after_commit']
+            if _plan_from_checkpoint(entry).checkpoint_key not in done]
+        self._save()
+
+    def _after_commit(self, plans):
+        deleted_ids = [deletion.id for plan in plans for deletion in plan.deletions]
+        if not deleted_ids:
+            return
+        try:
+            from cps.duplicate_index import delete_book_keys
+            delete_book_keys(deleted_ids)
+        except Exception as ex:
+            log.warning("[cwa-duplicates] Failed to delete duplicate index keys for books %s: %s", deleted_ids, str(ex))
+
+        try:
+            from cps.services.worker import WorkerThread
+            worker = WorkerThread.get_instance()
+        except Exception:
+            worker = None
+        for book_id in deleted_ids:
+            helper.clear_cover_thumbnail_cache(book_id)
+            try:
+                if worker:
+                    worker.cancel_tasks_for_book(book_id)
+            except Exception as ex:
+                log.warning("[cwa-duplicates] Failed to cancel tasks for book %s: %s", book_id, ex)
+            try:
+                self.cwa_db.scheduled_cancel_for_book(book_id)
+            except Exception as ex:
+                log.warning("[cwa-duplicates] Failed to cancel scheduled jobs for book %s: %s", book_id, ex)
+
+        for plan in plans:
+            deleted = [deletion.id for deletion in plan.deletions]
+            self.cwa_db.log_duplicate_resolution(
+                group_hash=plan.group_hash,
+                group_title=plan.title,
+                group_author=plan.author,
+                kept_book_id=plan.keep_id,
+                deleted_book_ids=deleted,
+                strategy=self.strategy,
+                trigger_type=self.trigger_type,
+                user_id=self.user_id,
+                notes=f"Resolved {len(deleted)} duplicate(s) using {self.strategy} strategy"
+            )
+            self.result['resolved_count'] += 1
+            self.result['kept_count'] += 1
+            self.result['deleted_count'] += len(deleted)
+            if self.trigger_type == 'automatic':
+                print(f"[cwa-duplicates-auto] ✓ Resolved '{plan.title}' by {plan.author}: "
+                      f"kept book {plan.keep_id}, deleted {len(deleted)} duplicate(s) [{self.strategy} strategy]",
+                      flush=True)
+
+    def _save(self):
+        self.checkpoint['strategy'] = self.strategy
+        _save_checkpoint(self.checkpoint)
+
+    def _report(self, elapsed, planned, resumed):
+        return {
+            'planned_groups': planned,
+            'resolved_groups': self.result['resolved_count'],
+            'deleted_books': self.result['deleted_count'],
+            'batches': self.batches,
+            'resumed': resumed,
+            'files_copied': sum(self.copy_modes.values()),
+            'bytes_copied': self.bytes_copied,
+            'copy_modes': dict(self.copy_modes),
+            'pending_removals': len(self.checkpoint['pending_removals']),
+            'elapsed_seconds': round(elapsed, 3),
+            'phase_seconds': {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+            'groups_per_second': round(self.result['resolved_count'] / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+def resolve_duplicate_groups(plans, cwa_db, strategy, trigger_type='manual', user_id=None):
+    """Applies planned resolutions, see DuplicateResolver. Returns the counts, errors and a throughput report."""
+    return DuplicateResolver(cwa_db, strategy, trigger_type=trigger_type, user_id=user_id).resolve(plans)
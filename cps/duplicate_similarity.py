@@ -0,0 +1,118 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""MinHash signatures and LSH banding for approximate duplicate detection.
+
+Titles and authors are cut into character shingles. A MinHash signature of the shingle set is split
+into bands, books sharing any band bucket become candidates and candidates are only reported when the
+title and the author similarity each reach the threshold and the numbers in the titles are the same.
+With 16 bands of 4 rows a pair at 0.7 similarity is found with a probability above 98%, unrelated
+books rarely share a bucket.
+"""
+
+import hashlib
+import random
+import struct
+
+SHINGLE_SIZE = 3
+LSH_BANDS = 16
+LSH_ROWS = 4
+NUM_PERMUTATIONS = LSH_BANDS * LSH_ROWS
+MIN_SIMILARITY = 0.7
+
+# Shingles are hashed once, each permutation xors the hashes with its own mask. That is a
+# permutation of the 64 bit hash space and several times cheaper than (a * x + b) mod p in Python.
+_rng = random.Random(0x5EED)
+_PERMUTATION_MASKS = tuple(_rng.getrandbits(64) for __ in range(NUM_PERMUTATIONS))
+
+
+def _tokens(text):
+    return "".join(char if char.isalnum() else " " for char in (text or "").lower()).split()
+
+
+def _shingle_text(text, prefix):
+    if len(text) <= SHINGLE_SIZE:
+        return {prefix + text} if text else set()
+    return {prefix + text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def shingle_book(title=None, author=None):
+    """Returns the shingle set of a normalized title and author, either may be None to leave it out.
+
+    Author tokens are sorted so "herbert, frank" and "frank herbert" produce the same shingles. Title
+    tokens with digits are added whole as well, volume and part numbers have to match exactly.
+    """
+    shingles = set()
+    if title is not None:
+        tokens = _tokens(title)
+        shingles |= _shingle_text(" ".join(tokens), "t:")
+        shingles |= {"n:" + token for token in tokens if any(char.isdigit() for char in token)}
+    if author is not None:
+        shingles |= _shingle_text(" ".join(sorted(_tokens(author))), "a:")
+    return shingles
+
+
+def similarity(first, second):
+    """Jaccard similarity of two shingle sets."""
+    if not first or not second:
+        return 1.0 if first == second else 0.0
+    return len(first & second) / len(first | second)
+
+
+def _part(shingles, prefix):
+    return {shingle for shingle in shingles if shingle.startswith(prefix)}
+
+
+def is_near_duplicate(first, second, threshold=MIN_SIMILARITY):
+    """True if two shingle sets of shingle_book describe the same book.
+
+    Titles and authors are compared on their own, so a shared author doesn't carry two different
+    titles over the threshold, and the numbers in the titles have to be the same.
+    """
+    if _part(first, "n:") != _part(second, "n:"):
+        return False
+    return (similarity(_part(first, "t:"), _part(second, "t:")) >= threshold
+            and similarity(_part(first, "a:"), _part(second, "a:")) >= threshold)
+
+
+def minhash_signature(shingles):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+              for shingle in shingles] or [0]
+    return [min([value ^ mask for value in hashes]) for mask in _PERMUTATION_MASKS]
+
+
+def lsh_buckets(signature):
+    """Returns one (band, bucket) pair per band, buckets are signed 64 bit integers to fit SQLite."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(struct.pack("<%dQ" % LSH_ROWS, *rows), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, "little", signed=True)))
+    return buckets
+
+
+class DisjointSet:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        while parent != self.parent[parent]:
+            self.parent[parent] = self.parent[self.parent[parent]]
+            parent = self.parent[parent]
+        self.parent[item] = parent
+        return parent
+
+    def union(self, first, second):
+        first_root, second_root = self.find(first), self.find(second)
+        if first_root != second_root:
+            self.parent[max(first_root, second_root)] = min(first_root, second_root)
+
+    def groups(self):
+        members = {}
+        for item in self.parent:
+            members.setdefault(self.find(item), []).append(item)
+        return [sorted(group) for group in members.values() if len(group) > 1]
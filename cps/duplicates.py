@@ -15,7 +15,6 @@ import hashlib
 import json
 import os
 import time
-from shutil import copyfile
 
 from . import db, calibre_db, logger, ub, csrf, config, helper
 from .services.worker import WorkerThread, STAT_FINISH_SUCCESS, STAT_FAIL, STAT_ENDED, STAT_CANCELLED
@@ -1563,6 +1562,7 @@ def auto_resolve_duplicates(strategy='newest', dry_run=False, user_id=None, trig
             'kept_count': int (total books kept)
             'errors': list of error messages
             'preview': list of dicts (if dry_run=True) with 'group', 'kept_book', 'deleted_books'
+            'report': throughput report of the batched resolution (if anything was resolved)
     """
     try:
         import time
@@ -1609,8 +1609,6 @@ def auto_resolve_duplicates(strategy='newest', dry_run=False, user_id=None, trig
         except Exception as e:
             log.debug("[cwa-duplicates] Disk space check failed: %s", str(e))
         
-        import shutil
-        
         # Validate strategy
         if not validate_resolution_strategy(strategy):
             return {'success': False, 'errors': [f'Invalid strategy: {strategy}']}
@@ -1645,7 +1643,10 @@ def auto_resolve_duplicates(strategy='newest', dry_run=False, user_id=None, trig
             'preview': [] if dry_run else None
         }
         
+        from cps.duplicate_resolution import plan_group_resolution, resolve_duplicate_groups
+
         cwa_db = CWA_DB()
+        plans = []
         
         for group in duplicate_groups:
             try:
@@ -1694,131 +1695,23 @@ def auto_resolve_duplicates(strategy='newest', dry_run=False, user_id=None, trig
                     result['resolved_count'] += 1
                     continue
                 
-                # Actual resolution mode
-                # Re-fetch books in the active session to avoid detached object issues
-                book_to_keep_id = book_to_keep.id
-                books_to_delete_ids = [b.id for b in books_to_delete]
-                book_to_keep_ref = calibre_db.get_book(book_to_keep_id)
-                if not book_to_keep_ref:
-                    result['errors'].append(f"Book to keep (ID {book_to_keep_id}) no longer exists")
-                    continue
-                books_to_delete = [calibre_db.get_book(book_id) for book_id in books_to_delete_ids]
-                books_to_delete = [b for b in books_to_delete if b]
-                if not books_to_delete:
-                    continue
-                book_to_keep = book_to_keep_ref
-
-                deleted_ids = []
-                backup_dir = f"/config/processed_books/duplicate_resolutions/{datetime.now().strftime('%Y%m%d_%H%M%S')}_group_{group['group_hash'][:8]}"
-                os.makedirs(backup_dir, exist_ok=True)
-
-                if strategy == 'merge':
-                    try:
-                        merge_duplicate_group(book_to_keep, books_to_delete)
-                    except Exception as e:
-                        log.error("[cwa-duplicates] Error merging books for group '%s': %s", group.get('title', 'unknown'), e)
-                        result['errors'].append(f"Group '{group.get('title', 'unknown')}': merge failed: {str(e)}")
-                        continue
-                
-                # Backup and delete each duplicate
-                for book in books_to_delete:
-                    try:
-                        print(f"[cwa-duplicates-auto] Starting deletion of book {book.id}...", flush=True)
-                        
-                        # Backup book files
-                        book_path = os.path.join(config.config_calibre_dir, book.path)
-                        if os.path.exists(book_path):
-                            backup_path = os.path.join(backup_dir, f"book_{book.id}")
-                            print(f"[cwa-duplicates-auto] Backing up book {book.id} to {backup_path}...", flush=True)
-                            shutil.copytree(book_path, backup_path)
-                            log.info("[cwa-duplicates] Backed up book %s to %s", book.id, backup_path)
-                        
-                        print(f"[cwa-duplicates-auto] Deleting book {book.id} from library...", flush=True)
-                        # Delete from Calibre library (bypass user permission check for automatic resolution)
-                        from cps import helper
-                        delete_result, delete_error = helper.delete_book(book, config.get_book_path(), book_format="")
-                        
-                        if not delete_result:
-                            raise Exception(f"Delete failed: {delete_error}")
-                        
-                        print(f"[cwa-duplicates-auto] Cleaning up database for book {book.id}...", flush=True)
-                        # Clean up database references
-                        from cps.editbooks import delete_whole_book
-                        delete_whole_book(book.id, book)
-                        
-                        calibre_db.session.commit()
-                        deleted_ids.append(book.id)
-                        log.info("[cwa-duplicates] Deleted duplicate book %s: %s", book.id, book.title)
-                        
-                        print(f"[cwa-duplicates-auto] Cancelling tasks for book {book.id}...", flush=True)
-                        # Cancel any pending tasks for this book
-                        try:
-                            from cps.services.worker import WorkerThread
-                            worker = WorkerThread.get_instance()
-                            if worker:
-                                cancelled_count = worker.cancel_tasks_for_book(book.id)
-                                if cancelled_count > 0:
-                                    log.info("[cwa-duplicates] Cancelled %d pending task(s) for deleted book %s", 
-                                            cancelled_count, book.id)
-                                    print(f"[cwa-duplicates-auto] Cancelled {cancelled_count} pending task(s) for book {book.id}", 
-                                          flush=True)
-                        except Exception as cancel_ex:
-                            log.warning("[cwa-duplicates] Failed to cancel tasks for book %s: %s", book.id, cancel_ex)
-                        
-                        print(f"[cwa-duplicates-auto] Cancelling scheduled jobs for book {book.id}...", flush=True)
-                        # Cancel any scheduled jobs (auto-send, etc.) for this book
-                        try:
-                            cancelled_scheduled = cwa_db.scheduled_cancel_for_book(book.id)
-                            if cancelled_scheduled > 0:
-                                log.info("[cwa-duplicates] Cancelled %d scheduled job(s) for deleted book %s", 
-                                        cancelled_scheduled, book.id)
-                        except Exception as schedule_ex:
-                            log.warning("[cwa-duplicates] Failed to cancel scheduled jobs for book %s: %s", book.id, schedule_ex)
-                        
-                        print(f"[cwa-duplicates-auto] Book {book.id} deletion complete", flush=True)
-                        
-                    except Exception as e:
-                        log.error("[cwa-duplicates] Error deleting book %s: %s", book.id, e)
-                        result['errors'].append(f"Failed to delete book {book.id}: {str(e)}")
-                
-                if deleted_ids:
-                    try:
-                        from cps.duplicate_index import delete_book_keys
-                        delete_book_keys(deleted_ids)
-                    except Exception as e:
-                        log.warning("[cwa-duplicates] Failed to delete duplicate index keys for books %s: %s",
-                                    deleted_ids, str(e))
-
-                    # Log to audit table
-                    cwa_db.log_duplicate_resolution(
-                        group_hash=group['group_hash'],
-                        group_title=group['title'],
-                        group_author=group['author'],
-                        kept_book_id=book_to_keep.id,
-                        deleted_book_ids=deleted_ids,
-                        strategy=strategy,
-                        trigger_type=trigger_type,
-                        user_id=user_id,
-                        notes=f"Resolved {len(deleted_ids)} duplicate(s) using {strategy} strategy"
-                    )
-                    
-                    result['resolved_count'] += 1
-                    result['kept_count'] += 1
-                    result['deleted_count'] += len(deleted_ids)
-                    
-                    log.info("[cwa-duplicates] Resolved duplicate group '%s' by %s: kept book %s, deleted %s duplicates", 
-                            group['title'], group['author'], book_to_keep.id, len(deleted_ids))
-                    
-                    # Docker log for automatic triggers
-                    if trigger_type == 'automatic':
-                        print(f"[cwa-duplicates-auto] ✓ Resolved '{group['title']}' by {group['author']}: "
-                              f"kept book {book_to_keep.id}, deleted {len(deleted_ids)} duplicate(s) [{strategy} strategy]", 
-                              flush=True)
+                # Every keep/delete/merge decision is made before the library is touched
+                plans.append(plan_group_resolution(group, book_to_keep, books_to_delete, strategy))
             
             except Exception as e:
-                log.error("[cwa-duplicates] Error resolving duplicate group '%s': %s", group.get('title', 'unknown'), e)
+                log.error("[cwa-duplicates] Error planning duplicate group '%s': %s", group.get('title', 'unknown'), e)
                 result['errors'].append(f"Group '{group.get('title', 'unknown')}': {str(e)}")
         
+        if plans:
+            resolution = resolve_duplicate_groups(plans, cwa_db, strategy, trigger_type=trigger_type, user_id=user_id)
+            for key in ('resolved_count', 'deleted_count', 'kept_count'):
+                result[key] += resolution[key]
+            result['errors'].extend(resolution['errors'])
+            result['report'] = resolution['report']
+            log.info("[cwa-duplicates] Resolution throughput: %s", json.dumps(resolution['report']))
+            print(f"[cwa-duplicates] Resolution throughput: {resolution['report']['groups_per_second']} groups/s, "
+                  f"{resolution['report']['batches']} batch(es), {resolution['report']['files_copied']} file(s) copied "
+                  f"{resolution['report']['copy_modes']}", flush=True)
 
         if result['errors']:
             result['success'] = False
@@ -1845,39 +1738,3 @@ def auto_resolve_duplicates(strategy='newest', dry_run=False, user_id=None, trig
                 calibre_db.session.close()
         except Exception:
             pass
-
-
-def merge_duplicate_group(book_to_keep, books_to_merge):
-    """Merge formats from duplicate books into the target book."""
-    if not book_to_keep or not books_to_merge:
-        return
-
-    to_book = calibre_db.get_book(book_to_keep.id)
-    if not to_book:
-        raise ValueError("Target book not found for merge")
-
-    existing_formats = [file.format for file in to_book.data] if to_book.data else []
-    author_name = "unknown"
-    if to_book.authors:
-        author_name = to_book.authors[0].name
-    to_name = helper.get_valid_filename(to_book.title, chars=96) + ' - ' + helper.get_valid_filename(author_name, chars=96)
-
-    for source in books_to_merge:
-        from_book = calibre_db.get_book(source.id)
-        if not from_book:
-            continue
-        for element in from_book.data:
-            if element.format not in existing_formats:
-                filepath_new = os.path.normpath(os.path.join(config.get_book_path(),
-                                                             to_book.path,
-                                                             to_name + "." + element.format.lower()))
-                filepath_old = os.path.normpath(os.path.join(config.get_book_path(),
-                                                             from_book.path,
-                                                             element.name + "." + element.format.lower()))
-                copyfile(filepath_old, filepath_new)
-                to_book.data.append(db.Data(to_book.id,
-                                            element.format,
-                                            element.uncompressed_size,
-                                            to_name))
-                existing_formats.append(element.format)
-    calibre_db.session.commit()
@@ -604,6 +604,8 @@ def edit_book_param(param, vals):
         if param == 'title' and vals.get('checkT') == "false":
             book.sort = sort_param
             calibre_db.session.commit()
+        if metadata_changed:
+            helper.refresh_download_artifacts(book.id)
 
         if metadata_changed and log_key is not None:
             try:
@@ -785,6 +787,22 @@ def _queue_duplicate_scan_after_change(book_ids=None):
         log.error("Failed to queue duplicate scan after change: %s", str(e))
 
 
+def _hardcover_identifiers(identifiers):
+    return {identifier.type.strip().lower(): identifier.val for identifier in identifiers
+            if identifier.type and "hardcover" in identifier.type.lower()}
+
+
+def _forget_hardcover_user_books(old_identifiers):
+    """Drop the Hardcover user_books cached for identifiers that were just edited."""
+    if not old_identifiers:
+        return
+    try:
+        from .hardcover_outbox import forget_user_books
+        forget_user_books(old_identifiers)
+    except Exception as e:
+        log.error("Failed to clear cached Hardcover user books: %s", str(e))
+
+
 @editbook.route("/ajax/xchange", methods=['POST'])
 @user_login_required
 @edit_required
@@ -894,10 +912,13 @@ def do_edit_book(book_id, upload_formats=None):
         modify_date |= edit_book_comments(Markup(to_save.get('comments')).unescape(), book)
 
         input_identifiers = identifier_list(to_save, book)
+        old_hardcover_ids = _hardcover_identifiers(book.identifiers)
         modification, warning = modify_identifiers(input_identifiers, book.identifiers, calibre_db.session)
         if warning:
             flash(_("Identifiers are not Case Sensitive, Overwriting Old Identifier"), category="warning")
         modify_date |= modification
+        if old_hardcover_ids != _hardcover_identifiers(input_identifiers):
+            _forget_hardcover_user_books(old_hardcover_ids)
 
         modify_date |= edit_book_tags(to_save.get('tags'), book)
         modify_date |= edit_book_series(to_save.get("series"), book)
@@ -971,6 +992,8 @@ def do_edit_book(book_id, upload_formats=None):
                 book_path=book.path,
                 last_modified=book.last_modified,
             )
+        if modify_date:
+            helper.refresh_download_artifacts(book.id)
 
         # CWA: Export of changed Metadata after commit, to avoid race conditions with folder renames
         # Only create log if there were actual meaningful metadata changes
@@ -1289,13 +1312,20 @@ def move_coverfile(meta, db_book):
               category="error")
 
 
-def delete_whole_book(book_id, book):
+def delete_whole_book(book_id, book, commit=True):
+    """Deletes the book from app.db and metadata.db.
+
+    With commit=False nothing is committed, the caller commits (or rolls back) both sessions.
+    """
     # delete book from shelves, Downloads, Read list
     ub.session.query(ub.BookShelf).filter(ub.BookShelf.book_id == book_id).delete()
     ub.session.query(ub.ReadBook).filter(ub.ReadBook.book_id == book_id).delete()
     ub.session.query(ub.ArchivedBook).filter(ub.ArchivedBook.book_id == book_id).delete()
-    ub.delete_download(book_id)
-    ub.session_commit()
+    if commit:
+        ub.delete_download(book_id)
+        ub.session_commit()
+    else:
+        ub.session.query(ub.Downloads).filter(ub.Downloads.book_id == book_id).delete()
 
     # check if only this book links to:
     # author, language, series, tags, custom columns
@@ -1316,20 +1346,23 @@ def delete_whole_book(book_id, book):
                     getattr(book, cc_string).remove(del_cc)
                     log.debug('remove ' + str(c.id))
                     calibre_db.session.delete(del_cc)
-                    calibre_db.session.commit()
+                    if commit:
+                        calibre_db.session.commit()
                 elif c.datatype == 'rating':
                     del_cc = getattr(book, cc_string)[0]
                     getattr(book, cc_string).remove(del_cc)
                     if len(del_cc.books) == 0:
                         log.debug('remove ' + str(c.id))
                         calibre_db.session.delete(del_cc)
-                        calibre_db.session.commit()
+                        if commit:
+                            calibre_db.session.commit()
                 else:
                     del_cc = getattr(book, cc_string)[0]
                     getattr(book, cc_string).remove(del_cc)
                     log.debug('remove ' + str(c.id))
                     calibre_db.session.delete(del_cc)
-                    calibre_db.session.commit()
+                    if commit:
+                        calibre_db.session.commit()
         else:
             modify_database_object([u''], getattr(book, cc_string), db.cc_classes[c.id],
                                    calibre_db.session, 'custom')
@@ -37,22 +37,12 @@ def _extract_cover(zip_file, cover_file, cover_path, tmp_file_name):
 
 
 def get_epub_layout(book, book_data):
-    file_path = os.path.normpath(os.path.join(config.get_book_path(),
-                                              book.path, book_data.name + "." + book_data.format.lower()))
-
-    try:
-        tree, __ = get_content_opf(file_path, default_ns)
-        p = tree.xpath('/pkg:package/pkg:metadata', namespaces=default_ns)[0]
-
-        layout = p.xpath('pkg:meta[@property="rendition:layout"]/text()', namespaces=default_ns)
-    except (etree.XMLSyntaxError, KeyError, IndexError, OSError) as e:
-        log.error("Could not parse epub metadata of book {} during kobo sync: {}".format(book.id, e))
-        layout = []
-
-    if len(layout) == 0:
+    # Served from the stored epub facts, the file is only parsed again if its size or mtime changed
+    from .epub_facts import get_epub_facts
+    facts = get_epub_facts(book, book_data)
+    if facts is None or not facts.is_valid:
         return None
-    else:
-        return layout[0]
+    return facts.layout
 
 
 def get_epub_info(tmp_file_path, original_file_name, original_file_extension, no_cover_processing):
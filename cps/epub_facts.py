@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Persisted EPUB facts (layout, uncompressed size, OPF version) for Kobo sync.
+
+Parsing content.opf of every EPUB on every sync page is expensive, the facts are therefore stored in
+app.db and only re-read when the file's size or mtime changes.
+"""
+
+import os
+import zipfile
+from collections import namedtuple
+
+from lxml import etree
+from sqlalchemy import exc
+
+from . import config, logger, ub
+from .epub_helper import read_content_opf, default_ns
+
+log = logger.create()
+
+EPUB_FACT_FORMATS = ('EPUB', 'KEPUB')
+
+EpubFacts = namedtuple('EpubFacts', ['is_valid', 'layout', 'uncompressed_size', 'opf_version'])
+
+
+def book_format_path(book, book_data):
+    return os.path.normpath(os.path.join(config.get_book_path(), book.path,
+                                         book_data.name + "." + book_data.format.lower()))
+
+
+def read_epub_facts(file_path):
+    """Reads the facts of one EPUB file, opening the archive only once."""
+    try:
+        with zipfile.ZipFile(file_path) as epub_zip:
+            uncompressed_size = sum(info.file_size for info in epub_zip.infolist())
+            try:
+                tree, __ = read_content_opf(epub_zip, default_ns)
+            except (etree.XMLSyntaxError, KeyError, IndexError) as e:
+                log.error("Could not parse epub metadata of {}: {}".format(file_path, e))
+                return EpubFacts(True, None, uncompressed_size, None)
+    except zipfile.BadZipFile as e:
+        log.error("Not a valid epub archive {}: {}".format(file_path, e))
+        return EpubFacts(False, None, None, None)
+
+    layout = tree.xpath('/pkg:package/pkg:metadata/pkg:meta[@property="rendition:layout"]/text()',
+                        namespaces=default_ns)
+    return EpubFacts(True, layout[0] if layout else None, uncompressed_size, tree.get('version'))
+
+
+def _to_facts(row):
+    return EpubFacts(row.is_valid, row.layout, row.uncompressed_size, row.opf_version)
+
+
+def load_epub_facts(book_ids, session=None):
+    """Bulk loads stored rows as {(book_id, format): EpubFormatInfo}, for use as `known` in get_epub_facts."""
+    session = session or ub.session
+    known = dict()
+    book_ids = list(book_ids)
+    for i in range(0, len(book_ids), 500):
+        for row in session.query(ub.EpubFormatInfo).filter(ub.EpubFormatInfo.book_id.in_(book_ids[i:i + 500])):
+            known[(row.book_id, row.format)] = row
+    return known
+
+
+def get_epub_facts(book, book_data, known=None, session=None):
+    """Returns EpubFacts of a book format, or None if the file is missing.
+
+    Stored facts are used while the file's size and mtime match, otherwise the file is parsed and the
+    stored row updated. `known` is an optional result of load_epub_facts covering this book.
+    """
+    session = session or ub.session
+    file_path = book_format_path(book, book_data)
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        log.error("Could not read epub of book {}: {}".format(book.id, e))
+        return None
+
+    key = (book.id, book_data.format)
+    if known is not None:
+        row = known.get(key)
+    else:
+        row = session.query(ub.EpubFormatInfo).filter(ub.EpubFormatInfo.book_id == book.id,
+                                                      ub.EpubFormatInfo.format == book_data.format).first()
+    if row is not None and row.file_size == stat.st_size and row.file_mtime == stat.st_mtime_ns:
+        return _to_facts(row)
+
+    facts = read_epub_facts(file_path)
+    store_epub_facts(book.id, book_data.format, stat, facts, row=row, session=session)
+    if known is not None:
+        known.pop(key, None)
+    return facts
+
+
+def store_epub_facts(book_id, book_format, stat, facts, row=None, session=None):
+    session = session or ub.session
+    try:
+        if row is None:
+            row = ub.EpubFormatInfo(book_id=book_id, format=book_format)
+            session.add(row)
+        row.file_size = stat.st_size
+        row.file_mtime = stat.st_mtime_ns
+        row.is_valid = facts.is_valid
+        row.layout = facts.layout
+        row.uncompressed_size = facts.uncompressed_size
+        row.opf_version = facts.opf_version
+        session.commit()
+    except (exc.IntegrityError, exc.OperationalError, exc.InvalidRequestError) as e:
+        # Another request stored the same format in the meantime, or the database is busy
+        session.rollback()
+        log.debug("Could not store epub facts of book %s: %s", book_id, e)
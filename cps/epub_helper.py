@@ -57,9 +57,12 @@ def _strip_xml_leading_noise(data):
 
 
 def get_content_opf(file_path, ns=None):
+    return read_content_opf(zipfile.ZipFile(file_path), ns)
+
+
+def read_content_opf(epubZip, ns=None):
     if ns is None:
         ns = default_ns
-    epubZip = zipfile.ZipFile(file_path)
     txt = epubZip.read('META-INF/container.xml')
     # Some EPUBs include a BOM or stray whitespace before the XML declaration,
     # which causes lxml to error with: "XML declaration allowed only at the start".
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Cache of rendered OPDS feeds.
+
+E-reader OPDS clients poll their feeds constantly. A rendered feed is kept under its endpoint and arguments,
+the requesting user and restrictions, the change marker of metadata.db and a generation of app.db which
+counts up whenever shelves, read states, downloads, archive flags or users are written.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import ub
+
+FEED_MODELS = (ub.Shelf, ub.BookShelf, ub.MagicShelf, ub.ReadBook, ub.Downloads, ub.ArchivedBook, ub.User)
+
+
+class FeedCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns (etag, rendered time, body, headers) of a cached feed, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, headers):
+        entry = (hashlib.sha1(body).hexdigest()[:20], time.time(), body, headers)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+feed_cache = FeedCache()
+
+
+def _touches_feed_models(objects):
+    return any(isinstance(obj, FEED_MODELS) for obj in objects)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_after_flush(session, flush_context):
+    if (_touches_feed_models(session.new) or _touches_feed_models(session.dirty)
+            or _touches_feed_models(session.deleted)):
+        feed_cache.invalidate()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_on_bulk_write(orm_execute_state):
+    # query(...).delete() and update() don't go through the flush
+    if orm_execute_state.is_delete or orm_execute_state.is_update:
+        if any(mapper.class_ in FEED_MODELS for mapper in orm_execute_state.all_mappers):
+            feed_cache.invalidate()
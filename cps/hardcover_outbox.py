@@ -0,0 +1,259 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Sends the Kobo reading progress and shelf additions to Hardcover in the background.
+
+Sync requests store a write in the hardcover_outbox table of cwa.db and wake the sender thread,
+which sends it from there. Pending writes are collapsed per user, book and kind, so only the
+latest progress of a book goes out. Failed writes are retried with exponential backoff, also after
+a restart.
+
+The user_book a book resolves to on Hardcover is cached in cwa.db as well, so a progress update of a
+book that is being read costs a single mutation instead of a lookup query plus the mutation.
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+from . import logger, ub
+from .services import hardcover
+
+sys.path.insert(1, '/app/calibre-web-automated/scripts/')
+from cwa_db import CWA_DB
+
+log = logger.create()
+
+KIND_PROGRESS = 'progress'
+KIND_ADD_BOOK = 'add_book'
+
+HARDCOVER_OUTBOX_BATCH = 20
+# Seconds before the first retry, doubled for every further failed attempt
+HARDCOVER_OUTBOX_RETRY_BASE = 30
+HARDCOVER_OUTBOX_RETRY_MAX = 3600
+HARDCOVER_OUTBOX_MAX_ATTEMPTS = 12
+# Seconds the idle sender sleeps before looking for due retries again
+HARDCOVER_OUTBOX_IDLE = 300
+# Seconds a resolved user_book is trusted before it is looked up again
+HARDCOVER_USER_BOOK_TTL = 6 * 60 * 60
+
+
+def hardcover_identifiers(identifiers):
+    """The hardcover-* identifiers of a book as a dict, ready to be stored as JSON"""
+    if isinstance(identifiers, dict):
+        return {key: str(value) for key, value in identifiers.items() if "hardcover" in key}
+    return {identifier.type: identifier.val for identifier in identifiers if "hardcover" in identifier.type}
+
+
+def retry_delay(attempts):
+    return min(HARDCOVER_OUTBOX_RETRY_BASE * 2 ** max(attempts - 1, 0), HARDCOVER_OUTBOX_RETRY_MAX)
+
+
+def forget_user_books(identifiers):
+    """Drops the cached user_books of a book's old identifiers after they were edited"""
+    if not hardcover:
+        return
+    key = hardcover.user_book_key(hardcover_identifiers(identifiers))
+    if key:
+        CWA_DB().hardcover_user_book_forget([key])
+
+
+class UserBookCache:
+    """Read-through store of the user_books HardcoverClient resolved, kept in cwa.db"""
+
+    def __init__(self, cwa_db, ttl=HARDCOVER_USER_BOOK_TTL):
+        self.cwa_db = cwa_db
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hardcover_user_id, key):
+        entry = self.cwa_db.hardcover_user_book_get(hardcover_user_id, key, time.time() - self.ttl)
+        if entry:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def put(self, hardcover_user_id, key, entry):
+        self.cwa_db.hardcover_user_book_put(hardcover_user_id, key, entry, time.time())
+
+    def forget(self, hardcover_user_id, key):
+        self.cwa_db.hardcover_user_book_forget([key], hardcover_user_id)
+
+
+class HardcoverOutbox:
+    def __init__(self, db_factory=None, client_factory=None, token_lookup=None):
+        self._db_factory = db_factory or CWA_DB
+        self._client_factory = client_factory or (
+            lambda token, user_book_cache: hardcover.HardcoverClient(token, user_book_cache=user_book_cache))
+        self._token_lookup = token_lookup or self._user_token
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._user_book_cache = None
+        # user id -> (token, client), kept across drains so the account is only looked up once per token
+        self._clients = dict()
+        self._app_session = None
+        self._recent = deque(maxlen=20)
+        self.sent = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def push_progress(self, user_id, book_id, identifiers, progress_percent):
+        self._push(user_id, book_id, KIND_PROGRESS,
+                   {'identifiers': hardcover_identifiers(identifiers), 'progress_percent': progress_percent})
+
+    def push_add_book(self, user_id, book_id, identifiers):
+        self._push(user_id, book_id, KIND_ADD_BOOK, {'identifiers': hardcover_identifiers(identifiers)})
+
+    def _push(self, user_id, book_id, kind, payload):
+        if not payload['identifiers']:
+            log.debug(f"Book {book_id} has no Hardcover identifiers, not queuing the Hardcover {kind} write")
+            return
+        # A single upsert, the write survives a restart before the sender gets to it
+        if not self._thread_db().hardcover_outbox_put(user_id, book_id, kind, json.dumps(payload)):
+            log.error(f"Failed to queue the Hardcover {kind} write of book {book_id}")
+            return
+        self.start()
+        self._wakeup.set()
+
+    def _thread_db(self):
+        cwa_db = getattr(self._local, 'cwa_db', None)
+        if cwa_db is None:
+            cwa_db = self._local.cwa_db = self._db_factory()
+        return cwa_db
+
+    def start(self):
+        """Starts the sender thread, it also picks up the writes left over from the last run"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='hardcover-outbox', daemon=True)
+                self._thread.start()
+
+    def debug_info(self):
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'sent': self.sent,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'user_book_cache_hits': self._user_book_cache.hits if self._user_book_cache else 0,
+            'user_book_cache_misses': self._user_book_cache.misses if self._user_book_cache else 0,
+            'recent': list(reversed(self._recent)),
+        }
+
+    def _run(self):
+        cwa_db = self._thread_db()
+        while True:
+            try:
+                self._wakeup.clear()
+                delay = self.drain(cwa_db)
+            except Exception as ex:
+                log.error(f"Hardcover outbox sender failed: {ex}")
+                delay = HARDCOVER_OUTBOX_RETRY_BASE
+            self._wakeup.wait(timeout=delay)
+
+    def drain(self, cwa_db):
+        """Sends all due writes, returns the seconds until the next one is due"""
+        users = dict()
+        handled = set()
+        if self._user_book_cache is None or self._user_book_cache.cwa_db is not cwa_db:
+            self._user_book_cache = UserBookCache(cwa_db)
+        while True:
+            rows = [row for row in cwa_db.hardcover_outbox_due(time.time(), HARDCOVER_OUTBOX_BATCH)
+                    if (row['id'], row['version']) not in handled]
+            if not rows:
+                break
+            for row in rows:
+                handled.add((row['id'], row['version']))
+                self._send(cwa_db, row, users)
+        next_attempt = cwa_db.hardcover_outbox_next_attempt()
+        if next_attempt is None:
+            return HARDCOVER_OUTBOX_IDLE
+        return min(HARDCOVER_OUTBOX_IDLE, max(0.0, next_attempt - time.time()))
+
+    def _client(self, user_id, users):
+        # The token is looked up once per user and drain, the client is reused as long as the token stays
+        # the same, creating it asks Hardcover for the account id and privacy setting
+        client = users.get(user_id)
+        if client is None:
+            try:
+                token = self._token_lookup(user_id)
+                cached = self._clients.get(user_id)
+                if cached and cached[0] == token:
+                    client = cached[1]
+                    client.user_book_cache = self._user_book_cache
+                else:
+                    self._clients.pop(user_id, None)
+                    client = self._client_factory(token, self._user_book_cache)
+                    self._clients[user_id] = (token, client)
+            except Exception as ex:
+                client = ex
+            users[user_id] = client
+        if isinstance(client, Exception):
+            raise client
+        return client
+
+    def _send(self, cwa_db, row, users):
+        payload = json.loads(row['payload'])
+        start = time.perf_counter()
+        try:
+            client = self._client(row['user_id'], users)
+            if row['kind'] == KIND_PROGRESS:
+                client.update_reading_progress(payload['identifiers'], payload['progress_percent'])
+            elif row['kind'] == KIND_ADD_BOOK:
+                # Adds the book if it doesn't exist and leaves it alone otherwise
+                if not client.get_user_book(payload['identifiers']):
+                    client.add_book(payload['identifiers'])
+        except hardcover.MissingHardcoverToken as ex:
+            # Missing or rejected token, the next write of the user starts with a fresh client
+            self._clients.pop(row['user_id'], None)
+            log.info(f"Dropping Hardcover {row['kind']} write of book {row['book_id']} for user {row['user_id']}: {ex}")
+            cwa_db.hardcover_outbox_done(row['id'], row['version'])
+            self.dropped += 1
+            self._record(row, start, 'dropped')
+            return
+        except Exception as ex:
+            self.failures += 1
+            attempts = row['attempts'] + 1
+            if attempts >= HARDCOVER_OUTBOX_MAX_ATTEMPTS:
+                log.error(f"Giving up Hardcover {row['kind']} write of book {row['book_id']} after {attempts} attempts: {ex}")
+                cwa_db.hardcover_outbox_done(row['id'], row['version'])
+                self.dropped += 1
+                self._record(row, start, 'dropped')
+            else:
+                delay = retry_delay(attempts)
+                log.warning(f"Hardcover {row['kind']} write of book {row['book_id']} failed, retrying in {delay}s: {ex}")
+                cwa_db.hardcover_outbox_retry(row['id'], row['version'], time.time() + delay, ex)
+                self._record(row, start, 'retry')
+            return
+        cwa_db.hardcover_outbox_done(row['id'], row['version'])
+        self.sent += 1
+        self._record(row, start, 'sent')
+
+    def _record(self, row, start, result):
+        self._recent.append({
+            'book_id': row['book_id'],
+            'kind': row['kind'],
+            'result': result,
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'ms': round((time.perf_counter() - start) * 1000, 1),
+        })
+
+    def _user_token(self, user_id):
+        if self._app_session is None:
+            self._app_session = ub.get_new_session_instance()
+        try:
+            user = self._app_session.query(ub.User).filter(ub.User.id == user_id).first()
+            return user.hardcover_token if user else None
+        finally:
+            self._app_session.remove()
+
+
+hardcover_outbox = HardcoverOutbox()
@@ -28,6 +28,7 @@ from .cw_login import current_user
 from sqlalchemy.sql.expression import true, false, and_, or_, text, func
 from sqlalchemy.exc import InvalidRequestError, OperationalError
 from werkzeug.datastructures import Headers
+from werkzeug.exceptions import NotFound
 from werkzeug.security import generate_password_hash
 from markupsafe import escape
 from urllib.parse import quote
@@ -56,13 +57,15 @@ _pending_thumbnail_books = set()
 import sys
 sys.path.insert(1, '/app/calibre-web-automated/scripts/')
 from cwa_db import CWA_DB
-from .services.worker import WorkerThread
+from .services.worker import WorkerThread, PRIORITY_NORMAL
 from .tasks.mail import TaskEmail
 from .tasks.thumbnail import TaskClearCoverThumbnailCache, TaskGenerateCoverThumbnails
 from .tasks.metadata_backup import TaskBackupMetadata
 from .file_helper import get_temp_dir
 from .epub_helper import get_content_opf, create_new_metadata_backup, updateEpub, replace_metadata
 from .embed_helper import do_calibre_export
+from .download_cache import artifact_digest, get_artifact_cache
+from .thumbnail_index import thumbnail_index
 
 log = logger.create()
 
@@ -85,7 +88,8 @@ except (ImportError, RuntimeError) as e:
 
 
 # Convert existing book entry to new format
-def convert_book_format(book_id, calibre_path, old_book_format, new_book_format, user_id, ereader_mail=None, subject=None):
+def convert_book_format(book_id, calibre_path, old_book_format, new_book_format, user_id, ereader_mail=None, subject=None,
+                        priority=PRIORITY_NORMAL):
     book = calibre_db.get_book(book_id)
     data = calibre_db.get_book_format(book.id, old_book_format)
     if not data:
@@ -119,7 +123,7 @@ def convert_book_format(book_id, calibre_path, old_book_format, new_book_format,
            link)
     settings['old_book_format'] = old_book_format
     settings['new_book_format'] = new_book_format
-    WorkerThread.add(user_id, TaskConvert(file_path, book.id, txt, settings, ereader_mail, user_id))
+    WorkerThread.add(user_id, TaskConvert(file_path, book.id, txt, settings, ereader_mail, user_id, priority))
     return None
 
 
@@ -862,84 +866,53 @@ def get_cover_on_failure():
         abort(403)
 
 
-def get_book_cover(book_id, resolution=None):
+def get_book_cover(book_id, resolution=None, versioned=False):
     book = calibre_db.get_filtered_book(book_id, allow_show_archived=True)
-    return get_book_cover_internal(book, resolution=resolution)
+    return get_book_cover_internal(book, resolution=resolution, versioned=versioned)
 
 
 def get_book_cover_with_uuid(book_uuid, resolution=None):
     book = calibre_db.get_book_by_uuid(book_uuid)
     if not book:
         return  # allows kobo.HandleCoverImageRequest to proxy request
-    return get_book_cover_internal(book, resolution=resolution)
+    return get_book_cover_internal(book, resolution=resolution, for_kobo=True)
 
 
-def get_book_cover_internal(book, resolution=None):
+def get_book_cover_internal(book, resolution=None, for_kobo=False, versioned=False):
     """Serve book cover with improved thumbnail generation fallback.
 
-    When a thumbnail is requested but missing, generate it synchronously
-    instead of falling back to the original cover.jpg.
+    Thumbnails are looked up in the in-memory thumbnail index. Missing ones are queued for background
+    generation and the original cover.jpg is sent meanwhile. Kobo devices get jpg thumbnails and don't
+    queue generation, to avoid delays during sync. Thumbnails requested with a versioned url are immutable.
     """
     if book and book.has_cover:
 
         # Send the book cover thumbnail if it exists in cache
         if resolution:
-            cache = fs.FileSystem()
-            # Check for both webp and jpg thumbnails, generate missing ones
-            webp_thumb = get_book_cover_thumbnail_by_format(book, resolution, 'webp')
-            jpg_thumb = get_book_cover_thumbnail_by_format(book, resolution, 'jpg')
-
-            # Check if files actually exist on disk
-            webp_exists = webp_thumb and cache.get_cache_file_exists(webp_thumb.filename, CACHE_TYPE_THUMBNAILS)
-            jpg_exists = jpg_thumb and cache.get_cache_file_exists(jpg_thumb.filename, CACHE_TYPE_THUMBNAILS)
-
-            # Generate missing thumbnails on-demand (skip for Kobo requests to avoid delays)
-            if not webp_exists or not jpg_exists:
-                try:
-                    from flask import has_request_context, request
-                    is_kobo_request = (has_request_context() and
-                                     request.path and
-                                     '/kobo/' in request.path)
-
-                    if not is_kobo_request and use_IM:
-                        from .tasks.thumbnail import TaskGenerateCoverThumbnails
-                        from .services.worker import WorkerThread
-                        
-                        # Queue thumbnail generation task if not already pending (prevents duplicate tasks)
-                        if book.id not in _pending_thumbnail_books:
-                            thumbnail_task = TaskGenerateCoverThumbnails(book_id=book.id)
-                            try:
-                                WorkerThread.add(None, thumbnail_task, hidden=True)
-                                # CRITICAL: Only add to pending set AFTER successful queue
-                                _pending_thumbnail_books.add(book.id)
-                                log.debug(f'Queued background thumbnail generation for book {book.id}')
-                            except Exception as queue_ex:
-                                # If queueing fails, don't add to pending set
-                                log.error(f'Failed to queue thumbnail task for book {book.id}: {queue_ex}')
-                        
-                        # Note: Thumbnails will be generated in background
-                        # Current request will fall back to serving original cover.jpg
-                except Exception as ex:
-                    log.debug(f'Failed to prepare thumbnail generation for book {book.id}: {ex}')
-
-            # Determine which thumbnail format to serve based on request context
-            try:
-                from flask import has_request_context, request
-                is_kobo_request = (has_request_context() and
-                                 request.path and
-                                 '/kobo/' in request.path)
-
-                # Prefer jpg for Kobo requests, webp for web requests
-                if is_kobo_request:
-                    thumbnail_to_serve = jpg_thumb if jpg_exists else (webp_thumb if webp_exists else None)
-                else:
-                    thumbnail_to_serve = webp_thumb if webp_exists else (jpg_thumb if jpg_exists else None)
-            except:
-                # Fallback if we can't determine request context
-                thumbnail_to_serve = webp_thumb if webp_exists else (jpg_thumb if jpg_exists else None)
-            if thumbnail_to_serve:
-                return send_from_directory(cache.get_cache_file_dir(thumbnail_to_serve.filename, CACHE_TYPE_THUMBNAILS),
-                                           thumbnail_to_serve.filename)
+            formats = ('jpg', 'webp') if for_kobo else ('webp', 'jpg')
+            thumbnails = [(fmt, thumbnail_index.get(THUMBNAIL_TYPE_COVER, book.id, resolution, fmt))
+                          for fmt in formats]
+
+            # Generate missing thumbnails in the background (skip for Kobo requests to avoid delays)
+            if not for_kobo and use_IM and not all(entry for __, entry in thumbnails):
+                # Queue thumbnail generation task if not already pending (prevents duplicate tasks)
+                if book.id not in _pending_thumbnail_books:
+                    try:
+                        WorkerThread.add(None, TaskGenerateCoverThumbnails(book_id=book.id), hidden=True)
+                        # CRITICAL: Only add to pending set AFTER successful queue
+                        _pending_thumbnail_books.add(book.id)
+                        log.debug(f'Queued background thumbnail generation for book {book.id}')
+                    except Exception as queue_ex:
+                        # If queueing fails, don't add to pending set
+                        log.error(f'Failed to queue thumbnail task for book {book.id}: {queue_ex}')
+
+            for fmt, entry in thumbnails:
+                if entry:
+                    response = send_thumbnail(entry[0], immutable=versioned)
+                    if response:
+                        return response
+                    # File vanished from the cache, regenerated on the next request
+                    thumbnail_index.discard(THUMBNAIL_TYPE_COVER, book.id, resolution, fmt)
 
         # Send the book cover from Google Drive if configured
         if config.config_use_google_drive:
@@ -1009,16 +982,31 @@ def get_series_cover_thumbnail(series_id, resolution=None):
 def get_series_cover_internal(series_id, resolution=None):
     # Send the series thumbnail if it exists in cache
     if resolution:
-        thumbnail = get_series_thumbnail(series_id, resolution)
-        if thumbnail:
-            cache = fs.FileSystem()
-            if cache.get_cache_file_exists(thumbnail.filename, CACHE_TYPE_THUMBNAILS):
-                return send_from_directory(cache.get_cache_file_dir(thumbnail.filename, CACHE_TYPE_THUMBNAILS),
-                                           thumbnail.filename)
+        # Series thumbnails are webp, older ones were stored as jpeg
+        for fmt in ('webp', 'jpeg', 'jpg'):
+            entry = thumbnail_index.get(THUMBNAIL_TYPE_SERIES, series_id, resolution, fmt)
+            if entry:
+                response = send_thumbnail(entry[0])
+                if response:
+                    return response
 
     return get_series_thumbnail_on_failure(series_id, resolution)
 
 
+def send_thumbnail(filename, immutable=False):
+    """Sends a file from the thumbnail cache, None if it doesn't exist."""
+    try:
+        response = send_from_directory(fs.FileSystem().get_cache_file_dir(filename, CACHE_TYPE_THUMBNAILS), filename)
+    except NotFound:
+        return None
+    if immutable:
+        # The url carries the book's last modified timestamp, a changed cover gets a new url
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
 def get_series_thumbnail(series_id, resolution):
     return (ub.session
         .query(ub.Thumbnail)
@@ -1242,45 +1230,30 @@ def do_download_file(book, book_format, client, data, headers):
             abort(404)
     else:
         filename = os.path.join(config.get_book_path(), book.path)
-        if not os.path.isfile(os.path.join(filename, book_name + "." + book_format)):
+        source_file = os.path.join(filename, book_name + "." + book_format)
+        if not os.path.isfile(source_file):
             # ToDo: improve error handling
-            log.error('File not found: %s', os.path.join(filename, book_name + "." + book_format))
+            log.error('File not found: %s', source_file)
 
         if client == "kobo" and book_format == "kepub":
             headers["Content-Disposition"] = headers["Content-Disposition"].replace(".kepub", ".kepub.epub")
 
-        if book_format == "kepub" and config.config_kepubifypath and config.config_embed_metadata:
-            try:
-                filename, download_name = do_kepubify_metadata_replace(book, os.path.join(filename,
-                                                                                          book_name + "." + book_format))
-                metadata_was_embedded = True
-            except Exception as e:
-                log.error_or_exception(f"Failed to kepubify metadata for book {book.id}: {e}")
-                filename = os.path.join(config.get_book_path(), book.path)
-                download_name = book_name
-        elif book_format != "kepub" and config.config_binariesdir and config.config_embed_metadata:
-            filename, download_name = do_calibre_export(book.id, book_format)
-            metadata_was_embedded = True
-
-            # Rename the exported file to match the expected download name (from Content-Disposition)
-            # This ensures KOReader calculates the checksum on the same file we calculated it on
-            if filename and download_name:
-                uuid_file = os.path.join(filename, download_name + "." + book_format)
-                expected_file = os.path.join(filename, book_name + "." + book_format)
-
-                if os.path.exists(uuid_file) and uuid_file != expected_file:
-                    try:
-                        # Remove the target file if it already exists
-                        if os.path.exists(expected_file):
-                            os.remove(expected_file)
-                        # Rename UUID file to expected name
-                        os.rename(uuid_file, expected_file)
-                        download_name = book_name
-                        log.info(f'Renamed exported file to match expected name: {book_name}.{book_format}')
-                    except Exception as e:
-                        log.error(f'Failed to rename exported file: {e}')
-        else:
-            download_name = book_name
+        embedder = None
+        if config.config_embed_metadata:
+            if book_format == "kepub" and config.config_kepubifypath:
+                embedder = "kepubify"
+            elif book_format != "kepub" and config.config_binariesdir:
+                embedder = "calibredb"
+        if embedder:
+            artifact, digest = get_download_artifact(book, book_format, source_file, embedder, current_user.locale)
+            if artifact:
+                response = make_response(send_from_directory(os.path.dirname(artifact), os.path.basename(artifact),
+                                                             etag=digest))
+                for element in headers:
+                    response.headers[element[0]] = element[1]
+                return response
+            # Embedding failed, send the file as stored
+        download_name = book_name
 
     # Calculate and store checksum if metadata was embedded
     if metadata_was_embedded and filename and download_name:
@@ -1308,6 +1281,69 @@ def do_download_file(book, book_format, client, data, headers):
     return response
 
 
+def _download_artifact_digest(book, book_format, source_file, embedder, locale):
+    stat = os.stat(source_file)
+    try:
+        cover_mtime = os.stat(os.path.join(os.path.dirname(source_file), "cover.jpg")).st_mtime_ns
+    except OSError:
+        cover_mtime = None
+    metadata_hash = (embedder, stat.st_size, stat.st_mtime_ns, cover_mtime)
+    # Kepubs are made per locale, they are variants of the same source
+    return artifact_digest(book.id, book_format, book.last_modified, metadata_hash,
+                           variant=str(locale) if embedder == "kepubify" else None)
+
+
+def get_download_artifact(book, book_format, source_file, embedder, locale=None):
+    """Returns (path, etag) of the book file with embedded metadata, (None, None) if embedding failed.
+
+    Files are produced once per book revision and served from the download cache afterwards.
+    """
+    cache = get_artifact_cache()
+    try:
+        digest = _download_artifact_digest(book, book_format, source_file, embedder, locale)
+    except OSError:
+        return None, None
+    path = cache.get(book.id, book_format, digest)
+    if path:
+        return path, digest
+
+    try:
+        if embedder == "kepubify":
+            tmp_dir, tmp_name = do_kepubify_metadata_replace(book, source_file)
+        else:
+            tmp_dir, tmp_name = do_calibre_export(book.id, book_format)
+    except Exception as e:
+        log.error_or_exception(f"Failed to embed metadata for book {book.id}: {e}")
+        return None, None
+    produced = os.path.join(tmp_dir, tmp_name + "." + book_format) if tmp_dir and tmp_name else None
+    if not produced or not os.path.isfile(produced):
+        log.error("Metadata embedding produced no %s file for book %s", book_format, book.id)
+        return None, None
+    path = cache.store(book.id, book_format, digest, produced)
+    if tmp_dir != get_temp_dir():
+        # calibredb export may create a directory per export
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    try:
+        from .progress_syncing import calculate_and_store_checksum
+        # KOReader calculates its checksum on the file with embedded metadata, it only changes with the artifact
+        calculate_and_store_checksum(book_id=book.id, book_format=book_format, file_path=path)
+    except Exception as e:
+        log.error(f"Failed to calculate/store checksum for book {book.id}: {e}")
+    return path, digest
+
+
+def refresh_download_artifacts(book_id):
+    """Rebuilds cached downloads of a book in the background after its metadata changed."""
+    if not config.config_embed_metadata or not config.config_binariesdir or config.config_use_google_drive:
+        return
+    # Kepub artifacts depend on the downloading user's locale and are cheap, they are rebuilt on download
+    formats = [book_format for book_format in get_artifact_cache().cached_formats(book_id) if book_format != "kepub"]
+    if formats:
+        from .tasks.download_artifacts import TaskRefreshDownloadArtifacts
+        WorkerThread.add('System', TaskRefreshDownloadArtifacts(book_id, formats), hidden=True)
+
+
 def do_kepubify_metadata_replace(book, file_path):
     custom_columns = (calibre_db.session.query(db.CustomColumns)
                       .filter(db.CustomColumns.mark_for_delete == 0)
@@ -1507,12 +1543,7 @@ def replace_cover_thumbnail_cache(book_id, book_path=None, last_modified=None):
     # Always allow replacing thumbnail cache
     # Remove from pending set to allow regeneration
     _pending_thumbnail_books.discard(book_id)
-    # Try to queue clear task (not critical if it fails)
-    try:
-        WorkerThread.add(None, TaskClearCoverThumbnailCache(book_id), hidden=True)
-    except Exception as e:
-        log.error(f'Failed to queue thumbnail clear for book {book_id}: {e}')
-    # Queue generation task and add to pending set only if successful
+    # One task clears and regenerates, and add to pending set only if successful
     try:
         WorkerThread.add(
             None,
@@ -1520,6 +1551,7 @@ def replace_cover_thumbnail_cache(book_id, book_path=None, last_modified=None):
                 book_id,
                 book_path=book_path,
                 last_modified=last_modified,
+                replace=True,
             ),
             hidden=True,
         )
@@ -0,0 +1,211 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Shared HTTP sessions for the metadata providers and the external integrations.
+
+Sessions are created once per name and kept, so connections to a host stay alive between requests
+instead of paying a new TCP and TLS handshake every time. Public hosts are reached through the
+cw_advocate pools and address validation. Every request is counted per host with its latency and
+whether it had to open a new connection.
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib.request import getproxies
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from . import logger
+from .cw_advocate import AddrValidator, ValidatingHTTPAdapter
+from .cw_advocate.connectionpool import ValidatingHTTPConnectionPool, ValidatingHTTPSConnectionPool
+
+log = logger.create()
+
+# Hosts kept per session and connections kept per host
+HTTP_POOL_HOSTS = 10
+HTTP_POOL_MAXSIZE = 8
+# Longest Retry-After a retry waits for, a request thread must not sleep for as long as a server asks
+HTTP_RETRY_AFTER_MAX = 5
+
+
+class CappedRetry(Retry):
+    """Retry honouring Retry-After only up to HTTP_RETRY_AFTER_MAX seconds."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, HTTP_RETRY_AFTER_MAX)
+
+
+# Retries connection errors and overload answers of idempotent requests, waiting 0.5s, 1s between tries
+HTTP_RETRY = CappedRetry(
+    total=2,
+    backoff_factor=0.5,
+    status_forcelist=(429, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class HttpMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = dict()
+
+    def _host(self, host):
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = {
+                'requests': 0,
+                'connections': 0,
+                'errors': 0,
+                'latency_ms': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                'total_ms': 0.0,
+            }
+        return entry
+
+    def connection_opened(self, host):
+        with self._lock:
+            self._host(host)['connections'] += 1
+
+    def request_done(self, host, seconds, error=False):
+        elapsed_ms = seconds * 1000
+        bucket = next((index for index, limit in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= limit),
+                      len(LATENCY_BUCKETS_MS))
+        with self._lock:
+            entry = self._host(host)
+            entry['requests'] += 1
+            entry['errors'] += int(error)
+            entry['latency_ms'][bucket] += 1
+            entry['total_ms'] += elapsed_ms
+
+    def snapshot(self):
+        labels = [f"<={limit}" for limit in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        with self._lock:
+            hosts = {}
+            for host, entry in sorted(self._hosts.items()):
+                requests_count = entry['requests']
+                hosts[host] = {
+                    'requests': requests_count,
+                    'connections': entry['connections'],
+                    'errors': entry['errors'],
+                    # Share of requests that went over an already open connection
+                    'reuse_ratio': round(max(0, requests_count - entry['connections']) / requests_count, 3)
+                    if requests_count else 0.0,
+                    'avg_ms': round(entry['total_ms'] / requests_count, 1) if requests_count else 0.0,
+                    'latency_ms': dict(zip(labels, entry['latency_ms'])),
+                }
+        total_requests = sum(entry['requests'] for entry in hosts.values())
+        total_connections = sum(entry['connections'] for entry in hosts.values())
+        return {
+            'sessions': sorted(_sessions),
+            'requests': total_requests,
+            'connections': total_connections,
+            'reuse_ratio': round(max(0, total_requests - total_connections) / total_requests, 3)
+            if total_requests else 0.0,
+            'hosts': hosts,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+
+
+http_metrics = HttpMetrics()
+
+
+def _metered_pool(base):
+    class MeteredPool(base):
+        def _new_conn(self):
+            http_metrics.connection_opened(self.host)
+            return super()._new_conn()
+
+    MeteredPool.__name__ = "Metered" + base.__name__
+    return MeteredPool
+
+
+class _MeteredAdapterMixin:
+    pool_classes_by_scheme = None
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes_by_scheme
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname or ""
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            http_metrics.request_done(host, time.perf_counter() - start, error=True)
+            raise
+        http_metrics.request_done(host, time.perf_counter() - start, error=response.status_code >= 500)
+        return response
+
+
+class MeteredHTTPAdapter(_MeteredAdapterMixin, HTTPAdapter):
+    pool_classes_by_scheme = {
+        "http": _metered_pool(HTTPConnectionPool),
+        "https": _metered_pool(HTTPSConnectionPool),
+    }
+
+
+class MeteredValidatingHTTPAdapter(_MeteredAdapterMixin, ValidatingHTTPAdapter):
+    pool_classes_by_scheme = {
+        "http": _metered_pool(ValidatingHTTPConnectionPool),
+        "https": _metered_pool(ValidatingHTTPSConnectionPool),
+    }
+
+
+_sessions = dict()
+_sessions_lock = threading.Lock()
+_validator = None
+
+
+def _address_validator():
+    global _validator
+    if _validator is None:
+        _validator = AddrValidator()
+    return _validator
+
+
+def get_http_session(name, headers=None, validate=True):
+    """Returns the shared session for name, created with headers on first use.
+
+    validate=False skips the address validation, for servers the admin configured themselves,
+    e.g. an Audiobookshelf instance in the local network. Validation is also skipped while a proxy
+    is configured in the environment, the addresses of the target hosts are not known then.
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            if headers:
+                session.headers.update(headers)
+            if validate and getproxies():
+                log.info("Proxy configured, HTTP session %s skips the address validation", name)
+                validate = False
+            if validate:
+                adapter = MeteredValidatingHTTPAdapter(validator=_address_validator(), max_retries=HTTP_RETRY,
+                                                       pool_connections=HTTP_POOL_HOSTS,
+                                                       pool_maxsize=HTTP_POOL_MAXSIZE)
+            else:
+                adapter = MeteredHTTPAdapter(max_retries=HTTP_RETRY, pool_connections=HTTP_POOL_HOSTS,
+                                             pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[name] = session
+    return session
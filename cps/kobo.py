@@ -11,9 +11,11 @@ from datetime import datetime, timezone
 from cps import cw_babel
 from kobo_sync_utils import get_kobo_created_ts
 import os
+import threading
 import uuid
-import zipfile
-from time import gmtime, strftime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import gmtime, strftime, monotonic
 import json
 from urllib.parse import unquote
 
@@ -33,18 +35,23 @@ from werkzeug.datastructures import Headers
 from sqlalchemy import func
 from sqlalchemy.sql.expression import and_, or_
 from sqlalchemy.exc import StatementError
+from sqlalchemy.orm import selectinload
 from sqlalchemy.sql import select
 import requests
+import requests.adapters
 
 from . import config, logger, kobo_auth, db, calibre_db, helper, shelf as shelf_lib, ub, csrf, kobo_sync_status, magic_shelf
 from . import isoLanguages
-from .epub import get_epub_layout
+from .epub_facts import get_epub_facts, load_epub_facts
 from .constants import COVER_THUMBNAIL_SMALL, COVER_THUMBNAIL_MEDIUM, COVER_THUMBNAIL_LARGE
 from .kobo_cover_cache import build_cover_image_id, normalize_cover_uuid
+from .kobo_fragment_cache import fragment_cache
 from .helper import get_download_link
+from .hardcover_outbox import hardcover_outbox
 from .services import SyncToken as SyncToken, hardcover
 from .web import download_required
 from .kobo_auth import requires_kobo_auth, get_auth_token
+from .services.worker import WorkerThread, PRIORITY_LOW
 
 KOBO_FORMATS = {"KEPUB": ["KEPUB"], "EPUB": ["EPUB3", "EPUB"]}
 KOBO_STOREAPI_URL = "https://storeapi.kobo.com"
@@ -52,6 +59,25 @@ KOBO_IMAGEHOST_URL = "https://cdn.kobo.com/book-images"
 
 SYNC_ITEM_LIMIT = 100
 
+# Requests to the Kobo store run on a small pool of threads sharing one keep-alive session,
+# the connect/read timeout also bounds how long a sync waits for the store
+KOBO_STORE_TIMEOUT = (2, 10)
+KOBO_STORE_WORKERS = 4
+_kobo_store_session = None
+_kobo_store_executor = None
+_kobo_store_lock = threading.Lock()
+
+# How long a book is held back from sync while its KEPUB conversion is queued or running,
+# and after how long a conversion that didn't produce a KEPUB is requested again
+KEPUB_CONVERSION_WAIT = 15 * 60
+KEPUB_CONVERSION_RETRY = 24 * 60 * 60
+
+# A book of a sync page, in the shape get_kobo_created_ts expects
+SyncEntry = namedtuple('SyncEntry', 'Books, date_added, is_archived')
+
+_kepub_requests = dict()
+_kepub_requests_lock = threading.Lock()
+
 kobo = Blueprint("kobo", __name__, url_prefix="/kobo/<auth_token>")
 kobo_auth.disable_failed_auth_redirect_for_blueprint(kobo)
 kobo_auth.register_url_value_preprocessor(kobo)
@@ -80,25 +106,58 @@ def get_kobo_activated():
     return config.config_kobo_sync
 
 
-def make_request_to_kobo_store(sync_token=None):
-    outgoing_headers = Headers(request.headers)
-    outgoing_headers.remove("Host")
-    if sync_token:
-        sync_token.set_kobo_store_header(outgoing_headers)
-
-    store_response = requests.request(
-        method=request.method,
-        url=get_store_url_for_current_request(),
-        headers=outgoing_headers,
-        data=request.get_data(),
+def _get_kobo_store_session():
+    global _kobo_store_session
+    if _kobo_store_session is None:
+        with _kobo_store_lock:
+            if _kobo_store_session is None:
+                session = requests.Session()
+                # Keep connections to the store alive between sync pages and devices
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=KOBO_STORE_WORKERS * 2)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _kobo_store_session = session
+    return _kobo_store_session
+
+
+def _send_kobo_store_request(method, url, headers, data):
+    store_response = _get_kobo_store_session().request(
+        method=method,
+        url=url,
+        headers=headers,
+        data=data,
         allow_redirects=False,
-        timeout=(2, 10)
+        timeout=KOBO_STORE_TIMEOUT
     )
     log.debug("Content: " + str(store_response.content))
     log.debug("StatusCode: " + str(store_response.status_code))
     return store_response
 
 
+def _kobo_store_request_args(sync_token=None):
+    outgoing_headers = Headers(request.headers)
+    outgoing_headers.remove("Host")
+    if sync_token:
+        sync_token.set_kobo_store_header(outgoing_headers)
+    return request.method, get_store_url_for_current_request(), outgoing_headers, request.get_data()
+
+
+def make_request_to_kobo_store(sync_token=None):
+    return _send_kobo_store_request(*_kobo_store_request_args(sync_token))
+
+
+def start_request_to_kobo_store(sync_token=None):
+    """Sends the current request to the Kobo store in the background, returns a future of the response."""
+    global _kobo_store_executor
+    args = _kobo_store_request_args(sync_token)
+    if _kobo_store_executor is None:
+        with _kobo_store_lock:
+            if _kobo_store_executor is None:
+                _kobo_store_executor = ThreadPoolExecutor(max_workers=KOBO_STORE_WORKERS,
+                                                          thread_name_prefix='kobo-store')
+    return _kobo_store_executor.submit(_send_kobo_store_request, *args)
+
+
 def redirect_or_proxy_request():
     if config.config_kobo_proxy:
         if request.method == "GET":
@@ -151,6 +210,95 @@ def get_magic_shelf_book_ids_for_kobo(user_id):
     return book_ids
 
 
+def load_sync_books(book_ids):
+    """Loads the books of a sync page with everything their entitlements need in a few IN queries."""
+    if not book_ids:
+        return dict()
+    books = (calibre_db.session.query(db.Books)
+             .filter(db.Books.id.in_(book_ids))
+             .options(selectinload(db.Books.data),
+                      selectinload(db.Books.authors),
+                      selectinload(db.Books.series),
+                      selectinload(db.Books.publishers),
+                      selectinload(db.Books.languages),
+                      selectinload(db.Books.comments))
+             .all())
+    return {book.id: book for book in books}
+
+
+def _load_book_reads(book_ids):
+    book_reads = dict()
+    for book_read in (ub.session.query(ub.ReadBook)
+                      .filter(ub.ReadBook.user_id == int(current_user.id), ub.ReadBook.book_id.in_(book_ids))
+                      .options(selectinload(ub.ReadBook.kobo_reading_state)
+                               .selectinload(ub.KoboReadingState.current_bookmark),
+                               selectinload(ub.ReadBook.kobo_reading_state)
+                               .selectinload(ub.KoboReadingState.statistics))):
+        book_reads.setdefault(book_read.book_id, book_read)
+    return book_reads
+
+
+def get_or_create_reading_states(book_ids):
+    """Bulk version of get_or_create_reading_state for a sync page, returns {book_id: KoboReadingState}."""
+    if not book_ids:
+        return dict()
+    book_reads = _load_book_reads(book_ids)
+    created = False
+    for book_id in book_ids:
+        book_read = book_reads.get(book_id)
+        if not book_read:
+            book_read = ub.ReadBook(user_id=current_user.id, book_id=book_id)
+            ub.session.add(book_read)
+            book_reads[book_id] = book_read
+        if not book_read.kobo_reading_state:
+            kobo_reading_state = ub.KoboReadingState(user_id=book_read.user_id, book_id=book_id)
+            kobo_reading_state.current_bookmark = ub.KoboBookmark()
+            kobo_reading_state.statistics = ub.KoboStatistics()
+            book_read.kobo_reading_state = kobo_reading_state
+            created = True
+    if created:
+        ub.session_commit()
+        # The commit expired all loaded states, reload them in one go instead of one by one
+        book_reads = _load_book_reads(book_ids)
+    return {book_id: book_reads[book_id].kobo_reading_state for book_id in book_ids if book_id in book_reads}
+
+
+def _kepub_conversion_active(book_id):
+    return WorkerThread.get_instance().has_active_task_of_type(
+        "TaskConvert",
+        extra_check=lambda task: (getattr(task, 'book_id', None) == book_id
+                                  and str(task.settings.get('new_book_format', '')).upper() == 'KEPUB'))
+
+
+def kepub_conversion_pending(book):
+    """Requests a missing KEPUB conversion in the background and tells whether the book should wait for it.
+
+    A book waits while its conversion is queued or running, at most KEPUB_CONVERSION_WAIT seconds. If the
+    conversion ended without a KEPUB the EPUB is synced, and the conversion isn't requested again before
+    KEPUB_CONVERSION_RETRY seconds passed.
+    """
+    formats = [data.format for data in book.data]
+    if 'KEPUB' in formats or 'EPUB' not in formats or not config.config_kepubifypath:
+        return False
+    now = monotonic()
+    with _kepub_requests_lock:
+        for book_id in [k for k, requested in _kepub_requests.items() if now - requested > KEPUB_CONVERSION_RETRY]:
+            del _kepub_requests[book_id]
+        requested = _kepub_requests.get(book.id)
+        if requested is None:
+            _kepub_requests[book.id] = now
+    if requested is None:
+        if not _kepub_conversion_active(book.id):
+            # Queued behind mails and the conversions users asked for
+            error = helper.convert_book_format(book.id, config.get_book_path(), 'EPUB', 'KEPUB', current_user.name,
+                                               priority=PRIORITY_LOW)
+            if error:
+                log.error("Kobo Sync: could not queue kepub conversion of book {}: {}".format(book.id, error))
+                return False
+        return True
+    return now - requested < KEPUB_CONVERSION_WAIT and _kepub_conversion_active(book.id)
+
+
 @kobo.route("/v1/library/sync")
 @requires_kobo_auth
 # @download_required
@@ -233,11 +381,12 @@ def HandleSyncRequest():
     log.debug("Kobo Sync: books last modified: {}".format(sync_token.books_last_modified))
 
     if only_kobo_shelves:
-        changed_entries = calibre_db.session.query(db.Books,
-                                                   ub.ArchivedBook.last_modified,
+        changed_entries = calibre_db.session.query(db.Books.id,
+                                                   db.Books.last_modified,
                                                    ub.BookShelf.date_added,
                                                    ub.ArchivedBook.is_archived)
         changed_entries = (changed_entries
+                           .select_from(db.Books)
                            .join(db.Data).outerjoin(ub.ArchivedBook, and_(db.Books.id == ub.ArchivedBook.book_id,
                                                                           ub.ArchivedBook.user_id == current_user.id))
                            .filter(db.Books.id.notin_(calibre_db.session.query(ub.KoboSyncedBooks.book_id)
@@ -259,10 +408,11 @@ def HandleSyncRequest():
                            ))
                            .distinct())
     else:
-        changed_entries = calibre_db.session.query(db.Books,
-                                                   ub.ArchivedBook.last_modified,
+        changed_entries = calibre_db.session.query(db.Books.id,
+                                                   db.Books.last_modified,
                                                    ub.ArchivedBook.is_archived)
         changed_entries = (changed_entries
+                           .select_from(db.Books)
                            .join(db.Data).outerjoin(ub.ArchivedBook, and_(db.Books.id == ub.ArchivedBook.book_id,
                                                                           ub.ArchivedBook.user_id == current_user.id))
                            .filter(db.Books.id.notin_(calibre_db.session.query(ub.KoboSyncedBooks.book_id)
@@ -270,43 +420,66 @@ def HandleSyncRequest():
                            .filter(calibre_db.common_filters(allow_show_archived=True))
                            .filter(db.Data.format.in_(KOBO_FORMATS))
                            .order_by(db.Books.last_modified)
-                           .order_by(db.Books.id))
-    log.debug("Kobo Sync: changed entries: {}".format(changed_entries.count()))
+                           .order_by(db.Books.id)
+                           .distinct())
+
+    # Fetch one page of book ids, the extra row tells whether another page follows
+    page_rows = changed_entries.limit(SYNC_ITEM_LIMIT + 1).all()
+    more_books = len(page_rows) > SYNC_ITEM_LIMIT
+    unique_rows = dict()
+    for row in page_rows[:SYNC_ITEM_LIMIT]:
+        unique_rows.setdefault(row.id, row)
+    page_rows = list(unique_rows.values())
+    log.debug("Kobo Sync: selected to sync: {}".format(len(page_rows)))
+
+    page_ids = [row.id for row in page_rows]
+    books_by_id = load_sync_books(page_ids)
+    reading_states = get_or_create_reading_states(page_ids)
+    known_facts = load_epub_facts(page_ids)
 
     reading_states_in_new_entitlements = []
-    books = changed_entries.limit(SYNC_ITEM_LIMIT)
-    log.debug("Kobo Sync: selected to sync: {}".format(len(books.all())))
-    for book in books:
-        formats = [data.format for data in book.Books.data]
-        if 'KEPUB' not in formats and config.config_kepubifypath and 'EPUB' in formats:
-            helper.convert_book_format(book.Books.id, config.get_book_path(), 'EPUB', 'KEPUB', current_user.name)
+    synced_book_ids = []
+    held_back_since = None
+    for row in page_rows:
+        book = books_by_id.get(row.id)
+        if book is None:
+            continue
+        if kepub_conversion_pending(book):
+            # Not ready yet: the book isn't marked as synced and the sync token stays before it,
+            # so it is sent with its KEPUB by a later sync
+            if held_back_since is None:
+                held_back_since = book.last_modified.replace(tzinfo=None)
+            continue
 
-        kobo_reading_state = get_or_create_reading_state(book.Books.id)
+        entry = SyncEntry(book, getattr(row, 'date_added', None), row.is_archived)
+        kobo_reading_state = reading_states[book.id]
         entitlement = {
-            "BookEntitlement": create_book_entitlement(book.Books, archived=(book.is_archived==True)),
-            "BookMetadata": get_metadata(book.Books),
+            "BookEntitlement": create_book_entitlement(book, archived=(entry.is_archived==True),
+                                                       known_facts=known_facts),
+            "BookMetadata": get_metadata(book, known_facts),
         }
 
         if kobo_reading_state.last_modified > sync_token.reading_state_last_modified:
-            entitlement["ReadingState"] = get_kobo_reading_state_response(book.Books, kobo_reading_state)
+            entitlement["ReadingState"] = get_kobo_reading_state_response(book, kobo_reading_state)
             new_reading_state_last_modified = max(new_reading_state_last_modified, kobo_reading_state.last_modified)
-            reading_states_in_new_entitlements.append(book.Books.id)
+            reading_states_in_new_entitlements.append(book.id)
 
-        ts_created = get_kobo_created_ts(book)
+        ts_created = get_kobo_created_ts(entry)
 
         if ts_created > sync_token.books_last_created:
             sync_results.append({"NewEntitlement": entitlement})
         else:
             sync_results.append({"ChangedEntitlement": entitlement})
 
-        new_books_last_modified = max(
-            book.Books.last_modified.replace(tzinfo=None), new_books_last_modified
-        )
-
-        new_books_last_created = max(ts_created, new_books_last_created)
-        kobo_sync_status.add_synced_books(book.Books.id)
+        book_last_modified = book.last_modified.replace(tzinfo=None)
+        if held_back_since is None or book_last_modified < held_back_since:
+            new_books_last_modified = max(book_last_modified, new_books_last_modified)
+            new_books_last_created = max(ts_created, new_books_last_created)
+        synced_book_ids.append(book.id)
+    kobo_sync_status.add_synced_book_ids(synced_book_ids)
 
-    max_change = changed_entries.filter(ub.ArchivedBook.is_archived)\
+    max_change = changed_entries.with_entities(ub.ArchivedBook.last_modified)\
+        .filter(ub.ArchivedBook.is_archived)\
         .filter(ub.ArchivedBook.user_id == current_user.id) \
         .order_by(func.datetime(ub.ArchivedBook.last_modified).desc()).first()
 
@@ -314,11 +487,11 @@ def HandleSyncRequest():
 
     new_archived_last_modified = max(new_archived_last_modified, max_change)
 
-    # no. of books returned
-    book_count = changed_entries.count()
-    # last entry:
-    cont_sync = bool(book_count)
-    log.debug("Kobo Sync: remaining books to sync: {}".format(book_count))
+    # Continue while books remain, books waiting for their KEPUB only keep the device syncing if
+    # this page made progress, otherwise they are picked up by the next sync
+    cont_sync = bool(synced_book_ids) and (more_books or held_back_since is not None)
+    log.debug("Kobo Sync: more books to sync: {}, waiting for kepub: {}".format(more_books,
+                                                                                 held_back_since is not None))
     # generate reading state data
     changed_reading_states = ub.session.query(ub.KoboReadingState)
 
@@ -341,10 +514,21 @@ def HandleSyncRequest():
         and_(ub.KoboReadingState.user_id == current_user.id,
              ub.KoboReadingState.book_id.notin_(reading_states_in_new_entitlements)))\
         .order_by(ub.KoboReadingState.last_modified)
-    log.debug("Kobo Sync: changed states: {}".format(changed_reading_states.count()))
-    cont_sync |= bool(changed_reading_states.count() > SYNC_ITEM_LIMIT)
-    for kobo_reading_state in changed_reading_states.limit(SYNC_ITEM_LIMIT).all():
-        book = calibre_db.session.query(db.Books).filter(db.Books.id == kobo_reading_state.book_id).one_or_none()
+    changed_reading_states = changed_reading_states.limit(SYNC_ITEM_LIMIT + 1).options(
+        selectinload(ub.KoboReadingState.book_read_link),
+        selectinload(ub.KoboReadingState.current_bookmark),
+        selectinload(ub.KoboReadingState.statistics)).all()
+    log.debug("Kobo Sync: changed states: {}".format(len(changed_reading_states)))
+    cont_sync |= len(changed_reading_states) > SYNC_ITEM_LIMIT
+    changed_reading_states = changed_reading_states[:SYNC_ITEM_LIMIT]
+
+    # The store's sync results are only merged into the last page. They only depend on the incoming request,
+    # so they are fetched while the reading states and shelves are assembled
+    store_future = start_request_to_kobo_store(sync_token) if config.config_kobo_proxy and not cont_sync else None
+    state_books = {book.id: book for book in calibre_db.session.query(db.Books).filter(
+        db.Books.id.in_([state.book_id for state in changed_reading_states]))}
+    for kobo_reading_state in changed_reading_states:
+        book = state_books.get(kobo_reading_state.book_id)
         if book:
             sync_results.append({
                 "ChangedReadingState": {
@@ -402,21 +586,24 @@ def HandleSyncRequest():
         sync_token.tags_last_modified = new_tags_last_modified
 
     # update last created timestamp to distinguish between new and changed entitlements
-    if not cont_sync:
+    if not cont_sync and held_back_since is None:
         sync_token.books_last_created = new_books_last_created
     sync_token.books_last_modified = new_books_last_modified
     sync_token.archive_last_modified = new_archived_last_modified
     sync_token.reading_state_last_modified = new_reading_state_last_modified
 
-    return generate_sync_response(sync_token, sync_results, cont_sync)
+    return generate_sync_response(sync_token, sync_results, cont_sync, store_future)
 
 
-def generate_sync_response(sync_token, sync_results, set_cont=False):
+def generate_sync_response(sync_token, sync_results, set_cont=False, store_future=None):
     extra_headers = {}
     if config.config_kobo_proxy and not set_cont:
         # Merge in sync results from the official Kobo store.
         try:
-            store_response = make_request_to_kobo_store(sync_token)
+            if store_future is not None:
+                store_response = store_future.result(timeout=sum(KOBO_STORE_TIMEOUT))
+            else:
+                store_response = make_request_to_kobo_store(sync_token)
 
             store_sync_results = store_response.json()
             sync_results += store_sync_results
@@ -497,15 +684,13 @@ def get_download_url_for_book(book_id, book_format):
     )
 
 
-def create_book_entitlement(book, archived):
+def _build_entitlement_fragment(book):
     book_uuid = str(book.uuid)
     return {
         "Accessibility": "Full",
-        "ActivePeriod": {"From": convert_to_kobo_timestamp_string(datetime.now(timezone.utc))},
         "Created": convert_to_kobo_timestamp_string(book.timestamp),
         "CrossRevisionId": book_uuid,
         "Id": book_uuid,
-        "IsRemoved": archived,
         "IsHiddenFromArchive": False,
         "IsLocked": False,
         "LastModified": convert_to_kobo_timestamp_string(book.last_modified),
@@ -515,6 +700,13 @@ def create_book_entitlement(book, archived):
     }
 
 
+def create_book_entitlement(book, archived, known_facts=None):
+    entitlement = dict(get_book_fragments(book, known_facts)["entitlement"])
+    entitlement["ActivePeriod"] = {"From": convert_to_kobo_timestamp_string(datetime.now(timezone.utc))}
+    entitlement["IsRemoved"] = archived
+    return entitlement
+
+
 def current_time():
     return strftime("%Y-%m-%dT%H:%M:%SZ", gmtime())
 
@@ -579,30 +771,24 @@ def _get_cover_image_id(book):
         return base_id
 
 
-def get_metadata(book):
-    download_urls = []
+def _build_metadata_fragment(book, known_facts=None):
+    downloads = []
     kepub = [data for data in book.data if data.format == 'KEPUB']
 
     for book_data in kepub if len(kepub) > 0 else book.data:
         if book_data.format not in KOBO_FORMATS:
             continue
+        # Layout and size are read from the stored epub facts, the file is only parsed if it changed
+        facts = get_epub_facts(book, book_data, known=known_facts)
+        if facts is not None and not facts.is_valid:
+            log.error("Kobo Sync: skipping invalid {} of book {}".format(book_data.format, book.id))
+            continue
+        size = book_data.uncompressed_size or (facts.uncompressed_size if facts else None)
         for kobo_format in KOBO_FORMATS[book_data.format]:
             # log.debug('Id: %s, Format: %s' % (book.id, kobo_format))
-            try:
-                if get_epub_layout(book, book_data) == 'pre-paginated':
-                    kobo_format = 'EPUB3FL'
-                download_urls.append(
-                    {
-                        "Format": kobo_format,
-                        "Size": book_data.uncompressed_size,
-                        "Url": get_download_url_for_book(book.id, book_data.format),
-                        # The Kobo forma accepts platforms: (Generic, Android)
-                        "Platform": "Generic",
-                        # "DrmType": "None", # Not required
-                    }
-                )
-            except (zipfile.BadZipfile, FileNotFoundError) as e:
-                log.error(e)
+            if facts is not None and facts.layout == 'pre-paginated':
+                kobo_format = 'EPUB3FL'
+            downloads.append((kobo_format, size, book_data.format))
 
     book_uuid = book.uuid
     cover_image_id = _get_cover_image_id(book)
@@ -616,7 +802,6 @@ def get_metadata(book):
         "CurrentDisplayPrice": {"CurrencyCode": "USD", "TotalAmount": 0},
         "CurrentLoveDisplayPrice": {"TotalAmount": 0},
         "Description": get_description(book),
-        "DownloadUrls": download_urls,
         "EntitlementId": book_uuid,
         "ExternalIds": [],
         "Genre": "00000000-0000-0000-0000-000000000001",
@@ -646,6 +831,44 @@ def get_metadata(book):
             }
         except Exception as e:
             print(e)
+    return metadata, downloads
+
+
+def _book_fragment_key(book):
+    """Revision of everything a book's cached fragments are built from."""
+    cover_mtime = None
+    if not config.config_use_google_drive:
+        try:
+            cover_mtime = os.stat(os.path.join(config.get_book_path(), book.path, "cover.jpg")).st_mtime_ns
+        except OSError:
+            pass
+    formats = tuple(sorted((data.format, data.uncompressed_size) for data in book.data))
+    return book.last_modified, cover_mtime, formats, config.config_use_google_drive, config.get_book_path()
+
+
+def get_book_fragments(book, known_facts=None):
+    """Returns the user independent entitlement and metadata of a book, shared by all users and devices."""
+    def build():
+        metadata, downloads = _build_metadata_fragment(book, known_facts)
+        return {"entitlement": _build_entitlement_fragment(book), "metadata": metadata, "downloads": downloads}
+    return fragment_cache.get_or_build(book.id, _book_fragment_key(book), build)
+
+
+def get_metadata(book, known_facts=None):
+    fragments = get_book_fragments(book, known_facts)
+    metadata = dict(fragments["metadata"])
+    # Download urls contain the user's auth token
+    metadata["DownloadUrls"] = [
+        {
+            "Format": kobo_format,
+            "Size": size,
+            "Url": get_download_url_for_book(book.id, book_format),
+            # The Kobo forma accepts platforms: (Generic, Android)
+            "Platform": "Generic",
+            # "DrmType": "None", # Not required
+        }
+        for kobo_format, size, book_format in fragments["downloads"]
+    ]
     return metadata
 
 
@@ -988,8 +1211,8 @@ def push_reading_state_to_hardcover(book: db.Books, request_bookmark: dict):
     """
     Sync reading progress to Hardcover if enabled for the user and book is not blacklisted.
 
-    Most exceptions are caught and logged so that issues with Hardcover do not prevent
-    the Kobo from clearing its reading state sync queue.
+    The progress is queued in the Hardcover outbox and sent in the background, so issues with
+    Hardcover do not prevent the Kobo from clearing its reading state sync queue.
 
     :param book: The book for which to sync reading progress.
     :param request_bookmark: The bookmark data from the Kobo request.
@@ -1007,19 +1230,15 @@ def push_reading_state_to_hardcover(book: db.Books, request_bookmark: dict):
         log.debug(f"Skipping reading progress sync for book {book.id} - blacklisted for reading progress")
         return
 
-    try:
-        hardcoverClient = hardcover.HardcoverClient(current_user.hardcover_token)
-    except hardcover.MissingHardcoverToken:
+    if not current_user.hardcover_token:
         log.info(f"User {current_user.name} has no Hardcover token, not syncing reading progress to Hardcover")
         return
-    except Exception as e:
-        log.error(f"Failed to create Hardcover client for user {current_user.name}: {e}")
-        return
 
+    # Sent by the outbox sender thread, so a slow Hardcover doesn't hold up the Kobo sync
     try:
-        hardcoverClient.update_reading_progress(book.identifiers, request_bookmark["ProgressPercent"])
+        hardcover_outbox.push_progress(current_user.id, book.id, book.identifiers, request_bookmark["ProgressPercent"])
     except Exception as e:
-        log.error(f"Failed to update reading progress for book {book.id} in Hardcover: {e}")
+        log.error(f"Failed to queue reading progress of book {book.id} for Hardcover: {e}")
 
 
 def get_read_status_for_kobo(ub_book_read):
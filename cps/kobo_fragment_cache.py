@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Cache of the user independent parts of Kobo entitlements and book metadata.
+
+Every device of every user gets the same metadata of a book, only download urls, archive state and
+reading state differ. Entries are kept per book id together with the revision key they were built for
+(last modified, cover mtime, formats, config), a changed key replaces the entry.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class KoboFragmentCache:
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, book_id, key):
+        with self._lock:
+            entry = self._entries.get(book_id)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(book_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, book_id, key, fragment):
+        with self._lock:
+            self._entries[book_id] = (key, fragment)
+            self._entries.move_to_end(book_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, book_id, key, build):
+        fragment = self.get(book_id, key)
+        if fragment is None:
+            fragment = build()
+            self.put(book_id, key, fragment)
+        return fragment
+
+    def invalidate(self, book_id=None):
+        with self._lock:
+            if book_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(book_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+fragment_cache = KoboFragmentCache()
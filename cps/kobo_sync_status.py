@@ -25,6 +25,19 @@ def add_synced_books(book_id):
         ub.session_commit()
 
 
+# Add several book ids of one sync page to kobo_synced_books table for current user with one commit
+def add_synced_book_ids(book_ids):
+    if not book_ids:
+        return
+    present = {row.book_id for row in ub.session.query(ub.KoboSyncedBooks.book_id)
+               .filter(ub.KoboSyncedBooks.user_id == current_user.id)
+               .filter(ub.KoboSyncedBooks.book_id.in_(book_ids))}
+    for book_id in dict.fromkeys(book_ids):
+        if book_id not in present:
+            ub.session.add(ub.KoboSyncedBooks(user_id=current_user.id, book_id=book_id))
+    ub.session_commit()
+
+
 # Select all entries of current book in kobo_synced_books table, which are from current user and delete them
 def remove_synced_book(book_id, all=False, session=None):
     if not all:
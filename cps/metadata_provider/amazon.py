@@ -5,7 +5,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
-import concurrent.futures
 import re
 import requests
 from bs4 import BeautifulSoup as BS  # requirement
@@ -16,6 +15,7 @@ try:
 except ImportError:
     pass
 
+from cps.http_client import get_http_session
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 import cps.logger as logger
 
@@ -32,8 +32,7 @@ class Amazon(Metadata):
         'Accept': '*/*',
         'Accept-Encoding': 'gzip, deflate, br, zstd',
     }
-    session = requests.Session()
-    session.headers=headers
+    session = get_http_session("amazon", headers=headers)
 
     def search(
         self, query: str, generic_cover: str = "", locale: str = "en"
@@ -195,12 +194,6 @@ class Amazon(Metadata):
             if len(links_list) == 0:
                 log.info(f"No Amazon search results found for query: {query}")
                 return []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                fut = {executor.submit(inner, link, index) for index, link in enumerate(links_list[:3])}
-                try:
-                    val = list(map(lambda x : x.result(), concurrent.futures.as_completed(fut, timeout=15)))
-                except concurrent.futures.TimeoutError:
-                    log.warning("Amazon search timeout after 15 seconds")
-                    val = []
+            val = self.fetch_details(inner, [(link, index) for index, link in enumerate(links_list[:3])], timeout=15)
         result = list(filter(lambda x: x, val))
         return [x[0] for x in sorted(result, key=itemgetter(1))] #sort by amazons listing order for best relevance
@@ -6,7 +6,6 @@
 # See CONTRIBUTORS for full list of authors.
 
 import cps.logger as logger
-import concurrent.futures
 import re
 import requests
 
@@ -20,6 +19,7 @@ try:
 except ImportError:
     pass
 
+from cps.http_client import get_http_session
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 import cps.logger as logger
 from operator import itemgetter
@@ -40,8 +40,7 @@ class AmazonJp(Metadata):
                'Priority' : 'u=0, i',
                'accept-encoding': 'gzip, deflate, br, zstd',
                'accept-language': 'ja-JP,ja;q=0.9'}
-    session = requests.Session()
-    session.headers=headers
+    session = get_http_session("amazonjp", headers=headers)
 
     def search(
         self, query: str, generic_cover: str = "", locale: str = "ja"
@@ -108,13 +107,7 @@ class AmazonJp(Metadata):
             soup = BS(results.text, 'html.parser')
             links_list = [next(filter(lambda i: "digital-text" in i["href"], x.findAll("a")))["href"] for x in
                           soup.findAll("div", attrs={"data-component-type": "s-search-result"})]
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                fut = {executor.submit(inner, link, index) for index, link in enumerate(links_list[:10])}
-                try:
-                    val = list(map(lambda x : x.result(), concurrent.futures.as_completed(fut, timeout=15)))
-                except concurrent.futures.TimeoutError:
-                    log.warning("Amazon search timeout after 15 seconds")
-                    val = []
+            val = self.fetch_details(inner, [(link, index) for index, link in enumerate(links_list[:10])], timeout=15)
         result = list(filter(lambda x: x, val))
         return [x[0] for x in sorted(result, key=itemgetter(1))] #sort by amazons listing order for best relevance
 
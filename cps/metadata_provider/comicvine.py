@@ -9,8 +9,8 @@
 from typing import Dict, List, Optional
 from urllib.parse import quote
 
-import requests
 from cps import logger
+from cps.http_client import get_http_session
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 
 log = logger.create()
@@ -39,7 +39,7 @@ class ComicVine(Metadata):
                 tokens = [quote(t.encode("utf-8")) for t in title_tokens]
                 query = "%20".join(tokens)
             try:
-                result = requests.get(
+                result = get_http_session("comicvine").get(
                     f"{ComicVine.BASE_URL}{query}{ComicVine.QUERY_PARAMS}",
                     headers=ComicVine.HEADERS,
                     timeout=15,
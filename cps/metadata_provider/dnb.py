@@ -18,6 +18,7 @@ import requests
 from lxml import etree
 
 from cps import logger, constants
+from cps.http_client import get_http_session
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 
 from cps import isoLanguages
@@ -158,7 +159,7 @@ class DNB(Metadata):
         log.info(f'DNB Query URL: {query_url}')
 
         try:
-            response = requests.get(query_url, headers=headers, timeout=timeout)
+            response = get_http_session("dnb").get(query_url, headers=headers, timeout=timeout)
             response.raise_for_status()
 
             xml_data = etree.XML(response.content)
@@ -408,7 +409,7 @@ class DNB(Metadata):
             url = url_elem.text.strip()
             if url.startswith("http://deposit.dnb.de/") or url.startswith("https://deposit.dnb.de/"):
                 try:
-                    response = requests.get(url, timeout=15)
+                    response = get_http_session("dnb").get(url, timeout=15)
                     response.raise_for_status()
 
                     comments_text = response.text
@@ -439,7 +440,7 @@ class DNB(Metadata):
 
         try:
             # Test the actual response from DNB
-            response = requests.head(cover_url, timeout=10)
+            response = get_http_session("dnb").head(cover_url, timeout=10)
             #log.info(f"DNB cover response status: {response.status_code}")
             #log.info(f"DNB cover content-type: {response.headers.get('content-type')}")
 
@@ -481,7 +482,7 @@ class DNB(Metadata):
         cover_url = self.COVERURL % book_data['isbn']
 
         try:
-            response = requests.get(cover_url, timeout=10)
+            response = get_http_session("dnb").get(cover_url, timeout=10)
             response.raise_for_status()
 
             content_type = response.headers.get('content-type').lower()
@@ -6,14 +6,13 @@
 # See CONTRIBUTORS for full list of authors.
 
 import re
-from concurrent import futures
 from typing import List, Optional
 
-import requests
 from html2text import HTML2Text
 from lxml import etree
 
 from cps import logger
+from cps.http_client import get_http_session
 from cps.services.Metadata import Metadata, MetaRecord, MetaSourceInfo
 
 log = logger.create()
@@ -52,11 +51,10 @@ class Douban(Metadata):
     DESCRIPTION_XPATH = "//div[@id='link-report']//div[@class='intro']"
     RATING_XPATH = "//div[@class='rating_self clearfix']/strong"
 
-    session = requests.Session()
-    session.headers = {
+    session = get_http_session("douban", headers={
         'user-agent':
         'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36 Edg/98.0.1108.56',
-    }
+    })
 
     def search(self,
                query: str,
@@ -75,18 +73,12 @@ class Douban(Metadata):
                 log.debug("No search results in Douban")
                 return []
 
-            with futures.ThreadPoolExecutor(
-                    max_workers=5, thread_name_prefix='douban') as executor:
-
-                fut = [
-                    executor.submit(self._parse_single_book, book_id,
-                                    generic_cover) for book_id in book_id_list
-                ]
-
-                val = [
-                    future.result() for future in futures.as_completed(fut)
-                    if future.result()
-                ]
+            val = [
+                book for book in self.fetch_details(
+                    self._parse_single_book,
+                    [(book_id, generic_cover) for book_id in book_id_list])
+                if book
+            ]
 
         return val
 
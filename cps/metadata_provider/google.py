@@ -10,9 +10,8 @@ from typing import Dict, List, Optional
 from urllib.parse import quote
 from datetime import datetime
 
-import requests
-
 from cps import logger
+from cps.http_client import get_http_session
 from cps.isoLanguages import get_lang3, get_language_name
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 
@@ -39,7 +38,7 @@ class Google(Metadata):
                 tokens = [quote(t.encode("utf-8")) for t in title_tokens]
                 query = "+".join(tokens)
             try:
-                results = requests.get(Google.SEARCH_URL + query, timeout=15)
+                results = get_http_session("google").get(Google.SEARCH_URL + query, timeout=15)
                 results.raise_for_status()
             except Exception as e:
                 log.warning(e)
@@ -37,6 +37,7 @@ except ImportError:
 # Try importing from full app; if unavailable (CLI), use light fallbacks
 try:  # pragma: no cover - normal app path
     from cps import logger, config, constants  # type: ignore
+    from cps.http_client import get_http_session  # type: ignore
     from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata  # type: ignore
     from cps.isoLanguages import get_language_name  # type: ignore
     from ..cw_login import current_user  # type: ignore
@@ -108,6 +109,11 @@ except Exception:  # pragma: no cover - CLI/testing path
 
     current_user = _DummyUser()  # type: ignore
 
+    _cli_session = requests.Session()
+
+    def get_http_session(name: str, headers=None, validate: bool = True):  # type: ignore
+        return _cli_session
+
 log = logger.create()
 
 
@@ -166,7 +172,7 @@ class Hardcover(Metadata):
         try:
             edition_search = query.split(":")[0] == "hardcover-id"
             Hardcover.HEADERS["Authorization"] = "Bearer %s" % token.replace("Bearer ", "")
-            resp = requests.post(
+            resp = get_http_session("hardcover").post(
                 Hardcover.BASE_URL,
                 json={
                     "query": Hardcover.EDITION_QUERY if edition_search else Hardcover.SEARCH_QUERY,
@@ -202,25 +208,77 @@ class Hardcover(Metadata):
                     val = self._parse_edition_results(result=book, generic_cover=generic_cover, locale=locale)
             else:
                 raw_results = self._safe_get(response_data, "data", "search", "results", default=[])
-                if isinstance(raw_results, str):
-                    import json as _json
-                    try:
-                        parsed = _json.loads(raw_results)
-                    except Exception:
-                        parsed = []
-                else:
-                    parsed = raw_results
-
-                for hit in self._safe_get(parsed, "hits", default=[]):
-                    match = self._parse_title_result(result=hit, generic_cover=generic_cover, locale=locale)
-                    if match:
-                        val.append(match)
+                val = self._parse_search_hits(raw_results, generic_cover, locale)
         except Exception as e:
             log.warning(f"Error processing results: {e}")
             return []
 
         return val
 
+    def search_batch(
+        self, searches: Dict[str, str], token: str, generic_cover: str = "", locale: str = "en",
+        per_page: int = 10, timeout: int = 30
+    ) -> Dict[str, List[MetaRecord]]:
+        """Runs several title or ISBN searches in one request, as aliased fields of one GraphQL query.
+
+        Returns the records per key of searches. Unlike search(), request and GraphQL errors are raised,
+        so callers can back off and retry the batch.
+        """
+        if not searches:
+            return {}
+        aliases = {f"q{index}": key for index, key in enumerate(searches)}
+        variables = ", ".join(f"${alias}: String!" for alias in aliases)
+        fields = " ".join(
+            f"{alias}: search(query: ${alias}, query_type: \"Book\", per_page: {int(per_page)}) {{ results }}"
+            for alias in aliases
+        )
+        headers = dict(Hardcover.HEADERS, Authorization="Bearer %s" % token.replace("Bearer ", ""))
+        resp = get_http_session("hardcover").post(
+            Hardcover.BASE_URL,
+            json={
+                "query": f"query BatchSearch({variables}) {{ {fields} }}",
+                "variables": {alias: searches[key] for alias, key in aliases.items()},
+            },
+            headers=headers,
+            timeout=timeout,
+        )
+        resp.raise_for_status()
+        response_data = resp.json()
+        data = response_data.get("data")
+        if not isinstance(data, dict):
+            raise ValueError(f"GraphQL errors: {response_data.get('errors')}")
+        if response_data.get("errors"):
+            log.warning(f"GraphQL errors in batch search: {response_data['errors']}")
+
+        return {
+            key: self._parse_search_hits(
+                self._safe_get(data, alias, "results", default=[]), generic_cover, locale, isbn=searches[key]
+            )
+            for alias, key in aliases.items()
+        }
+
+    def _parse_search_hits(
+        self, raw_results, generic_cover: str, locale: str, isbn: str = ""
+    ) -> List[MetaRecord]:
+        """Parses the search results scalar, records whose document lists isbn get it as identifier"""
+        if isinstance(raw_results, str):
+            import json as _json
+            try:
+                parsed = _json.loads(raw_results)
+            except Exception:
+                parsed = []
+        else:
+            parsed = raw_results
+
+        val: List[MetaRecord] = []
+        for hit in self._safe_get(parsed, "hits", default=[]) or []:
+            match = self._parse_title_result(result=hit, generic_cover=generic_cover, locale=locale)
+            if match:
+                if isbn and isbn in (self._safe_get(hit, "document", "isbns", default=[]) or []):
+                    match.identifiers["isbn"] = isbn
+                val.append(match)
+        return val
+
     def _parse_title_result(
         self, result: Dict, generic_cover: str, locale: str
     ) -> Optional[MetaRecord]:
@@ -13,6 +13,7 @@ from datetime import datetime
 import requests
 
 from cps import logger
+from cps.http_client import get_http_session
 from cps.isoLanguages import get_lang3, get_language_name
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 
@@ -38,7 +39,7 @@ class IBDb(Metadata):
                 tokens = [quote(t.encode("utf-8")) for t in title_tokens]
                 query = "+".join(tokens)
             try:
-                results = requests.get(IBDb.SEARCH_URL + query, timeout=15)
+                results = get_http_session("ibdb").get(IBDb.SEARCH_URL + query, timeout=15)
                 results.raise_for_status()
             except requests.HTTPError as e:
                 status_code = getattr(e.response, "status_code", None)
@@ -5,7 +5,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
-import concurrent.futures
 import json
 import re
 from datetime import datetime
@@ -203,15 +202,9 @@ class Kobo(Metadata):
         if not links:
             return []
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futs = {executor.submit(fetch_and_parse, link, i): i for i, link in enumerate(links)}
-            try:
-                for fut in concurrent.futures.as_completed(futs, timeout=self.DETAIL_TIMEOUT):
-                    item = fut.result()
-                    if item:
-                        results.append(item)
-            except concurrent.futures.TimeoutError:
-                log.warning("Kobo search detail timeout after %ss", self.DETAIL_TIMEOUT)
+        items = self.fetch_details(fetch_and_parse, [(link, i) for i, link in enumerate(links)],
+                                   timeout=self.DETAIL_TIMEOUT)
+        results.extend(item for item in items if item)
 
         results.sort(key=lambda x: x[1])
         return [x[0] for x in results]
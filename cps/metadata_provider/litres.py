@@ -11,6 +11,7 @@ from typing import Dict, List, Optional, Any
 from urllib.parse import urljoin
 
 from cps import logger
+from cps.http_client import get_http_session
 from cps.isoLanguages import get_lang3, get_language_name
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 
@@ -37,8 +38,7 @@ class Litres(Metadata):
 
     def __init__(self):
         super().__init__()
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.session = get_http_session("litres", headers={
             "User-Agent": "Calibre-Web-Litres-Provider/2.0",
             "Accept": "application/json, text/plain, */*",
             "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8",
@@ -8,17 +8,16 @@
 import datetime
 import json
 import re
-from multiprocessing.pool import ThreadPool
 from typing import List, Optional, Tuple, Union
 from urllib.parse import quote
 
-import requests
 from dateutil import parser
 from html2text import HTML2Text
 from lxml.html import HtmlElement, fromstring, tostring
 from markdown2 import Markdown
 
 from cps import logger
+from cps.http_client import get_http_session
 from cps.isoLanguages import get_language_name
 from cps.services.Metadata import MetaRecord, MetaSourceInfo, Metadata
 
@@ -109,7 +108,7 @@ class LubimyCzytac(Metadata):
     ) -> Optional[List[MetaRecord]]:
         if self.active:
             try:
-                result = requests.get(self._prepare_query(title=query), timeout=15)
+                result = get_http_session("lubimyczytac").get(self._prepare_query(title=query), timeout=15)
                 result.raise_for_status()
             except Exception as e:
                 log.warning(e)
@@ -118,11 +117,10 @@ class LubimyCzytac(Metadata):
             lc_parser = LubimyCzytacParser(root=root, metadata=self)
             matches = lc_parser.parse_search_results()
             if matches:
-                with ThreadPool(processes=10) as pool:
-                    final_matches = pool.starmap(
-                        lc_parser.parse_single_book,
-                        [(match, generic_cover, locale) for match in matches],
-                    )
+                final_matches = self.fetch_details(
+                    lc_parser.parse_single_book,
+                    [(match, generic_cover, locale) for match in matches],
+                )
                 # Filter out None values from failed individual book parsing
                 final_matches = [match for match in final_matches if match is not None]
                 # If all detailed parsing failed, return original matches with basic info
@@ -206,7 +204,7 @@ class LubimyCzytacParser:
         self, match: MetaRecord, generic_cover: str, locale: str
     ) -> MetaRecord:
         try:
-            response = requests.get(match.url, timeout=15)
+            response = get_http_session("lubimyczytac").get(match.url, timeout=15)
             response.raise_for_status()
         except Exception as e:
             log.warning(e)
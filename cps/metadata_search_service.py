@@ -0,0 +1,172 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Runs metadata provider searches on one shared, bounded thread pool.
+
+Every provider gets its own deadline and results are handed out as each provider returns. Results
+are cached per (provider, normalized query, locale) for a while, so re-opening the search dialog
+does not hit the network again.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from flask import copy_current_request_context, has_request_context
+
+from . import logger
+
+log = logger.create()
+
+METADATA_SEARCH_WORKERS = 8
+# Seconds a search waits for a provider, providers can set SEARCH_DEADLINE to override it
+METADATA_SEARCH_DEADLINE = 20
+METADATA_SEARCH_TTL = 600
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+STATUS_TIMEOUT = 'timeout'
+
+
+class MetadataSearchService:
+    def __init__(self, max_workers=METADATA_SEARCH_WORKERS, deadline=METADATA_SEARCH_DEADLINE,
+                 ttl=METADATA_SEARCH_TTL, max_entries=256):
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = dict()
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._runs = deque(maxlen=50)
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    @staticmethod
+    def normalize_query(query):
+        return " ".join(str(query or "").lower().split())
+
+    def make_key(self, provider, query, locale):
+        return provider.__id__, self.normalize_query(query), str(locale or "")
+
+    def deadline_for(self, provider):
+        return getattr(provider, "SEARCH_DEADLINE", None) or self.deadline
+
+    def submit(self, provider, query, generic_cover="", locale="en"):
+        """Returns a future of the provider's records, resolved right away while the cache is fresh.
+
+        A search already running for the same key is shared instead of started again.
+        """
+        key = self.make_key(provider, query, locale)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                future = Future()
+                future.set_result(entry[1])
+                return future
+            future = self._pending.get(key)
+            if future is not None:
+                self.hits += 1
+                return future
+            self.misses += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='metadata-search')
+            search = provider.search
+            if has_request_context():
+                search = copy_current_request_context(search)
+            future = self._executor.submit(self._search, search, provider, key, query, generic_cover, locale)
+            self._pending[key] = future
+        return future
+
+    def search(self, providers, query, generic_cover="", locale="en"):
+        """Yields (provider, records, status) in the order the providers finish.
+
+        Providers missing their deadline are reported with STATUS_TIMEOUT and keep running in the
+        background, their results still end up in the cache for the next search.
+        """
+        started = time.monotonic()
+        futures = {self.submit(provider, query, generic_cover, locale): provider for provider in providers}
+        deadlines = {future: started + self.deadline_for(provider) for future, provider in futures.items()}
+        while futures:
+            timeout = max(0.0, min(deadlines[future] for future in futures) - time.monotonic())
+            done, __ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = futures.pop(future)
+                try:
+                    yield provider, future.result(), STATUS_OK
+                except Exception as exc:
+                    log.warning("Metadata provider %s failed: %s", provider.__class__.__name__, exc)
+                    yield provider, [], STATUS_ERROR
+            now = time.monotonic()
+            for future in [future for future in futures if deadlines[future] <= now and not future.done()]:
+                provider = futures.pop(future)
+                with self._lock:
+                    self.timeouts += 1
+                log.warning("Metadata provider %s did not answer within %ss",
+                            provider.__class__.__name__, self.deadline_for(provider))
+                yield provider, [], STATUS_TIMEOUT
+
+    def search_one(self, provider, query, generic_cover="", locale="en", timeout=None):
+        """Records of one provider, raises concurrent.futures.TimeoutError after its deadline."""
+        future = self.submit(provider, query, generic_cover, locale)
+        return future.result(timeout=timeout or self.deadline_for(provider))
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    def debug_info(self):
+        with self._lock:
+            return {
+                'ttl_seconds': self.ttl,
+                'workers': self.max_workers,
+                'deadline_seconds': self.deadline,
+                'cached_entries': len(self._cache),
+                'running': len(self._pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'timeouts': self.timeouts,
+                'failures': self.failures,
+                'recent_searches': list(reversed(self._runs)),
+            }
+
+    def _search(self, search, provider, key, query, generic_cover, locale):
+        start = time.perf_counter()
+        try:
+            records = [record for record in (search(query, generic_cover, locale) or []) if record]
+        except Exception:
+            with self._lock:
+                self.failures += 1
+                self._pending.pop(key, None)
+                self._record(provider, start, None)
+            raise
+        with self._lock:
+            now = time.monotonic()
+            if len(self._cache) >= self.max_entries:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+                if len(self._cache) >= self.max_entries:
+                    self._cache.clear()
+            self._cache[key] = (now + self.ttl, records)
+            self._pending.pop(key, None)
+            self._record(provider, start, len(records))
+        return records
+
+    def _record(self, provider, start, count):
+        self._runs.append({
+            'provider': provider.__id__,
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'ms': round((time.perf_counter() - start) * 1000, 1),
+            'results': count,
+        })
+
+
+metadata_search_service = MetadataSearchService()
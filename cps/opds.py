@@ -7,6 +7,8 @@
 
 import datetime
 import json
+import time
+from functools import wraps
 from urllib.parse import unquote_plus
 
 from flask import Blueprint, request, render_template, make_response, abort, Response, g, url_for
@@ -22,6 +24,7 @@ from .usermanagement import requires_basic_auth_if_no_ano, auth
 from .helper import get_download_link, get_book_cover
 from .pagination import Pagination
 from .web import render_read_books
+from .feed_cache import feed_cache
 
 
 opds = Blueprint('opds', __name__)
@@ -203,6 +206,57 @@ def get_opds_root_entries(user, allow_anonymous):
     return entries
 
 
+def feed_cache_key(ttl=None):
+    user = auth.current_user()
+    restrictions = (getattr(user, 'id', None),
+                    getattr(user, 'role', None),
+                    getattr(user, 'sidebar_view', None),
+                    user.filter_language(),
+                    tuple(user.list_allowed_tags()),
+                    tuple(user.list_denied_tags()),
+                    getattr(user, 'allowed_column_value', None) or "",
+                    getattr(user, 'denied_column_value', None) or "",
+                    config.config_restricted_column,
+                    config.config_read_column,
+                    config.config_books_per_page,
+                    config.config_calibre_web_title,
+                    str(get_locale()))
+    return (request.endpoint,
+            tuple(sorted(request.args.items(multi=True))),
+            request.host_url + request.script_root,
+            restrictions,
+            calibre_db.library_change_marker(),
+            feed_cache.generation,
+            int(time.time() // ttl) if ttl else None)
+
+
+def cached_feed(ttl=None):
+    """Serves the rendered feed from the feed cache and answers conditional requests with 304.
+
+    ttl limits how long a feed stays cached when it changes without database writes, e.g. random books.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = feed_cache_key(ttl)
+            entry = feed_cache.get(key)
+            if entry is None:
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                entry = feed_cache.put(key, response.get_data(), {'Content-Type': response.headers['Content-Type']})
+            etag, rendered, body, headers = entry
+            response = make_response(body)
+            response.headers.update(headers)
+            response.set_etag(etag)
+            response.last_modified = rendered
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
 @opds.before_request
 def track_opds_access():
     """Track OPDS feed access for analytics"""
@@ -258,12 +312,14 @@ def feed_normal_search():
 
 @opds.route("/opds/books")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_booksindex():
     return render_element_index(db.Books.sort, None, 'opds.feed_letter_books')
 
 
 @opds.route("/opds/books/letter/<book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_letter_books(book_id):
     off = request.args.get("offset") or 0
     letter = true() if book_id == "00" else func.upper(db.Books.sort).startswith(book_id)
@@ -278,6 +334,7 @@ def feed_letter_books(book_id):
 
 @opds.route("/opds/new")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_new():
     if not auth.current_user().check_visibility(constants.SIDEBAR_RECENT):
         abort(404)
@@ -290,6 +347,7 @@ def feed_new():
 
 @opds.route("/opds/discover")
 @requires_basic_auth_if_no_ano
+@cached_feed(ttl=300)
 def feed_discover():
     if not auth.current_user().check_visibility(constants.SIDEBAR_RANDOM):
         abort(404)
@@ -301,6 +359,7 @@ def feed_discover():
 
 @opds.route("/opds/rated")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_best_rated():
     if not auth.current_user().check_visibility(constants.SIDEBAR_BEST_RATED):
         abort(404)
@@ -314,6 +373,7 @@ def feed_best_rated():
 
 @opds.route("/opds/hot")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_hot():
     if not auth.current_user().check_visibility(constants.SIDEBAR_HOT):
         abort(404)
@@ -338,6 +398,7 @@ def feed_hot():
 
 @opds.route("/opds/author")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_authorindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_AUTHOR):
         abort(404)
@@ -346,6 +407,7 @@ def feed_authorindex():
 
 @opds.route("/opds/author/letter/<book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_letter_author(book_id):
     if not auth.current_user().check_visibility(constants.SIDEBAR_AUTHOR):
         abort(404)
@@ -363,12 +425,14 @@ def feed_letter_author(book_id):
 
 @opds.route("/opds/author/<int:book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_author(book_id):
     return render_xml_dataset(db.Authors, book_id)
 
 
 @opds.route("/opds/publisher")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_publisherindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_PUBLISHER):
         abort(404)
@@ -386,12 +450,14 @@ def feed_publisherindex():
 
 @opds.route("/opds/publisher/<int:book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_publisher(book_id):
     return render_xml_dataset(db.Publishers, book_id)
 
 
 @opds.route("/opds/category")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_categoryindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_CATEGORY):
         abort(404)
@@ -400,6 +466,7 @@ def feed_categoryindex():
 
 @opds.route("/opds/category/letter/<book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_letter_category(book_id):
     if not auth.current_user().check_visibility(constants.SIDEBAR_CATEGORY):
         abort(404)
@@ -419,12 +486,14 @@ def feed_letter_category(book_id):
 
 @opds.route("/opds/category/<int:book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_category(book_id):
     return render_xml_dataset(db.Tags, book_id)
 
 
 @opds.route("/opds/series")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_seriesindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_SERIES):
         abort(404)
@@ -433,6 +502,7 @@ def feed_seriesindex():
 
 @opds.route("/opds/series/letter/<book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_letter_series(book_id):
     if not auth.current_user().check_visibility(constants.SIDEBAR_SERIES):
         abort(404)
@@ -452,6 +522,7 @@ def feed_letter_series(book_id):
 
 @opds.route("/opds/series/<int:book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_series(book_id):
     off = request.args.get("offset") or 0
     entries, __, pagination = calibre_db.fill_indexpage((int(off) / (int(config.config_books_per_page)) + 1), 0,
@@ -464,6 +535,7 @@ def feed_series(book_id):
 
 @opds.route("/opds/ratings")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_ratingindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_RATING):
         abort(404)
@@ -486,12 +558,14 @@ def feed_ratingindex():
 
 @opds.route("/opds/ratings/<book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_ratings(book_id):
     return render_xml_dataset(db.Ratings, book_id)
 
 
 @opds.route("/opds/formats")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_formatindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_FORMAT):
         abort(404)
@@ -510,6 +584,7 @@ def feed_formatindex():
 
 @opds.route("/opds/formats/<book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_format(book_id):
     off = request.args.get("offset") or 0
     entries, __, pagination = calibre_db.fill_indexpage((int(off) / (int(config.config_books_per_page)) + 1), 0,
@@ -523,6 +598,7 @@ def feed_format(book_id):
 @opds.route("/opds/language")
 @opds.route("/opds/language/")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_languagesindex():
     if not auth.current_user().check_visibility(constants.SIDEBAR_LANGUAGE):
         abort(404)
@@ -540,6 +616,7 @@ def feed_languagesindex():
 
 @opds.route("/opds/language/<int:book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_languages(book_id):
     off = request.args.get("offset") or 0
     entries, __, pagination = calibre_db.fill_indexpage((int(off) / (int(config.config_books_per_page)) + 1), 0,
@@ -552,6 +629,7 @@ def feed_languages(book_id):
 
 @opds.route("/opds/shelfindex")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_shelfindex():
     if not (auth.current_user().is_authenticated or g.allow_anonymous):
         abort(404)
@@ -569,6 +647,7 @@ def feed_shelfindex():
 
 @opds.route("/opds/magicshelfindex")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_magic_shelfindex():
     if not (auth.current_user().is_authenticated or g.allow_anonymous):
         abort(404)
@@ -600,6 +679,7 @@ def feed_magic_shelfindex():
 
 @opds.route("/opds/shelf/<int:book_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_shelf(book_id):
     if not (auth.current_user().is_authenticated or g.allow_anonymous):
         abort(404)
@@ -640,6 +720,7 @@ def feed_shelf(book_id):
 
 @opds.route("/opds/magicshelf/<int:shelf_id>")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_magic_shelf(shelf_id):
     if not (auth.current_user().is_authenticated or g.allow_anonymous):
         abort(404)
@@ -723,6 +804,7 @@ def feed_get_cover(book_id):
 
 @opds.route("/opds/readbooks")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_read_books():
     if not (auth.current_user().check_visibility(constants.SIDEBAR_READ_AND_UNREAD) and not auth.current_user().is_anonymous):
         return abort(403)
@@ -733,6 +815,7 @@ def feed_read_books():
 
 @opds.route("/opds/unreadbooks")
 @requires_basic_auth_if_no_ano
+@cached_feed()
 def feed_unread_books():
     if not (auth.current_user().check_visibility(constants.SIDEBAR_READ_AND_UNREAD) and not auth.current_user().is_anonymous):
         return abort(403)
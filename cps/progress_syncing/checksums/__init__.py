@@ -13,19 +13,24 @@ Provides checksum calculation and management for book files.
 Supports KOReader's partial MD5 algorithm for efficient file identification.
 """
 
-from .koreader import calculate_koreader_partial_md5, CHECKSUM_VERSION
+from .koreader import calculate_koreader_partial_md5, CHECKSUM_VERSION, SOURCE_CHECKSUM_VERSION
 from .manager import (
     store_checksum,
     calculate_and_store_checksum,
     get_latest_checksum,
-    get_checksum_history
+    get_checksum_history,
+    find_books_by_checksum,
+    get_shared_checksum_groups
 )
 
 __all__ = [
     'calculate_koreader_partial_md5',
     'CHECKSUM_VERSION',
+    'SOURCE_CHECKSUM_VERSION',
     'store_checksum',
     'calculate_and_store_checksum',
     'get_latest_checksum',
     'get_checksum_history',
+    'find_books_by_checksum',
+    'get_shared_checksum_groups',
 ]
@@ -30,6 +30,8 @@ log = logger.create()
 
 # Current algorithm version - use string identifier for clarity
 CHECKSUM_VERSION = 'koreader'
+# Same algorithm, stored for the original ingest file instead of the library copy
+SOURCE_CHECKSUM_VERSION = 'koreader-source'
 
 
 def calculate_koreader_partial_md5(filepath: str) -> Optional[str]:
@@ -26,7 +26,7 @@ from datetime import datetime, timezone
 from typing import Optional, List, Tuple
 
 from ... import logger
-from .koreader import calculate_koreader_partial_md5, CHECKSUM_VERSION
+from .koreader import calculate_koreader_partial_md5, CHECKSUM_VERSION, SOURCE_CHECKSUM_VERSION
 
 log = logger.create()
 
@@ -179,6 +179,8 @@ def get_latest_checksum(
     """
     Get the most recent checksum for a book/format (by created timestamp).
 
+    Checksums of original ingest files are skipped, they don't describe the file in the library.
+
     Args:
         book_id: Calibre book ID
         book_format: File format (EPUB, AZW3, etc.)
@@ -195,11 +197,13 @@ def get_latest_checksum(
                 SELECT checksum FROM book_format_checksums
                 WHERE book = :book_id
                 AND format = :format
+                AND version != :source_version
                 ORDER BY created DESC
                 LIMIT 1
             '''), {
                 'book_id': book_id,
-                'format': book_format.upper()
+                'format': book_format.upper(),
+                'source_version': SOURCE_CHECKSUM_VERSION
             }).fetchone()
 
             return result[0] if result else None
@@ -245,3 +249,116 @@ def get_checksum_history(
     except Exception as e:
         log.error(f"Failed to get checksum history for book {book_id}: {e}")
         return []
+
+
+def _is_sqlalchemy_connection(db_connection) -> bool:
+    return hasattr(db_connection, 'execute') and hasattr(db_connection.execute.__self__, 'dialect')
+
+
+def find_books_by_checksum(
+    checksum: str,
+    book_format: Optional[str] = None,
+    db_connection=None
+) -> List[int]:
+    """
+    Find the books that have (or had) a file with the given checksum.
+
+    The whole history is searched, so a file matches even after the library copy
+    was modified by metadata enforcement or EPUB fixing.
+
+    Args:
+        checksum: MD5 checksum string
+        book_format: Optional file format (EPUB, AZW3, etc.) the file must have
+        db_connection: Optional database connection (SQLAlchemy or sqlite3)
+
+    Returns:
+        Sorted list of Calibre book IDs, empty if none match or the lookup failed
+    """
+    try:
+        from ... import calibre_db
+        from sqlalchemy import text
+
+        if db_connection is None:
+            db_connection = calibre_db.engine.connect()
+            should_close = True
+        else:
+            should_close = False
+
+        format_filter = book_format.upper() if book_format else None
+        try:
+            if _is_sqlalchemy_connection(db_connection):
+                rows = db_connection.execute(text('''
+                    SELECT DISTINCT book FROM book_format_checksums
+                    WHERE checksum = :checksum
+                    AND (:format IS NULL OR format = :format)
+                '''), {
+                    'checksum': checksum,
+                    'format': format_filter
+                }).fetchall()
+            else:
+                rows = db_connection.execute('''
+                    SELECT DISTINCT book FROM book_format_checksums
+                    WHERE checksum = ?
+                    AND (? IS NULL OR format = ?)
+                ''', (checksum, format_filter, format_filter)).fetchall()
+            return sorted(int(row[0]) for row in rows)
+        finally:
+            if should_close:
+                db_connection.close()
+
+    except Exception as e:
+        log.error(f"Failed to look up books by checksum {checksum}: {e}")
+        return []
+
+
+def get_shared_checksum_groups(
+    candidate_book_ids=None,
+    db_connection=None
+) -> List[List[int]]:
+    """
+    Group books that share a file, i.e. any (format, checksum) pair.
+
+    Served by the covering (checksum, format, book) index, so a full library
+    scan is a single index walk.
+
+    Args:
+        candidate_book_ids: Optional book IDs, only groups containing one of them are returned
+        db_connection: Optional SQLAlchemy connection (uses calibre_db if None)
+
+    Returns:
+        List of sorted book ID lists, each with at least two books
+    """
+    from ... import calibre_db
+    from sqlalchemy import text
+
+    where = ''
+    params = {}
+    if candidate_book_ids is not None:
+        candidate_book_ids = sorted({int(book_id) for book_id in candidate_book_ids})
+        if not candidate_book_ids:
+            return []
+        placeholders = ','.join(f':book_{index}' for index in range(len(candidate_book_ids)))
+        where = f'''
+            WHERE checksum IN (
+                SELECT checksum FROM book_format_checksums WHERE book IN ({placeholders})
+            )
+        '''
+        params = {f'book_{index}': book_id for index, book_id in enumerate(candidate_book_ids)}
+
+    if db_connection is None:
+        db_connection = calibre_db.engine.connect()
+        should_close = True
+    else:
+        should_close = False
+    try:
+        rows = db_connection.execute(text(f'''
+            SELECT GROUP_CONCAT(DISTINCT book)
+            FROM book_format_checksums
+            {where}
+            GROUP BY checksum, format
+            HAVING COUNT(DISTINCT book) > 1
+        '''), params).fetchall()
+    finally:
+        if should_close:
+            db_connection.close()
+    return [sorted(int(book_id) for book_id in row[0].split(',')) for row in rows if row[0]]
@@ -248,12 +248,20 @@ def ensure_checksum_table(conn):
                     execute_sql(f"CREATE INDEX {table_prefix}idx_checksum_version ON book_format_checksums(checksum, version)")
                     execute_sql(f"CREATE INDEX {table_prefix}idx_book_format ON book_format_checksums(book, format)")
                     execute_sql(f"CREATE INDEX {table_prefix}idx_created ON book_format_checksums(created)")
+                    execute_sql(f"CREATE INDEX {table_prefix}idx_checksum_format_book ON book_format_checksums(checksum, format, book)")
                     conn.commit()
                     log.info("Migrated book_format_checksums to add ON DELETE CASCADE")
                 except Exception as migration_error:
                     log.error(f"Failed to migrate book_format_checksums for CASCADE: {migration_error}")
                     table_exists = True
 
+            # Covering index for content-hash duplicate detection, added after the table was introduced
+            execute_sql(
+                f"CREATE INDEX IF NOT EXISTS {table_prefix}idx_checksum_format_book "
+                f"ON book_format_checksums(checksum, format, book)"
+            )
+            conn.commit()
+
         if not table_exists:
             # Create table for book format checksums
             execute_sql(f"""
@@ -271,6 +279,7 @@ def ensure_checksum_table(conn):
             execute_sql(f"CREATE INDEX {table_prefix}idx_checksum_version ON book_format_checksums(checksum, version)")
             execute_sql(f"CREATE INDEX {table_prefix}idx_book_format ON book_format_checksums(book, format)")
             execute_sql(f"CREATE INDEX {table_prefix}idx_created ON book_format_checksums(created)")
+            execute_sql(f"CREATE INDEX {table_prefix}idx_checksum_format_book ON book_format_checksums(checksum, format, book)")
             conn.commit()
             log.info(f"Created {table_name} table with indexes")
 
@@ -9,13 +9,14 @@ import datetime
 
 from . import config, constants
 from .services.background_scheduler import BackgroundScheduler, CronTrigger, IntervalTrigger, use_APScheduler, DateTrigger
-from .tasks.database import TaskReconnectDatabase, TaskCleanArchivedBooks
+from .tasks.database import TaskReconnectDatabase, TaskCleanArchivedBooks, TaskRollupActivity
 from .tasks.clean import TaskClean
 from .tasks.thumbnail import TaskGenerateCoverThumbnails, TaskGenerateSeriesThumbnails, TaskClearCoverThumbnailCache
 from .tasks.thumbnail_migration import check_and_migrate_thumbnails
 from .services.worker import WorkerThread
 from .tasks.metadata_backup import TaskBackupMetadata
 from .tasks.auto_hardcover_id import TaskAutoHardcoverID
+from .tasks.epub_facts import TaskBackfillEpubFacts
 
 def get_scheduled_tasks(reconnect=True):
     tasks = list()
@@ -39,6 +40,9 @@ def get_scheduled_tasks(reconnect=True):
     if config.schedule_generate_series_covers:
         tasks.append([lambda: TaskGenerateSeriesThumbnails(), 'generate book covers', False])
 
+    # Store layout and size facts of new or changed EPUB files for Kobo sync
+    tasks.append([lambda: TaskBackfillEpubFacts(), 'index epub files', True])
+
     return tasks
 
 
@@ -71,6 +75,7 @@ def register_scheduled_tasks(reconnect=True):
 
         _schedule_hardcover_auto_fetch(scheduler, timezone_info)
         _schedule_archived_book_cleanup(scheduler, timezone_info)
+        _schedule_activity_rollup(scheduler, timezone_info)
 
         # Kick-off tasks, if they should currently be running
         if should_task_be_running(start, duration):
@@ -185,6 +190,15 @@ def register_startup_tasks():
         except Exception:
             pass
 
+        # Resume sending the Hardcover writes still queued in cwa.db
+        try:
+            from .services import hardcover
+            if config.config_hardcover_sync and bool(hardcover):
+                from .hardcover_outbox import hardcover_outbox
+                hardcover_outbox.start()
+        except Exception:
+            pass
+
         # Run scheduled tasks immediately for development and testing
         # Ignore tasks that should currently be running, as these will be added when registering scheduled tasks
         if constants.APP_MODE in ['development', 'test'] and not should_task_be_running(start, duration):
@@ -377,3 +391,14 @@ def _schedule_archived_book_cleanup(scheduler, timezone_info):
     except Exception:
         # Scheduling is best-effort; never block startup
         pass
+
+
+def _schedule_activity_rollup(scheduler, timezone_info):
+    """Schedule the hourly activity rollup, which also compacts raw events past their retention."""
+    try:
+        scheduler.schedule_task(lambda: TaskRollupActivity(), user='System',
+                                trigger=IntervalTrigger(hours=1, timezone=timezone_info),
+                                name='roll up user activity', hidden=True)
+    except Exception:
+        # Scheduling is best-effort; never block startup
+        pass
@@ -5,14 +5,13 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
-import concurrent.futures
 import importlib
 import inspect
 import json
 import os
 import sys
 
-from flask import Blueprint, request, url_for, make_response, jsonify, copy_current_request_context
+from flask import Blueprint, Response, request, url_for, make_response, jsonify, stream_with_context
 from .cw_login import current_user
 from flask_babel import get_locale
 from sqlalchemy.exc import InvalidRequestError, OperationalError
@@ -20,6 +19,7 @@ from sqlalchemy.orm.attributes import flag_modified
 
 from cps.services.Metadata import Metadata
 from . import constants, logger, ub, web_server
+from .metadata_search_service import metadata_search_service
 from .usermanagement import user_login_required
 
 
@@ -138,7 +138,7 @@ def metadata_change_active_provider(prov_name):
         if provider is not None:
             if bool(global_enabled.get(provider.__id__, True)):
                 try:
-                    data = provider.search(new_state.get("query", ""))
+                    data = metadata_search_service.search_one(provider, new_state.get("query", ""))
                 except Exception as exc:
                     log.warning("Metadata provider %s failed: %s", provider.__class__.__name__, exc)
                     data = []
@@ -153,29 +153,27 @@ def metadata_change_active_provider(prov_name):
 @meta.route("/metadata/search", methods=["POST"])
 @user_login_required
 def metadata_search():
-    query = request.form.to_dict().get("query")
-    data = list()
+    form = request.form.to_dict()
+    query = form.get("query")
     active = current_user.view_settings.get("metadata", {})
     locale = get_locale()
     global_enabled = _get_global_provider_enabled_map()
-    if query:
-        static_cover = url_for("static", filename="generic_cover.svg")
-        # ret = cl[0].search(query, static_cover, locale)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            meta = {
-                executor.submit(copy_current_request_context(c.search), query, static_cover, locale): c
-                for c in cl
-                if active.get(c.__id__, True) and bool(global_enabled.get(c.__id__, True))
-            }
-            for future in concurrent.futures.as_completed(meta):
-                try:
-                    result = future.result()
-                except Exception as exc:
-                    provider = meta.get(future)
-                    provider_name = provider.__class__.__name__ if provider else "Unknown"
-                    log.warning("Metadata provider %s failed: %s", provider_name, exc)
-                    continue
-                if not result:
-                    continue
-                data.extend([asdict(x) for x in result if x])
-    return  make_response(jsonify(data))
+    providers = [c for c in cl if active.get(c.__id__, True) and bool(global_enabled.get(c.__id__, True))]
+    static_cover = url_for("static", filename="generic_cover.svg")
+    searches = metadata_search_service.search(providers, query, static_cover, locale) if query else []
+
+    if form.get("stream"):
+        # One JSON line per provider as soon as it answered
+        def stream_results():
+            for provider, records, status in searches:
+                yield json.dumps({
+                    "provider": provider.__id__,
+                    "status": status,
+                    "results": [asdict(x) for x in records],
+                }) + "\n"
+        return Response(stream_with_context(stream_results()), mimetype="application/x-ndjson")
+
+    data = list()
+    for __, records, __ in searches:
+        data.extend([asdict(x) for x in records])
+    return make_response(jsonify(data))
@@ -9,9 +9,28 @@ import abc
 import dataclasses
 import os
 import re
-from typing import Dict, Generator, List, Optional, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Union
 
-from cps import constants
+from cps import constants, logger
+
+log = logger.create()
+
+# Detail page fetches of all providers share one pool, separate from the pool running the searches
+METADATA_DETAIL_WORKERS = 8
+_detail_executor = None
+_detail_lock = threading.Lock()
+
+
+def _get_detail_executor() -> ThreadPoolExecutor:
+    global _detail_executor
+    if _detail_executor is None:
+        with _detail_lock:
+            if _detail_executor is None:
+                _detail_executor = ThreadPoolExecutor(max_workers=METADATA_DETAIL_WORKERS,
+                                                      thread_name_prefix='metadata-detail')
+    return _detail_executor
 
 
 @dataclasses.dataclass
@@ -59,6 +78,29 @@ class Metadata:
     ) -> Optional[List[MetaRecord]]:
         pass
 
+    @staticmethod
+    def fetch_details(
+        fetch: Callable, items: Iterable[tuple], timeout: Optional[float] = None
+    ) -> List:
+        """Runs fetch(*item) for every item on the shared detail pool.
+
+        Returns the results in item order, None for fetches that failed or missed the timeout.
+        """
+        futures = [_get_detail_executor().submit(fetch, *item) for item in items]
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            log.warning("%d metadata detail fetch(es) missed the %ss timeout", len(not_done), timeout)
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result() if future in done else None)
+            except Exception as ex:
+                log.warning("Metadata detail fetch failed: %s", ex)
+                results.append(None)
+        return results
+
     @staticmethod
     def get_title_tokens(
         title: str, strip_joiners: bool = True
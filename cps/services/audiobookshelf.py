@@ -5,9 +5,8 @@
 import os
 import time
 
-import requests
-
 from .. import logger
+from ..http_client import get_http_session
 
 log = logger.create()
 
@@ -15,6 +14,11 @@ _CACHE_TTL_SECONDS = 60
 _cache = {"at": 0.0, "items": {}, "progress": {}}
 
 
+def _session():
+    # The server is set up by the admin and usually lives in the local network, so no address validation
+    return get_http_session("audiobookshelf", validate=False)
+
+
 def _config():
     url = os.environ.get("AUDIOBOOKSHELF_URL", "").rstrip("/")
     token = os.environ.get("AUDIOBOOKSHELF_TOKEN", "")
@@ -32,14 +36,14 @@ def _headers():
 
 def _get(path, timeout=8):
     url, _ = _config()
-    resp = requests.get(url + path, headers=_headers(), timeout=timeout)
+    resp = _session().get(url + path, headers=_headers(), timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
 
 def _post(path, timeout=8):
     url, _ = _config()
-    resp = requests.post(url + path, headers=_headers(), timeout=timeout)
+    resp = _session().post(url + path, headers=_headers(), timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
@@ -85,7 +89,7 @@ def cover_bytes(item_id, timeout=8):
         return None, None
     url, _ = _config()
     try:
-        resp = requests.get(url + "/api/items/{}/cover".format(item_id), headers=_headers(), timeout=timeout)
+        resp = _session().get(url + "/api/items/{}/cover".format(item_id), headers=_headers(), timeout=timeout)
         resp.raise_for_status()
         return resp.content, resp.headers.get("Content-Type", "image/jpeg")
     except Exception as e:
@@ -9,11 +9,11 @@ import json
 import os
 import time
 
-import requests
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 
 from .. import logger
+from ..http_client import get_http_session
 
 log = logger.create()
 
@@ -65,7 +65,7 @@ def _get_access_token():
     signature = private_key.sign(signing_input, padding.PKCS1v15(), hashes.SHA256())
     jwt = (signing_input + b"." + _b64url(signature)).decode()
 
-    resp = requests.post(key.get("token_uri", _TOKEN_URI), data={
+    resp = get_http_session("firebase").post(key.get("token_uri", _TOKEN_URI), data={
         "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
         "assertion": jwt,
     }, timeout=8)
@@ -110,7 +110,7 @@ def _list_documents(project_id, token, path):
         params = {"pageSize": 300}
         if page_token:
             params["pageToken"] = page_token
-        resp = requests.get(url, headers={"Authorization": "Bearer " + token}, params=params, timeout=10)
+        resp = get_http_session("firebase").get(url, headers={"Authorization": "Bearer " + token}, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         for d in data.get("documents", []):
@@ -125,7 +125,7 @@ def _list_documents(project_id, token, path):
 def _get_document(project_id, token, path):
     url = "https://firestore.googleapis.com/v1/projects/{}/databases/(default)/documents/{}".format(
         project_id, path)
-    resp = requests.get(url, headers={"Authorization": "Bearer " + token}, timeout=8)
+    resp = get_http_session("firebase").get(url, headers={"Authorization": "Bearer " + token}, timeout=8)
     if resp.status_code == 404:
         return {}
     resp.raise_for_status()
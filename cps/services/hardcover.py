@@ -19,6 +19,7 @@ from datetime import datetime
 import requests
 
 from .. import logger
+from ..http_client import get_http_session
 
 log = logger.create()
 
@@ -80,8 +81,16 @@ class MissingHardcoverToken(Exception):
     pass
 
 
+def user_book_key(ids):
+    """The identifier get_user_book looks a book up by, as 'type:value', None without Hardcover identifiers"""
+    for key in ("hardcover-edition", "hardcover-id", "hardcover-slug"):
+        if ids.get(key):
+            return f"{key}:{ids[key]}"
+    return None
+
+
 class HardcoverClient:
-    def __init__(self, token: str):
+    def __init__(self, token: str, user_book_cache=None):
         if not token:
             raise MissingHardcoverToken("Hardcover API token is required")
         self.endpoint = GRAPHQL_ENDPOINT
@@ -89,21 +98,26 @@ class HardcoverClient:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {token}",
         }
+        # Optional get/put/forget store of resolved user_books, keyed by Hardcover user and identifier
+        self.user_book_cache = user_book_cache
         try:
-            self.privacy = self.get_privacy()
+            account = self.get_account()
         except Exception as e:
             log.error(f"Error fetching Hardcover account privacy setting: {e}")
             raise
+        self.user_id = account.get("id")
+        self.privacy = account.get("account_privacy_setting_id", 1)
 
-    def get_privacy(self):
+    def get_account(self):
         query = """
             {
                 me {
+                    id
                     account_privacy_setting_id
                 }
             }"""
         response = self.execute(query)
-        return (response.get("me")[0] or [{}]).get("account_privacy_setting_id", 1)
+        return (response.get("me") or [{}])[0] or {}
 
     def get_user_book(self, ids):
         ids = self.parse_identifiers(ids)
@@ -152,6 +166,9 @@ class HardcoverClient:
     def update_reading_progress(self, identifiers, progress_percent):
         ids = self.parse_identifiers(identifiers)
         if len(ids) != 0:
+            # Steady state: the open read is known already, so only the progress mutation is sent
+            if self.update_cached_reading_progress(ids, progress_percent):
+                return
             book = self.get_user_book(ids)
             # Book doesn't exist, add it in Reading status
             if not book:
@@ -164,44 +181,87 @@ class HardcoverClient:
                 return
             pages = book.get("edition", {}).get("pages", 0)
             if pages:
-                pages_read = round(pages * (progress_percent / 100))
                 read = next(iter(book.get("user_book_reads")), None)
                 if not read:
                     # read = self.add_read(book, pages_read)
                     # No read exists for some reason, return since we can't update anything.
                     return
                 else:
-                    mutation = """
-                    mutation ($readId: Int!, $pages: Int, $editionId: Int, $startedAt: date, $finishedAt: date) {
-                        update_user_book_read(id: $readId, object: {
-                            progress_pages: $pages,
-                            edition_id: $editionId,
-                            started_at: $startedAt,
-                            finished_at: $finishedAt
-                        }) {
-                            id
-                        }
-                    }"""
-                    variables = {
-                        "readId": int(read.get("id")),
-                        "pages": pages_read,
-                        "editionId": int(book.get("edition").get("id")),
-                        "startedAt": read.get(
-                            "started_at", datetime.now().strftime("%Y-%m-%d")
-                        ),
-                        "finishedAt": (
-                            datetime.now().strftime("%Y-%m-%d")
-                            if progress_percent == MAX_PROGRESS_PERCENTAGE
-                            else None
-                        ),
+                    entry = {
+                        "user_book_id": book.get("id"),
+                        "status_id": book.get("status_id"),
+                        "edition_id": book.get("edition").get("id"),
+                        "pages": pages,
+                        "read_id": read.get("id"),
+                        "read_started_at": read.get("started_at"),
                     }
                     if progress_percent == MAX_PROGRESS_PERCENTAGE:
                         self.change_book_status(book, STATUS_READ)
-                    self.execute(query=mutation, variables=variables)
+                    self.update_read(entry, progress_percent)
+                    self._remember_user_book(ids, entry, progress_percent)
             return
         else:
             return
 
+    def update_cached_reading_progress(self, ids, progress_percent):
+        """Update the progress with the cached user_book, returns False if the full lookup is needed"""
+        key = user_book_key(ids)
+        if not self.user_book_cache or not self.user_id or not key:
+            return False
+        # Finishing a book changes its status, that always goes through the lookup
+        if progress_percent == MAX_PROGRESS_PERCENTAGE:
+            self.user_book_cache.forget(self.user_id, key)
+            return False
+        entry = self.user_book_cache.get(self.user_id, key)
+        if not entry:
+            return False
+        try:
+            if self.update_read(entry, progress_percent):
+                return True
+        except MissingHardcoverToken:
+            raise
+        except Exception as e:
+            log.debug(f"Cached Hardcover read {entry['read_id']} could not be updated, looking it up again: {e}")
+        # The read is gone on Hardcover, e.g. finished or deleted on the website
+        self.user_book_cache.forget(self.user_id, key)
+        return False
+
+    def update_read(self, entry, progress_percent):
+        mutation = """
+        mutation ($readId: Int!, $pages: Int, $editionId: Int, $startedAt: date, $finishedAt: date) {
+            update_user_book_read(id: $readId, object: {
+                progress_pages: $pages,
+                edition_id: $editionId,
+                started_at: $startedAt,
+                finished_at: $finishedAt
+            }) {
+                id
+            }
+        }"""
+        variables = {
+            "readId": int(entry["read_id"]),
+            "pages": round(entry["pages"] * (progress_percent / 100)),
+            "editionId": int(entry["edition_id"]),
+            "startedAt": entry.get("read_started_at") or datetime.now().strftime("%Y-%m-%d"),
+            "finishedAt": (
+                datetime.now().strftime("%Y-%m-%d")
+                if progress_percent == MAX_PROGRESS_PERCENTAGE
+                else None
+            ),
+        }
+        response = self.execute(query=mutation, variables=variables)
+        return (response.get("update_user_book_read") or {}).get("id")
+
+    def _remember_user_book(self, ids, entry, progress_percent):
+        key = user_book_key(ids)
+        if not self.user_book_cache or not self.user_id or not key:
+            return
+        if progress_percent == MAX_PROGRESS_PERCENTAGE:
+            # The read is finished now, the next progress starts a new one
+            self.user_book_cache.forget(self.user_id, key)
+        else:
+            self.user_book_cache.put(self.user_id, key, dict(entry, status_id=STATUS_READING))
+
     def change_book_status(self, book, status):
         mutation = (
             """
@@ -522,7 +582,8 @@ class HardcoverClient:
 
     def execute(self, query, variables=None):
         payload = {"query": query, "variables": variables or {}}
-        response = requests.post(self.endpoint, json=payload, headers=self.headers)
+        response = get_http_session("hardcover").post(self.endpoint, json=payload, headers=self.headers,
+                                                      timeout=REQUEST_TIMEOUT)
         try:
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -5,10 +5,10 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
+import os
 import threading
 import abc
 import uuid
-import time
 
 try:
     import queue
@@ -32,6 +32,21 @@ STAT_CANCELLED = 5
 # Only retain this many tasks in dequeued list
 TASK_CLEANUP_TRIGGER = 20
 
+# Worker lanes, each runs its tasks on its own threads, so long running maintenance jobs don't hold up mails,
+# uploads and conversions queued behind them. Tasks pick their lane with CalibreTask.lane.
+LANE_INTERACTIVE = 'interactive'
+LANE_IO = 'io'
+LANE_CPU = 'cpu'
+# Tasks running at the same time per lane, overridden by e.g. CWA_WORKER_LANES="interactive=3,io=2".
+# One interactive task at a time keeps mails, uploads and conversions in the order they were queued.
+# Tasks with CalibreTask.exclusive set wait for all running tasks of all lanes and run alone.
+DEFAULT_LANES = {LANE_INTERACTIVE: 1, LANE_IO: 1, LANE_CPU: 1}
+
+# Task priorities, lower ones are started first within a lane, equal ones in the order they were added
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
 QueuedTask = namedtuple('QueuedTask', 'num, user, added, task, hidden')
 
 
@@ -42,14 +57,35 @@ def _get_main_thread():
     raise Exception("main thread not found?!")
 
 
-class ImprovedQueue(queue.Queue):
+def get_lane_concurrency():
+    lanes = dict(DEFAULT_LANES)
+    for setting in os.environ.get('CWA_WORKER_LANES', '').split(','):
+        name, __, value = setting.partition('=')
+        name = name.strip()
+        if name not in lanes:
+            continue
+        try:
+            lanes[name] = max(1, int(value))
+        except ValueError:
+            log.warning("Invalid worker lane setting: %s", setting)
+    return lanes
+
+
+class TaskQueue(queue.PriorityQueue):
+    """Queue of QueuedTask items ordered by task priority, then by the order they were added"""
+
+    def put_task(self, item, priority):
+        self.put((priority, item.num, item))
+
+    def get_task(self, timeout=None):
+        return self.get(timeout=timeout)[2]
+
     def to_list(self):
         """
         Returns a copy of all items in the queue without removing them.
         """
-
         with self.mutex:
-            return list(self.queue)
+            return [entry[2] for entry in self.queue]
 
 
 # Class for all worker tasks in the background
@@ -62,34 +98,45 @@ class WorkerThread(threading.Thread):
             cls._instance = WorkerThread()
         return cls._instance
 
-    def __init__(self):
+    def __init__(self, lanes=None):
         threading.Thread.__init__(self)
 
         self.dequeued = list()
 
         self.doLock = threading.Lock()
-        self.queue = ImprovedQueue()
+        self.concurrency = dict(lanes or get_lane_concurrency())
+        self.lanes = {name: TaskQueue() for name in self.concurrency}
+        # Running tasks and exclusive ones running or waiting to run, guarded by the condition
+        self._gate = threading.Condition()
+        self._running = 0
+        self._exclusive_running = False
+        self._exclusive_waiting = 0
         self.num = 0
         self.start()
 
     @classmethod
     def add(cls, user, task, hidden=False):
-        ins = cls.get_instance()
-        ins.num += 1
+        cls.get_instance().enqueue(user, task, hidden)
+
+    def enqueue(self, user, task, hidden=False):
+        with self.doLock:
+            self.num += 1
+            num = self.num
         username = user if user is not None else 'System'
         log.debug("Add Task for user: {} - {}".format(username, task))
-        ins.queue.put(QueuedTask(
-            num=ins.num,
+        lane = self.lanes.get(task.lane) or self.lanes[LANE_INTERACTIVE]
+        lane.put_task(QueuedTask(
+            num=num,
             user=username,
             added=datetime.now(),
             task=task,
             hidden=hidden
-        ))
+        ), task.priority)
 
     @property
     def tasks(self):
         with self.doLock:
-            tasks = self.queue.to_list() + self.dequeued
+            tasks = [item for lane in self.lanes.values() for item in lane.to_list()] + self.dequeued
             return sorted(tasks, key=lambda x: x.num)
 
     def cleanup_tasks(self):
@@ -109,8 +156,19 @@ class WorkerThread(threading.Thread):
 
             self.dequeued = sorted(ret, key=lambda y: y.num)
 
-    # Main thread loop starting the different tasks
+    # Starts the runners of all lanes and waits for them
     def run(self):
+        runners = list()
+        for name, lane in self.lanes.items():
+            for index in range(self.concurrency[name]):
+                runner = threading.Thread(target=self.run_lane, args=(lane,), name="worker-{}-{}".format(name, index))
+                runner.start()
+                runners.append(runner)
+        for runner in runners:
+            runner.join()
+
+    # Runner loop starting the tasks of one lane
+    def run_lane(self, lane):
         main_thread = _get_main_thread()
         while main_thread.is_alive():
             try:
@@ -119,9 +177,8 @@ class WorkerThread(threading.Thread):
                 # the main thread is still alive.
                 # We don't use a daemon here because we don't want the tasks to just be abruptly halted, leading to
                 # possible file / database corruption
-                item = self.queue.get(timeout=1)
+                item = lane.get_task(timeout=1)
             except queue.Empty:
-                time.sleep(1)
                 continue
 
             with self.doLock:
@@ -134,17 +191,45 @@ class WorkerThread(threading.Thread):
 
             # sometimes tasks (like Upload) don't actually have work to do and are created as already finished
             if item.task.stat is STAT_WAITING:
-                # CalibreTask.start() should wrap all exceptions in its own error handling
-                item.task.start(self)
+                exclusive = self._enter(item.task)
+                try:
+                    # CalibreTask.start() should wrap all exceptions in its own error handling
+                    item.task.start(self)
+                finally:
+                    self._leave(exclusive)
 
             # remove self_cleanup tasks and hidden "System Tasks" from list
             if item.task.self_cleanup or item.hidden:
-                self.dequeued.remove(item)
-
-            self.queue.task_done()
+                with self.doLock:
+                    if item in self.dequeued:
+                        self.dequeued.remove(item)
+
+            lane.task_done()
+
+    def _enter(self, task):
+        exclusive = bool(task.exclusive)
+        with self._gate:
+            if exclusive:
+                self._exclusive_waiting += 1
+                self._gate.wait_for(lambda: not self._running and not self._exclusive_running)
+                self._exclusive_waiting -= 1
+                self._exclusive_running = True
+            else:
+                # Waiting exclusive tasks go first, they would otherwise wait for a busy lane forever
+                self._gate.wait_for(lambda: not self._exclusive_running and not self._exclusive_waiting)
+                self._running += 1
+        return exclusive
+
+    def _leave(self, exclusive):
+        with self._gate:
+            if exclusive:
+                self._exclusive_running = False
+            else:
+                self._running -= 1
+            self._gate.notify_all()
 
     def end_task(self, task_id):
-        ins = self.get_instance()
+        ins = self
         for __, __, __, task, __ in ins.tasks:
             if str(task.id) == str(task_id) and task.is_cancellable:
                 task.stat = STAT_CANCELLED if task.stat == STAT_WAITING else STAT_ENDED
@@ -159,12 +244,12 @@ class WorkerThread(threading.Thread):
             int: Number of tasks cancelled
         """
         cancelled_count = 0
-        ins = self.get_instance()
+        ins = self
         
         try:
             with ins.doLock:
                 # Access queue and dequeued directly to avoid recursive lock from .tasks property
-                tasks_snapshot = list(ins.queue.to_list() + ins.dequeued)
+                tasks_snapshot = [item for lane in ins.lanes.values() for item in lane.to_list()] + ins.dequeued
         except Exception as e:
             log.warning("[worker] Could not get tasks snapshot: %s", str(e))
             return 0
@@ -222,6 +307,12 @@ class WorkerThread(threading.Thread):
 class CalibreTask:
     __metaclass__ = abc.ABCMeta
 
+    # Worker lane and priority within the lane, tasks override them as class attributes or properties
+    lane = LANE_INTERACTIVE
+    priority = PRIORITY_NORMAL
+    # Run alone, after the running tasks of all lanes finished and before any other task starts
+    exclusive = False
+
     def __init__(self, message):
         self._progress = 0
         self.stat = STAT_WAITING
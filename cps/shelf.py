@@ -18,6 +18,7 @@ from . import calibre_db, config, db, logger, ub
 from .render_template import render_title_template
 from .usermanagement import login_required_if_no_ano, user_login_required
 from .services import hardcover
+from .hardcover_outbox import hardcover_outbox
 log = logger.create()
 
 shelf = Blueprint('shelf', __name__)
@@ -103,18 +104,17 @@ def add_to_shelf(shelf_id, book_id):
         else:
             return redirect(url_for('web.index'))
     if shelf.kobo_sync and config.config_hardcover_sync and bool(hardcover):
-        try:
-            hardcoverClient = hardcover.HardcoverClient(current_user.hardcover_token)
+        if not current_user.hardcover_token:
+            log.info(f"User {current_user.name} has no Hardcover token, cannot add to Hardcover")
+        else:
             # Will add the book to Hardcover if it doesn't exist,
             # and leave it alone otherwise
             # (updating status is handled in update_reading_progress
             # and the book may be blacklisted from syncing)
-            if not hardcoverClient.get_user_book(book.identifiers):
-                hardcoverClient.add_book(book.identifiers)
-        except hardcover.MissingHardcoverToken:
-            log.info(f"User {current_user.name} has no Hardcover token, cannot add to Hardcover")
-        except Exception as e:
-            log.debug(f"Failed to create Hardcover client for {current_user.name}: {e}")
+            try:
+                hardcover_outbox.push_add_book(current_user.id, book.id, book.identifiers)
+            except Exception as e:
+                log.debug(f"Failed to queue adding book {book.id} to Hardcover for {current_user.name}: {e}")
 
     return "", 204
 
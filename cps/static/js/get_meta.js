@@ -232,9 +232,110 @@ $(function () {
     $("#identifier-table").append(line);
   }
 
+  var searchController = null;
+
+  function showResults(books, offset) {
+    if (!$("#book-list").length) {
+      $("#meta-info").html('<ul id="book-list" class="media-list"></ul>');
+    }
+    books.forEach(function (book, i) {
+      var idx = offset + i;
+      var $book = $(templates.bookResult({ book: book, index: idx }));
+      $book.find("button").on("click", function () {
+        populateForm(book, idx);
+      });
+      applyMetaSelections($book);
+      $("#book-list").append($book);
+    });
+  }
+
+  function showNoResult() {
+    $("#meta-info").html(
+      '<p class="text-danger">' +
+        msg.no_result +
+        "!</p>" +
+        $("#meta-info")[0].innerHTML
+    );
+  }
+
+  function showSearchError() {
+    $("#meta-info").html(
+      '<p class="text-danger">' +
+        msg.search_error +
+        "!</p>" +
+        $("#meta-info")[0].innerHTML
+    );
+  }
+
+  // Results are shown provider by provider as the server streams them (one JSON object per line)
+  function doStreamedSearch(keyword) {
+    if (searchController) {
+      searchController.abort();
+    }
+    var controller = new AbortController();
+    searchController = controller;
+    var count = 0;
+    var buffer = "";
+    var decoder = new TextDecoder();
+    var body = new URLSearchParams({ query: keyword, stream: "1" });
+
+    function handleLine(line) {
+      if (!line.trim()) {
+        return;
+      }
+      var chunk = JSON.parse(line);
+      if (chunk.results.length) {
+        showResults(chunk.results, count);
+        count += chunk.results.length;
+      }
+    }
+
+    fetch(getPath() + "/metadata/search", {
+      method: "POST",
+      headers: { "X-CSRFToken": $("input[name='csrf_token']").val() },
+      body: body,
+      credentials: "same-origin",
+      signal: controller.signal,
+    })
+      .then(function (response) {
+        if (!response.ok) {
+          throw new Error(response.statusText);
+        }
+        var reader = response.body.getReader();
+        function read() {
+          return reader.read().then(function (result) {
+            buffer += decoder.decode(result.value || new Uint8Array(), { stream: !result.done });
+            var lines = buffer.split("\n");
+            buffer = lines.pop();
+            lines.forEach(handleLine);
+            if (result.done) {
+              handleLine(buffer);
+              return;
+            }
+            return read();
+          });
+        }
+        return read();
+      })
+      .then(function () {
+        if (searchController === controller && !count) {
+          showNoResult();
+        }
+      })
+      .catch(function (err) {
+        if (err.name !== "AbortError") {
+          showSearchError();
+        }
+      });
+  }
+
   function doSearch(keyword) {
     if (keyword) {
       $("#meta-info").text(msg.loading);
+      if (window.fetch && window.AbortController && window.ReadableStream && window.TextDecoder) {
+        doStreamedSearch(keyword);
+        return;
+      }
       $.ajax({
         url: getPath() + "/metadata/search",
         type: "POST",
@@ -242,32 +343,12 @@ $(function () {
         dataType: "json",
         success: function success(data) {
           if (data.length) {
-            $("#meta-info").html('<ul id="book-list" class="media-list"></ul>');
-            data.forEach(function (book, idx) {
-              var $book = $(templates.bookResult({ book: book, index: idx }));
-              $book.find("button").on("click", function () {
-                populateForm(book, idx);
-              });
-              applyMetaSelections($book);
-              $("#book-list").append($book);
-            });
+            showResults(data, 0);
           } else {
-            $("#meta-info").html(
-              '<p class="text-danger">' +
-                msg.no_result +
-                "!</p>" +
-                $("#meta-info")[0].innerHTML
-            );
+            showNoResult();
           }
         },
-        error: function error() {
-          $("#meta-info").html(
-            '<p class="text-danger">' +
-              msg.search_error +
-              "!</p>" +
-              $("#meta-info")[0].innerHTML
-          );
-        },
+        error: showSearchError,
       });
     }
   }
@@ -6,15 +6,16 @@
 # See CONTRIBUTORS for full list of authors.
 
 import json
+import os
 import time
 from datetime import datetime
 from os import getenv
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from cps import config, db, logger, ub
-from cps.services.worker import CalibreTask, STAT_FAIL, STAT_FINISH_SUCCESS, STAT_CANCELLED, STAT_ENDED
+from cps.services.worker import (CalibreTask, STAT_FAIL, STAT_FINISH_SUCCESS, STAT_CANCELLED, STAT_ENDED, LANE_IO,
+                                 PRIORITY_LOW)
 from flask_babel import lazy_gettext as N_
-from sqlalchemy import not_
 
 # Import the Hardcover provider
 try:
@@ -22,26 +23,69 @@ try:
 except ImportError:
     Hardcover = None
 
+log = logger.create()
+
+# Books looked up per Hardcover request, each book sends a title and, if it has one, an ISBN search
+HARDCOVER_LOOKUP_BATCH_SIZE = 10
+HARDCOVER_LOOKUP_PER_PAGE = 10
+# Last book id handled by an unfinished run, the next run continues after it
+HARDCOVER_AUTO_ID_CURSOR_FILE = "/config/cwa_hardcover_auto_id_cursor.json"
+HARDCOVER_IDENTIFIER_TYPES = ['hardcover-id', 'hardcover-slug', 'hardcover-edition']
+
+
+def _load_cursor() -> int:
+    try:
+        with open(HARDCOVER_AUTO_ID_CURSOR_FILE) as cursor_file:
+            return int(json.load(cursor_file).get('last_book_id', 0))
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, TypeError, AttributeError) as ex:
+        log.warning(f"Ignoring unreadable Hardcover auto-fetch cursor: {ex}")
+        return 0
+
+
+def _save_cursor(last_book_id: int):
+    temp_path = HARDCOVER_AUTO_ID_CURSOR_FILE + ".tmp"
+    try:
+        with open(temp_path, 'w') as cursor_file:
+            json.dump({'last_book_id': last_book_id, 'updated': datetime.utcnow().isoformat()}, cursor_file)
+        os.replace(temp_path, HARDCOVER_AUTO_ID_CURSOR_FILE)
+    except OSError as ex:
+        log.warning(f"Could not write Hardcover auto-fetch cursor: {ex}")
+
+
+def _clear_cursor():
+    try:
+        os.remove(HARDCOVER_AUTO_ID_CURSOR_FILE)
+    except FileNotFoundError:
+        pass
+    except OSError as ex:
+        log.warning(f"Could not remove Hardcover auto-fetch cursor: {ex}")
+
 
 class TaskAutoHardcoverID(CalibreTask):
     """
     Background task to automatically fetch Hardcover IDs for books in the library.
     
     This task:
-    1. Queries all books without hardcover-id, hardcover-slug, or hardcover-edition identifiers
-    2. Processes books in configurable batches with rate limiting
-    3. Searches Hardcover API for each book using title + authors
-    4. Calculates confidence scores for matches
+    1. Pages by id through all books without hardcover-id, hardcover-slug, or hardcover-edition identifiers
+    2. Packs the title + authors and ISBN searches of several books into one GraphQL request
+    3. Waits rate_limit_delay between requests
+    4. Scores the results of all books of a request and commits matches and review entries once
     5. Auto-applies high-confidence matches (>=threshold, default 0.85)
     6. Queues low-confidence matches for manual review
-    7. Implements exponential backoff on API errors
+    7. Implements exponential backoff on API errors, retrying the failed request
+    8. Remembers the last handled book, so a cancelled or failed run resumes there
     """
+    lane = LANE_IO
+    priority = PRIORITY_LOW
 
     def __init__(self, 
                  min_confidence: float = 0.85,
                  batch_size: int = 50,
                  rate_limit_delay: float = 5.0,
                  max_backoff_errors: int = 5,
+                 lookup_batch_size: int = HARDCOVER_LOOKUP_BATCH_SIZE,
                  task_message=N_('Auto-fetching Hardcover IDs')):
         super(TaskAutoHardcoverID, self).__init__(task_message)
         self.log = logger.create()
@@ -50,6 +94,7 @@ class TaskAutoHardcoverID(CalibreTask):
         self.batch_size = batch_size
         self.rate_limit_delay = rate_limit_delay
         self.max_backoff_errors = max_backoff_errors
+        self.lookup_batch_size = max(1, lookup_batch_size)
         
         # Stats tracking
         self.books_processed = 0
@@ -58,10 +103,12 @@ class TaskAutoHardcoverID(CalibreTask):
         self.skipped_no_results = 0
         self.errors = 0
         self.total_confidence = 0.0
+        self.requests_sent = 0
         
         # Error tracking for exponential backoff
         self.consecutive_errors = 0
         self.current_delay = rate_limit_delay
+        self.last_request = None
 
     def _cancel_requested(self) -> bool:
         return self.stat in (STAT_CANCELLED, STAT_ENDED)
@@ -92,77 +139,52 @@ class TaskAutoHardcoverID(CalibreTask):
             return
         
         try:
-            # Query books without hardcover identifiers
-            books = self._get_books_without_hardcover_id()
-            total_books = len(books)
+            cursor = _load_cursor()
+            total_books = self._books_without_hardcover_id(cursor).count()
             
             if total_books == 0:
                 self.log.info("No books found without Hardcover IDs")
+                _clear_cursor()
                 self._handleSuccess()
                 return
             
-            self.log.info(f"Found {total_books} books without Hardcover IDs. Processing in batches of {self.batch_size}...")
+            if cursor:
+                self.log.info(f"Resuming Hardcover auto-fetch after book {cursor}")
+            self.log.info(f"Found {total_books} books without Hardcover IDs. "
+                          f"Looking up {self.lookup_batch_size} books per request...")
             
-            # Process books in batches
-            batch_count = (total_books + self.batch_size - 1) // self.batch_size
-            for batch_num in range(batch_count):
-                # Check if task was cancelled
-                if self._cancel_requested():
-                    self.log.info("Task cancelled by user")
-                    return
-                
-                start_idx = batch_num * self.batch_size
-                end_idx = min(start_idx + self.batch_size, total_books)
-                batch = books[start_idx:end_idx]
-                
-                self.log.info(f"Processing batch {batch_num + 1}/{batch_count} ({len(batch)} books)")
+            provider = Hardcover()
+            while True:
+                books = self._books_without_hardcover_id(cursor).order_by(db.Books.id).limit(self.batch_size).all()
+                if not books:
+                    break
                 
-                for book in batch:
-                    # Check if cancelled
-                    if self._cancel_requested():
-                        self.log.info("Task cancelled by user")
-                        return
-                    
-                    # Check if we've hit too many consecutive errors
-                    if self.consecutive_errors >= self.max_backoff_errors:
-                        error_msg = f"Exceeded maximum consecutive errors ({self.max_backoff_errors}). Stopping to protect API key."
-                        self.log.error(error_msg)
-                        self._save_stats()
-                        self._handleError(error_msg)
+                for start in range(0, len(books), self.lookup_batch_size):
+                    chunk = books[start:start + self.lookup_batch_size]
+                    facts = [self._book_facts(book) for book in chunk]
+                    results = self._search_with_backoff(provider, token, self._build_searches(facts))
+                    if results is None:
                         return
                     
                     try:
-                        self._process_book(book)
-                        self.books_processed += 1
-                        
-                        # Reset consecutive errors on success
-                        self.consecutive_errors = 0
-                        self.current_delay = self.rate_limit_delay
-                        
-                        # Update progress
-                        self.progress = self.books_processed / total_books
-                        
-                        # Rate limiting: wait between requests
-                        if self.books_processed < total_books:
-                            if not self._sleep_with_cancel_check(self.current_delay):
-                                return
-                            
+                        self._process_results(chunk, facts, results)
                     except Exception as e:
-                        self.log.error(f"Error processing book {book.id} '{book.title}': {e}")
+                        self.log.error(f"Error processing {len(chunk)} books starting at book {chunk[0].id}: {e}")
                         self.errors += 1
-                        self.consecutive_errors += 1
-                        
-                        # Exponential backoff
-                        self.current_delay = min(self.current_delay * 2, 60.0)
-                        self.log.warning(f"Consecutive errors: {self.consecutive_errors}. Increasing delay to {self.current_delay}s")
-                        if not self._sleep_with_cancel_check(self.current_delay):
-                            return
+                    self.books_processed += len(chunk)
+                    
+                    cursor = chunk[-1].id
+                    _save_cursor(cursor)
+                    self.progress = min(self.books_processed / total_books, 1.0)
+            
+            _clear_cursor()
             
             # Save final stats
             self._save_stats()
             
             # Log summary
-            self.log.info(f"Hardcover auto-fetch completed: {self.books_processed} processed, "
+            self.log.info(f"Hardcover auto-fetch completed: {self.books_processed} processed in "
+                         f"{self.requests_sent} requests, "
                          f"{self.auto_matched} auto-matched, {self.queued_for_review} queued for review, "
                          f"{self.skipped_no_results} skipped (no results), {self.errors} errors")
             
@@ -182,186 +204,215 @@ class TaskAutoHardcoverID(CalibreTask):
         )
         return token
 
-    def _get_books_without_hardcover_id(self) -> List[db.Books]:
+    def _books_without_hardcover_id(self, after_id: int = 0):
         """
-        Query all books that don't have any Hardcover identifiers.
+        Query the books after after_id that don't have any Hardcover identifiers.
         Excludes books with hardcover-id, hardcover-slug, or hardcover-edition.
         """
-        books = self.calibre_db.session.query(db.Books).filter(
-            ~db.Books.identifiers.any(
-                db.Identifiers.type.in_(['hardcover-id', 'hardcover-slug', 'hardcover-edition'])
-            )
-        ).limit(10000).all()  # Safety limit
-        
-        return books
+        return self.calibre_db.session.query(db.Books).filter(
+            db.Books.id > after_id,
+            ~db.Books.identifiers.any(db.Identifiers.type.in_(HARDCOVER_IDENTIFIER_TYPES))
+        )
 
-    def _process_book(self, book: db.Books):
+    @staticmethod
+    def _build_searches(facts: List[Dict]) -> Dict[str, str]:
+        """The searches of a lookup batch, keyed by kind and the book's position in the batch"""
+        searches = {}
+        for index, book_facts in enumerate(facts):
+            if book_facts['isbn']:
+                searches[f"isbn{index}"] = book_facts['isbn']
+            searches[f"title{index}"] = book_facts['query']
+        return searches
+
+    def _search_with_backoff(self, provider, token: str, searches: Dict[str, str]) -> Optional[Dict]:
         """
-        Process a single book: search Hardcover API, calculate confidence, apply or queue.
+        Send the searches as one request, retrying it with exponential backoff on errors.
+        Returns None if the run has to stop.
         """
-        # Build search query from book metadata
-        authors = [author.name for author in book.authors] if book.authors else []
-        author_str = ", ".join(authors[:3]) if authors else ""  # Limit to first 3 authors
-        
-        # Build search query
-        if author_str:
-            search_query = f"{book.title} {author_str}"
-        else:
-            search_query = book.title
-        
-        self.log.debug(f"Searching Hardcover for: {search_query}")
-        
-        # Initialize Hardcover provider
-        provider = Hardcover()
-        
-        # Search Hardcover API
-        results = provider.search(search_query)
-        
-        if not results:
-            self.log.debug(f"No Hardcover results for book {book.id} '{book.title}'")
-            self.skipped_no_results += 1
-            return
-        
-        self.log.debug(f"Found {len(results)} Hardcover results for book {book.id}")
-        
-        # Calculate confidence scores for each result
-        scored_results = []
-        for result in results[:10]:  # Limit to top 10 results
-            # Get book's ISBN for matching
-            book_isbn = None
-            for identifier in book.identifiers:
-                if identifier.type.lower() == 'isbn':
-                    book_isbn = identifier.val
-                    break
+        while True:
+            if self._cancel_requested():
+                self.log.info("Task cancelled by user")
+                return None
+            
+            # Check if we've hit too many consecutive errors
+            if self.consecutive_errors >= self.max_backoff_errors:
+                error_msg = f"Exceeded maximum consecutive errors ({self.max_backoff_errors}). Stopping to protect API key."
+                self.log.error(error_msg)
+                self._save_stats()
+                self._handleError(error_msg)
+                return None
             
-            # Get book's series info
-            book_series = book.series[0].name if book.series else None
-            book_series_index = book.series_index if book.series else None
+            # Rate limiting: keep current_delay between the starts of two requests
+            if self.last_request is not None:
+                wait = self.current_delay - (time.monotonic() - self.last_request)
+                if wait > 0 and not self._sleep_with_cancel_check(wait):
+                    return None
+            self.last_request = time.monotonic()
+            
+            try:
+                self.log.debug(f"Searching Hardcover with {len(searches)} searches")
+                self.requests_sent += 1
+                results = provider.search_batch(searches, token, per_page=HARDCOVER_LOOKUP_PER_PAGE)
+            except Exception as e:
+                self.log.error(f"Error searching Hardcover: {e}")
+                self.errors += 1
+                self.consecutive_errors += 1
+                
+                # Exponential backoff
+                self.current_delay = min(self.current_delay * 2, 60.0)
+                self.log.warning(f"Consecutive errors: {self.consecutive_errors}. Increasing delay to {self.current_delay}s")
+                continue
             
-            # Get publisher
-            book_publisher = book.publishers[0].name if book.publishers else None
+            # Reset consecutive errors on success
+            self.consecutive_errors = 0
+            self.current_delay = self.rate_limit_delay
+            return results
+
+    def _process_results(self, books: List[db.Books], facts: List[Dict], results: Dict):
+        """
+        Score the results of all books of a lookup batch, then apply and queue them with one commit each.
+        """
+        matches = []
+        reviews = []
+        skipped = 0
+        confidence = 0.0
+        for index, (book, book_facts) in enumerate(zip(books, facts)):
+            # ISBN hits first, they carry the confirmed isbn for the scoring
+            candidates = {}
+            for result in results.get(f"isbn{index}", []) + results.get(f"title{index}", []):
+                candidates.setdefault(str(result.id), result)
             
-            # Get publication year
-            book_year = str(book.pubdate)[:4] if book.pubdate else None
+            scored_results = self._score_results(list(candidates.values())[:10], book_facts)
+            if not scored_results:
+                self.log.debug(f"No Hardcover results for book {book.id} '{book.title}'")
+                skipped += 1
+                continue
             
-            # Calculate confidence score
+            best_match = scored_results[0]
+            self.log.debug(f"Best match for book {book.id}: score={best_match['score']:.3f}, reason={best_match['reason']}")
+            confidence += best_match['score']
+            if best_match['score'] >= self.min_confidence:
+                matches.append((book, best_match))
+            else:
+                reviews.append((book, book_facts['query'], scored_results))
+        self.skipped_no_results += skipped
+        self.total_confidence += confidence
+        
+        self._apply_hardcover_ids(matches)
+        self.auto_matched += len(matches)
+        self._queue_for_review(reviews)
+        self.queued_for_review += len(reviews)
+
+    @staticmethod
+    def _book_facts(book: db.Books) -> Dict:
+        """Collect the search query and the metadata the confidence score compares"""
+        authors = [author.name for author in book.authors] if book.authors else []
+        author_str = ", ".join(authors[:3]) if authors else ""  # Limit to first 3 authors
+        isbn = next((identifier.val for identifier in book.identifiers if identifier.type.lower() == 'isbn'), None)
+        return {
+            'query': f"{book.title} {author_str}" if author_str else book.title,
+            'title': book.title,
+            'authors': authors,
+            'isbn': isbn.replace('-', '').replace(' ', '') if isbn else None,
+            'series': book.series[0].name if book.series else None,
+            'series_index': book.series_index if book.series else None,
+            'publisher': book.publishers[0].name if book.publishers else None,
+            'year': str(book.pubdate)[:4] if book.pubdate else None,
+        }
+
+    @staticmethod
+    def _score_results(results: List, book_facts: Dict) -> List[dict]:
+        """Score all results of one book, highest confidence first"""
+        scored_results = []
+        for result in results:
             score, reason = Hardcover.calculate_confidence_score(
                 result=result,
-                query_title=book.title,
-                query_authors=authors,
-                query_isbn=book_isbn,
-                query_series=book_series,
-                query_series_index=book_series_index,
-                query_publisher=book_publisher,
-                query_year=book_year
+                query_title=book_facts['title'],
+                query_authors=book_facts['authors'],
+                query_isbn=book_facts['isbn'],
+                query_series=book_facts['series'],
+                query_series_index=book_facts['series_index'],
+                query_publisher=book_facts['publisher'],
+                query_year=book_facts['year']
             )
-            
             scored_results.append({
                 'result': result,
                 'score': score,
                 'reason': reason
             })
-        
-        # Sort by confidence score (highest first)
         scored_results.sort(key=lambda x: x['score'], reverse=True)
-        
-        if not scored_results:
-            self.skipped_no_results += 1
-            return
-        
-        # Get best match
-        best_match = scored_results[0]
-        best_score = best_match['score']
-        best_result = best_match['result']
-        
-        self.log.debug(f"Best match for book {book.id}: score={best_score:.3f}, reason={best_match['reason']}")
-        
-        # Track average confidence
-        self.total_confidence += best_score
-        
-        # Auto-apply if confidence is high enough
-        if best_score >= self.min_confidence:
-            self._apply_hardcover_id(book, best_result)
-            self.auto_matched += 1
-            self.log.info(f"Auto-matched book {book.id} '{book.title}' to Hardcover ID {best_result.id} (confidence: {best_score:.3f})")
-        else:
-            # Queue for manual review
-            self._queue_for_review(book, search_query, scored_results)
-            self.queued_for_review += 1
-            self.log.debug(f"Queued book {book.id} '{book.title}' for manual review (confidence: {best_score:.3f})")
+        return scored_results
 
-    def _apply_hardcover_id(self, book: db.Books, result):
-        """Apply Hardcover identifiers to a book"""
+    def _apply_hardcover_ids(self, matches: List[tuple]):
+        """Apply the Hardcover identifiers of all matches with one commit"""
+        if not matches:
+            return
         try:
-            # Add hardcover-id
-            if 'hardcover-id' in result.identifiers:
-                hardcover_id = str(result.identifiers['hardcover-id'])
-                new_identifier = db.Identifiers(hardcover_id, 'hardcover-id', book.id)
-                self.calibre_db.session.add(new_identifier)
-            
-            # Add hardcover-slug
-            if 'hardcover-slug' in result.identifiers:
-                hardcover_slug = str(result.identifiers['hardcover-slug'])
-                new_identifier = db.Identifiers(hardcover_slug, 'hardcover-slug', book.id)
-                self.calibre_db.session.add(new_identifier)
-            
-            # Add hardcover-edition (if available)
-            if 'hardcover-edition' in result.identifiers:
-                hardcover_edition = str(result.identifiers['hardcover-edition'])
-                new_identifier = db.Identifiers(hardcover_edition, 'hardcover-edition', book.id)
-                self.calibre_db.session.add(new_identifier)
+            for book, best_match in matches:
+                result = best_match['result']
+                for identifier_type in HARDCOVER_IDENTIFIER_TYPES:
+                    if identifier_type in result.identifiers:
+                        self.calibre_db.session.add(
+                            db.Identifiers(str(result.identifiers[identifier_type]), identifier_type, book.id))
             
             self.calibre_db.session.commit()
             
         except Exception as e:
-            self.log.error(f"Error applying Hardcover ID to book {book.id}: {e}")
+            self.log.error(f"Error applying Hardcover IDs to books {[book.id for book, __ in matches]}: {e}")
             self.calibre_db.session.rollback()
             raise
+        
+        for book, best_match in matches:
+            self.log.info(f"Auto-matched book {book.id} '{book.title}' to Hardcover ID {best_match['result'].id} "
+                          f"(confidence: {best_match['score']:.3f})")
 
-    def _queue_for_review(self, book: db.Books, search_query: str, scored_results: List[dict]):
-        """Queue ambiguous match for manual review"""
+    def _queue_for_review(self, reviews: List[tuple]):
+        """Queue ambiguous matches for manual review with one commit"""
+        if not reviews:
+            return
         try:
             # Initialize user session for ub database
             ub.init_db_thread()
             
-            # Prepare results for JSON storage (top 5 candidates)
-            results_json = []
-            scores_json = []
-            
-            for item in scored_results[:5]:
-                result = item['result']
-                results_json.append({
-                    'id': str(result.id),
-                    'title': result.title,
-                    'authors': result.authors,
-                    'url': result.url,
-                    'cover': result.cover,
-                    'description': result.description or "",
-                    'series': result.series or "",
-                    'series_index': str(result.series_index) if result.series_index else "",
-                    'publisher': result.publisher or "",
-                    'publishedDate': result.publishedDate or "",
-                    'identifiers': {k: str(v) for k, v in result.identifiers.items()}
-                })
-                scores_json.append([item['score'], item['reason']])
-            
-            # Create queue entry
-            queue_entry = ub.HardcoverMatchQueue(
-                book_id=book.id,
-                book_title=book.title,
-                book_authors=", ".join([author.name for author in book.authors]) if book.authors else "",
-                search_query=search_query,
-                hardcover_results=json.dumps(results_json),
-                confidence_scores=json.dumps(scores_json),
-                created_at=datetime.utcnow().isoformat(),
-                reviewed=0
-            )
+            for book, search_query, scored_results in reviews:
+                # Prepare results for JSON storage (top 5 candidates)
+                results_json = []
+                scores_json = []
+                
+                for item in scored_results[:5]:
+                    result = item['result']
+                    results_json.append({
+                        'id': str(result.id),
+                        'title': result.title,
+                        'authors': result.authors,
+                        'url': result.url,
+                        'cover': result.cover,
+                        'description': result.description or "",
+                        'series': result.series or "",
+                        'series_index': str(result.series_index) if result.series_index else "",
+                        'publisher': result.publisher or "",
+                        'publishedDate': result.publishedDate or "",
+                        'identifiers': {k: str(v) for k, v in result.identifiers.items()}
+                    })
+                    scores_json.append([item['score'], item['reason']])
+                
+                ub.session.add(ub.HardcoverMatchQueue(
+                    book_id=book.id,
+                    book_title=book.title,
+                    book_authors=", ".join([author.name for author in book.authors]) if book.authors else "",
+                    search_query=search_query,
+                    hardcover_results=json.dumps(results_json),
+                    confidence_scores=json.dumps(scores_json),
+                    created_at=datetime.utcnow().isoformat(),
+                    reviewed=0
+                ))
+                self.log.debug(f"Queued book {book.id} '{book.title}' for manual review "
+                               f"(confidence: {scored_results[0]['score']:.3f})")
             
-            ub.session.add(queue_entry)
             ub.session.commit()
             
         except Exception as e:
-            self.log.error(f"Error queuing book {book.id} for review: {e}")
+            self.log.error(f"Error queuing books {[book.id for book, __, __ in reviews]} for review: {e}")
             ub.session.rollback()
             raise
 
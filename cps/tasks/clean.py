@@ -11,10 +11,13 @@ from flask_babel import lazy_gettext as N_
 from sqlalchemy.sql.expression import or_
 
 from cps import logger, file_helper, ub
-from cps.services.worker import CalibreTask
+from cps.services.worker import CalibreTask, LANE_IO, PRIORITY_LOW
 
 
 class TaskClean(CalibreTask):
+    lane = LANE_IO
+    priority = PRIORITY_LOW
+
     def __init__(self, task_message=N_('Delete temp folder contents')):
         super(TaskClean, self).__init__(task_message)
         self.log = logger.create()
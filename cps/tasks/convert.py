@@ -16,7 +16,7 @@ from uuid import uuid4
 from sqlalchemy.exc import SQLAlchemyError
 from flask_babel import lazy_gettext as N_
 
-from cps.services.worker import CalibreTask
+from cps.services.worker import CalibreTask, PRIORITY_NORMAL
 from cps import db
 from cps import logger, config
 from cps.subproc_wrapper import process_open
@@ -36,8 +36,10 @@ current_milli_time = lambda: int(round(time() * 1000))
 
 
 class TaskConvert(CalibreTask):
-    def __init__(self, file_path, book_id, task_message, settings, ereader_mail, user=None):
+    def __init__(self, file_path, book_id, task_message, settings, ereader_mail, user=None,
+                 priority=PRIORITY_NORMAL):
         super(TaskConvert, self).__init__(task_message)
+        self.priority = priority
         self.worker_thread = None
         self.file_path = file_path
         self.book_id = book_id
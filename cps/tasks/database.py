@@ -8,10 +8,15 @@
 from flask_babel import lazy_gettext as N_
 
 from cps import config, logger, db, ub, calibre_db
-from cps.services.worker import CalibreTask
+from cps.services.worker import CalibreTask, LANE_INTERACTIVE, LANE_IO, PRIORITY_HIGH, PRIORITY_LOW
 
 
 class TaskReconnectDatabase(CalibreTask):
+    lane = LANE_INTERACTIVE
+    priority = PRIORITY_HIGH
+    # Swaps the engine below the tasks of the other lanes, so none of them may run meanwhile
+    exclusive = True
+
     def __init__(self, task_message=N_('Reconnecting Calibre database')):
         super(TaskReconnectDatabase, self).__init__(task_message)
         self.log = logger.create()
@@ -32,6 +37,9 @@ class TaskReconnectDatabase(CalibreTask):
 
 
 class TaskCleanArchivedBooks(CalibreTask):
+    lane = LANE_IO
+    priority = PRIORITY_LOW
+
     def __init__(self, task_message=N_('Clean archived book references')):
         super(TaskCleanArchivedBooks, self).__init__(task_message)
         self.log = logger.create()
@@ -101,3 +109,41 @@ class TaskCleanArchivedBooks(CalibreTask):
             self._handleError('Failed to clean archived_book rows: ' + str(ex))
         finally:
             self.app_db_session.remove()
+
+
+class TaskRollupActivity(CalibreTask):
+    lane = LANE_IO
+    priority = PRIORITY_LOW
+
+    def __init__(self, task_message=N_('Roll up user activity statistics')):
+        super(TaskRollupActivity, self).__init__(task_message)
+        self.log = logger.create()
+
+    @property
+    def name(self):
+        return "Roll Up User Activity"
+
+    @property
+    def is_cancellable(self):
+        return False
+
+    def run(self, worker_thread):
+        try:
+            import sys
+            if '/app/calibre-web-automated/scripts/' not in sys.path:
+                sys.path.insert(1, '/app/calibre-web-automated/scripts/')
+            from cwa_db import CWA_DB
+
+            cwa_db = CWA_DB()
+            rolled_up = cwa_db.rollup_activity()
+            self.progress = 0.5
+            compacted = cwa_db.compact_activity()
+            if rolled_up or compacted:
+                self.log.info("Rolled up %s activity events, removed %s compacted raw events", rolled_up, compacted)
+            if compacted:
+                from cps.cwa_stats_service import stats_service
+                stats_service.invalidate()
+            self._handleSuccess()
+        except Exception as ex:
+            self.log.error("Failed to roll up user activity: %s", str(ex))
+            self._handleError('Failed to roll up user activity: ' + str(ex))
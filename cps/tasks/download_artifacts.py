@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+import os
+
+from flask_babel import lazy_gettext as N_
+
+from cps import config, db, logger
+from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED, LANE_IO
+
+
+class TaskRefreshDownloadArtifacts(CalibreTask):
+    """Rebuilds the cached downloads of a book after its metadata was edited.
+
+    The next download is served from the cache instead of waiting for calibredb export.
+    """
+    lane = LANE_IO
+
+    def __init__(self, book_id, formats, task_message=N_('Refreshing cached downloads')):
+        super(TaskRefreshDownloadArtifacts, self).__init__(task_message)
+        self.log = logger.create()
+        self.book_id = book_id
+        self.formats = [book_format.lower() for book_format in formats]
+        self.calibre_db = db.CalibreDB(expire_on_commit=False, init=True)
+
+    @property
+    def name(self):
+        return "Refresh Cached Downloads"
+
+    @property
+    def is_cancellable(self):
+        return True
+
+    def run(self, worker_thread):
+        from cps.helper import get_download_artifact
+        try:
+            book = self.calibre_db.session.query(db.Books).filter(db.Books.id == self.book_id).first()
+            if not book:
+                self._handleSuccess()
+                return
+            book_data = {data.format.lower(): data for data in book.data}
+            for index, book_format in enumerate(self.formats):
+                if self.stat in (STAT_CANCELLED, STAT_ENDED):
+                    return
+                data = book_data.get(book_format)
+                if data:
+                    source_file = os.path.join(config.get_book_path(), book.path,
+                                               data.name + "." + book_format)
+                    get_download_artifact(book, book_format, source_file, "calibredb")
+                self.progress = (index + 1) / len(self.formats)
+            self._handleSuccess()
+        except Exception as ex:
+            self.log.error("Failed to refresh cached downloads of book %s: %s", self.book_id, str(ex))
+            self._handleError('Failed to refresh cached downloads: ' + str(ex))
+        finally:
+            self.calibre_db.session.close()
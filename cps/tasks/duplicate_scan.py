@@ -20,7 +20,7 @@ from cps.duplicate_index import (
     merge_affected_groups_into_cache,
     rebuild_duplicate_index,
 )
-from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED
+from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED, LANE_IO, PRIORITY_LOW
 from cps.ub import init_db_thread
 
 # Access CWA DB (scripts path)
@@ -32,6 +32,9 @@ log = logger.create()
 
 
 class TaskDuplicateScan(CalibreTask):
+    lane = LANE_IO
+    priority = PRIORITY_LOW
+
     def __init__(self, full_scan=True, task_message=None, trigger_type='manual', user_id=None, book_ids=None):
         super(TaskDuplicateScan, self).__init__(task_message or N_('Duplicate scan'))
         self.full_scan = full_scan
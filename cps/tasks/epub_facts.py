@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+from flask_babel import lazy_gettext as N_
+
+from cps import db, logger, ub
+from cps.epub_facts import EPUB_FACT_FORMATS, get_epub_facts, load_epub_facts
+from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED, LANE_IO, PRIORITY_LOW
+
+
+class TaskBackfillEpubFacts(CalibreTask):
+    """Stores layout and size facts of EPUB/KEPUB files, so Kobo sync doesn't have to open them.
+
+    Only formats without stored facts, or whose file changed since, are parsed.
+    """
+    BATCH_SIZE = 200
+    lane = LANE_IO
+    priority = PRIORITY_LOW
+
+    def __init__(self, book_ids=None, task_message=N_('Indexing EPUB files for Kobo sync')):
+        super(TaskBackfillEpubFacts, self).__init__(task_message)
+        self.log = logger.create()
+        self.book_ids = list(book_ids) if book_ids else None
+        self.app_db_session = ub.get_new_session_instance()
+        self.calibre_db = db.CalibreDB(expire_on_commit=False, init=True)
+
+    @property
+    def name(self):
+        return "Index EPUB Files"
+
+    @property
+    def is_cancellable(self):
+        return True
+
+    def _book_ids(self):
+        query = (self.calibre_db.session.query(db.Data.book)
+                 .filter(db.Data.format.in_(EPUB_FACT_FORMATS))
+                 .distinct()
+                 .order_by(db.Data.book))
+        if self.book_ids:
+            query = query.filter(db.Data.book.in_(self.book_ids))
+        return [row[0] for row in query]
+
+    def run(self, worker_thread):
+        try:
+            book_ids = self._book_ids()
+            count = len(book_ids)
+            checked = 0
+            for start in range(0, count, self.BATCH_SIZE):
+                chunk = book_ids[start:start + self.BATCH_SIZE]
+                known = load_epub_facts(chunk, self.app_db_session)
+                rows = (self.calibre_db.session.query(db.Books, db.Data)
+                        .join(db.Data, db.Data.book == db.Books.id)
+                        .filter(db.Books.id.in_(chunk))
+                        .filter(db.Data.format.in_(EPUB_FACT_FORMATS))
+                        .all())
+                for book, book_data in rows:
+                    get_epub_facts(book, book_data, known=known, session=self.app_db_session)
+                    checked += 1
+
+                self.progress = min(1.0, (start + len(chunk)) / count)
+                self.message = N_('Checked %(count)s EPUB files', count=checked)
+                if self.stat in (STAT_CANCELLED, STAT_ENDED):
+                    self.log.info('EPUB facts backfill stopped after %s files', checked)
+                    return
+            self._handleSuccess()
+        except Exception as ex:
+            self.log.error("Failed to index EPUB files: %s", str(ex))
+            self.app_db_session.rollback()
+            self._handleError('Failed to index EPUB files: ' + str(ex))
+        finally:
+            self.calibre_db.session.close()
+            self.app_db_session.remove()
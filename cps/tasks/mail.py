@@ -18,7 +18,7 @@ from email.utils import formatdate, parseaddr, make_msgid
 from email.generator import Generator
 from flask_babel import lazy_gettext as N_
 
-from cps.services.worker import CalibreTask
+from cps.services.worker import CalibreTask, LANE_INTERACTIVE, PRIORITY_HIGH
 from cps.services import gmail
 from cps.embed_helper import do_calibre_export
 from cps import logger, config
@@ -99,6 +99,9 @@ class EmailSSL(EmailBase, smtplib.SMTP_SSL):
 
 
 class TaskEmail(CalibreTask):
+    lane = LANE_INTERACTIVE
+    priority = PRIORITY_HIGH
+
     def __init__(self, subject, filepath, attachment, settings, recipient, task_message, text, id=0, internal=False):
         super(TaskEmail, self).__init__(task_message)
         self.subject = subject
@@ -6,16 +6,17 @@
 # See CONTRIBUTORS for full list of authors.
 
 import os
+from concurrent.futures import FIRST_COMPLETED, wait
 from shutil import copyfile, copyfileobj
-from urllib.request import urlopen
-from io import BytesIO
 from datetime import datetime, timezone
 from dataclasses import dataclass
 
 from .. import constants
 from cps import config, db, fs, gdriveutils, logger, ub
-from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED
-from sqlalchemy import func, text, or_
+from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED, LANE_CPU, PRIORITY_HIGH, PRIORITY_LOW
+from cps.thumbnail_index import thumbnail_index
+from thumbnail_render import create_render_pool, get_resize_height, get_resize_width, render_cover_thumbnails
+from sqlalchemy import or_
 from flask_babel import lazy_gettext as N_
 try:
     from wand.image import Image
@@ -24,6 +25,9 @@ except (ImportError, RuntimeError) as e:
     use_IM = False
 
 
+COVER_RESOLUTIONS = (constants.COVER_THUMBNAIL_SMALL, constants.COVER_THUMBNAIL_MEDIUM, constants.COVER_THUMBNAIL_LARGE)
+
+
 @dataclass(frozen=True)
 class BookCoverSource:
     id: int
@@ -31,15 +35,12 @@ class BookCoverSource:
     last_modified: datetime
 
 
-def get_resize_height(resolution):
-    return int(255 * resolution)
-
-
-def get_resize_width(resolution, original_width, original_height):
-    height = get_resize_height(resolution)
-    percent = (height / float(original_height))
-    width = int((float(original_width) * float(percent)))
-    return width if width % 2 == 0 else width + 1
+@dataclass(frozen=True)
+class SeriesBookSource:
+    id: int
+    path: str
+    series_index: float
+    last_modified: datetime
 
 
 def get_best_fit(width, height, image_width, image_height):
@@ -61,12 +62,22 @@ def get_best_fit(width, height, image_width, image_height):
 
 
 class TaskGenerateCoverThumbnails(CalibreTask):
-    def __init__(self, book_id=-1, task_message='', book_path=None, last_modified=None):
+    """Generates missing and outdated cover thumbnails.
+
+    Covers are rendered by a process pool when several books are scanned, each cover is decoded once for
+    all resolutions and formats. Database rows and the thumbnail index are only written by this thread.
+    """
+    # Covers handed to the render pool ahead of the finished ones
+    MAX_PENDING_COVERS = 32
+    lane = LANE_CPU
+
+    def __init__(self, book_id=-1, task_message='', book_path=None, last_modified=None, replace=False):
         super(TaskGenerateCoverThumbnails, self).__init__(task_message)
         self.log = logger.create()
         self.book_id = book_id
         self.book_path = book_path
         self.last_modified = last_modified
+        self.replace = replace
         self.app_db_session = ub.get_new_session_instance()
         self.cache = fs.FileSystem()
         self.resolutions = [
@@ -74,26 +85,40 @@ class TaskGenerateCoverThumbnails(CalibreTask):
             constants.COVER_THUMBNAIL_MEDIUM,
             constants.COVER_THUMBNAIL_LARGE
         ]
+        self.total_generated = 0
+        self.finished_books = 0
+        self.book_count = 0
 
     def run(self, worker_thread):
+        pool = None
         try:
+            if self.replace and self.book_id > 0:
+                self.clear_book_cover_thumbnails()
             if use_IM and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
                 self.message = 'Scanning Books'
                 books_with_covers = self.get_cover_sources()
-                count = len(books_with_covers)
+                self.book_count = len(books_with_covers)
+                if self.book_count > 1 and constants.THUMBNAIL_WORKERS > 1:
+                    pool = create_render_pool(constants.THUMBNAIL_WORKERS)
 
-                total_generated = 0
-                for i, book in enumerate(books_with_covers):
+                pending = dict()
+                for book in books_with_covers:
 
                     # Generate new thumbnails for missing covers
-                    generated = self.create_book_cover_thumbnails(book)
-
-                    # Increment the progress
-                    self.progress = (1.0 / count) * i
-
-                    if generated > 0:
-                        total_generated += generated
-                        self.message = N_('Generated %(count)s cover thumbnails', count=total_generated)
+                    thumbnails = self.create_book_cover_thumbnails(book)
+                    if not thumbnails:
+                        self.finish_book_cover_thumbnails(book, [], [])
+                    elif pool:
+                        try:
+                            future = pool.submit(render_cover_thumbnails, self.get_book_cover(book),
+                                                 self.get_render_outputs(thumbnails))
+                            pending[future] = (book, thumbnails)
+                        except Exception as ex:
+                            self.finish_book_cover_thumbnails(book, thumbnails, [], str(ex))
+                        if len(pending) >= self.MAX_PENDING_COVERS:
+                            self.collect_rendered_thumbnails(pending, wait_all=False)
+                    else:
+                        self.render_book_cover_thumbnails(book, thumbnails)
 
                     # Check if job has been cancelled or ended
                     if self.stat == STAT_CANCELLED:
@@ -104,11 +129,19 @@ class TaskGenerateCoverThumbnails(CalibreTask):
                         self.log.info(f'GenerateCoverThumbnails task has been ended.')
                         return
 
-                if total_generated == 0:
+                self.collect_rendered_thumbnails(pending, wait_all=True)
+                if self.stat in (STAT_CANCELLED, STAT_ENDED):
+                    self.log.info(f'GenerateCoverThumbnails task has been stopped.')
+                    return
+
+                if self.total_generated == 0:
                     self.self_cleanup = True
 
             self._handleSuccess()
         finally:
+            if pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+
             # CRITICAL: Clear book from pending set on ALL exit paths (success, cancel, end, error)
             # This must run even if task is cancelled, ended, or errors out
             if self.book_id != -1:
@@ -121,6 +154,78 @@ class TaskGenerateCoverThumbnails(CalibreTask):
             # Always clean up database session
             self.app_db_session.remove()
 
+    def clear_book_cover_thumbnails(self):
+        # The old thumbnails of a replaced cover go in the same task, so no other task can run in between
+        thumbnails = (self.app_db_session.query(ub.Thumbnail)
+                      .filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_COVER)
+                      .filter(ub.Thumbnail.entity_id == self.book_id)
+                      .all())
+        for thumbnail in thumbnails:
+            self.cache.delete_cache_file(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
+            self.app_db_session.delete(thumbnail)
+        self.app_db_session.commit()
+        thumbnail_index.discard(constants.THUMBNAIL_TYPE_COVER, self.book_id)
+
+    def render_book_cover_thumbnails(self, book, thumbnails):
+        try:
+            results = render_cover_thumbnails(self.get_book_cover(book), self.get_render_outputs(thumbnails))
+        except Exception as ex:
+            self.finish_book_cover_thumbnails(book, thumbnails, [], str(ex))
+        else:
+            self.finish_book_cover_thumbnails(book, thumbnails, results)
+
+    def collect_rendered_thumbnails(self, pending, wait_all):
+        while pending:
+            done, __ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                book, thumbnails = pending.pop(future)
+                try:
+                    self.finish_book_cover_thumbnails(book, thumbnails, future.result())
+                except Exception as ex:
+                    self.finish_book_cover_thumbnails(book, thumbnails, [], str(ex))
+            if self.stat in (STAT_CANCELLED, STAT_ENDED) or (done and not wait_all):
+                return
+
+    def finish_book_cover_thumbnails(self, book, thumbnails, results, error=None):
+        errors = dict(results)
+        for thumbnail in thumbnails:
+            thumbnail_error = errors.get(self.get_thumbnail_path(thumbnail), error or 'Thumbnail was not rendered')
+            if thumbnail_error:
+                self.log.debug(f'Error creating {thumbnail.format.upper()} thumbnail for book {book.id}: '
+                               + thumbnail_error)
+                self._handleError(f'Error creating {thumbnail.format.upper()} book thumbnail: ' + thumbnail_error)
+            else:
+                thumbnail_index.add(thumbnail)
+                self.total_generated += 1
+        if thumbnails and self.total_generated > 0:
+            self.message = N_('Generated %(count)s cover thumbnails', count=self.total_generated)
+
+        # Increment the progress
+        self.finished_books += 1
+        self.progress = (1.0 / self.book_count) * self.finished_books if self.book_count else 1
+
+    def get_thumbnail_path(self, thumbnail):
+        return self.cache.get_cache_file_path(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
+
+    def get_render_outputs(self, thumbnails):
+        return [(thumbnail.resolution, thumbnail.format, self.get_thumbnail_path(thumbnail))
+                for thumbnail in thumbnails]
+
+    @staticmethod
+    def get_book_cover(book):
+        """Returns the cover path, or the cover's content for Google Drive"""
+        if config.config_use_google_drive:
+            if not gdriveutils.is_gdrive_ready():
+                raise Exception('Google Drive is configured but not ready')
+            content = gdriveutils.get_cover_via_gdrive(book.path)
+            if not content:
+                raise Exception('Google Drive cover url not found')
+            return content
+        book_cover_filepath = os.path.join(config.get_book_path(), book.path, 'cover.jpg')
+        if not os.path.isfile(book_cover_filepath):
+            raise Exception('Book cover file not found')
+        return book_cover_filepath
+
     @staticmethod
     def get_books_with_covers(book_id=-1):
         filter_exp = (db.Books.id == book_id) if book_id != -1 else True
@@ -149,7 +254,8 @@ class TaskGenerateCoverThumbnails(CalibreTask):
             .all()
 
     def create_book_cover_thumbnails(self, book):
-        generated = 0
+        """Creates or updates the thumbnail rows of a book, returns the thumbnails to render."""
+        thumbnails = list()
         book_cover_thumbnails = self.get_book_cover_thumbnails(book.id)
 
         # Build a map: (resolution, format) -> thumbnail
@@ -166,8 +272,7 @@ class TaskGenerateCoverThumbnails(CalibreTask):
                 if thumb:
                     file_missing = not self.cache.get_cache_file_exists(thumb.filename, constants.CACHE_TYPE_THUMBNAILS)
                 if not thumb or file_missing:
-                    generated += 1
-                    self.create_book_cover_single_thumbnail_format(book, resolution, fmt)
+                    thumbnails.append(self.create_book_cover_single_thumbnail_format(book, resolution, fmt))
 
         # Replace outdated, legacy, or format-mismatch thumbnails
         for thumbnail in book_cover_thumbnails:
@@ -178,27 +283,27 @@ class TaskGenerateCoverThumbnails(CalibreTask):
 
                 # If any legacy condition matched, migrate: delete old file & regenerate with deterministic name
                 if legacy_naming or wrong_format:
-                    old_id = thumbnail.id
                     old_filename = thumbnail.filename
+                    resolution = thumbnail.resolution
+                    thumbnail_index.discard(constants.THUMBNAIL_TYPE_COVER, book.id,
+                                            thumbnail.resolution, thumbnail.format.lower())
                     self.app_db_session.delete(thumbnail)
                     self.app_db_session.commit()
                     # Regenerate both formats for this resolution
                     for fmt in formats:
-                        self.create_book_cover_single_thumbnail_format(book, thumbnail.resolution, fmt)
+                        thumbnails.append(self.create_book_cover_single_thumbnail_format(book, resolution, fmt))
                     # remove old file if still present
                     try:
                         self.cache.delete_cache_file(old_filename, constants.CACHE_TYPE_THUMBNAILS)
                     except Exception:
                         pass
-                    generated += 1
                     continue
 
                 if source_newer:
-                    generated += 1
-                    self.update_book_cover_thumbnail(book, thumbnail)
+                    thumbnails.append(self.update_book_cover_thumbnail(thumbnail))
             except Exception as ex:
                 self.log.debug(f"Thumbnail migration/update issue for book {book.id}: {ex}")
-        return generated
+        return [thumbnail for thumbnail in thumbnails if thumbnail is not None]
 
     def create_book_cover_single_thumbnail_format(self, book, resolution, fmt):
         thumbnail = ub.Thumbnail()
@@ -210,106 +315,30 @@ class TaskGenerateCoverThumbnails(CalibreTask):
         self.app_db_session.add(thumbnail)
         try:
             self.app_db_session.commit()
-            self.generate_book_thumbnail(book, thumbnail)
+            return thumbnail
         except Exception as ex:
             self.log.debug(f'Error creating {fmt.upper()} book thumbnail: ' + str(ex))
             self._handleError(f'Error creating {fmt.upper()} book thumbnail: ' + str(ex))
             self.app_db_session.rollback()
+            return None
 
-    def create_book_cover_single_thumbnail(self, book, resolution):
-        # Generate WebP thumbnail (for web UI)
-        thumbnail_webp = ub.Thumbnail()
-        thumbnail_webp.type = constants.THUMBNAIL_TYPE_COVER
-        thumbnail_webp.entity_id = book.id
-        thumbnail_webp.format = 'webp'
-        thumbnail_webp.resolution = resolution
-
-        self.app_db_session.add(thumbnail_webp)
-        try:
-            self.app_db_session.commit()
-            self.generate_book_thumbnail(book, thumbnail_webp)
-        except Exception as ex:
-            self.log.debug('Error creating WebP book thumbnail: ' + str(ex))
-            self._handleError('Error creating WebP book thumbnail: ' + str(ex))
-            self.app_db_session.rollback()
-
-        # Generate JPEG thumbnail (for Kobo/devices)
-        thumbnail_jpg = ub.Thumbnail()
-        thumbnail_jpg.type = constants.THUMBNAIL_TYPE_COVER
-        thumbnail_jpg.entity_id = book.id
-        thumbnail_jpg.format = 'jpg'
-        thumbnail_jpg.resolution = resolution
-
-        self.app_db_session.add(thumbnail_jpg)
-        try:
-            self.app_db_session.commit()
-            self.generate_book_thumbnail(book, thumbnail_jpg)
-        except Exception as ex:
-            self.log.debug('Error creating JPEG book thumbnail: ' + str(ex))
-            self._handleError('Error creating JPEG book thumbnail: ' + str(ex))
-            self.app_db_session.rollback()
-
-    def update_book_cover_thumbnail(self, book, thumbnail):
+    def update_book_cover_thumbnail(self, thumbnail):
         thumbnail.generated_at = datetime.now(timezone.utc)
 
         try:
             self.app_db_session.commit()
             self.cache.delete_cache_file(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
-            self.generate_book_thumbnail(book, thumbnail)
+            return thumbnail
         except Exception as ex:
             self.log.debug('Error updating book thumbnail: ' + str(ex))
             self._handleError('Error updating book thumbnail: ' + str(ex))
             self.app_db_session.rollback()
+            return None
 
-    def generate_book_thumbnail(self, book, thumbnail):
-        if book and thumbnail:
-            if config.config_use_google_drive:
-                if not gdriveutils.is_gdrive_ready():
-                    raise Exception('Google Drive is configured but not ready')
-
-                content = gdriveutils.get_cover_via_gdrive(book.path)
-                if not content:
-                    raise Exception('Google Drive cover url not found')
-                try:
-                    stream = BytesIO(content)
-                    with Image(file=stream) as img:
-                        filename = self.cache.get_cache_file_path(thumbnail.filename,
-                                                                  constants.CACHE_TYPE_THUMBNAILS)
-                        height = get_resize_height(thumbnail.resolution)
-                        if img.height > height:
-                            width = get_resize_width(thumbnail.resolution, img.width, img.height)
-                            img.resize(width=width, height=height, filter='lanczos')
-                        # Set format for thumbnail
-                        img.format = thumbnail.format
-                        try:
-                            img.compression_quality = 82
-                        except Exception:
-                            pass
-                        img.save(filename=filename)
-                except Exception as ex:
-                    self.log.debug('Error generating thumbnail file: ' + str(ex))
-                    raise ex
-                finally:
-                    if stream is not None:
-                        stream.close()
-            else:
-                book_cover_filepath = os.path.join(config.get_book_path(), book.path, 'cover.jpg')
-                if not os.path.isfile(book_cover_filepath):
-                    raise Exception('Book cover file not found')
-
-                with Image(filename=book_cover_filepath) as img:
-                    height = get_resize_height(thumbnail.resolution)
-                    filename = self.cache.get_cache_file_path(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
-                    if img.height > height:
-                        width = get_resize_width(thumbnail.resolution, img.width, img.height)
-                        img.resize(width=width, height=height, filter='lanczos')
-                    # Set format for thumbnail
-                    img.format = thumbnail.format
-                    try:
-                        img.compression_quality = 82
-                    except Exception:
-                        pass
-                    img.save(filename=filename)
+    @property
+    def priority(self):
+        # A single book's thumbnails are waited for in the web UI, the full scan can wait
+        return PRIORITY_HIGH if self.book_id != -1 else PRIORITY_LOW
 
     @property
     def name(self):
@@ -327,6 +356,15 @@ class TaskGenerateCoverThumbnails(CalibreTask):
 
 
 class TaskGenerateSeriesThumbnails(CalibreTask):
+    """Generates the mosaic thumbnails of series with four or more covered books.
+
+    Series membership and modification times are loaded with one query, only series whose thumbnail is
+    missing or older than one of their books are composited. Tiles are cut from the books' cover
+    thumbnails while those are current, the full cover is only opened otherwise.
+    """
+    lane = LANE_CPU
+    priority = PRIORITY_LOW
+
     def __init__(self, task_message=''):
         super(TaskGenerateSeriesThumbnails, self).__init__(task_message)
         self.log = logger.create()
@@ -339,87 +377,90 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
         ]
 
     def run(self, worker_thread):
-        if self.calibre_db.session and use_IM and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
-            self.message = 'Scanning Series'
-            all_series = self.get_series_with_four_plus_books()
-            count = len(all_series)
-
-            total_generated = 0
-            for i, series in enumerate(all_series):
-                generated = 0
-                series_thumbnails = self.get_series_thumbnails(series.id)
-                series_books = self.get_series_books(series.id)
-
-                # Generate new thumbnails for missing covers
-                resolutions = list(map(lambda t: t.resolution, series_thumbnails))
-                missing_resolutions = list(set(self.resolutions).difference(resolutions))
-                for resolution in missing_resolutions:
-                    generated += 1
-                    self.create_series_thumbnail(series, series_books, resolution)
-
-                # Replace outdated or missing thumbnails
-                for thumbnail in series_thumbnails:
-                    if any(book.last_modified > thumbnail.generated_at for book in series_books):
-                        generated += 1
-                        self.update_series_thumbnail(series_books, thumbnail)
-
-                    elif not self.cache.get_cache_file_exists(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS):
-                        generated += 1
-                        self.update_series_thumbnail(series_books, thumbnail)
-
-                # Increment the progress
-                self.progress = (1.0 / count) * i
-
-                if generated > 0:
-                    total_generated += generated
-                    self.message = N_('Generated {0} series thumbnails').format(total_generated)
-
-                # Check if job has been cancelled or ended
-                if self.stat == STAT_CANCELLED:
-                    self.log.info(f'GenerateSeriesThumbnails task has been cancelled.')
-                    return
+        try:
+            if self.calibre_db.session and use_IM and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
+                self.message = 'Scanning Series'
+                dirty_series = self.get_dirty_series(self.get_series_books(), self.get_series_thumbnails())
+                count = len(dirty_series)
 
-                if self.stat == STAT_ENDED:
-                    self.log.info(f'GenerateSeriesThumbnails task has been ended.')
-                    return
+                total_generated = 0
+                for i, (series_id, series_books, outdated) in enumerate(dirty_series):
+                    for resolution, thumbnail in outdated:
+                        if thumbnail is None:
+                            self.create_series_thumbnail(series_id, series_books, resolution)
+                        else:
+                            self.update_series_thumbnail(series_books, thumbnail)
+                        total_generated += 1
 
-            if total_generated == 0:
-                self.self_cleanup = True
+                    # Increment the progress
+                    self.progress = (1.0 / count) * (i + 1)
+                    self.message = N_('Generated {0} series thumbnails').format(total_generated)
 
-        self._handleSuccess()
-        self.app_db_session.remove()
+                    # Check if job has been cancelled or ended
+                    if self.stat == STAT_CANCELLED:
+                        self.log.info(f'GenerateSeriesThumbnails task has been cancelled.')
+                        return
 
-    def get_series_with_four_plus_books(self):
-        return self.calibre_db.session \
-            .query(db.Series) \
-            .join(db.books_series_link) \
-            .join(db.Books) \
-            .filter(db.Books.has_cover == 1) \
-            .group_by(text('books_series_link.series')) \
-            .having(func.count('book_series_link') > 3) \
-            .all()
+                    if self.stat == STAT_ENDED:
+                        self.log.info(f'GenerateSeriesThumbnails task has been ended.')
+                        return
 
-    def get_series_books(self, series_id):
-        return self.calibre_db.session \
-            .query(db.Books) \
-            .join(db.books_series_link) \
-            .join(db.Series) \
-            .filter(db.Books.has_cover == 1) \
-            .filter(db.Series.id == series_id) \
-            .all()
+                if total_generated == 0:
+                    self.self_cleanup = True
 
-    def get_series_thumbnails(self, series_id):
-        return (self.app_db_session
-            .query(ub.Thumbnail)
-            .filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_SERIES)
-            .filter(ub.Thumbnail.entity_id == series_id)
-            .filter(or_(ub.Thumbnail.expiration.is_(None), ub.Thumbnail.expiration > datetime.now(timezone.utc)))
-            .all())
+            self._handleSuccess()
+        finally:
+            self.calibre_db.session.close()
+            self.app_db_session.remove()
 
-    def create_series_thumbnail(self, series, series_books, resolution):
+    def get_series_books(self):
+        """Returns the covered books of every series with more than three of them, keyed by series id"""
+        rows = (self.calibre_db.session
+                .query(db.books_series_link.c.series, db.Books.id, db.Books.path, db.Books.series_index,
+                       db.Books.last_modified)
+                .join(db.Books, db.Books.id == db.books_series_link.c.book)
+                .filter(db.Books.has_cover == 1)
+                .all())
+        series_books = dict()
+        for row in rows:
+            series_books.setdefault(row.series, []).append(
+                SeriesBookSource(id=row.id, path=row.path, series_index=row.series_index,
+                                 last_modified=row.last_modified))
+        return {series_id: books for series_id, books in series_books.items() if len(books) > 3}
+
+    def get_series_thumbnails(self):
+        series_thumbnails = dict()
+        for thumbnail in (self.app_db_session
+                          .query(ub.Thumbnail)
+                          .filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_SERIES)
+                          .filter(or_(ub.Thumbnail.expiration.is_(None),
+                                      ub.Thumbnail.expiration > datetime.now(timezone.utc)))
+                          .all()):
+            series_thumbnails.setdefault(thumbnail.entity_id, []).append(thumbnail)
+        return series_thumbnails
+
+    def get_dirty_series(self, series_books, series_thumbnails):
+        """Returns (series id, books, [(resolution, thumbnail or None)]) of series needing new thumbnails"""
+        dirty_series = list()
+        for series_id, books in series_books.items():
+            latest_change = max(book.last_modified.replace(tzinfo=None) for book in books)
+            thumbnails = {thumbnail.resolution: thumbnail for thumbnail in series_thumbnails.get(series_id, [])}
+            outdated = list()
+            for resolution in sorted(set(self.resolutions).union(thumbnails)):
+                thumbnail = thumbnails.get(resolution)
+                if (thumbnail is None
+                        or latest_change > thumbnail.generated_at
+                        or not self.cache.get_cache_file_exists(thumbnail.filename,
+                                                                constants.CACHE_TYPE_THUMBNAILS)):
+                    outdated.append((resolution, thumbnail))
+            if outdated:
+                dirty_series.append((series_id, books, outdated))
+        return dirty_series
+
+    def create_series_thumbnail(self, series_id, series_books, resolution):
         thumbnail = ub.Thumbnail()
         thumbnail.type = constants.THUMBNAIL_TYPE_SERIES
-        thumbnail.entity_id = series.id
+        thumbnail.entity_id = series_id
         # Store series thumbnails as WebP as well
         thumbnail.format = 'webp'
         thumbnail.resolution = resolution
@@ -428,6 +469,7 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
         try:
             self.app_db_session.commit()
             self.generate_series_thumbnail(series_books, thumbnail)
+            thumbnail_index.add(thumbnail)
         except Exception as ex:
             self.log.debug('Error creating book thumbnail: ' + str(ex))
             self._handleError('Error creating book thumbnail: ' + str(ex))
@@ -440,11 +482,26 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
             self.app_db_session.commit()
             self.cache.delete_cache_file(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
             self.generate_series_thumbnail(series_books, thumbnail)
+            thumbnail_index.add(thumbnail)
         except Exception as ex:
             self.log.debug('Error updating book thumbnail: ' + str(ex))
             self._handleError('Error updating book thumbnail: ' + str(ex))
             self.app_db_session.rollback()
 
+    def get_tile_source(self, book, resolution):
+        """Returns the book's current cover thumbnail, its cover file or the cover's content for Google Drive"""
+        book_modified = book.last_modified.replace(tzinfo=None)
+        for cover_resolution in COVER_RESOLUTIONS:
+            if cover_resolution < resolution:
+                continue
+            for fmt in ('jpg', 'webp'):
+                entry = thumbnail_index.get(constants.THUMBNAIL_TYPE_COVER, book.id, cover_resolution, fmt)
+                if entry and entry[1] and entry[1].replace(tzinfo=None) >= book_modified:
+                    path = self.cache.get_cache_file_path(entry[0], constants.CACHE_TYPE_THUMBNAILS)
+                    if os.path.isfile(path):
+                        return path
+        return TaskGenerateCoverThumbnails.get_book_cover(book)
+
     def generate_series_thumbnail(self, series_books, thumbnail):
         # Get the last four books in the series based on series_index
         books = sorted(series_books, key=lambda b: float(b.series_index), reverse=True)[:4]
@@ -455,47 +512,8 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
         height = 0
         with Image() as canvas:
             for book in books:
-                if config.config_use_google_drive:
-                    if not gdriveutils.is_gdrive_ready():
-                        raise Exception('Google Drive is configured but not ready')
-
-                    web_content_link = gdriveutils.get_cover_via_gdrive(book.path)
-                    if not web_content_link:
-                        raise Exception('Google Drive cover url not found')
-
-                    stream = None
-                    try:
-                        stream = urlopen(web_content_link)
-                        with Image(file=stream) as img:
-                            # Use the first image in this set to determine the width and height to scale the
-                            # other images in this set
-                            if width == 0 or height == 0:
-                                width = get_resize_width(thumbnail.resolution, img.width, img.height)
-                                height = get_resize_height(thumbnail.resolution)
-                                canvas.blank(width, height)
-
-                            dimensions = get_best_fit(width, height, img.width, img.height)
-
-                            # resize and crop the image
-                            img.resize(width=int(dimensions['width']), height=int(dimensions['height']),
-                                       filter='lanczos')
-                            img.crop(width=int(width / 2.0), height=int(height / 2.0), gravity='center')
-
-                            # add the image to the canvas
-                            canvas.composite(img, left, top)
-
-                    except Exception as ex:
-                        self.log.debug('Error generating thumbnail file: ' + str(ex))
-                        raise ex
-                    finally:
-                        if stream is not None:
-                            stream.close()
-
-                book_cover_filepath = os.path.join(config.get_book_path(), book.path, 'cover.jpg')
-                if not os.path.isfile(book_cover_filepath):
-                    raise Exception('Book cover file not found')
-
-                with Image(filename=book_cover_filepath) as img:
+                source = self.get_tile_source(book, thumbnail.resolution)
+                with (Image(blob=source) if isinstance(source, bytes) else Image(filename=source)) as img:
                     # Use the first image in this set to determine the width and height to scale the
                     # other images in this set
                     if width == 0 or height == 0:
@@ -542,6 +560,8 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
 
 
 class TaskClearCoverThumbnailCache(CalibreTask):
+    lane = LANE_CPU
+
     def __init__(self, book_id, task_message=N_('Clearing cover thumbnail cache')):
         super(TaskClearCoverThumbnailCache, self).__init__(task_message)
         self.log = logger.create()
@@ -577,13 +597,15 @@ class TaskClearCoverThumbnailCache(CalibreTask):
 
     def delete_thumbnail(self, thumbnail):
         try:
+            entity_id = thumbnail.entity_id
             self.cache.delete_cache_file(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
             self.app_db_session \
                 .query(ub.Thumbnail) \
                 .filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_COVER) \
-                .filter(ub.Thumbnail.entity_id == thumbnail.entity_id) \
+                .filter(ub.Thumbnail.entity_id == entity_id) \
                 .delete()
             self.app_db_session.commit()
+            thumbnail_index.discard(constants.THUMBNAIL_TYPE_COVER, entity_id)
         except Exception as ex:
             self.log.debug('Error deleting book thumbnail: ' + str(ex))
             self._handleError('Error deleting book thumbnail: ' + str(ex))
@@ -592,11 +614,21 @@ class TaskClearCoverThumbnailCache(CalibreTask):
         try:
             self.app_db_session.query(ub.Thumbnail).filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_COVER).delete()
             self.app_db_session.commit()
+            thumbnail_index.clear(constants.THUMBNAIL_TYPE_COVER)
             self.cache.delete_cache_dir(constants.CACHE_TYPE_THUMBNAILS)
         except Exception as ex:
             self.log.debug('Error deleting thumbnail directory: ' + str(ex))
             self._handleError('Error deleting thumbnail directory: ' + str(ex))
 
+    @property
+    def priority(self):
+        return PRIORITY_HIGH if self.book_id > 0 else PRIORITY_LOW
+
+    @property
+    def exclusive(self):
+        # Emptying the whole cache must not overlap a generation running next to it
+        return self.book_id < 0
+
     @property
     def name(self):
         return N_('Cover Thumbnails')
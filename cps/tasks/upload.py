@@ -9,10 +9,13 @@ from datetime import datetime
 
 from flask_babel import lazy_gettext as N_
 
-from cps.services.worker import CalibreTask, STAT_FINISH_SUCCESS
+from cps.services.worker import CalibreTask, STAT_FINISH_SUCCESS, LANE_INTERACTIVE, PRIORITY_HIGH
 
 
 class TaskUpload(CalibreTask):
+    lane = LANE_INTERACTIVE
+    priority = PRIORITY_HIGH
+
     def __init__(self, task_message, book_title):
         super(TaskUpload, self).__init__(task_message)
         self.start_time = self.end_time = datetime.now()
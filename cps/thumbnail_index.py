@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Process wide index of generated cover and series thumbnails.
+
+Serving a cover thumbnail used to query app.db for the webp and the jpg thumbnail and check both files on
+disk. The index maps (type, entity id, resolution, format) to (filename, generated_at). It is loaded from
+the thumbnail table on first use and kept current by the thumbnail tasks, the only writers of that table.
+"""
+
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import or_
+
+from . import ub
+
+
+class ThumbnailIndex:
+    def __init__(self):
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def load(self, session):
+        with self._lock:
+            rows = (session.query(ub.Thumbnail.type, ub.Thumbnail.entity_id, ub.Thumbnail.resolution,
+                                  ub.Thumbnail.format, ub.Thumbnail.filename, ub.Thumbnail.generated_at)
+                    .filter(or_(ub.Thumbnail.expiration.is_(None),
+                                ub.Thumbnail.expiration > datetime.now(timezone.utc)))
+                    .all())
+            self._entries = {(row.type, row.entity_id, row.resolution, (row.format or '').lower()):
+                             (row.filename, row.generated_at) for row in rows}
+
+    def get(self, thumbnail_type, entity_id, resolution, thumbnail_format):
+        """Returns (filename, generated_at) of a generated thumbnail, or None."""
+        if self._entries is None:
+            self.load(ub.session)
+        return self._entries.get((thumbnail_type, entity_id, resolution, thumbnail_format))
+
+    def add(self, thumbnail):
+        """Records a thumbnail whose file was written."""
+        with self._lock:
+            if self._entries is not None:
+                key = (thumbnail.type, thumbnail.entity_id, thumbnail.resolution, thumbnail.format.lower())
+                self._entries[key] = (thumbnail.filename, thumbnail.generated_at)
+
+    def discard(self, thumbnail_type, entity_id, resolution=None, thumbnail_format=None):
+        with self._lock:
+            if self._entries is None:
+                return
+            for key in [key for key in self._entries
+                        if key[0] == thumbnail_type and key[1] == entity_id
+                        and resolution in (None, key[2]) and thumbnail_format in (None, key[3])]:
+                del self._entries[key]
+
+    def clear(self, thumbnail_type=None):
+        with self._lock:
+            if self._entries is None:
+                return
+            if thumbnail_type is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == thumbnail_type]:
+                    del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries or ())
+
+
+thumbnail_index = ThumbnailIndex()
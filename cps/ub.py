@@ -782,6 +782,26 @@ class Thumbnail(Base):
     expiration = Column(DateTime, nullable=True)
 
 
+# Per-format facts of a book's EPUB/KEPUB file, valid while the file's size and mtime are unchanged
+class EpubFormatInfo(Base):
+    __tablename__ = 'epub_format_info'
+
+    id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, nullable=False)
+    format = Column(String, nullable=False)
+    file_size = Column(Integer)
+    file_mtime = Column(Integer)  # st_mtime_ns
+    is_valid = Column(Boolean, default=True)  # False if the file is not a readable zip archive
+    layout = Column(String, nullable=True)  # rendition:layout, e.g. 'pre-paginated'
+    uncompressed_size = Column(Integer, nullable=True)
+    opf_version = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        UniqueConstraint('book_id', 'format', name='uq_epub_format_info_book_format'),
+    )
+
+
 # Add missing tables during migration of database
 def add_missing_tables(engine, _session):
     if not engine.dialect.has_table(engine.connect(), "archived_book"):
@@ -796,6 +816,8 @@ def add_missing_tables(engine, _session):
         MagicShelfCache.__table__.create(bind=engine, checkfirst=True)
     if not engine.dialect.has_table(engine.connect(), "hidden_magic_shelf_templates"):
         HiddenMagicShelfTemplate.__table__.create(bind=engine, checkfirst=True)
+    if not engine.dialect.has_table(engine.connect(), "epub_format_info"):
+        EpubFormatInfo.__table__.create(bind=engine, checkfirst=True)
 
 
 # migrate all settings missing in registration table
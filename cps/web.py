@@ -4,8 +4,10 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
+import io
 import os
 import json
+import tarfile
 import mimetypes
 import chardet  # dependency of requests
 import copy
@@ -16,6 +18,7 @@ import xml.etree.ElementTree as ET
 
 from flask import Blueprint, jsonify
 from flask import request, redirect, send_from_directory, send_file, make_response, flash, abort, url_for, Response, g
+from flask import stream_with_context
 from flask import session as flask_session
 from flask_babel import gettext as _
 from flask_babel import get_locale
@@ -24,6 +27,7 @@ from flask_limiter import RateLimitExceeded
 from flask_limiter.util import get_remote_address
 from sqlalchemy.exc import IntegrityError, InvalidRequestError, OperationalError
 from sqlalchemy.sql.expression import text, func, false, not_, and_, or_
+from sqlalchemy.sql import operators
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.sql.functions import coalesce
 from werkzeug.datastructures import Headers
@@ -44,6 +48,7 @@ from .cw_babel import get_available_locale
 from .usermanagement import login_required_if_no_ano
 from .kobo_sync_status import remove_synced_book
 from . import magic_shelf
+from . import comic_pages
 from .render_template import render_title_template
 from .kobo_sync_status import change_archived_books
 from . import limiter
@@ -243,53 +248,61 @@ def update_view():
     return "1", 200
 
 
-'''
+def _get_comic_file(book_id, book_format):
+    if book_format.lower() not in comic_pages.COMIC_FORMATS or config.config_use_google_drive:
+        return None
+    book = calibre_db.get_filtered_book(book_id, allow_show_archived=True)
+    if not book:
+        return None
+    for bookformat in book.data:
+        if bookformat.format.lower() == book_format.lower():
+            return os.path.join(config.get_book_path(), book.path, bookformat.name) + "." + book_format.lower()
+    return None
+
+
+@web.route("/ajax/getcomic/<int:book_id>/<book_format>")
+@user_login_required
+def get_comic_index(book_id, book_format):
+    comic_file = _get_comic_file(book_id, book_format)
+    if not comic_file:
+        return "", 204
+    try:
+        pages = comic_pages.get_page_index(comic_file, book_format, config.config_rarfile_location)
+    except (OSError, comic_pages.ComicArchiveError, zipfile.BadZipFile, tarfile.TarError) as ex:
+        log.error('Unable to open comic %s: %s', comic_file, ex)
+        return "", 204
+    return jsonify(pages=pages, last=len(pages) - 1)
+
+
 @web.route("/ajax/getcomic/<int:book_id>/<book_format>/<int:page>")
 @user_login_required
 def get_comic_book(book_id, book_format, page):
-    book = calibre_db.get_book(book_id)
-    if not book:
+    comic_file = _get_comic_file(book_id, book_format)
+    if not comic_file:
         return "", 204
-    else:
-        for bookformat in book.data:
-            if bookformat.format.lower() == book_format.lower():
-                cbr_file = os.path.join(config.config_calibre_dir, book.path, bookformat.name) + "." + book_format
-                if book_format in ("cbr", "rar"):
-                    if feature_support['rar'] == True:
-                        rarfile.UNRAR_TOOL = config.config_rarfile_location
-                        try:
-                            rf = rarfile.RarFile(cbr_file)
-                            names = sort(rf.namelist())
-                            extract = lambda page: rf.read(names[page])
-                        except:
-                            # rarfile not valid
-                            log.error('Unrar binary not found, or unable to decompress file %s', cbr_file)
-                            return "", 204
-                    else:
-                        log.info('Unrar is not supported please install python rarfile extension')
-                        # no support means return nothing
-                        return "", 204
-                elif book_format in ("cbz", "zip"):
-                    zf = zipfile.ZipFile(cbr_file)
-                    names=sort(zf.namelist())
-                    extract = lambda page: zf.read(names[page])
-                elif book_format in ("cbt", "tar"):
-                    tf = tarfile.TarFile(cbr_file)
-                    names=sort(tf.getnames())
-                    extract = lambda page: tf.extractfile(names[page]).read()
-                else:
-                    log.error('unsupported comic format')
-                    return "", 204
-
-                b64 = codecs.encode(extract(page), 'base64').decode()
-                ext = names[page].rpartition('.')[-1]
-                if ext not in ('png', 'gif', 'jpg', 'jpeg', 'webp'):
-                    ext = 'png'
-                extractedfile="data:image/" + ext + ";base64," + b64
-                fileData={"name": names[page], "page":page, "last":len(names)-1, "content": extractedfile}
-                return make_response(json.dumps(fileData))
+    max_width = request.args.get("width", type=int)
+    prefetch = min(request.args.get("prefetch", 2, type=int), 10)
+    try:
+        data, mimetype, etag, page_count = comic_pages.get_page(comic_file, book_format, page, max_width,
+                                                                 config.config_rarfile_location)
+    except IndexError:
+        abort(404)
+    except (OSError, comic_pages.ComicArchiveError, zipfile.BadZipFile, tarfile.TarError) as ex:
+        log.error('Unable to read page %s of comic %s: %s', page, comic_file, ex)
         return "", 204
-'''
+    response = send_file(io.BytesIO(data), mimetype=mimetype, etag=etag, conditional=True, max_age=86400)
+    # Pages are only served to logged in users, shared caches must not keep them
+    response.cache_control.public = False
+    response.cache_control.private = True
+    # Let the reader warm the next pages while the current one is displayed
+    next_pages = range(page + 1, min(page + 1 + prefetch, page_count))
+    if next_pages:
+        response.headers["Link"] = ", ".join(
+            "<{}>; rel=prefetch".format(url_for("web.get_comic_book", book_id=book_id, book_format=book_format,
+                                                page=next_page, width=max_width))
+            for next_page in next_pages)
+    response.headers["X-Comic-Last-Page"] = str(page_count - 1)
+    return response
 
 
 # ################################### Typeahead ##################################################################
@@ -338,8 +351,6 @@ def get_languages_json():
 def get_matching_tags():
     tag_dict = {'tags': []}
     q = calibre_db.session.query(db.Books).filter(calibre_db.common_filters(True))
-    calibre_db.create_functions()
-    # calibre_db.session.connection().connection.connection.create_function("lower", 1, db.lcase)
     author_input = request.args.get('authors') or ''
     title_input = request.args.get('title') or ''
     include_tag_inputs = request.args.getlist('include_tag') or ''
@@ -1482,8 +1493,7 @@ def list_books():
     elif not state:
         order = [db.Books.timestamp.desc()]
 
-    total_count = filtered_count = calibre_db.session.query(db.Books).filter(
-        calibre_db.common_filters(allow_show_archived=True)).count()
+    total_count = filtered_count = calibre_db.count_visible_books(allow_show_archived=True)
     if state is not None:
         if search_param:
             books = calibre_db.search_query(search_param, config).all()
@@ -1491,7 +1501,8 @@ def list_books():
         else:
             query = calibre_db.generate_linked_query(config.config_read_column, db.Books)
             books = query.filter(calibre_db.common_filters(allow_show_archived=True)).all()
-        entries = calibre_db.get_checkbox_sorted(books, state, off, limit, order, True)
+        entries = [(entry[0].id, entry[1], entry[2])
+                   for entry in calibre_db.get_checkbox_sorted(books, state, off, limit, order, True)]
     elif search_param:
         entries, filtered_count, __ = calibre_db.get_search_results(search_param,
                                                                     config,
@@ -1499,33 +1510,58 @@ def list_books():
                                                                     [order, ''],
                                                                     limit,
                                                                     *join)
+        entries = [(entry[0].id, entry[1], entry[2]) for entry in entries]
     else:
-        entries, __, __ = calibre_db.fill_indexpage_with_archived_books((int(off) / (int(limit)) + 1),
-                                                                        db.Books,
-                                                                        limit,
-                                                                        True,
-                                                                        order,
-                                                                        True,
-                                                                        True,
-                                                                        config.config_read_column,
-                                                                        *join)
-
-    result = list()
-    for entry in entries:
-        val = entry[0]
-        val.is_archived = entry[1] is True
-        val.read_status = entry[2] == ub.ReadBook.STATUS_FINISHED
-        for lang_index in range(0, len(val.languages)):
-            val.languages[lang_index].language_name = isoLanguages.get_language_name(get_locale(), val.languages[
-                lang_index].lang_code)
-        result.append(val)
+        entries = _list_books_page(off, limit, order, *join)
 
-    table_entries = {'totalNotFiltered': total_count, 'total': filtered_count, "rows": result}
-    js_list = json.dumps(table_entries, cls=db.AlchemyEncoder)
+    cc = calibre_db.get_cc_columns(config, filter_config_custom_read=True)
+    rows = calibre_db.get_book_table_rows(
+        [(book_id, is_archived, read_status == ub.ReadBook.STATUS_FINISHED)
+         for book_id, is_archived, read_status in entries], cc)
+
+    def stream_rows():
+        yield '{{"totalNotFiltered": {}, "total": {}, "rows": ['.format(total_count, filtered_count)
+        for index, row in enumerate(rows):
+            yield (',' if index else '') + json.dumps(row)
+        yield ']}'
+
+    return Response(stream_with_context(stream_rows()), mimetype="application/json")
+
+
+def _list_books_page(off, limit, order, *join):
+    # Only project ids plus archived/read state, the table fields are loaded by get_book_table_rows
+    query = calibre_db.generate_linked_query(config.config_read_column, db.Books.id)
+    indx = 0
+    while indx < len(join):
+        if len(join) - indx >= 3:
+            query = query.outerjoin(join[indx], join[indx + 1]).outerjoin(join[indx + 2])
+            indx += 3
+        elif len(join) - indx == 2:
+            query = query.outerjoin(join[indx], join[indx + 1])
+            indx += 2
+        else:
+            query = query.outerjoin(join[indx])
+            indx += 1
+    if join:
+        # Joins on multi valued columns repeat a book, one row per book before paging, sorted by its first value
+        query = query.group_by(db.Books.id)
+        order = [_grouped_order_clause(clause) for clause in order]
+    try:
+        return [(book_id, is_archived, read_status)
+                for book_id, is_archived, read_status in (query.filter(calibre_db.common_filters(allow_show_archived=True))
+                                                          .order_by(*order).offset(off).limit(limit))]
+    except Exception as ex:
+        log.error_or_exception(ex)
+        return list()
 
-    response = make_response(js_list)
-    response.headers["Content-Type"] = "application/json; charset=utf-8"
-    return response
+
+def _grouped_order_clause(clause):
+    modifier = getattr(clause, 'modifier', None)
+    if modifier is operators.desc_op:
+        return func.max(clause.element).desc()
+    if modifier is operators.asc_op:
+        return func.min(clause.element).asc()
+    return func.min(clause)
 
 
 @web.route("/ajax/table_settings", methods=['POST'])
@@ -1794,7 +1830,7 @@ def get_cover(book_id, resolution=None):
         'lg': constants.COVER_THUMBNAIL_LARGE,
     }
     cover_resolution = resolutions.get(resolution, None)
-    return get_book_cover(book_id, cover_resolution)
+    return get_book_cover(book_id, cover_resolution, versioned='c' in request.args)
 
 
 @web.route("/series_cover/<int:series_id>")
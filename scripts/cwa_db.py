@@ -15,6 +15,8 @@ from tabulate import tabulate
 
 
 class CWA_DB:
+    read_only = False
+
     def __init__(self, verbose=False):
         self.verbose = verbose
 
@@ -55,12 +57,36 @@ class CWA_DB:
             print(f"[cwa-db]: The following error occurred while trying to connect to the CWA Enforcement DB: {e}")
             sys.exit(0)
         if con:
+            try:
+                # WAL lets the stats readers run alongside activity logging
+                con.execute("PRAGMA journal_mode=WAL")
+            except sqlError:
+                pass
             cur = con.cursor()
             if self.verbose:
                 print("[cwa-db]: Connection with the CWA Enforcement DB Successful!")
             return con, cur
 
 
+    @classmethod
+    def reader(cls, verbose=False):
+        """Returns a read-only CWA_DB for running stats queries on its own connection.
+
+        Schema and settings setup is skipped, the database is expected to exist already. Rollups
+        are not maintained through a reader, callers roll up on a regular instance first.
+        """
+        db = cls.__new__(cls)
+        db.verbose = verbose
+        db.db_file = "cwa.db"
+        db.db_path = "/config/"
+        db.read_only = True
+        db.con = sqlite3.connect(f"file:{db.db_path}{db.db_file}?mode=ro", uri=True, timeout=30,
+                                 check_same_thread=False)
+        db.cur = db.con.cursor()
+        db.cwa_settings = {}
+        return db
+
+
     def make_tables(self) -> tuple[list[str], list[str]]:
         """Creates the tables for the CWA DB if they don't already exist"""
         schema = []
@@ -520,7 +546,7 @@ class CWA_DB:
                 cwa_settings[key] = default_value
 
         # Define which settings should remain as integers (not converted to boolean)
-        integer_settings = ['ingest_timeout_minutes', 'ingest_stale_temp_minutes', 'ingest_stale_temp_interval', 'auto_send_delay_minutes', 'hardcover_auto_fetch_batch_size', 'hardcover_auto_fetch_schedule_hour', 'duplicate_scan_hour', 'duplicate_scan_chunk_size', 'duplicate_scan_debounce_seconds', 'archived_cleanup_schedule_hour', 'cover_download_max_mb']
+        integer_settings = ['ingest_timeout_minutes', 'ingest_stale_temp_minutes', 'ingest_stale_temp_interval', 'auto_send_delay_minutes', 'hardcover_auto_fetch_batch_size', 'hardcover_auto_fetch_schedule_hour', 'duplicate_scan_hour', 'duplicate_scan_chunk_size', 'duplicate_scan_debounce_seconds', 'duplicate_detection_similarity', 'archived_cleanup_schedule_hour', 'cover_download_max_mb', 'activity_raw_retention_days']
         
         # Define which settings should remain as floats (not converted to boolean)
         float_settings = ['hardcover_auto_fetch_min_confidence', 'hardcover_auto_fetch_rate_limit']
@@ -921,126 +947,147 @@ class CWA_DB:
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (user_id, user_name, event_type, item_id, item_title, extra_data_json))
             self.con.commit()
+            self.rollup_activity()
         except Exception as e:
             print(f"[cwa-db] Error logging activity: {e}")
 
     def get_active_users(self):
         """Returns list of distinct users who have activity logged."""
         try:
+            self.rollup_activity()
             self.cur.execute("""
-                SELECT DISTINCT user_id, COALESCE(user_name, 'Unknown User') as user_name
-                FROM cwa_user_activity
-                WHERE user_id IS NOT NULL
+                SELECT DISTINCT user_id, user_name
+                FROM cwa_activity_hourly
+                WHERE user_id != -1
                 ORDER BY user_name ASC
             """)
             return self.cur.fetchall()
         except Exception as e:
             print(f"[cwa-db] Error fetching active users: {e}")
             return []
-    def get_hourly_activity_heatmap(self, days=None, start_date=None, end_date=None, user_id=None):
-        """Returns activity count by hour of day and day of week for heatmap visualization.
-        
-        Returns list of tuples: (day_of_week, hour, count)
-        day_of_week: 0=Sunday, 1=Monday, ..., 6=Saturday
-        hour: 0-23
-        """
-        try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
-            
-            self.cur.execute(f"""
-                SELECT 
-                    CAST(strftime('%w', timestamp) AS INTEGER) as day_of_week,
-                    CAST(strftime('%H', timestamp) AS INTEGER) as hour,
-                    COUNT(*) as activity_count
-                FROM cwa_user_activity
-                WHERE {combined_filter}
-                GROUP BY day_of_week, hour
-                ORDER BY day_of_week, hour
-            """)
-            return self.cur.fetchall()
-        except Exception as e:
-            print(f"[cwa-db] Error getting hourly activity heatmap: {e}")
-            return []
 
-    def get_reading_velocity(self, days=None, start_date=None, end_date=None, user_id=None):
-        """Returns books read per week for velocity trend chart.
-        
-        Returns list of tuples: (week_start_date, books_read_count)
+    # ==============================
+    # Activity rollups
+    # ==============================
+
+    def _build_date_filter(self, column="timestamp", days=None, start_date=None, end_date=None, default_days=30, whole_days=False) -> str:
+        """Builds the dashboard date range filter for a timestamp column.
+
+        whole_days is used for columns holding plain 'YYYY-MM-DD' dates, where the usual
+        "< end + 1 day" upper bound would include the following day.
+        """
+        if start_date and end_date:
+            if whole_days:
+                return f"{column} BETWEEN date('{start_date}') AND date('{end_date}')"
+            return f"{column} BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
+        days = days or default_days
+        return f"{column} >= date('now', '-{days} days')"
+
+    def rollup_activity(self) -> int:
+        """Folds raw activity events that are not yet counted into the hourly and daily rollup tables.
+
+        The watermark is read and advanced inside one write transaction, so concurrent callers never
+        count an event twice. Returns the number of events rolled up.
         """
+        if self.read_only:
+            return 0
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 90  # Default to 90 days for velocity trends
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
-            
-            self.cur.execute(f"""
-                SELECT 
-                    date(timestamp, 'weekday 0', '-6 days') as week_start,
-                    COUNT(DISTINCT item_id) as books_read
-                FROM cwa_user_activity
-                WHERE event_type = 'READ'
-                    AND {combined_filter}
-                GROUP BY week_start
-                ORDER BY week_start
-            """)
-            return self.cur.fetchall()
+            self.cur.execute("SELECT last_rolled_id FROM cwa_activity_rollup_state WHERE id = 1")
+            row = self.cur.fetchone()
+            self.cur.execute("SELECT MAX(id) FROM cwa_user_activity")
+            max_id = self.cur.fetchone()[0] or 0
+            if row and max_id <= row[0]:
+                return 0
+
+            self.con.commit()
+            self.cur.execute("BEGIN IMMEDIATE")
+            try:
+                self.cur.execute("SELECT last_rolled_id FROM cwa_activity_rollup_state WHERE id = 1")
+                row = self.cur.fetchone()
+                last_id = row[0] if row else 0
+                self.cur.execute("SELECT MAX(id), COUNT(*) FROM cwa_user_activity WHERE id > ?", (last_id,))
+                max_id, pending = self.cur.fetchone()
+                if not max_id:
+                    self.con.rollback()
+                    return 0
+
+                self.cur.execute("""
+                    INSERT INTO cwa_activity_hourly (bucket, user_id, user_name, event_type, format, has_extra_data,
+                                                     source, device_type, endpoint, event_count, last_timestamp)
+                    SELECT
+                        strftime('%Y-%m-%d %H:00:00', timestamp),
+                        COALESCE(user_id, -1),
+                        COALESCE(user_name, 'Unknown User'),
+                        COALESCE(event_type, ''),
+                        UPPER(COALESCE(
+                            CASE WHEN json_valid(extra_data)
+                                THEN json_extract(extra_data, '$.format')
+                                ELSE extra_data
+                            END,
+                            'UNKNOWN'
+                        )),
+                        extra_data IS NOT NULL,
+                        COALESCE(CASE WHEN json_valid(extra_data) THEN json_extract(extra_data, '$.source') END, 'direct'),
+                        COALESCE(CASE WHEN json_valid(extra_data) THEN json_extract(extra_data, '$.device_type') END, 'unknown'),
+                        COALESCE(CASE WHEN json_valid(extra_data) THEN json_extract(extra_data, '$.endpoint') END,
+                                 event_type, ''),
+                        COUNT(*),
+                        MAX(timestamp)
+                    FROM cwa_user_activity
+                    WHERE id > ? AND id <= ? AND date(timestamp) IS NOT NULL
+                    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+                    ON CONFLICT(bucket, user_id, user_name, event_type, format, has_extra_data, source, device_type, endpoint)
+                    DO UPDATE SET event_count = event_count + excluded.event_count,
+                                  last_timestamp = MAX(COALESCE(last_timestamp, ''), excluded.last_timestamp)
+                """, (last_id, max_id))
+
+                self.cur.execute("""
+                    INSERT INTO cwa_activity_daily_items (day, user_id, item_id, event_type, item_title, event_count)
+                    SELECT date(timestamp), COALESCE(user_id, -1), item_id, COALESCE(event_type, ''),
+                           MAX(item_title), COUNT(*)
+                    FROM cwa_user_activity
+                    WHERE id > ? AND id <= ? AND item_id IS NOT NULL AND date(timestamp) IS NOT NULL
+                    GROUP BY 1, 2, 3, 4
+                    ON CONFLICT(day, user_id, item_id, event_type)
+                    DO UPDATE SET event_count = event_count + excluded.event_count,
+                                  item_title = COALESCE(excluded.item_title, item_title)
+                """, (last_id, max_id))
+
+                self.cur.execute("UPDATE cwa_activity_rollup_state SET last_rolled_id = ?, last_rollup = CURRENT_TIMESTAMP WHERE id = 1",
+                                 (max_id,))
+                self.con.commit()
+                return pending
+            except Exception:
+                self.con.rollback()
+                raise
         except Exception as e:
-            print(f"[cwa-db] Error getting reading velocity: {e}")
-            return []
+            print(f"[cwa-db] Error rolling up user activity: {e}")
+            return 0
 
-    def get_format_preferences(self, days=None, start_date=None, end_date=None, user_id=None):
-        """Returns format preferences by user for stacked bar chart.
-        
-        Returns list of tuples: (user_name, format, count)
+    def compact_activity(self, retention_days=None) -> int:
+        """Deletes raw activity events older than the retention window once they are rolled up.
+
+        retention_days defaults to the activity_raw_retention_days setting, 0 keeps raw events forever.
+        Returns the number of deleted events.
         """
+        if retention_days is None:
+            retention_days = int(self.cwa_settings.get('activity_raw_retention_days', 0) or 0)
+        if retention_days <= 0:
+            return 0
+        self.rollup_activity()
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
-            
-            self.cur.execute(f"""
-                SELECT 
-                    COALESCE(user_name, 'Unknown User') as user_name,
-                    UPPER(COALESCE(
-                        CASE WHEN json_valid(extra_data) 
-                            THEN json_extract(extra_data, '$.format')
-                            ELSE extra_data
-                        END,
-                        'UNKNOWN'
-                    )) as format,
-                    COUNT(*) as count
-                FROM cwa_user_activity
-                WHERE event_type IN ('DOWNLOAD', 'READ', 'EMAIL')
-                    AND {combined_filter}
-                GROUP BY user_name, format
-                ORDER BY user_name, count DESC
-            """)
-            return self.cur.fetchall()
+            self.cur.execute("""
+                DELETE FROM cwa_user_activity
+                WHERE id <= (SELECT last_rolled_id FROM cwa_activity_rollup_state WHERE id = 1)
+                  AND timestamp < datetime('now', ?)
+            """, (f"-{int(retention_days)} days",))
+            deleted = self.cur.rowcount
+            self.cur.execute("UPDATE cwa_activity_rollup_state SET last_compaction = CURRENT_TIMESTAMP WHERE id = 1")
+            self.con.commit()
+            return deleted
         except Exception as e:
-            print(f"[cwa-db] Error getting format preferences: {e}")
-            return []
+            print(f"[cwa-db] Error compacting user activity: {e}")
+            return 0
 
     def get_discovery_sources(self, days=None, start_date=None, end_date=None, user_id=None):
         """Returns count of book discoveries grouped by source.
@@ -1048,28 +1095,12 @@ class CWA_DB:
         Returns list of tuples: (source, count)
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
             self.cur.execute(f"""
-                SELECT 
-                    COALESCE(
-                        CASE WHEN json_valid(extra_data) 
-                            THEN json_extract(extra_data, '$.source')
-                            ELSE NULL
-                        END,
-                        'direct'
-                    ) as source,
-                    COUNT(*) as count
-                FROM cwa_user_activity
+                SELECT source, SUM(event_count) as count
+                FROM cwa_activity_hourly
                 WHERE event_type IN ('READ', 'DOWNLOAD')
                     AND {combined_filter}
                 GROUP BY source
@@ -1086,28 +1117,12 @@ class CWA_DB:
         Returns list of tuples: (device_type, count)
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
             self.cur.execute(f"""
-                SELECT 
-                    COALESCE(
-                        CASE WHEN json_valid(extra_data) 
-                            THEN json_extract(extra_data, '$.device_type')
-                            ELSE NULL
-                        END,
-                        'unknown'
-                    ) as device_type,
-                    COUNT(*) as count
-                FROM cwa_user_activity
+                SELECT device_type, SUM(event_count) as count
+                FROM cwa_activity_hourly
                 WHERE {combined_filter}
                 GROUP BY device_type
                 ORDER BY count DESC
@@ -1742,16 +1757,8 @@ class CWA_DB:
         Returns: List of tuples: (category, count)
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
             # Categorize events
             self.cur.execute(f"""
@@ -1763,8 +1770,8 @@ class CWA_DB:
                         WHEN event_type IN ('DOWNLOAD', 'READ', 'SEARCH', 'LOGIN') THEN 'Web UI'
                         ELSE 'Other'
                     END as category,
-                    COUNT(*) as count
-                FROM cwa_user_activity
+                    SUM(event_count) as count
+                FROM cwa_activity_hourly
                 WHERE {combined_filter}
                 GROUP BY category
                 ORDER BY count DESC
@@ -1790,36 +1797,12 @@ class CWA_DB:
         Returns: List of tuples: (endpoint, category, count, last_accessed)
         """
         try:
-            import json
-            
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
-            # Debug: Check what event types actually exist
-            debug_query = f"SELECT DISTINCT event_type FROM cwa_user_activity WHERE {combined_filter}"
-            print(f"[cwa-db] Checking event types with filter: {debug_query}")
-            self.cur.execute(debug_query)
-            event_types = self.cur.fetchall()
-            print(f"[cwa-db] Found event types: {event_types}")
-            
-            # Debug: Check what events exist
-            query = f"""
+            self.cur.execute(f"""
                 SELECT 
-                    CASE
-                        WHEN extra_data IS NOT NULL AND extra_data != '' 
-                            AND json_valid(extra_data) = 1
-                            AND json_extract(extra_data, '$.endpoint') IS NOT NULL 
-                        THEN json_extract(extra_data, '$.endpoint')
-                        ELSE event_type
-                    END as endpoint,
+                    endpoint,
                     CASE 
                         WHEN event_type = 'KOBO_SYNC' THEN 'Kobo'
                         WHEN event_type = 'OPDS_ACCESS' THEN 'OPDS'
@@ -1830,22 +1813,16 @@ class CWA_DB:
                         WHEN event_type = 'LOGIN' THEN 'Authentication'
                         ELSE 'Other'
                     END as category,
-                    COUNT(*) as access_count,
-                    MAX(timestamp) as last_accessed
-                FROM cwa_user_activity
+                    SUM(event_count) as access_count,
+                    MAX(last_timestamp) as last_accessed
+                FROM cwa_activity_hourly
                 WHERE {combined_filter}
                 GROUP BY endpoint, category
-                HAVING COUNT(*) > 0
+                HAVING SUM(event_count) > 0
                 ORDER BY access_count DESC, last_accessed DESC
-                LIMIT {limit}
-            """
-            
-            print(f"[cwa-db] Endpoint frequency query: {query}")
-            self.cur.execute(query)
-            
-            results = self.cur.fetchall()
-            print(f"[cwa-db] Endpoint frequency results: {results}")
-            return results
+                LIMIT {int(limit)}
+            """)
+            return self.cur.fetchall()
             
         except Exception as e:
             print(f"[cwa-db] Error getting endpoint frequency: {e}")
@@ -1864,24 +1841,16 @@ class CWA_DB:
         Returns: List of tuples: (day_of_week, hour, count)
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
             # Get API activity by time (focus on API events)
             self.cur.execute(f"""
                 SELECT 
-                    CAST(strftime('%w', timestamp) AS INTEGER) as day_of_week,
-                    CAST(strftime('%H', timestamp) AS INTEGER) as hour,
-                    COUNT(*) as api_count
-                FROM cwa_user_activity
+                    CAST(strftime('%w', bucket) AS INTEGER) as day_of_week,
+                    CAST(strftime('%H', bucket) AS INTEGER) as hour,
+                    SUM(event_count) as api_count
+                FROM cwa_activity_hourly
                 WHERE event_type IN ('KOBO_SYNC', 'OPDS_ACCESS', 'EMAIL', 'DOWNLOAD')
                     AND {combined_filter}
                 GROUP BY day_of_week, hour
@@ -2123,23 +2092,15 @@ class CWA_DB:
         hour: 0-23
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
             self.cur.execute(f"""
                 SELECT 
-                    CAST(strftime('%w', timestamp) AS INTEGER) as day_of_week,
-                    CAST(strftime('%H', timestamp) AS INTEGER) as hour,
-                    COUNT(*) as activity_count
-                FROM cwa_user_activity
+                    CAST(strftime('%w', bucket) AS INTEGER) as day_of_week,
+                    CAST(strftime('%H', bucket) AS INTEGER) as hour,
+                    SUM(event_count) as activity_count
+                FROM cwa_activity_hourly
                 WHERE {combined_filter}
                 GROUP BY day_of_week, hour
                 ORDER BY day_of_week, hour
@@ -2156,22 +2117,15 @@ class CWA_DB:
         week_label format: 'YYYY-Www' (e.g., '2025-W01')
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = (self._build_date_filter("day", days, start_date, end_date, whole_days=True)
+                               + self._build_user_filter(user_id))
             
             self.cur.execute(f"""
                 SELECT 
-                    strftime('%Y-W%W', timestamp) as week,
+                    strftime('%Y-W%W', day) as week,
                     COUNT(DISTINCT item_id) as books_read
-                FROM cwa_user_activity
+                FROM cwa_activity_daily_items
                 WHERE event_type = 'READ'
                     AND {combined_filter}
                 GROUP BY week
@@ -2188,26 +2142,15 @@ class CWA_DB:
         Returns list of tuples: (user_name, format, count)
         """
         try:
-            # Build date filter
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
-            user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            self.rollup_activity()
+            combined_filter = self._build_date_filter("bucket", days, start_date, end_date) + self._build_user_filter(user_id)
             
             self.cur.execute(f"""
                 SELECT 
-                    COALESCE(user_name, 'Unknown User') as user_name,
-                    UPPER(COALESCE(
-                        json_extract(extra_data, '$.format'),
-                        'Unknown'
-                    )) as format,
-                    COUNT(*) as count
-                FROM cwa_user_activity
+                    user_name,
+                    format,
+                    SUM(event_count) as count
+                FROM cwa_activity_hourly
                 WHERE event_type IN ('DOWNLOAD', 'READ')
                     AND {combined_filter}
                 GROUP BY user_name, format
@@ -2221,6 +2164,8 @@ class CWA_DB:
     def get_dashboard_stats(self, days=None, start_date=None, end_date=None, user_id=None):
         """Returns comprehensive activity stats for the user dashboard.
         
+        Counts come from the activity rollup tables, only the recent searches list reads raw events.
+
         Args:
             days: Number of days back from now (legacy support)
             start_date: Start date string 'YYYY-MM-DD' (takes precedence over days)
@@ -2228,22 +2173,19 @@ class CWA_DB:
             user_id: Filter stats for specific user ID (optional)
         """
         try:
+            self.rollup_activity()
+
             # Use date range if provided, otherwise fall back to days
-            if start_date and end_date:
-                date_filter = f"timestamp BETWEEN date('{start_date}') AND date('{end_date}', '+1 day')"
-            else:
-                days = days or 30  # Default to 30 days
-                date_filter = f"timestamp >= date('now', '-{days} days')"
-            
-            # Add user filter if provided
             user_filter = self._build_user_filter(user_id)
-            combined_filter = date_filter + user_filter
+            combined_filter = self._build_date_filter("timestamp", days, start_date, end_date) + user_filter
+            hourly_filter = self._build_date_filter("bucket", days, start_date, end_date) + user_filter
+            items_filter = self._build_date_filter("day", days, start_date, end_date, whole_days=True) + user_filter
             
             # 1. Activity timeline - Daily counts by event type
             self.cur.execute(f"""
-                SELECT date(timestamp) as day, event_type, COUNT(*) as count
-                FROM cwa_user_activity 
-                WHERE {combined_filter}
+                SELECT date(bucket) as day, NULLIF(event_type, '') as event_type, SUM(event_count) as count
+                FROM cwa_activity_hourly 
+                WHERE {hourly_filter}
                 GROUP BY day, event_type
                 ORDER BY day ASC
             """)
@@ -2253,9 +2195,9 @@ class CWA_DB:
             if self._has_user_filter(user_id):
                 # Show most active days for specific user
                 self.cur.execute(f"""
-                    SELECT date(timestamp) as day, COUNT(*) as activity_count
-                    FROM cwa_user_activity 
-                    WHERE {combined_filter}
+                    SELECT date(bucket) as day, SUM(event_count) as activity_count
+                    FROM cwa_activity_hourly 
+                    WHERE {hourly_filter}
                     GROUP BY day
                     ORDER BY activity_count DESC 
                     LIMIT 10
@@ -2264,9 +2206,9 @@ class CWA_DB:
             else:
                 # Show top active users across all users
                 self.cur.execute(f"""
-                    SELECT user_id, COALESCE(user_name, 'Unknown User') as user_name, COUNT(*) as activity_count
-                    FROM cwa_user_activity 
-                    WHERE {combined_filter}
+                    SELECT NULLIF(user_id, -1) as user_id, user_name, SUM(event_count) as activity_count
+                    FROM cwa_activity_hourly 
+                    WHERE {hourly_filter}
                     GROUP BY user_id, user_name
                     ORDER BY activity_count DESC 
                     LIMIT 10
@@ -2275,12 +2217,11 @@ class CWA_DB:
 
             # 3. Most popular books (reads + downloads + emails combined)
             self.cur.execute(f"""
-                SELECT item_title, item_id, COUNT(*) as hits
-                FROM cwa_user_activity 
-                WHERE item_id IS NOT NULL 
-                  AND event_type IN ('DOWNLOAD', 'READ', 'EMAIL')
-                  AND {combined_filter}
-                GROUP BY item_id, item_title
+                SELECT MAX(item_title) as item_title, item_id, SUM(event_count) as hits
+                FROM cwa_activity_daily_items 
+                WHERE event_type IN ('DOWNLOAD', 'READ', 'EMAIL')
+                  AND {items_filter}
+                GROUP BY item_id
                 ORDER BY hits DESC 
                 LIMIT 10
             """)
@@ -2300,19 +2241,11 @@ class CWA_DB:
 
             # 5. Download format distribution
             self.cur.execute(f"""
-                SELECT 
-                    UPPER(COALESCE(
-                        CASE WHEN json_valid(extra_data) 
-                            THEN json_extract(extra_data, '$.format')
-                            ELSE extra_data 
-                        END,
-                        'UNKNOWN'
-                    )) as format,
-                    COUNT(*) as count
-                FROM cwa_user_activity
+                SELECT format, SUM(event_count) as count
+                FROM cwa_activity_hourly
                 WHERE event_type IN ('DOWNLOAD', 'EMAIL')
-                  AND extra_data IS NOT NULL
-                  AND {combined_filter}
+                  AND has_extra_data = 1
+                  AND {hourly_filter}
                 GROUP BY format
                 ORDER BY count DESC
             """)
@@ -2320,46 +2253,39 @@ class CWA_DB:
 
             # 6. Event type breakdown (LOGIN, DOWNLOAD, READ, SEARCH, EMAIL)
             self.cur.execute(f"""
-                SELECT event_type, COUNT(*) as count
-                FROM cwa_user_activity
-                WHERE {combined_filter}
+                SELECT NULLIF(event_type, '') as event_type, SUM(event_count) as count
+                FROM cwa_activity_hourly
+                WHERE {hourly_filter}
                 GROUP BY event_type
                 ORDER BY count DESC
             """)
             event_breakdown = self.cur.fetchall()
 
             # 7. Total activity metrics
-            if self._has_user_filter(user_id):
-                # For single user, show total logins instead of active users
-                self.cur.execute(f"""
-                    SELECT 
-                        COUNT(*) as total_events,
-                        COUNT(CASE WHEN event_type = 'LOGIN' THEN 1 END) as total_logins,
-                        COUNT(DISTINCT CASE WHEN event_type IN ('DOWNLOAD', 'EMAIL') THEN item_id END) as unique_downloads,
-                        COUNT(DISTINCT CASE WHEN event_type = 'READ' THEN item_id END) as unique_reads,
-                        0 as active_users,
-                        COUNT(CASE WHEN event_type IN ('DOWNLOAD', 'EMAIL') THEN 1 END) as total_downloads,
-                        COUNT(CASE WHEN event_type = 'READ' THEN 1 END) as total_reads,
-                        COUNT(CASE WHEN event_type = 'SEARCH' THEN 1 END) as total_searches
-                    FROM cwa_user_activity
-                    WHERE {combined_filter}
-                """)
-            else:
-                # For all users, show active user count
-                self.cur.execute(f"""
-                    SELECT 
-                        COUNT(*) as total_events,
-                        COUNT(CASE WHEN event_type = 'LOGIN' THEN 1 END) as total_logins,
-                        COUNT(DISTINCT CASE WHEN event_type IN ('DOWNLOAD', 'EMAIL') THEN item_id END) as unique_downloads,
-                        COUNT(DISTINCT CASE WHEN event_type = 'READ' THEN item_id END) as unique_reads,
-                        COUNT(DISTINCT user_id) as active_users,
-                        COUNT(CASE WHEN event_type IN ('DOWNLOAD', 'EMAIL') THEN 1 END) as total_downloads,
-                        COUNT(CASE WHEN event_type = 'READ' THEN 1 END) as total_reads,
-                        COUNT(CASE WHEN event_type = 'SEARCH' THEN 1 END) as total_searches
-                    FROM cwa_user_activity
-                    WHERE {combined_filter}
-                """)
-            totals = self.cur.fetchone()
+            # For a single user the active user count is not meaningful, total logins are shown instead
+            active_users = "0" if self._has_user_filter(user_id) else "COUNT(DISTINCT NULLIF(user_id, -1))"
+            self.cur.execute(f"""
+                SELECT 
+                    COALESCE(SUM(event_count), 0) as total_events,
+                    COALESCE(SUM(CASE WHEN event_type = 'LOGIN' THEN event_count END), 0) as total_logins,
+                    {active_users} as active_users,
+                    COALESCE(SUM(CASE WHEN event_type IN ('DOWNLOAD', 'EMAIL') THEN event_count END), 0) as total_downloads,
+                    COALESCE(SUM(CASE WHEN event_type = 'READ' THEN event_count END), 0) as total_reads,
+                    COALESCE(SUM(CASE WHEN event_type = 'SEARCH' THEN event_count END), 0) as total_searches
+                FROM cwa_activity_hourly
+                WHERE {hourly_filter}
+            """)
+            event_totals = self.cur.fetchone()
+            self.cur.execute(f"""
+                SELECT 
+                    COUNT(DISTINCT CASE WHEN event_type IN ('DOWNLOAD', 'EMAIL') THEN item_id END) as unique_downloads,
+                    COUNT(DISTINCT CASE WHEN event_type = 'READ' THEN item_id END) as unique_reads
+                FROM cwa_activity_daily_items
+                WHERE {items_filter}
+            """)
+            item_totals = self.cur.fetchone()
+            totals = (event_totals[0], event_totals[1], item_totals[0], item_totals[1],
+                      event_totals[2], event_totals[3], event_totals[4], event_totals[5])
 
             return {
                 "timeline": timeline_data or [],
@@ -2540,6 +2466,153 @@ class CWA_DB:
             print(f"[cwa-db] Error getting resolution history: {e}")
             return []
 
+    # ==============================
+    # Hardcover Outbox
+    # ==============================
+
+    def hardcover_outbox_put(self, user_id: int, book_id: int, kind: str, payload: str) -> bool:
+        """Queue a Hardcover write, replacing the pending write of the same user, book and kind."""
+        try:
+            now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+            self.cur.execute("""
+                INSERT INTO hardcover_outbox (user_id, book_id, kind, payload, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, book_id, kind) DO UPDATE SET
+                    payload = excluded.payload,
+                    updated_at = excluded.updated_at,
+                    version = version + 1,
+                    attempts = 0,
+                    next_attempt_at = 0,
+                    last_error = ''
+            """, (int(user_id), int(book_id), kind, payload, now, now))
+            self.con.commit()
+            return True
+        except Exception as e:
+            print(f"[cwa-db] Error queuing Hardcover write: {e}")
+            return False
+
+    def hardcover_outbox_due(self, now: float, limit: int = 20) -> list[dict]:
+        """Pending Hardcover writes whose next attempt is due, oldest first."""
+        try:
+            self.cur.execute("""
+                SELECT id, user_id, book_id, kind, payload, version, attempts
+                FROM hardcover_outbox
+                WHERE next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            """, (now, int(limit)))
+            cols = [d[0] for d in self.cur.description]
+            return [dict(zip(cols, row)) for row in self.cur.fetchall()]
+        except Exception as e:
+            print(f"[cwa-db] Error reading Hardcover outbox: {e}")
+            return []
+
+    def hardcover_outbox_done(self, row_id: int, version: int) -> bool:
+        """Remove a sent write, unless it was replaced by a newer one in the meantime."""
+        try:
+            self.cur.execute("DELETE FROM hardcover_outbox WHERE id=? AND version=?", (int(row_id), int(version)))
+            self.con.commit()
+            return self.cur.rowcount > 0
+        except Exception as e:
+            print(f"[cwa-db] Error removing Hardcover outbox entry: {e}")
+            return False
+
+    def hardcover_outbox_retry(self, row_id: int, version: int, next_attempt_at: float, error: str) -> None:
+        """Schedule the next attempt of a failed write, unless it was replaced by a newer one."""
+        try:
+            self.cur.execute("""
+                UPDATE hardcover_outbox
+                SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE id=? AND version=?
+            """, (next_attempt_at, str(error)[:500], int(row_id), int(version)))
+            self.con.commit()
+        except Exception as e:
+            print(f"[cwa-db] Error rescheduling Hardcover outbox entry: {e}")
+
+    def hardcover_outbox_next_attempt(self) -> float | None:
+        """Unix time the next pending write is due, None if the outbox is empty."""
+        try:
+            return self.cur.execute("SELECT MIN(next_attempt_at) FROM hardcover_outbox").fetchone()[0]
+        except Exception as e:
+            print(f"[cwa-db] Error reading Hardcover outbox: {e}")
+            return None
+
+    def get_hardcover_outbox_stats(self) -> dict:
+        """Queue depth of the Hardcover outbox for the stats page."""
+        stats = {'depth': 0, 'retrying': 0, 'oldest': None, 'last_error': ''}
+        try:
+            row = self.cur.execute("""
+                SELECT COUNT(*), SUM(CASE WHEN attempts > 0 THEN 1 ELSE 0 END), MIN(updated_at)
+                FROM hardcover_outbox
+            """).fetchone()
+            stats.update(depth=row[0] or 0, retrying=row[1] or 0, oldest=row[2])
+            error = self.cur.execute("""
+                SELECT last_error FROM hardcover_outbox
+                WHERE attempts > 0 AND last_error != ''
+                ORDER BY updated_at DESC LIMIT 1
+            """).fetchone()
+            if error:
+                stats['last_error'] = error[0]
+        except Exception as e:
+            print(f"[cwa-db] Error reading Hardcover outbox stats: {e}")
+        return stats
+
+    # ==============================
+    # Hardcover User Book Cache
+    # ==============================
+
+    def hardcover_user_book_get(self, hardcover_user_id: int, identifier: str, fetched_after: float) -> dict | None:
+        """Cached user_book of a Hardcover user and identifier, None if missing or fetched before the given time."""
+        try:
+            self.cur.execute("""
+                SELECT user_book_id, status_id, edition_id, pages, read_id, read_started_at, fetched_at
+                FROM hardcover_user_book_cache
+                WHERE hardcover_user_id=? AND identifier=? AND fetched_at >= ?
+            """, (int(hardcover_user_id), identifier, fetched_after))
+            row = self.cur.fetchone()
+            if not row:
+                return None
+            cols = [d[0] for d in self.cur.description]
+            return dict(zip(cols, row))
+        except Exception as e:
+            print(f"[cwa-db] Error reading Hardcover user book cache: {e}")
+            return None
+
+    def hardcover_user_book_put(self, hardcover_user_id: int, identifier: str, entry: dict, fetched_at: float) -> bool:
+        """Store or refresh the cached user_book of a Hardcover user and identifier."""
+        try:
+            self.cur.execute("""
+                INSERT OR REPLACE INTO hardcover_user_book_cache
+                    (hardcover_user_id, identifier, user_book_id, status_id, edition_id, pages, read_id,
+                     read_started_at, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (int(hardcover_user_id), identifier, int(entry['user_book_id']), int(entry['status_id']),
+                  int(entry['edition_id']), int(entry['pages']), int(entry['read_id']),
+                  entry.get('read_started_at'), fetched_at))
+            self.con.commit()
+            return True
+        except Exception as e:
+            print(f"[cwa-db] Error writing Hardcover user book cache: {e}")
+            return False
+
+    def hardcover_user_book_forget(self, identifiers: list[str], hardcover_user_id: int | None = None) -> int:
+        """Drop cached user_books of the given identifiers, of one Hardcover user or of all of them."""
+        if not identifiers:
+            return 0
+        try:
+            placeholders = ",".join("?" for _ in identifiers)
+            query = f"DELETE FROM hardcover_user_book_cache WHERE identifier IN ({placeholders})"
+            params = list(identifiers)
+            if hardcover_user_id is not None:
+                query += " AND hardcover_user_id=?"
+                params.append(int(hardcover_user_id))
+            self.cur.execute(query, params)
+            self.con.commit()
+            return self.cur.rowcount
+        except Exception as e:
+            print(f"[cwa-db] Error clearing Hardcover user book cache: {e}")
+            return 0
+
 
 def main():
     db = CWA_DB()
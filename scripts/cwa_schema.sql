@@ -44,6 +44,7 @@ CREATE TABLE IF NOT EXISTS cwa_settings(
     auto_ingest_ignored_formats TEXT DEFAULT "" NOT NULL,
     auto_convert_retained_formats TEXT DEFAULT "" NOT NULL,
     auto_ingest_automerge TEXT DEFAULT "new_record" NOT NULL,
+    auto_ingest_skip_known_files SMALLINT DEFAULT 0 NOT NULL,  -- skip files whose checksum is already in the library
     ingest_timeout_minutes INTEGER DEFAULT 15 NOT NULL,
     ingest_stale_temp_minutes INTEGER DEFAULT 120 NOT NULL,
     ingest_stale_temp_interval INTEGER DEFAULT 600 NOT NULL,
@@ -56,6 +57,7 @@ CREATE TABLE IF NOT EXISTS cwa_settings(
     archived_cleanup_schedule TEXT DEFAULT 'daily' NOT NULL,
     archived_cleanup_schedule_day TEXT DEFAULT 'sunday' NOT NULL,
     archived_cleanup_schedule_hour INTEGER DEFAULT 3 NOT NULL,
+    activity_raw_retention_days INTEGER DEFAULT 0 NOT NULL,  -- 0 = keep raw activity events forever
     enable_mobile_blur SMALLINT DEFAULT 1 NOT NULL,
     auto_metadata_fetch_enabled SMALLINT DEFAULT 0 NOT NULL,
     auto_metadata_smart_application SMALLINT DEFAULT 0 NOT NULL,
@@ -79,6 +81,8 @@ CREATE TABLE IF NOT EXISTS cwa_settings(
     duplicate_detection_series SMALLINT DEFAULT 0 NOT NULL,
     duplicate_detection_publisher SMALLINT DEFAULT 0 NOT NULL,
     duplicate_detection_format SMALLINT DEFAULT 0 NOT NULL,
+    duplicate_detection_content SMALLINT DEFAULT 0 NOT NULL,  -- also group books sharing a file checksum
+    duplicate_detection_similarity INTEGER DEFAULT 0 NOT NULL,  -- 0 = exact keys, 70-100 = title/author similarity threshold in percent
     hardcover_auto_fetch_enabled SMALLINT DEFAULT 0 NOT NULL,
     hardcover_auto_fetch_schedule TEXT DEFAULT 'weekly' NOT NULL,
     hardcover_auto_fetch_schedule_day TEXT DEFAULT 'sunday' NOT NULL,
@@ -133,6 +137,43 @@ CREATE INDEX IF NOT EXISTS idx_activity_user ON cwa_user_activity(user_id);
 CREATE INDEX IF NOT EXISTS idx_activity_event ON cwa_user_activity(event_type);
 CREATE INDEX IF NOT EXISTS idx_activity_time ON cwa_user_activity(timestamp);
 
+-- Hourly activity rollups for the stats dashboard, maintained incrementally from cwa_user_activity.
+-- Dimension columns are NOT NULL so the unique key can be used as an upsert target.
+CREATE TABLE IF NOT EXISTS cwa_activity_hourly (
+    bucket TEXT NOT NULL,  -- 'YYYY-MM-DD HH:00:00' (UTC, same clock as cwa_user_activity.timestamp)
+    user_id INTEGER NOT NULL DEFAULT -1,  -- -1 = no user
+    user_name TEXT NOT NULL DEFAULT 'Unknown User',
+    event_type TEXT NOT NULL DEFAULT '',
+    format TEXT NOT NULL DEFAULT 'UNKNOWN',
+    has_extra_data INTEGER NOT NULL DEFAULT 0,
+    source TEXT NOT NULL DEFAULT 'direct',
+    device_type TEXT NOT NULL DEFAULT 'unknown',
+    endpoint TEXT NOT NULL DEFAULT '',
+    event_count INTEGER NOT NULL DEFAULT 0,
+    last_timestamp DATETIME
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_activity_hourly_key ON cwa_activity_hourly(bucket, user_id, user_name, event_type, format, has_extra_data, source, device_type, endpoint);
+
+-- Daily per-book rollups, used for top books and distinct read/download counts
+CREATE TABLE IF NOT EXISTS cwa_activity_daily_items (
+    day TEXT NOT NULL,  -- 'YYYY-MM-DD'
+    user_id INTEGER NOT NULL DEFAULT -1,
+    item_id INTEGER NOT NULL,
+    event_type TEXT NOT NULL DEFAULT '',
+    item_title TEXT,
+    event_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_activity_daily_items_key ON cwa_activity_daily_items(day, user_id, item_id, event_type);
+
+-- Rollup watermark (singleton): raw events with id <= last_rolled_id are already counted in the rollups
+CREATE TABLE IF NOT EXISTS cwa_activity_rollup_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_rolled_id INTEGER DEFAULT 0 NOT NULL,
+    last_rollup DATETIME,
+    last_compaction DATETIME
+);
+INSERT OR IGNORE INTO cwa_activity_rollup_state (id, last_rolled_id) VALUES (1, 0);
+
 -- Hardcover auto-fetch match queue for manual review of ambiguous matches
 CREATE TABLE IF NOT EXISTS hardcover_match_queue(
     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
@@ -164,6 +205,37 @@ CREATE TABLE IF NOT EXISTS hardcover_auto_fetch_stats(
     avg_confidence REAL DEFAULT 0.0 NOT NULL
 );
 
+-- Pending Hardcover writes of the Kobo sync, at most one per user, book and kind (newer writes replace older ones)
+CREATE TABLE IF NOT EXISTS hardcover_outbox(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,                           -- 'progress' | 'add_book'
+    payload TEXT NOT NULL,                        -- JSON: hardcover identifiers and progress
+    version INTEGER DEFAULT 1 NOT NULL,           -- bumped on every replacement
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    attempts INTEGER DEFAULT 0 NOT NULL,
+    next_attempt_at REAL DEFAULT 0 NOT NULL,      -- unix time
+    last_error TEXT DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_hardcover_outbox_key ON hardcover_outbox(user_id, book_id, kind);
+CREATE INDEX IF NOT EXISTS idx_hardcover_outbox_due ON hardcover_outbox(next_attempt_at);
+
+-- The Hardcover user_book a book's identifiers resolved to, so progress updates can skip the lookup query
+CREATE TABLE IF NOT EXISTS hardcover_user_book_cache(
+    hardcover_user_id INTEGER NOT NULL,
+    identifier TEXT NOT NULL,                     -- e.g. 'hardcover-edition:123', the identifier the lookup used
+    user_book_id INTEGER NOT NULL,
+    status_id INTEGER NOT NULL,
+    edition_id INTEGER NOT NULL,
+    pages INTEGER NOT NULL,
+    read_id INTEGER NOT NULL,                     -- the open user_book_read progress is written to
+    read_started_at TEXT,
+    fetched_at REAL NOT NULL,                     -- unix time
+    PRIMARY KEY (hardcover_user_id, identifier)
+);
+
 -- Duplicate detection cache table
 CREATE TABLE IF NOT EXISTS cwa_duplicate_cache (
     id INTEGER PRIMARY KEY CHECK (id = 1),  -- Singleton table, only one row
@@ -196,6 +268,17 @@ CREATE TABLE IF NOT EXISTS cwa_duplicate_book_keys (
 CREATE INDEX IF NOT EXISTS idx_cwa_duplicate_book_keys_key
     ON cwa_duplicate_book_keys(criteria_fingerprint, duplicate_key);
 
+-- LSH band buckets of the MinHash title/author signatures, only filled in approximate duplicate mode
+CREATE TABLE IF NOT EXISTS cwa_duplicate_book_bands (
+    book_id INTEGER NOT NULL,
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    PRIMARY KEY (book_id, band)
+);
+
+CREATE INDEX IF NOT EXISTS idx_cwa_duplicate_book_bands_bucket
+    ON cwa_duplicate_book_bands(band, bucket);
+
 -- Auto-resolution audit log
 CREATE TABLE IF NOT EXISTS cwa_duplicate_resolutions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -488,6 +488,7 @@ def run_post_batch_follow_up() -> int:
         _post_internal_endpoint("/cwa-internal/reconnect-db"),
         _post_internal_endpoint("/duplicates/invalidate-cache"),
         _post_internal_endpoint("/cwa-internal/queue-duplicate-scan"),
+        _post_internal_endpoint("/cwa-internal/queue-epub-facts"),
     ]
     if all(checks):
         print("[ingest-processor] Post-batch follow-up completed", flush=True)
@@ -987,6 +988,8 @@ class NewBookProcessor:
                 self.generate_book_checksums(staged_path.stem, book_id=self.last_added_book_id)
             else:
                 self.generate_book_checksums(staged_path.stem)
+            if added_ids:
+                self.store_source_checksum(added_ids[-1])
 
             # If we overwrote an existing book, Calibre does not bump books.timestamp, only last_modified.
             # Update timestamp to last_modified for any rows changed by this import so sorting by 'new' reflects overwrites.
@@ -1299,6 +1302,53 @@ class NewBookProcessor:
             print(f"[ingest-processor] Error generating book checksums: {e}", flush=True)
             # Don't fail the import if checksum generation fails
 
+    def find_known_file_book_ids(self, file_path: str) -> list[int]:
+        """Return the ids of library books that have (or had) a file with the same format and partial MD5"""
+        try:
+            sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+            from cps.progress_syncing.checksums import calculate_koreader_partial_md5, find_books_by_checksum
+
+            checksum = calculate_koreader_partial_md5(file_path)
+            if not checksum:
+                return []
+            book_format = Path(file_path).suffix[1:]
+            with sqlite3.connect(self.metadata_db, timeout=30) as con:
+                return find_books_by_checksum(checksum, book_format, db_connection=con)
+        except Exception as e:
+            print(f"[ingest-processor] WARN: Could not check for known files: {e}", flush=True)
+            return []
+
+    def skip_known_file(self) -> bool:
+        """Skip calibredb add when the ingested file is already in the library, see auto_ingest_skip_known_files"""
+        if not self.cwa_settings.get('auto_ingest_skip_known_files'):
+            return False
+        if self.cwa_settings.get('auto_ingest_automerge') == 'overwrite':
+            return False
+        book_ids = self.find_known_file_book_ids(self.filepath)
+        if not book_ids:
+            return False
+        print(f"[ingest-processor] Skipping {self.filename}, the same file is already in the library (book ID {', '.join(map(str, book_ids))})", flush=True)
+        return True
+
+    def store_source_checksum(self, book_id: int) -> None:
+        """Record the checksum of the original ingest file, so a later re-import of it is recognised even after conversion or EPUB fixing
+
+        Stored with its own version, the newest checksum of a format stays the one of the library file"""
+        try:
+            sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+            from cps.progress_syncing.checksums import calculate_koreader_partial_md5, store_checksum, SOURCE_CHECKSUM_VERSION
+
+            if not os.path.exists(self.filepath):
+                return
+            checksum = calculate_koreader_partial_md5(self.filepath)
+            if not checksum:
+                return
+            with sqlite3.connect(self.metadata_db, timeout=30) as con:
+                store_checksum(book_id=book_id, book_format=self.input_format.upper(), checksum=checksum,
+                               version=SOURCE_CHECKSUM_VERSION, db_connection=con)
+        except Exception as e:
+            print(f"[ingest-processor] WARN: Could not store checksum of the original file: {e}", flush=True)
+
     def set_library_permissions(self):
         try:
             nsm = os.getenv("NETWORK_SHARE_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
@@ -1429,6 +1479,9 @@ def main(filepath=None):
             skip_delete = True
             return 0
 
+        if nbp.skip_known_file():
+            return 0
+
         if nbp.is_target_format: # File can just be imported
             print(f"\n[ingest-processor]: No conversion needed for {nbp.filename}, importing now...", flush=True)
             nbp.add_book_to_library(filepath)
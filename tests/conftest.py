@@ -415,6 +415,27 @@ def mock_calibre_tools(mocker):
     return mocks
 
 
+# Modules imported while collecting, before any test replaced them with stubs
+_collected_modules = {}
+
+
+@pytest.fixture
+def collected_modules(monkeypatch):
+    """
+    Run a test against the modules that were imported at collection time.
+
+    Some unit tests install stub ``cps`` or ``sqlalchemy`` packages in
+    ``sys.modules`` and leave them behind. Lazy imports inside the real modules
+    would pick those stubs up, so they are put back for the duration of the test.
+    """
+    for name, module in _collected_modules.items():
+        if sys.modules.get(name) is not module:
+            monkeypatch.setitem(sys.modules, name, module)
+    for name, module in list(sys.modules.items()):
+        if name not in _collected_modules and getattr(module, '__spec__', None) is None:
+            monkeypatch.delitem(sys.modules, name)
+
+
 # ============================================================================
 # Skip Markers for Conditional Tests
 # ============================================================================
@@ -465,6 +486,11 @@ def pytest_collection_modifyitems(config, items):
             item.add_marker(skip_docker_integration)
 
 
+def pytest_collection_finish(session):
+    """Remember the imported modules for the collected_modules fixture."""
+    _collected_modules.update(sys.modules)
+
+
 # ============================================================================
 # Docker Container Fixtures (for integration/e2e tests)
 # ============================================================================
@@ -17,6 +17,7 @@ Usage:
 
 import zipfile
 from pathlib import Path
+import random
 import sys
 import io
 
@@ -281,6 +282,81 @@ def create_epub_with_metadata(output_path: Path) -> None:
     print(f"  ✓ Created ({size:,} bytes)")
 
 
+_TITLE_WORDS = (
+    "amber", "ancient", "archive", "autumn", "beneath", "bitter", "blackwood", "broken", "candle", "castle",
+    "cathedral", "chronicle", "cinder", "clockwork", "crimson", "crossing", "crown", "daughter", "distant",
+    "dragon", "dream", "dusk", "echoes", "emerald", "empire", "ember", "eternal", "falcon", "fallen", "forest",
+    "forgotten", "fortune", "garden", "ghost", "glass", "golden", "harbor", "harvest", "hidden", "hollow",
+    "horizon", "hunter", "iron", "island", "journey", "kingdom", "lantern", "legacy", "letters", "lighthouse",
+    "marble", "meadow", "memory", "midnight", "mirror", "moonlit", "mountain", "narrow", "northern", "ocean",
+    "orchard", "painted", "paper", "phantom", "pilgrim", "prince", "quiet", "raven", "republic", "river",
+    "sapphire", "scarlet", "secret", "shadow", "shattered", "silent", "silver", "sorrow", "spring", "stolen",
+    "storm", "summer", "sunken", "tempest", "thorn", "thunder", "tower", "twilight", "valley", "velvet",
+    "voyage", "wanderer", "whisper", "widow", "winter", "wolves", "wonder", "yesterday", "zephyr",
+)
+_FIRST_NAMES = (
+    "Ada", "Bram", "Clara", "Dorian", "Edith", "Felix", "Greta", "Hugo", "Ines", "Jonas", "Karin", "Leon",
+    "Mara", "Nils", "Olga", "Pavel", "Rosa", "Soren", "Tilda", "Viktor",
+)
+_LAST_NAMES = (
+    "Albrecht", "Bergman", "Castellano", "Duvall", "Eriksen", "Fontaine", "Gallagher", "Hartmann", "Ibarra",
+    "Jansson", "Kowalski", "Lindqvist", "Moreau", "Novak", "Okafor", "Petrov", "Quinlan", "Rasmussen",
+    "Szabo", "Takahashi",
+)
+
+
+def _near_duplicate_variant(rng: random.Random, title: str, author: str) -> tuple[str, str]:
+    """Returns a variant of a title and author as it shows up when the same book is imported twice."""
+    variant = rng.choice(("case", "author_order", "article", "typo"))
+    if variant == "case":
+        return title.upper() + "!", author
+    if variant == "author_order":
+        first, last = author.split(" ", 1)
+        return title, f"{last}, {first}"
+    if variant == "article":
+        return f"The {title}", author
+    words = title.split(" ")
+    index = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[index]
+    position = rng.randrange(1, len(word) - 2)
+    words[index] = word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    return " ".join(words), author
+
+
+def generate_synthetic_library(book_count: int, near_duplicate_rate: float = 0.1, seed: int = 0) -> list[dict]:
+    """
+    Generate metadata records of a synthetic library for duplicate detection benchmarks.
+
+    Every record is a dict with id, title, author, language and work. Records sharing a
+    work are the same book imported twice with a small variation (typo, upper case,
+    leading article or "Last, First" author), all other works are distinct.
+    """
+    rng = random.Random(seed)
+    records = []
+    works = []
+    seen_titles = set()
+    while len(records) < book_count:
+        if works and rng.random() < near_duplicate_rate:
+            work, title, author = rng.choice(works)
+            title, author = _near_duplicate_variant(rng, title, author)
+        else:
+            title = " ".join(rng.sample(_TITLE_WORDS, rng.randint(4, 6))).title()
+            if title in seen_titles:
+                continue
+            seen_titles.add(title)
+            author = f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+            work = len(works)
+            works.append((work, title, author))
+        records.append({
+            "id": len(records) + 1,
+            "title": title,
+            "author": author,
+            "language": "eng",
+            "work": work,
+        })
+    return records
+
+
 def main():
     """Main entry point."""
     print("=" * 70)
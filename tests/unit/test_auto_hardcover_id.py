@@ -0,0 +1,168 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the batched Hardcover ID matching task against a stub GraphQL server"""
+
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cps import db, http_client, ub
+from cps.metadata_provider import hardcover as hardcover_provider
+from cps.services.worker import STAT_FINISH_SUCCESS
+from cps.tasks import auto_hardcover_id
+
+DUNE_ISBN = '9780441013593'
+CATALOG = [
+    {'id': 101, 'title': 'Dune', 'slug': 'dune', 'author_names': ['Frank Herbert'], 'isbns': [DUNE_ISBN]},
+    {'id': 102, 'title': 'Dune Messiah', 'slug': 'dune-messiah', 'author_names': ['Frank Herbert'], 'isbns': []},
+]
+
+
+class _GraphQLHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        _GraphQLHandler.requests.append(payload)
+        data = {}
+        for alias, query in payload['variables'].items():
+            hits = [{'document': book} for book in CATALOG
+                    if query in book['isbns'] or query.lower().startswith(book['title'].lower())
+                    or book['title'].lower().startswith(query.split()[0].lower())]
+            data[alias] = {'results': json.dumps({'hits': hits})}
+        body = json.dumps({'data': data}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _library():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+    @event.listens_for(engine, 'connect')
+    def attach(connection, __):
+        connection.execute("attach database ':memory:' as calibre")
+
+    db.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    titles = ['Dune', 'Dune Messiah', 'Obscure Pamphlet', 'Already Linked', 'Dun']
+    session.execute(db.Books.__table__.insert(), [
+        dict(id=book_id, title=title, sort=title, author_sort='Herbert, Frank', path='book{}'.format(book_id),
+             has_cover=0, uuid=str(book_id), timestamp=datetime(2026, 1, 1), pubdate=datetime(2026, 1, 1),
+             last_modified=datetime(2026, 1, 1))
+        for book_id, title in enumerate(titles, start=1)])
+    session.execute(db.Authors.__table__.insert(), [dict(id=1, name='Frank Herbert', sort='Herbert, Frank', link=''),
+                                                    dict(id=2, name='Somebody Else', sort='Else, Somebody', link='')])
+    session.execute(db.books_authors_link.insert(),
+                    [dict(book=book_id, author=2 if book_id == 5 else 1) for book_id in range(1, 6)])
+    session.execute(db.Identifiers.__table__.insert(), [dict(type='isbn', val='978-0441013593', book=1),
+                                                        dict(type='hardcover-id', val='555', book=4)])
+    session.commit()
+    return session
+
+
+@pytest.fixture
+def hardcover(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _GraphQLHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _GraphQLHandler.requests = []
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    ub.Base.metadata.create_all(engine)
+    app_session = scoped_session(sessionmaker(bind=engine))
+    calibre_session = _library()
+
+    monkeypatch.setattr(hardcover_provider.Hardcover, 'BASE_URL', 'http://127.0.0.1:{}/'.format(server.server_port))
+    monkeypatch.setattr(hardcover_provider, 'get_http_session',
+                        lambda name: http_client.get_http_session('hardcover-stub', validate=False))
+    monkeypatch.setattr(auto_hardcover_id, 'HARDCOVER_AUTO_ID_CURSOR_FILE', str(tmp_path / 'cursor.json'))
+    monkeypatch.setattr(auto_hardcover_id.db, 'CalibreDB', lambda **kwargs: SimpleNamespace(session=calibre_session))
+    monkeypatch.setattr(auto_hardcover_id.TaskAutoHardcoverID, '_get_hardcover_token', lambda self: 'token')
+    monkeypatch.setattr(auto_hardcover_id.TaskAutoHardcoverID, '_save_stats', lambda self: None)
+    monkeypatch.setattr(ub, 'session', app_session, raising=False)
+    monkeypatch.setattr(ub, 'init_db_thread', lambda: None)
+    yield SimpleNamespace(calibre=calibre_session, app=app_session, cursor=tmp_path / 'cursor.json')
+    app_session.remove()
+    server.shutdown()
+    server.server_close()
+
+
+def _task(**kwargs):
+    return auto_hardcover_id.TaskAutoHardcoverID(rate_limit_delay=0, **kwargs)
+
+
+def _identifiers(session):
+    return sorted((row.book, row.type, row.val) for row in session.query(db.Identifiers)
+                  if row.type.startswith('hardcover'))
+
+
+@pytest.mark.unit
+class TestAutoHardcoverID:
+    def test_books_are_looked_up_in_one_request_and_scored_together(self, hardcover):
+        task = _task()
+        task.run(None)
+
+        assert task.stat == STAT_FINISH_SUCCESS and task.progress == 1.0
+        assert len(_GraphQLHandler.requests) == 1
+        request = _GraphQLHandler.requests[0]
+        assert 'q0: search(query: $q0' in request['query']
+        assert sorted(request['variables'].values()) == sorted([
+            DUNE_ISBN, 'Dune Frank Herbert', 'Dune Messiah Frank Herbert', 'Obscure Pamphlet Frank Herbert',
+            'Dun Somebody Else'])
+        assert _identifiers(hardcover.calibre) == [
+            (1, 'hardcover-id', '101'), (1, 'hardcover-slug', 'dune'),
+            (2, 'hardcover-id', '102'), (2, 'hardcover-slug', 'dune-messiah'),
+            (4, 'hardcover-id', '555')]
+        assert [entry.book_id for entry in hardcover.app.query(ub.HardcoverMatchQueue)] == [5]
+        assert (task.books_processed, task.auto_matched, task.queued_for_review, task.skipped_no_results) == (4, 2, 1, 1)
+        assert not hardcover.cursor.exists()
+
+    def test_cancelled_run_resumes_after_the_cursor(self, hardcover, monkeypatch):
+        cancelled = _task(lookup_batch_size=2)
+        monkeypatch.setattr(cancelled, '_cancel_requested', lambda: cancelled.requests_sent >= 1)
+        cancelled.run(None)
+
+        assert json.loads(hardcover.cursor.read_text())['last_book_id'] == 2
+        assert len(_GraphQLHandler.requests) == 1
+
+        resumed = _task(lookup_batch_size=2)
+        resumed.run(None)
+
+        assert resumed.books_processed == 2 and resumed.requests_sent == 1
+        assert sorted(_GraphQLHandler.requests[1]['variables'].values()) == [
+            'Dun Somebody Else', 'Obscure Pamphlet Frank Herbert']
+        assert not hardcover.cursor.exists()
+
+    def test_failed_requests_back_off_and_retry_the_same_books(self, hardcover, monkeypatch):
+        calls = []
+        search_batch = hardcover_provider.Hardcover.search_batch
+
+        def flaky(provider, searches, token, **kwargs):
+            calls.append(sorted(searches.values()))
+            if len(calls) == 1:
+                raise ConnectionError("rate limited")
+            return search_batch(provider, searches, token, **kwargs)
+
+        monkeypatch.setattr(hardcover_provider.Hardcover, 'search_batch', flaky)
+        task = _task()
+        task.run(None)
+
+        assert calls[0] == calls[1] and len(calls) == 2
+        assert task.errors == 1 and task.auto_matched == 2
@@ -0,0 +1,122 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the comic page index cache in cps/comic_pages.py"""
+
+import os
+import threading
+import zipfile
+
+import pytest
+
+from cps import comic_pages
+
+
+def _make_cbz(path, names):
+    with zipfile.ZipFile(path, 'w') as cbz:
+        for name in names:
+            cbz.writestr(name, name.encode())
+    return str(path)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = comic_pages.ComicArchiveCache(max_size=2)
+    monkeypatch.setattr(comic_pages, "archive_cache", cache)
+    yield cache
+    cache.clear()
+
+
+@pytest.mark.unit
+class TestComicPages:
+    def test_pages_are_natural_sorted_images_only(self, tmp_path, cache):
+        cbz = _make_cbz(tmp_path / "a.cbz", ["page10.jpg", "page2.png", "ComicInfo.xml", "page1.jpg"])
+        assert comic_pages.get_page_index(cbz, "cbz") == ["page1.jpg", "page2.png", "page10.jpg"]
+
+    def test_get_page_returns_raw_bytes_and_type(self, tmp_path, cache):
+        cbz = _make_cbz(tmp_path / "a.cbz", ["p1.jpg", "p2.png"])
+        data, mimetype, etag, count = comic_pages.get_page(cbz, "cbz", 1)
+        assert data == b"p2.png"
+        assert mimetype == "image/png"
+        assert count == 2
+        assert etag != comic_pages.get_page(cbz, "cbz", 0)[2]
+
+    def test_out_of_range_page(self, tmp_path, cache):
+        cbz = _make_cbz(tmp_path / "a.cbz", ["p1.jpg"])
+        with pytest.raises(IndexError):
+            comic_pages.get_page(cbz, "cbz", 1)
+
+    def test_archive_is_reused_between_pages(self, tmp_path, cache):
+        cbz = _make_cbz(tmp_path / "a.cbz", ["p1.jpg", "p2.jpg"])
+        first, __ = cache.get(cbz, "cbz")
+        second, __ = cache.get(cbz, "cbz")
+        assert first is second
+
+    def test_lru_evicts_oldest_archive(self, tmp_path, cache):
+        paths = [_make_cbz(tmp_path / "{}.cbz".format(i), ["p.jpg"]) for i in range(3)]
+        for path in paths:
+            cache.get(path, "cbz")
+        assert [key[0] for key in cache._archives] == paths[1:]
+
+    def test_replaced_file_gets_new_index(self, tmp_path, cache):
+        cbz = _make_cbz(tmp_path / "a.cbz", ["p1.jpg"])
+        comic_pages.get_page_index(cbz, "cbz")
+        _make_cbz(tmp_path / "a.cbz", ["p1.jpg", "p2.jpg", "p3.jpg"])
+        os.utime(cbz, ns=(1, 1))
+        assert len(comic_pages.get_page_index(cbz, "cbz")) == 3
+        assert len(cache._archives) == 1
+
+    def test_unsupported_format(self, tmp_path, cache):
+        path = tmp_path / "a.cb7"
+        path.write_bytes(b"")
+        with pytest.raises(comic_pages.ComicArchiveError):
+            comic_pages.get_page_index(str(path), "cb7")
+
+    def test_evicted_archive_still_serves_a_held_request(self, tmp_path, cache):
+        first = _make_cbz(tmp_path / "a.cbz", ["p1.jpg", "p2.jpg"])
+        archive, __ = cache.get(first, "cbz")
+        for i in range(2):
+            cache.get(_make_cbz(tmp_path / "{}.cbz".format(i), ["p.jpg"]), "cbz")
+        assert archive.closed
+        assert archive.read(1) == b"p2.jpg"
+
+    def test_eviction_waits_for_a_running_read(self, tmp_path, cache):
+        archive, __ = cache.get(_make_cbz(tmp_path / "a.cbz", ["p1.jpg"]), "cbz")
+        reading, release = threading.Event(), threading.Event()
+        read = archive._read
+
+        def slow_read(name):
+            reading.set()
+            release.wait(5)
+            return read(name)
+        archive._read = slow_read
+        result = []
+        reader = threading.Thread(target=lambda: result.append(archive.read(0)))
+        reader.start()
+        reading.wait(5)
+        closer = threading.Thread(target=archive.close)
+        closer.start()
+        closer.join(0.2)
+        assert closer.is_alive() and not archive.closed
+        release.set()
+        reader.join(5)
+        closer.join(5)
+        assert result == [b"p1.jpg"] and archive.closed
+
+    def test_pages_are_only_cached_privately(self, tmp_path, cache, monkeypatch):
+        from types import SimpleNamespace
+        from flask import Flask
+        from cps import web
+
+        cbz = _make_cbz(tmp_path / "a.cbz", ["p1.jpg", "p2.jpg"])
+        monkeypatch.setattr(web, "_get_comic_file", lambda book_id, book_format: cbz)
+        monkeypatch.setattr(web, "config", SimpleNamespace(config_rarfile_location=None))
+        app = Flask(__name__)
+        app.register_blueprint(web.web)
+        with app.test_request_context("/ajax/getcomic/1/cbz/0"):
+            response = web.get_comic_book.__wrapped__(1, "cbz", 0)
+        assert response.cache_control.private and not response.cache_control.public
+        assert response.cache_control.max_age == 86400
@@ -0,0 +1,148 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for content-hash duplicate lookups on book_format_checksums"""
+
+import importlib
+import sqlite3
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+
+from cps.progress_syncing.checksums import (
+    calculate_koreader_partial_md5,
+    find_books_by_checksum,
+    get_latest_checksum,
+    get_shared_checksum_groups,
+)
+from cps.progress_syncing.models import ensure_checksum_table
+
+CHECKSUM_ROWS = [
+    (1, 'EPUB', 'a' * 32),
+    (1, 'EPUB', 'b' * 32),  # history, the file was modified later
+    (2, 'EPUB', 'b' * 32),
+    (3, 'PDF', 'b' * 32),  # same checksum, other format
+    (4, 'EPUB', 'c' * 32),
+    (5, 'MOBI', 'd' * 32),
+    (6, 'MOBI', 'd' * 32),
+]
+
+
+@pytest.fixture
+def metadata_db(tmp_path, collected_modules):
+    path = tmp_path / 'metadata.db'
+    conn = sqlite3.connect(str(path))
+    conn.execute('CREATE TABLE books (id INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO books (id) VALUES (?)', [(book_id,) for book_id in range(1, 7)])
+    # Table as created by releases before the covering index
+    conn.execute('''
+        CREATE TABLE book_format_checksums (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book INTEGER NOT NULL,
+            format TEXT NOT NULL COLLATE NOCASE,
+            checksum TEXT NOT NULL,
+            version TEXT NOT NULL DEFAULT 'koreader',
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (book) REFERENCES books(id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_checksum ON book_format_checksums(checksum)')
+    conn.executemany('INSERT INTO book_format_checksums (book, format, checksum) VALUES (?, ?, ?)', CHECKSUM_ROWS)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.mark.unit
+class TestChecksumDuplicateLookups:
+    def test_existing_table_gets_covering_index(self, metadata_db):
+        conn = sqlite3.connect(str(metadata_db))
+        ensure_checksum_table(conn)
+        indexes = {row[1] for row in conn.execute('PRAGMA index_list(book_format_checksums)')}
+        plan = ' '.join(str(row[-1]) for row in conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT GROUP_CONCAT(DISTINCT book) FROM book_format_checksums
+            GROUP BY checksum, format HAVING COUNT(DISTINCT book) > 1
+        '''))
+
+        assert 'idx_checksum_format_book' in indexes
+        assert 'COVERING INDEX idx_checksum_format_book' in plan
+
+    def test_find_books_by_checksum_with_sqlite_and_sqlalchemy(self, metadata_db):
+        with sqlite3.connect(str(metadata_db)) as conn:
+            assert find_books_by_checksum('b' * 32, 'epub', db_connection=conn) == [1, 2]
+            assert find_books_by_checksum('b' * 32, db_connection=conn) == [1, 2, 3]
+            assert find_books_by_checksum('f' * 32, 'EPUB', db_connection=conn) == []
+
+        engine = create_engine('sqlite:///{}'.format(metadata_db))
+        with engine.connect() as conn:
+            assert find_books_by_checksum('d' * 32, 'MOBI', db_connection=conn) == [5, 6]
+
+    def test_shared_checksum_groups(self, metadata_db):
+        engine = create_engine('sqlite:///{}'.format(metadata_db))
+        with engine.connect() as conn:
+            groups = get_shared_checksum_groups(db_connection=conn)
+            assert sorted(groups) == [[1, 2], [5, 6]]
+            assert get_shared_checksum_groups(candidate_book_ids=[2], db_connection=conn) == [[1, 2]]
+            assert get_shared_checksum_groups(candidate_book_ids=[4], db_connection=conn) == []
+            assert get_shared_checksum_groups(candidate_book_ids=[], db_connection=conn) == []
+
+
+@pytest.fixture
+def processor(monkeypatch, metadata_db, tmp_path):
+    scripts_dir = Path(__file__).resolve().parents[2] / 'scripts'
+    monkeypatch.syspath_prepend(str(scripts_dir))
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    ingest_processor = importlib.import_module('ingest_processor')
+
+    ingest_file = tmp_path / 'ingest' / 'Book.epub'
+    ingest_file.parent.mkdir()
+    ingest_file.write_bytes(b'epub content' * 100)
+
+    nbp = object.__new__(ingest_processor.NewBookProcessor)
+    nbp.cwa_settings = {'auto_ingest_skip_known_files': 1, 'auto_ingest_automerge': 'new_record'}
+    nbp.filepath = str(ingest_file)
+    nbp.filename = ingest_file.name
+    nbp.input_format = 'epub'
+    nbp.metadata_db = str(metadata_db)
+    return nbp
+
+
+@pytest.mark.unit
+class TestKnownFileSkip:
+    def test_new_file_is_imported(self, processor):
+        assert processor.skip_known_file() is False
+
+    def test_known_file_is_skipped_after_its_source_checksum_was_stored(self, processor):
+        processor.store_source_checksum(4)
+        with sqlite3.connect(processor.metadata_db) as conn:
+            stored = conn.execute(
+                "SELECT checksum FROM book_format_checksums WHERE book = 4 AND format = 'EPUB' ORDER BY id DESC"
+            ).fetchone()[0]
+
+        assert stored == calculate_koreader_partial_md5(processor.filepath)
+        assert processor.find_known_file_book_ids(processor.filepath) == [4]
+        assert processor.skip_known_file() is True
+
+    def test_skip_is_opt_in_and_not_applied_with_overwrite(self, processor):
+        processor.store_source_checksum(4)
+
+        processor.cwa_settings['auto_ingest_automerge'] = 'overwrite'
+        assert processor.skip_known_file() is False
+        processor.cwa_settings = {'auto_ingest_skip_known_files': 0, 'auto_ingest_automerge': 'new_record'}
+        assert processor.skip_known_file() is False
+
+    def test_source_checksum_is_not_the_latest_library_checksum(self, processor, monkeypatch):
+        import cps
+
+        processor.store_source_checksum(4)
+        monkeypatch.setattr(cps, 'calibre_db',
+                            SimpleNamespace(engine=create_engine('sqlite:///{}'.format(processor.metadata_db))),
+                            raising=False)
+
+        assert get_latest_checksum(4, 'epub') == 'c' * 32
@@ -0,0 +1,157 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the CWA user activity rollups
+
+The stats dashboard reads hourly and daily rollup tables instead of scanning cwa_user_activity,
+these tests check the rollups count the same events as the raw table.
+"""
+
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+scripts_dir = Path(__file__).parent.parent.parent / "scripts"
+sys.path.insert(0, str(scripts_dir))
+
+
+@pytest.fixture
+def activity_db(temp_cwa_db):
+    db = temp_cwa_db
+    db.cur.execute("DELETE FROM cwa_user_activity")
+    db.cur.execute("DELETE FROM cwa_activity_hourly")
+    db.cur.execute("DELETE FROM cwa_activity_daily_items")
+    db.cur.execute("UPDATE cwa_activity_rollup_state SET last_rolled_id = "
+                   "(SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'cwa_user_activity')")
+    db.con.commit()
+    return db
+
+
+def _ts(days_ago=0, hour=12):
+    moment = datetime.now(timezone.utc).replace(hour=hour, minute=15, second=0, microsecond=0) - timedelta(days=days_ago)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _insert(db, user_id, user_name, event_type, item_id=None, item_title=None, extra_data=None, timestamp=None):
+    if isinstance(extra_data, dict):
+        extra_data = json.dumps(extra_data)
+    db.cur.execute("""
+        INSERT INTO cwa_user_activity (user_id, user_name, event_type, item_id, item_title, extra_data, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, user_name, event_type, item_id, item_title, extra_data, timestamp or _ts()))
+    db.con.commit()
+
+
+def _sample_events(db):
+    _insert(db, 1, "alice", "LOGIN", extra_data={"device_type": "desktop"}, timestamp=_ts(2, 8))
+    _insert(db, 1, "alice", "DOWNLOAD", 10, "Dune", {"format": "epub", "source": "search"}, _ts(2, 9))
+    _insert(db, 1, "alice", "DOWNLOAD", 10, "Dune", {"format": "epub"}, _ts(1, 9))
+    _insert(db, 1, "alice", "READ", 10, "Dune", {"format": "epub", "device_type": "mobile"}, _ts(1, 21))
+    _insert(db, 2, "bob", "READ", 11, "Emma", None, _ts(1, 21))
+    _insert(db, 2, "bob", "EMAIL", 11, "Emma", "mobi", _ts(0, 3))
+    _insert(db, 2, "bob", "KOBO_SYNC", extra_data={"endpoint": "/kobo/sync"}, timestamp=_ts(0, 4))
+    _insert(db, 2, None, "SEARCH", extra_data="dune", timestamp=_ts(0, 5))
+    _insert(db, 3, "carol", "LOGIN", timestamp=_ts(40, 8))
+
+
+@pytest.mark.unit
+class TestActivityRollup:
+    def test_rollup_is_incremental(self, activity_db):
+        _sample_events(activity_db)
+        assert activity_db.rollup_activity() == 9
+        assert activity_db.rollup_activity() == 0
+        total = activity_db.cur.execute("SELECT SUM(event_count) FROM cwa_activity_hourly").fetchone()[0]
+        assert total == 9
+
+        _insert(activity_db, 1, "alice", "LOGIN")
+        assert activity_db.rollup_activity() == 1
+        total = activity_db.cur.execute("SELECT SUM(event_count) FROM cwa_activity_hourly").fetchone()[0]
+        assert total == 10
+
+    def test_log_activity_rolls_up_on_insert(self, activity_db):
+        activity_db.log_activity(5, "dave", "DOWNLOAD", 42, "Ulysses", {"format": "pdf"})
+        watermark = activity_db.cur.execute("SELECT last_rolled_id FROM cwa_activity_rollup_state").fetchone()[0]
+        max_id = activity_db.cur.execute("SELECT MAX(id) FROM cwa_user_activity").fetchone()[0]
+        assert watermark == max_id
+        assert activity_db.cur.execute(
+            "SELECT item_id, event_count FROM cwa_activity_daily_items").fetchall() == [(42, 1)]
+
+    def test_dashboard_stats_match_raw_events(self, activity_db):
+        _sample_events(activity_db)
+        stats = activity_db.get_dashboard_stats(days=30)
+
+        assert stats["totals"] == {
+            "total_events": 8,
+            "total_logins": 1,
+            "unique_downloads": 2,
+            "unique_reads": 2,
+            "active_users": 2,
+            "total_downloads": 3,
+            "total_reads": 2,
+            "total_searches": 1,
+        }
+        assert stats["top_books"][0] == ("Dune", 10, 3)
+        assert dict(stats["format_distribution"]) == {"EPUB": 2, "MOBI": 1}
+        assert dict((row[1], row[2]) for row in stats["top_users"]) == {"alice": 4, "bob": 3, "Unknown User": 1}
+        assert len(stats["recent_searches"]) == 1
+
+    def test_breakdowns_read_json_fields(self, activity_db):
+        _sample_events(activity_db)
+        assert dict(activity_db.get_device_breakdown(days=30)) == {"unknown": 6, "desktop": 1, "mobile": 1}
+        assert dict(activity_db.get_discovery_sources(days=30)) == {"direct": 3, "search": 1}
+        endpoints = {row[0]: row[2] for row in activity_db.get_endpoint_frequency_grouped(days=30)}
+        assert endpoints["/kobo/sync"] == 1
+        assert endpoints["DOWNLOAD"] == 2
+
+    def test_user_and_date_range_filters(self, activity_db):
+        _sample_events(activity_db)
+        start = _ts(1)[:10]
+        stats = activity_db.get_dashboard_stats(start_date=start, end_date=start, user_id=1)
+        assert stats["totals"]["total_events"] == 2
+        assert stats["totals"]["unique_reads"] == 1
+        assert activity_db.get_reading_velocity(start_date=start, end_date=start, user_id=2)[0][1] == 1
+
+
+@pytest.mark.unit
+class TestActivityCompaction:
+    def test_compaction_keeps_rollups(self, activity_db):
+        _sample_events(activity_db)
+        before = activity_db.get_dashboard_stats(days=60)["totals"]
+
+        assert activity_db.compact_activity(retention_days=30) == 1
+        remaining = activity_db.cur.execute("SELECT COUNT(*) FROM cwa_user_activity").fetchone()[0]
+        assert remaining == 8
+        assert activity_db.get_dashboard_stats(days=60)["totals"] == before
+
+    def test_compaction_disabled_by_default(self, activity_db):
+        _sample_events(activity_db)
+        assert activity_db.compact_activity() == 0
+        assert activity_db.cur.execute("SELECT COUNT(*) FROM cwa_user_activity").fetchone()[0] == 9
+
+    def test_stored_retention_is_read_back_as_days(self, activity_db):
+        from cwa_db import CWA_DB
+
+        _sample_events(activity_db)
+        activity_db.update_cwa_settings({'activity_raw_retention_days': 90})
+        db = CWA_DB(verbose=False)
+        try:
+            assert db.cwa_settings['activity_raw_retention_days'] == 90
+            assert db.compact_activity() == 0
+            assert db.cur.execute("SELECT COUNT(*) FROM cwa_user_activity").fetchone()[0] == 9
+        finally:
+            db.con.close()
+
+    def test_compaction_never_drops_events_not_rolled_up(self, activity_db):
+        _sample_events(activity_db)
+        activity_db.rollup_activity()
+        activity_db.cur.execute("UPDATE cwa_activity_rollup_state SET last_rolled_id = 0")
+        activity_db.con.commit()
+        activity_db.rollup_activity = lambda: 0
+        assert activity_db.compact_activity(retention_days=30) == 0
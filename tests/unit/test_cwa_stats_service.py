@@ -0,0 +1,112 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the concurrent, cached CWA stats service"""
+
+import threading
+import time
+
+import pytest
+
+from cps.cwa_stats_service import STATS_TABS, StatsService, _fixed, _ranged
+
+
+class FakeReader:
+    def __init__(self):
+        self.thread = threading.get_ident()
+
+    def slow(self, days=None, start_date=None, end_date=None, user_id=None, delay=0.2):
+        time.sleep(delay)
+        return {'days': days, 'start_date': start_date, 'end_date': end_date, 'user_id': user_id,
+                'thread': self.thread}
+
+    def broken(self):
+        raise RuntimeError("boom")
+
+
+def _service(**kwargs):
+    tabs = {
+        'tab': {
+            'a': _ranged('slow', user=True),
+            'b': _ranged('slow'),
+            'c': _fixed('slow', delay=0.2),
+        },
+        'broken': {'x': _fixed('broken'), 'y': _ranged('broken', empty=dict), 'ok': _fixed('slow', delay=0)},
+    }
+    return StatsService(tabs=tabs, reader_factory=FakeReader, **kwargs)
+
+
+@pytest.mark.unit
+class TestStatsService:
+    def test_queries_run_concurrently_on_separate_readers(self):
+        service = _service()
+        start = time.perf_counter()
+        results = service.get('tab', days=7, user_id=3)
+        assert time.perf_counter() - start < 0.5
+        assert len({result['thread'] for result in results.values()}) == 3
+
+    def test_arguments_follow_date_range_and_user(self):
+        service = _service()
+        results = service.get('tab', days=7, start_date='2026-01-01', end_date='2026-01-31', user_id=3)
+        assert results['a']['start_date'] == '2026-01-01' and results['a']['days'] is None
+        assert results['a']['user_id'] == 3
+        assert results['b']['user_id'] is None
+        assert results['c']['start_date'] is None
+
+    def test_results_are_cached_per_key(self):
+        service = _service()
+        first = service.get('tab', days=7, user_id=[2, 1])
+        assert service.get('tab', days=7, user_id=[1, 2]) is first
+        assert service.get('tab', days=30, user_id=[1, 2]) is not first
+        assert (service.hits, service.misses) == (1, 2)
+
+    def test_ttl_and_invalidation(self):
+        service = _service(ttl=0)
+        first = service.get('tab', days=7)
+        assert service.get('tab', days=7) is not first
+
+        service = _service()
+        first = service.get('tab', days=7)
+        service.invalidate('other')
+        assert service.get('tab', days=7) is first
+        service.invalidate('tab')
+        assert service.get('tab', days=7) is not first
+        assert service.get('tab', days=7, refresh=True) is not first
+
+    def test_failed_query_does_not_fail_the_page(self):
+        results = _service().get('broken')
+        assert results == {'x': [], 'y': {}, 'ok': results['ok']}
+
+    def test_failed_dict_queries_keep_their_shape(self):
+        class Broken:
+            def __getattr__(self, name):
+                raise RuntimeError("no database")
+        results = StatsService(reader_factory=Broken).get('page', days=7)
+        assert results['dashboard_stats']['totals']['total_logins'] == 0
+        assert results['session_duration']['distribution'] == [] and results['hourly_heatmap'] == []
+        assert set(results) == set(STATS_TABS['page'])
+
+    def test_unknown_tab(self):
+        assert _service().get('nope') == {}
+
+    def test_debug_info_reports_query_timings(self):
+        service = _service()
+        service.get('tab', days=7, user_id=5)
+        info = service.debug_info()
+        run = info['recent_runs'][0]
+        assert run['tab'] == 'tab' and run['user_id'] == 5
+        assert set(run['query_ms']) == {'a', 'b', 'c'}
+        assert all(ms >= 150 for ms in run['query_ms'].values())
+        assert run['wall_ms'] < sum(run['query_ms'].values())
+
+
+@pytest.mark.unit
+def test_activity_tab_matches_direct_queries(temp_cwa_db):
+    temp_cwa_db.log_activity(200, "reader test", "DOWNLOAD", 1, "Book", {"format": "epub"})
+    service = StatsService()
+    results = service.get('activity', days=30, cwa_db=temp_cwa_db)
+    assert results['dashboard_stats'] == temp_cwa_db.get_dashboard_stats(days=30)
+    assert results['devices'] == temp_cwa_db.get_device_breakdown(days=30)
@@ -0,0 +1,134 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the SQLite user defined functions registered by cps.db"""
+
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool
+
+from cps import db
+
+TITLE_REGEX = r'^(A|The|An|Der|Die|Das|Den|Ein|Eine|Einen|Dem|Des|Einem|Eines|Le|La|Les|L\'|Un|Une)\s+'
+
+
+@pytest.fixture
+def title_config(monkeypatch):
+    config = SimpleNamespace(config_title_regex=TITLE_REGEX)
+    monkeypatch.setattr(db.CalibreDB, "config", config)
+    db._compile_title_regex.cache_clear()
+    return config
+
+
+def _connect():
+    conn = sqlite3.connect(":memory:")
+    db.register_functions(conn)
+    return conn
+
+
+@pytest.mark.unit
+class TestTitleSort:
+    def test_moves_article_to_end(self, title_config):
+        assert db.title_sort("The Hobbit") == "Hobbit, The"
+
+    def test_without_config_only_strips(self, monkeypatch):
+        monkeypatch.setattr(db.CalibreDB, "config", None)
+        assert db.title_sort("  The Hobbit ") == "The Hobbit"
+
+    def test_none_passes_through(self, title_config):
+        assert db.title_sort(None) is None
+
+    def test_regex_compiled_once_per_pattern(self, title_config):
+        for title in ("The Hobbit", "A Tale", "Dune", "Le Petit Prince"):
+            db.title_sort(title)
+        info = db._compile_title_regex.cache_info()
+        assert info.misses == 1
+        assert info.hits == 3
+
+    def test_config_change_takes_effect(self, title_config):
+        assert db.title_sort("Der Prozess") == "Prozess, Der"
+        title_config.config_title_regex = r'^(The)\s+'
+        assert db.title_sort("Der Prozess") == "Der Prozess"
+        assert db._compile_title_regex.cache_info().misses == 2
+
+
+@pytest.mark.unit
+class TestLcase:
+    def test_ascii_fast_path(self):
+        db._unidecode_lower.cache_clear()
+        assert db.lcase("Tolkien") == "tolkien"
+        assert db._unidecode_lower.cache_info().currsize == 0
+
+    def test_non_ascii_is_transliterated_and_memoized(self):
+        db._unidecode_lower.cache_clear()
+        assert db.lcase("Émile Zola") == "emile zola"
+        assert db.lcase("Émile Zola") == "emile zola"
+        info = db._unidecode_lower.cache_info()
+        assert info.misses == 1
+        assert info.hits == 1
+
+    def test_null_stays_null(self):
+        assert db.lcase(None) is None
+
+
+@pytest.mark.unit
+class TestRegistration:
+    def test_functions_usable_from_sql(self, title_config):
+        conn = _connect()
+        assert conn.execute("SELECT lower('Ärger'), title_sort('The Road')").fetchone() == ("arger", "Road, The")
+        assert len(conn.execute("SELECT uuid4()").fetchone()[0]) == 36
+
+    def test_registered_on_engine_connect(self, title_config):
+        engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        event.listen(engine, "connect", db._on_connect)
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT title_sort('An Apple')")).scalar() == "Apple, An"
+        engine.dispose()
+
+
+@pytest.mark.unit
+class TestOrderAuthorNames:
+    def test_follows_author_sort(self):
+        authors = [(1, "Émile Zola", "Zola, Émile"), (2, "Anne Brontë", "Brontë, Anne")]
+        assert db._order_author_names("Brontë, Anne & Zola, Émile", authors) == ["Anne Brontë", "Émile Zola"]
+
+    def test_sort_match_is_case_insensitive(self):
+        authors = [(1, "b hooks", "hooks, b")]
+        assert db._order_author_names("Hooks, B", authors) == ["b hooks"]
+
+    def test_unmatched_authors_are_appended(self):
+        authors = [(1, "Jane Doe", "Doe, Jane"), (2, "John Roe", "Roe, John")]
+        assert db._order_author_names("Roe, John & Unknown", authors) == ["John Roe", "Jane Doe"]
+
+
+def _populated_connection(rows):
+    conn = _connect()
+    conn.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author TEXT)")
+    authors = ["Tolkien", "Zola, Émile", "Dostoyevsky", "Brontë, Charlotte", "Le Guin"]
+    conn.executemany("INSERT INTO books (title, author) VALUES (?, ?)",
+                     [("The Book %d" % i, authors[i % len(authors)]) for i in range(rows)])
+    return conn
+
+
+@pytest.mark.slow
+def test_benchmark_sort_and_search_rows_per_second(title_config):
+    rows = 50000
+    conn = _populated_connection(rows)
+
+    start = time.perf_counter()
+    conn.execute("SELECT title_sort(title) FROM books ORDER BY 1").fetchall()
+    sort_rate = rows / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    conn.execute("SELECT id FROM books WHERE lower(author) LIKE '%emile%' OR lower(title) LIKE '%book 1%'").fetchall()
+    search_rate = rows / (time.perf_counter() - start)
+
+    print("\ntitle_sort: {:,.0f} rows/s, lower() search: {:,.0f} rows/s".format(sort_rate, search_rate))
+    assert sort_rate > 0 and search_rate > 0
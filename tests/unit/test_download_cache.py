@@ -0,0 +1,82 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the cache of downloads with embedded metadata"""
+
+import os
+from datetime import datetime
+
+import pytest
+
+from cps.download_cache import DownloadArtifactCache, artifact_digest
+
+
+def _produce(tmp_path, name, size):
+    path = tmp_path / 'export' / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+@pytest.mark.unit
+class TestDownloadArtifactCache:
+    def test_store_and_get(self, tmp_path):
+        cache = DownloadArtifactCache(str(tmp_path / 'cache'), 1024)
+        assert cache.get(1, 'epub', 'abc') is None
+        path = cache.store(1, 'EPUB', 'abc', _produce(tmp_path, 'book.epub', 10))
+
+        assert cache.get(1, 'epub', 'abc') == path
+        assert os.path.basename(path) == '1_abc.epub'
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.cached_formats(1) == ['epub']
+        assert not os.listdir(tmp_path / 'export')
+
+    def test_new_revision_replaces_older_artifact(self, tmp_path):
+        cache = DownloadArtifactCache(str(tmp_path / 'cache'), 1024)
+        cache.store(1, 'epub', 'old', _produce(tmp_path, 'a.epub', 10))
+        cache.store(1, 'pdf', 'old', _produce(tmp_path, 'a.pdf', 10))
+        cache.store(1, 'epub', 'new', _produce(tmp_path, 'b.epub', 10))
+
+        assert cache.get(1, 'epub', 'old') is None
+        assert cache.get(1, 'epub', 'new')
+        assert cache.get(1, 'pdf', 'old')
+
+    def test_variants_of_one_source_are_kept_side_by_side(self, tmp_path):
+        cache = DownloadArtifactCache(str(tmp_path / 'cache'), 1024)
+        modified = datetime(2026, 3, 1, 12, 0)
+        source = ('kepubify', 10, 1, None)
+        english, german = (artifact_digest(1, 'kepub', modified, source, variant=locale) for locale in ('en', 'de'))
+        cache.store(1, 'kepub', english, _produce(tmp_path, 'a.kepub', 10))
+        cache.store(1, 'kepub', german, _produce(tmp_path, 'b.kepub', 10))
+        assert cache.get(1, 'kepub', english) and cache.get(1, 'kepub', german)
+
+        changed = artifact_digest(1, 'kepub', datetime(2026, 3, 2), source, variant='en')
+        cache.store(1, 'kepub', changed, _produce(tmp_path, 'c.kepub', 10))
+        assert cache.get(1, 'kepub', english) is None and cache.get(1, 'kepub', german) is None
+        assert cache.get(1, 'kepub', changed)
+
+    def test_least_recently_used_artifacts_are_evicted(self, tmp_path):
+        cache = DownloadArtifactCache(str(tmp_path / 'cache'), 250)
+        for book_id in (1, 2):
+            path = cache.store(book_id, 'epub', 'rev', _produce(tmp_path, 'b.epub', 100))
+            os.utime(path, (book_id, book_id))
+        cache.get(1, 'epub', 'rev')  # book 1 is now the most recently used
+        cache.store(3, 'epub', 'rev', _produce(tmp_path, 'b.epub', 100))
+
+        assert cache.get(2, 'epub', 'rev') is None
+        assert cache.get(1, 'epub', 'rev') and cache.get(3, 'epub', 'rev')
+        assert cache.size() == 200
+
+        cache.invalidate(1)
+        assert cache.cached_formats(1) == []
+
+    def test_digest_follows_book_revision(self):
+        modified = datetime(2026, 3, 1, 12, 0)
+        digest = artifact_digest(1, 'epub', modified, ('calibredb', 10, 1, None, None))
+        assert digest == artifact_digest(1, 'EPUB', modified, ('calibredb', 10, 1, None, None))
+        assert digest != artifact_digest(1, 'epub', datetime(2026, 3, 2), ('calibredb', 10, 1, None, None))
+        assert digest != artifact_digest(1, 'epub', modified, ('calibredb', 10, 1, 5, None))
+        assert artifact_digest(1, 'epub', modified, ('calibredb', 10, 1, None, None), variant='de').startswith(digest)
@@ -36,25 +36,41 @@ class _Field:
     def __eq__(self, other):
         return ("eq", other)
 
+    def in_(self, values):
+        return ("in", tuple(values))
+
+
+class _Books:
+    id = _Field()
+
 
 class _Query:
-    def __init__(self, calls):
+    def __init__(self, calls, rows=None):
         self.calls = calls
+        self.rows = rows
+        self.book_ids = None
 
     def filter(self, *args, **kwargs):
+        for arg in args:
+            if isinstance(arg, tuple) and arg[0] == "in":
+                self.book_ids = set(arg[1])
         return self
 
-    def delete(self):
-        self.calls.append("format-delete")
+    def all(self):
+        return [row for row in (self.rows or {}).values() if self.book_ids is None or row.id in self.book_ids]
+
+    def delete(self, synchronize_session=None):
+        self.calls.append("format-delete" if self.rows is None else "dirty-delete")
         return 1
 
 
 class _Session:
-    def __init__(self, calls):
+    def __init__(self, calls, books=None):
         self.calls = calls
+        self.books = books
 
-    def query(self, *args, **kwargs):
-        return _Query(self.calls)
+    def query(self, subject, *args, **kwargs):
+        return _Query(self.calls, self.books if subject is _Books else None)
 
     def commit(self):
         self.calls.append("commit")
@@ -235,15 +251,15 @@ def _load_editbooks_module(delete_key_calls):
     return module, calls
 
 
-def _load_duplicates_module(delete_key_calls):
+def _load_duplicates_module(delete_key_calls, checkpoint_dir):
     _clear_modules()
     _install_common_web_stubs()
 
     cps = _install_stub("cps")
     logger = _install_stub("cps.logger", {"create": lambda: _Logger()})
     calls = []
-    session = _Session(calls)
     calibre_books = {}
+    session = _Session(calls, calibre_books)
     calibre_db = _install_stub(
         "cps.calibre_db",
         {
@@ -252,12 +268,28 @@ def _load_duplicates_module(delete_key_calls):
             "session": session,
         },
     )
-    helper = _install_stub("cps.helper", {"delete_book": lambda *args, **kwargs: (True, None)})
+    helper = _install_stub(
+        "cps.helper",
+        {
+            "delete_book": lambda *args, **kwargs: (True, None),
+            "delete_book_file": lambda book, path: calls.append(("folder", book.id)) or (True, None),
+            "clear_cover_thumbnail_cache": lambda book_id: calls.append(("thumbnails", book_id)),
+            "get_valid_filename": lambda value, chars=128: value,
+        },
+    )
     config = _install_stub(
         "cps.config",
-        {"config_calibre_dir": "/library", "get_book_path": lambda: "/library"},
+        {"config_calibre_dir": "/library", "get_book_path": lambda: "/library", "config_use_google_drive": False},
+    )
+    db = _install_stub(
+        "cps.db",
+        {
+            "Books": _Books,
+            "Data": lambda book, book_format, size, name: SimpleNamespace(format=book_format, name=name),
+            "Metadata_Dirtied": SimpleNamespace(book=_Field()),
+        },
     )
-    db = _install_stub("cps.db", {"Books": SimpleNamespace(id=_Field())})
+
     current_user = SimpleNamespace(is_authenticated=True, id=9, role_admin=lambda: True, role_edit=lambda: True)
 
     cps.logger = logger
@@ -266,7 +298,10 @@ def _load_duplicates_module(delete_key_calls):
     cps.config = config
     cps.db = db
 
-    _install_stub("cps.ub", {"init_db_thread": lambda: calls.append("init-db-thread")})
+    cps.ub = _install_stub("cps.ub", {
+        "init_db_thread": lambda: calls.append("init-db-thread"),
+        "session": SimpleNamespace(commit=lambda: None, rollback=lambda: None),
+    })
     _install_stub("cps.csrf", {"exempt": _decorator})
     _install_stub("cps.admin", {"admin_required": _decorator})
     _install_stub("cps.usermanagement", {"login_required_if_no_ano": _decorator})
@@ -283,7 +318,8 @@ def _load_duplicates_module(delete_key_calls):
         },
     )
     _install_stub("cps.services")
-    _install_stub("cps.editbooks", {"delete_whole_book": lambda book_id, book: calls.append(("whole", book_id))})
+    _install_stub("cps.editbooks",
+                  {"delete_whole_book": lambda book_id, book, commit=True: calls.append(("whole", book_id))})
     _install_stub(
         "cps.duplicate_index",
         {
@@ -305,6 +341,14 @@ def _load_duplicates_module(delete_key_calls):
     _install_stub("sqlalchemy.sql.expression", {"true": lambda: True, "false": lambda: False})
     _install_stub("sqlalchemy.orm", {"joinedload": lambda *args, **kwargs: None})
 
+    resolution_path = pathlib.Path(__file__).resolve().parents[2] / "cps" / "duplicate_resolution.py"
+    spec = importlib.util.spec_from_file_location("cps.duplicate_resolution", resolution_path)
+    resolution = importlib.util.module_from_spec(spec)
+    resolution.__package__ = "cps"
+    sys.modules["cps.duplicate_resolution"] = resolution
+    spec.loader.exec_module(resolution)
+    resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE = str(checkpoint_dir / "checkpoint.json")
+
     duplicates_path = pathlib.Path(__file__).resolve().parents[2] / "cps" / "duplicates.py"
     spec = importlib.util.spec_from_file_location("cps.duplicates", duplicates_path)
     module = importlib.util.module_from_spec(spec)
@@ -343,10 +387,10 @@ def test_delete_book_from_table_format_only_keeps_duplicate_keys_and_invalidates
     assert _CwaDB.instances[-1].invalidated is True
 
 
-def test_auto_resolve_duplicates_deletes_duplicate_keys_and_refreshes_cache():
+def test_auto_resolve_duplicates_deletes_duplicate_keys_and_refreshes_cache(tmp_path):
     _CwaDB.instances = []
     delete_key_calls = []
-    module, calibre_books, calls = _load_duplicates_module(delete_key_calls)
+    module, calibre_books, calls = _load_duplicates_module(delete_key_calls, tmp_path)
     kept = SimpleNamespace(
         id=1,
         title="Dune",
@@ -385,10 +429,10 @@ def test_auto_resolve_duplicates_deletes_duplicate_keys_and_refreshes_cache():
     assert _CwaDB.instances[-1].invalidated is False
 
 
-def test_auto_resolve_dry_run_does_not_invalidate_duplicate_cache():
+def test_auto_resolve_dry_run_does_not_invalidate_duplicate_cache(tmp_path):
     _CwaDB.instances = []
     delete_key_calls = []
-    module, _calibre_books, calls = _load_duplicates_module(delete_key_calls)
+    module, _calibre_books, calls = _load_duplicates_module(delete_key_calls, tmp_path)
     kept = SimpleNamespace(
         id=1,
         title="Dune",
@@ -7,6 +7,7 @@
 from datetime import datetime, timezone
 from types import ModuleType, SimpleNamespace
 import importlib.util
+import itertools
 import json
 import pathlib
 import sqlite3
@@ -96,11 +97,17 @@ def _load_duplicate_index_module():
 
     _install_stub("cwa_db", {"CWA_DB": object})
 
-    duplicate_index_path = pathlib.Path(__file__).resolve().parents[2] / "cps" / "duplicate_index.py"
-    spec = importlib.util.spec_from_file_location("cps.duplicate_index", duplicate_index_path)
+    cps.string_helper = _load_cps_module("string_helper")
+    cps.duplicate_similarity = _load_cps_module("duplicate_similarity")
+    return _load_cps_module("duplicate_index")
+
+
+def _load_cps_module(name):
+    module_path = pathlib.Path(__file__).resolve().parents[2] / "cps" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(f"cps.{name}", module_path)
     module = importlib.util.module_from_spec(spec)
     module.__package__ = "cps"
-    sys.modules["cps.duplicate_index"] = module
+    sys.modules[f"cps.{name}"] = module
     spec.loader.exec_module(module)
     return module
 
@@ -131,6 +138,13 @@ class _FakeCwaDB:
             );
             CREATE INDEX idx_cwa_duplicate_book_keys_key
                 ON cwa_duplicate_book_keys(criteria_fingerprint, duplicate_key);
+            CREATE TABLE cwa_duplicate_book_bands (
+                book_id INTEGER NOT NULL,
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                PRIMARY KEY (book_id, band)
+            );
+            CREATE INDEX idx_cwa_duplicate_book_bands_bucket ON cwa_duplicate_book_bands(band, bucket);
             CREATE TABLE cwa_duplicate_cache (
                 id INTEGER PRIMARY KEY CHECK (id = 1),
                 scan_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -207,9 +221,61 @@ class _Query:
         return self.scalar_value
 
 
+def _calibre_library(books, path):
+    """Column-level copy of the fake books in the Calibre tables the key computation reads."""
+    library = sqlite3.connect(path)
+    library.executescript(
+        """
+        CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author_sort TEXT);
+        CREATE TABLE authors (id INTEGER PRIMARY KEY, name TEXT UNIQUE, sort TEXT COLLATE NOCASE);
+        CREATE TABLE books_authors_link (id INTEGER PRIMARY KEY, book INTEGER, author INTEGER);
+        CREATE TABLE languages (id INTEGER PRIMARY KEY, lang_code TEXT UNIQUE);
+        CREATE TABLE books_languages_link (id INTEGER PRIMARY KEY, book INTEGER, lang_code INTEGER);
+        CREATE TABLE series (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+        CREATE TABLE books_series_link (id INTEGER PRIMARY KEY, book INTEGER, series INTEGER);
+        CREATE TABLE publishers (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+        CREATE TABLE books_publishers_link (id INTEGER PRIMARY KEY, book INTEGER, publisher INTEGER);
+        CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT);
+        """
+    )
+
+    def link(table, column, value, book_id, link_table, link_column):
+        library.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (value,))
+        item_id = library.execute(f"SELECT id FROM {table} WHERE {column} = ?", (value,)).fetchone()[0]
+        library.execute(f"INSERT INTO {link_table} (book, {link_column}) VALUES (?, ?)", (book_id, item_id))
+
+    for book in books:
+        sorts = [getattr(author, "sort", author.name) for author in book.authors]
+        library.execute(
+            "INSERT INTO books (id, title, author_sort) VALUES (?, ?, ?)",
+            (book.id, book.title, getattr(book, "author_sort", " & ".join(sorts))),
+        )
+        for author, sort in zip(book.authors, sorts):
+            library.execute("INSERT OR IGNORE INTO authors (name, sort) VALUES (?, ?)", (author.name, sort))
+            author_id = library.execute("SELECT id FROM authors WHERE name = ?", (author.name,)).fetchone()[0]
+            library.execute("INSERT INTO books_authors_link (book, author) VALUES (?, ?)", (book.id, author_id))
+        for language in book.languages:
+            link("languages", "lang_code", language.lang_code, book.id, "books_languages_link", "lang_code")
+        for series in book.series:
+            link("series", "name", series.name, book.id, "books_series_link", "series")
+        for publisher in book.publishers:
+            link("publishers", "name", publisher.name, book.id, "books_publishers_link", "publisher")
+        for data in book.data:
+            library.execute("INSERT INTO data (book, format) VALUES (?, ?)", (book.id, data.format))
+    library.commit()
+    library.close()
+
+
+_library_ids = itertools.count()
+
+
 class _Session:
+    directory = None
+
     def __init__(self, books):
         self.books = list(books)
+        self.path = str(self.directory / f"metadata-{next(_library_ids)}.db")
+        _calibre_library(self.books, self.path)
 
     def query(self, subject):
         subject_text = str(subject)
@@ -244,14 +310,18 @@ def _book(
 
 
 @pytest.fixture
-def duplicate_index(monkeypatch):
+def duplicate_index(monkeypatch, tmp_path):
     module = _load_duplicate_index_module()
     _FakeCwaDB.reset()
     monkeypatch.setattr(module, "CWA_DB", _FakeCwaDB)
+    monkeypatch.setattr(_Session, "directory", tmp_path)
+    monkeypatch.setattr(module, "_metadata_db_path", lambda: module.calibre_db.session.path)
     monkeypatch.setattr(module, "joinedload", lambda value: value)
     yield module
     for name in (
         "cps.duplicate_index",
+        "cps.duplicate_similarity",
+        "cps.string_helper",
         "cps.duplicates",
         "cps.calibre_db",
         "cps.db",
@@ -672,3 +742,313 @@ def test_schema_contains_duplicate_book_key_table():
 
     assert table == ("cwa_duplicate_book_keys",)
     assert index == ("idx_cwa_duplicate_book_keys_key",)
+
+
+def _load_synthetic_library(book_count, seed=0):
+    fixtures = pathlib.Path(__file__).resolve().parents[1] / "fixtures" / "generate_synthetic.py"
+    spec = importlib.util.spec_from_file_location("generate_synthetic", fixtures)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.generate_synthetic_library(book_count, near_duplicate_rate=0.1, seed=seed)
+
+
+SIMILARITY_SETTINGS = {
+    "duplicate_detection_title": 1,
+    "duplicate_detection_author": 1,
+    "duplicate_detection_language": 1,
+    "duplicate_detection_similarity": 80,
+}
+
+
+def test_similarity_threshold_is_opt_in_and_keeps_exact_fingerprints(duplicate_index):
+    exact = {"duplicate_detection_title": 1, "duplicate_detection_author": 1}
+
+    assert duplicate_index.get_similarity_threshold(exact) is None
+    assert duplicate_index.get_similarity_threshold({**exact, "duplicate_detection_similarity": 0}) is None
+    assert duplicate_index.get_similarity_threshold({**exact, "duplicate_detection_similarity": 40}) == 0.7
+    assert duplicate_index.get_similarity_threshold({**exact, "duplicate_detection_similarity": 85}) == 0.85
+    assert duplicate_index.get_criteria_fingerprint(exact) == duplicate_index.get_criteria_fingerprint(
+        {**exact, "duplicate_detection_similarity": 0}
+    )
+    assert duplicate_index.get_criteria_fingerprint(exact) != duplicate_index.get_criteria_fingerprint(
+        {**exact, "duplicate_detection_similarity": 85}
+    )
+
+
+def test_similarity_mode_groups_near_duplicates_with_exact_remaining_criteria(duplicate_index):
+    books = [
+        _book(1, "The Left Hand of Darkness", "Ursula K. Le Guin"),
+        _book(2, "Left Hand of Darkness", "Le Guin, Ursula K."),
+        _book(3, "The Left Hand of Darkness", "Ursula K. Le Guin", language="deu"),
+        _book(4, "The Lathe of Heaven", "Ursula K. Le Guin"),
+    ]
+    duplicate_index.calibre_db.session = _Session(books)
+
+    exact_settings = {**SIMILARITY_SETTINGS, "duplicate_detection_similarity": 0}
+    duplicate_index.rebuild_duplicate_index(exact_settings)
+    assert duplicate_index.get_duplicate_groups_from_index(exact_settings, include_dismissed=True) == []
+    assert _FakeCwaDB().cur.execute("SELECT COUNT(*) FROM cwa_duplicate_book_bands").fetchone() == (0,)
+
+    duplicate_index.rebuild_duplicate_index(SIMILARITY_SETTINGS)
+    groups = duplicate_index.get_duplicate_groups_from_index(SIMILARITY_SETTINGS, include_dismissed=True)
+
+    assert [sorted(book.id for book in group["books"]) for group in groups] == [[1, 2]]
+
+
+def test_similarity_mode_incremental_merge_follows_chained_near_duplicates(duplicate_index):
+    books = [
+        _book(1, "Silver Lantern Over The Northern Harbor", "Clara Moreau"),
+        _book(2, "Silver Lantern Over The Northern Harbour", "Clara Moreau"),
+        _book(3, "The Silver Lantern Over The Northern Harbour", "Moreau, Clara"),
+        _book(4, "Winter Orchard", "Clara Moreau"),
+    ]
+    duplicate_index.calibre_db.session = _Session(books)
+    duplicate_index.upsert_book_keys({1, 2, 3, 4}, SIMILARITY_SETTINGS)
+    _seed_cache(scan_pending=False, last_scanned_book_id=4)
+
+    result = duplicate_index.merge_affected_groups_into_cache({3}, SIMILARITY_SETTINGS)
+    cache = _FakeCwaDB().get_duplicate_cache()
+
+    assert result["updated"] is True
+    assert [sorted(group["book_ids"]) for group in cache["duplicate_groups"]] == [[1, 2, 3]]
+
+    duplicate_index.delete_book_keys({2})
+    assert _FakeCwaDB().cur.execute(
+        "SELECT COUNT(*) FROM cwa_duplicate_book_bands WHERE book_id = 2"
+    ).fetchone() == (0,)
+
+
+def test_similarity_mode_benchmark_on_synthetic_library(duplicate_index, monkeypatch):
+    import time
+
+    records = _load_synthetic_library(3000)
+    books = [_book(1, record["title"], record["author"]) for record in records]
+    for book, record in zip(books, records):
+        book.id = record["id"]
+    duplicate_index.calibre_db.session = _Session(books)
+
+    comparisons = []
+    is_near_duplicate = duplicate_index.is_near_duplicate
+
+    def counting_is_near_duplicate(first, second, threshold):
+        comparisons.append(1)
+        return is_near_duplicate(first, second, threshold)
+
+    monkeypatch.setattr(duplicate_index, "is_near_duplicate", counting_is_near_duplicate)
+    # The lowest threshold, a swapped letter costs a short title up to 0.3 of its own similarity
+    settings = {**SIMILARITY_SETTINGS, "duplicate_detection_similarity": 70}
+    start = time.perf_counter()
+    duplicate_index.rebuild_duplicate_index(settings)
+    indexed = time.perf_counter()
+    groups = duplicate_index._group_book_id_lists(settings)
+    grouped = time.perf_counter()
+    print(
+        f"\nsimilarity scan of {len(books)} books: index {indexed - start:.2f}s, "
+        f"grouping {grouped - indexed:.2f}s, {len(comparisons)} verified candidate pairs"
+    )
+
+    work_of = {record["id"]: record["work"] for record in records}
+    expected = {}
+    for record in records:
+        expected.setdefault(record["work"], []).append(record["id"])
+    expected_groups = {tuple(ids) for ids in expected.values() if len(ids) > 1}
+    found_groups = {tuple(group) for group in groups}
+
+    # Every reported group is one work, nearly every planted near-duplicate is found
+    assert all(len({work_of[book_id] for book_id in group}) == 1 for group in groups)
+    assert len(found_groups & expected_groups) >= 0.95 * len(expected_groups)
+    # Candidate verification stays near-linear instead of comparing all pairs
+    assert len(comparisons) < 3 * len(books)
+
+
+@pytest.mark.parametrize("first, second", [
+    (("It", "Stephen King"), ("Cujo", "Stephen King")),
+    (("Dune", "Jane Herbert"), ("Emma", "Jane Herbert")),
+    (("The Wheel of Time Volume 1", "Robert Jordan"), ("The Wheel of Time Volume 2", "Robert Jordan")),
+    (("Foundation", "Isaac Asimov"), ("Foundation", "Jack Williamson")),
+])
+def test_shared_author_or_title_alone_is_no_near_duplicate(duplicate_index, first, second):
+    first_shingles = duplicate_index.shingle_book(*first)
+    second_shingles = duplicate_index.shingle_book(*second)
+
+    assert not duplicate_index.is_near_duplicate(first_shingles, second_shingles, 0.7)
+
+
+def test_similarity_mode_keeps_different_titles_of_one_author_apart(duplicate_index):
+    books = [
+        _book(1, "It", "Stephen King"),
+        _book(2, "Cujo", "Stephen King"),
+        _book(3, "The Wheel of Time Volume 1", "Robert Jordan"),
+        _book(4, "The Wheel of Time Volume 2", "Robert Jordan"),
+        _book(5, "Wheel of Time, Volume 2", "Jordan, Robert"),
+    ]
+    duplicate_index.calibre_db.session = _Session(books)
+    settings = {**SIMILARITY_SETTINGS, "duplicate_detection_similarity": 70}
+
+    duplicate_index.rebuild_duplicate_index(settings)
+    groups = duplicate_index.get_duplicate_groups_from_index(settings, include_dismissed=True)
+
+    assert [sorted(book.id for book in group["books"]) for group in groups] == [[4, 5]]
+
+
+def test_schema_contains_duplicate_band_table():
+    schema = pathlib.Path(__file__).resolve().parents[2] / "scripts" / "cwa_schema.sql"
+    connection = sqlite3.connect(":memory:")
+    connection.executescript(schema.read_text())
+
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(cwa_duplicate_book_bands)")]
+    settings_columns = [row[1] for row in connection.execute("PRAGMA table_info(cwa_settings)")]
+
+    assert columns == ["book_id", "band", "bucket"]
+    assert "duplicate_detection_similarity" in settings_columns
+
+
+def test_content_matching_joins_metadata_groups_through_shared_files(duplicate_index, monkeypatch):
+    books = [
+        _book(1, "Dune", "Frank Herbert"),
+        _book(2, "Dune", "Frank Herbert"),
+        _book(3, "Dune (Retail)", "Herbert Frank"),
+        _book(4, "Foundation", "Isaac Asimov"),
+        _book(5, "Imported Twice", "Unknown"),
+        _book(6, "Different Metadata", "Someone Else"),
+    ]
+    duplicate_index.calibre_db.session = _Session(books)
+    shared_files = [[2, 3], [5, 6]]
+
+    def content_groups(candidate_book_ids=None):
+        if candidate_book_ids is None:
+            return shared_files
+        return [group for group in shared_files if set(group) & set(candidate_book_ids)]
+
+    monkeypatch.setattr(duplicate_index, "_content_group_book_id_lists", content_groups)
+    settings = {
+        "duplicate_detection_title": 1,
+        "duplicate_detection_author": 1,
+        "duplicate_detection_language": 0,
+        "duplicate_detection_content": 1,
+    }
+    assert duplicate_index.get_criteria_fingerprint(settings) != duplicate_index.get_criteria_fingerprint(
+        {**settings, "duplicate_detection_content": 0}
+    )
+    duplicate_index.rebuild_duplicate_index(settings)
+
+    assert sorted(duplicate_index._group_book_id_lists(settings)) == [[1, 2, 3], [5, 6]]
+    # From book 3 the shared file leads to 2 and its metadata group to 1
+    assert duplicate_index._group_book_id_lists(settings, candidate_book_ids={3}) == [[1, 2, 3]]
+    assert duplicate_index._group_book_id_lists(settings, candidate_book_ids={4}) == []
+
+
+def test_rebuild_streams_into_shadow_tables_until_the_swap(duplicate_index, monkeypatch):
+    books = [_book(book_id, "Dune", "Frank Herbert") for book_id in range(1, 8)]
+    duplicate_index.calibre_db.session = _Session(books)
+    settings = {"duplicate_detection_title": 1, "duplicate_detection_author": 1, "duplicate_detection_language": 0}
+    duplicate_index.upsert_book_keys({1}, settings)
+    monkeypatch.setattr(duplicate_index, "DUPLICATE_INDEX_REBUILD_BATCH_SIZE", 2)
+    seen = []
+
+    def progress(indexed, total):
+        cwa_db = _FakeCwaDB()
+        live = cwa_db.cur.execute("SELECT COUNT(*) FROM cwa_duplicate_book_keys").fetchone()[0]
+        shadow = cwa_db.cur.execute("SELECT COUNT(*) FROM cwa_duplicate_book_keys_rebuild").fetchone()[0]
+        seen.append((indexed, total, live, shadow))
+
+    result = duplicate_index.rebuild_duplicate_index(settings, progress_callback=progress)
+    cwa_db = _FakeCwaDB()
+    tables = cwa_db.cur.execute("SELECT name FROM sqlite_master ORDER BY name").fetchall()
+
+    # Each page is committed to the shadow table while readers still see the previous index
+    assert seen == [(0, 7, 1, 0), (2, 7, 1, 2), (4, 7, 1, 4), (6, 7, 1, 6), (7, 7, 1, 7)]
+    assert result["max_book_id"] == 7 and result["indexed_count"] == 7
+    assert cwa_db.cur.execute("SELECT COUNT(*) FROM cwa_duplicate_book_keys").fetchone() == (7,)
+    assert ("idx_cwa_duplicate_book_keys_key",) in tables
+    assert ("idx_cwa_duplicate_book_bands_bucket",) in tables
+    assert ("cwa_duplicate_book_keys_rebuild",) not in tables
+
+
+def test_failed_rebuild_keeps_the_previous_index(duplicate_index):
+    books = [_book(1, "Dune", "Frank Herbert"), _book(2, "Dune", "Frank Herbert")]
+    duplicate_index.calibre_db.session = _Session(books)
+    settings = {"duplicate_detection_title": 1, "duplicate_detection_author": 1, "duplicate_detection_language": 0}
+    duplicate_index.upsert_book_keys({1}, settings)
+
+    def cancelled(indexed, total):
+        if indexed:
+            raise RuntimeError("cancelled")
+
+    with pytest.raises(RuntimeError):
+        duplicate_index.rebuild_duplicate_index(settings, progress_callback=cancelled)
+    rows = _FakeCwaDB().cur.execute("SELECT book_id FROM cwa_duplicate_book_keys").fetchall()
+
+    assert rows == [(1,)]
+    duplicate_index.rebuild_duplicate_index(settings)
+    assert _FakeCwaDB().cur.execute("SELECT COUNT(*) FROM cwa_duplicate_book_keys").fetchone() == (2,)
+
+
+def _indexed_key_rows(book_ids=None):
+    rows = _FakeCwaDB().cur.execute(
+        """
+        SELECT book_id, normalized_title, normalized_author, normalized_language,
+               normalized_series, normalized_publisher, format_signature, duplicate_key
+        FROM cwa_duplicate_book_keys ORDER BY book_id
+        """
+    ).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+
+def test_sql_key_pass_matches_python_key_parts(duplicate_index):
+    books = [
+        _book(1, "Dune", "Frank Herbert", series="Dune", publisher="Ace", formats=["EPUB", "pdf"]),
+        _book(2, "Frank Herbert, Dune Messiah", "Frank Herbert", language=None, formats=[]),
+        _book(3, "", "Frank Herbert", language="ENG", publisher="Chilton"),
+        _book(4, "  Children of Dune ", "  Frank HERBERT ", series="  Dune  ", formats=["azw3", "EPUB"]),
+    ]
+    duplicate_index.calibre_db.session = _Session(books)
+    settings = {
+        "duplicate_detection_title": 1,
+        "duplicate_detection_author": 1,
+        "duplicate_detection_series": 1,
+        "duplicate_detection_format": 1,
+        "duplicate_detection_similarity": 80,
+    }
+
+    def expected(book):
+        parts = duplicate_index.build_book_key_parts(book, settings)
+        key = duplicate_index._hash_json(duplicate_index._enabled_key_values(parts, settings))
+        return (*parts.as_db_tuple(), key)
+
+    result = duplicate_index.upsert_book_keys({1, 2, 3, 4, 9}, settings)
+
+    assert result["updated"] == 4 and result["missing_ids"] == [9]
+    assert _indexed_key_rows() == {book.id: expected(book) for book in books}
+
+    duplicate_index.rebuild_duplicate_index(settings)
+    bands = _FakeCwaDB().cur.execute("SELECT book_id, band, bucket FROM cwa_duplicate_book_bands").fetchall()
+
+    assert _indexed_key_rows() == {book.id: expected(book) for book in books}
+    assert sorted(bands) == sorted(
+        (book.id, band, bucket)
+        for book in books
+        for band, bucket in duplicate_index.lsh_buckets(duplicate_index.minhash_signature(
+            duplicate_index._similarity_shingles(expected(book)[0], expected(book)[1], settings)
+        ))
+    )
+
+
+def test_sql_primary_author_follows_author_sort(duplicate_index):
+    book = _book(1, "Good Omens", "Terry Pratchett")
+    book.authors = [
+        SimpleNamespace(name="Terry Pratchett", sort="Pratchett, Terry"),
+        SimpleNamespace(name="Neil Gaiman", sort="Gaiman, Neil"),
+    ]
+    book.author_sort = "gaiman, neil & Pratchett, Terry"
+    orphan = _book(2, "Mort", "Terry Pratchett")
+    orphan.authors = [SimpleNamespace(name="Terry Pratchett", sort="Pratchett, Terry")]
+    orphan.author_sort = "Unknown Sort & Pratchett, Terry"
+    duplicate_index.calibre_db.session = _Session([book, orphan])
+    settings = {"duplicate_detection_title": 1, "duplicate_detection_author": 1}
+
+    duplicate_index.rebuild_duplicate_index(settings)
+    rows = _indexed_key_rows()
+
+    assert rows[1][1] == "neil gaiman"
+    assert rows[2][1] == "terry pratchett"
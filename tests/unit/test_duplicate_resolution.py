@@ -0,0 +1,311 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+from types import ModuleType, SimpleNamespace
+import importlib.util
+import json
+import pathlib
+import shutil
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+
+def _install_stub(monkeypatch, name, attrs=None):
+    module = ModuleType(name)
+    if attrs:
+        for key, value in attrs.items():
+            setattr(module, key, value)
+    monkeypatch.setitem(sys.modules, name, module)
+    return module
+
+
+class _Logger:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _Field:
+    def in_(self, values):
+        return ("in", set(values))
+
+
+class _Books:
+    id = _Field()
+
+
+class _Query:
+    def __init__(self, session, subject):
+        self.session = session
+        self.subject = subject
+        self.book_ids = set()
+
+    def filter(self, condition):
+        self.book_ids = condition[1]
+        return self
+
+    def all(self):
+        return [book for book_id, book in self.session.books.items() if book_id in self.book_ids]
+
+    def delete(self, synchronize_session=None):
+        self.session.calls.append(("dirty-delete", sorted(self.book_ids)))
+
+
+class _Session:
+    def __init__(self, books):
+        self.books = books
+        self.staged = []
+        self.calls = []
+
+    def query(self, subject):
+        return _Query(self, subject)
+
+    def commit(self):
+        for book_id in self.staged:
+            self.books.pop(book_id, None)
+        self.calls.append(("commit", sorted(self.staged)))
+        self.staged = []
+
+    def rollback(self):
+        self.calls.append(("rollback", sorted(self.staged)))
+        self.staged = []
+
+
+class _CwaDB:
+    def __init__(self):
+        self.resolutions = []
+
+    def log_duplicate_resolution(self, **kwargs):
+        self.resolutions.append(kwargs)
+
+    def scheduled_cancel_for_book(self, book_id):
+        return 0
+
+
+@pytest.fixture
+def library(tmp_path):
+    return tmp_path / "library"
+
+
+@pytest.fixture
+def resolution(monkeypatch, tmp_path, library):
+    for name in list(sys.modules):
+        if name == "cps" or name.startswith("cps."):
+            monkeypatch.delitem(sys.modules, name)
+    session = _Session({})
+    app_session = SimpleNamespace(commit=lambda: session.calls.append(("ub-commit",)),
+                                  rollback=lambda: session.calls.append(("ub-rollback",)))
+    failing = set()
+    unremovable = set()
+
+    def delete_whole_book(book_id, book, commit=True):
+        assert commit is False
+        if book_id in failing:
+            raise RuntimeError(f"cannot delete {book_id}")
+        session.staged.append(book_id)
+
+    def delete_book_file(book, calibre_path):
+        if book.id in unremovable:
+            raise FileNotFoundError(f"author folder of {book.id} is gone")
+        shutil.rmtree(pathlib.Path(calibre_path) / book.path)
+        return True, None
+
+    cps = _install_stub(monkeypatch, "cps")
+    cps.logger = _install_stub(monkeypatch, "cps.logger", {"create": lambda: _Logger()})
+    cps.calibre_db = _install_stub(monkeypatch, "cps.calibre_db", {"session": session})
+    cps.ub = _install_stub(monkeypatch, "cps.ub", {"session": app_session})
+    cps.config = _install_stub(monkeypatch, "cps.config", {
+        "get_book_path": lambda: str(library),
+        "config_calibre_dir": str(library),
+        "config_use_google_drive": False,
+    })
+    cps.db = _install_stub(monkeypatch, "cps.db", {
+        "Books": _Books,
+        "Data": lambda book, book_format, size, name: SimpleNamespace(format=book_format, name=name),
+        "Metadata_Dirtied": SimpleNamespace(book=_Field()),
+    })
+    cps.helper = _install_stub(monkeypatch, "cps.helper", {
+        "get_valid_filename": lambda value, chars=128: value,
+        "delete_book_file": delete_book_file,
+        "clear_cover_thumbnail_cache": lambda book_id: None,
+    })
+    deleted_keys = []
+    _install_stub(monkeypatch, "cps.editbooks", {"delete_whole_book": delete_whole_book})
+    _install_stub(monkeypatch, "cps.duplicate_index", {"delete_book_keys": lambda ids: deleted_keys.append(sorted(ids))})
+    _install_stub(monkeypatch, "cps.services")
+    _install_stub(monkeypatch, "cps.services.worker", {"WorkerThread": SimpleNamespace(get_instance=lambda: None)})
+
+    module_path = pathlib.Path(__file__).resolve().parents[2] / "cps" / "duplicate_resolution.py"
+    spec = importlib.util.spec_from_file_location("cps.duplicate_resolution", module_path)
+    module = importlib.util.module_from_spec(spec)
+    module.__package__ = "cps"
+    monkeypatch.setitem(sys.modules, "cps.duplicate_resolution", module)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "DUPLICATE_RESOLUTION_BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(module, "DUPLICATE_RESOLUTION_CHECKPOINT_FILE", str(tmp_path / "checkpoint.json"))
+    module.session = session
+    module.failing = failing
+    module.unremovable = unremovable
+    module.deleted_keys = deleted_keys
+    return module
+
+
+def _book(session, library, book_id, formats):
+    path = f"Frank Herbert/Dune ({book_id})"
+    (library / path).mkdir(parents=True)
+    data = []
+    for book_format in formats:
+        (library / path / f"Dune - Frank Herbert.{book_format.lower()}").write_text(f"{book_id}-{book_format}")
+        data.append(SimpleNamespace(format=book_format, name="Dune - Frank Herbert", uncompressed_size=10))
+    book = SimpleNamespace(id=book_id, title="Dune", path=path, data=data,
+                           authors=[SimpleNamespace(name="Frank Herbert")])
+    session.books[book_id] = book
+    return book
+
+
+def _plan(resolution, group_hash, keep, delete, strategy="newest"):
+    group = {"group_hash": group_hash, "title": "Dune", "author": "Frank Herbert"}
+    return resolution.plan_group_resolution(group, keep, delete, strategy)
+
+
+def test_merge_copies_missing_formats_and_commits_each_batch_once(resolution, library):
+    session = resolution.session
+    plans = []
+    for index in range(3):
+        keep = _book(session, library, index * 10 + 1, ["EPUB"])
+        duplicate = _book(session, library, index * 10 + 2, ["EPUB", "PDF"])
+        plans.append(_plan(resolution, f"group{index}", keep, [duplicate], strategy="merge"))
+    cwa_db = _CwaDB()
+
+    result = resolution.DuplicateResolver(cwa_db, "merge", batch_size=2).resolve(plans)
+
+    assert [call for call in session.calls if call[0] in ("commit", "ub-commit")] == [
+        ("commit", [2, 12]), ("ub-commit",), ("commit", [22]), ("ub-commit",)]
+    assert result["resolved_count"] == 3 and result["deleted_count"] == 3 and not result["errors"]
+    assert result["report"]["batches"] == 2 and result["report"]["files_copied"] == 3
+    assert sum(result["report"]["copy_modes"].values()) == 3
+    assert [data.format for data in session.books[1].data] == ["EPUB", "PDF"]
+    assert (library / "Frank Herbert/Dune (1)/Dune - Frank Herbert.pdf").read_text() == "2-PDF"
+    assert not (library / "Frank Herbert/Dune (2)").exists()
+    assert len(list((pathlib.Path(resolution.DUPLICATE_RESOLUTION_BACKUP_DIR)).glob("*/book_2/*"))) == 2
+    assert resolution.deleted_keys == [[2, 12], [22]]
+    assert [entry["kept_book_id"] for entry in cwa_db.resolutions] == [1, 11, 21]
+    assert not pathlib.Path(resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE).exists()
+
+
+def test_failed_batch_is_retried_group_by_group(resolution, library):
+    session = resolution.session
+    plans = [
+        _plan(resolution, "good", _book(session, library, 1, ["EPUB"]),
+              [_book(session, library, 2, ["EPUB"])]),
+        _plan(resolution, "bad", _book(session, library, 3, ["EPUB"]),
+              [_book(session, library, 4, ["PDF"])], strategy="merge"),
+    ]
+    resolution.failing.add(4)
+
+    result = resolution.DuplicateResolver(_CwaDB(), "merge").resolve(plans)
+
+    assert result["resolved_count"] == 1 and result["deleted_count"] == 1
+    assert result["errors"] == ["Group 'Dune': cannot delete 4"]
+    assert ("commit", [2]) in session.calls and 4 in session.books
+    # Nothing of the failed batch was committed before it was rolled back
+    assert session.calls[:2] == [("rollback", [2]), ("ub-rollback",)]
+    # The merged copy of the group that was rolled back is removed again
+    assert not (library / "Frank Herbert/Dune (3)/Dune - Frank Herbert.pdf").exists()
+    assert (library / "Frank Herbert/Dune (4)").exists()
+
+
+def test_interrupted_run_resumes_pending_removals_and_skips_completed_groups(resolution, library):
+    session = resolution.session
+    keep = _book(session, library, 1, ["EPUB"])
+    duplicate = _book(session, library, 2, ["EPUB"])
+    plan = _plan(resolution, "group", keep, [duplicate])
+    # A previous run committed the group but stopped before removing the folder
+    session.books.pop(2)
+    pathlib.Path(resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE).write_text(json.dumps({
+        "completed": [plan.checkpoint_key],
+        "pending_removals": [{"id": 2, "path": duplicate.path}],
+    }))
+
+    result = resolution.DuplicateResolver(_CwaDB(), "newest").resolve([plan])
+
+    assert result["report"]["resumed"] is True and result["report"]["planned_groups"] == 0
+    assert not (library / duplicate.path).exists()
+    assert not any(call[0] == "commit" for call in session.calls)
+    assert not pathlib.Path(resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE).exists()
+
+
+def test_clone_file_falls_back_to_a_plain_copy(resolution, tmp_path, monkeypatch):
+    source = tmp_path / "source.epub"
+    source.write_text("book")
+    monkeypatch.setattr(resolution, "fcntl", None)
+    monkeypatch.setattr(resolution.os, "link", lambda *args: (_ for _ in ()).throw(OSError("cross-device")))
+
+    assert resolution.clone_file(str(source), str(tmp_path / "target.epub")) == "copy"
+    assert (tmp_path / "target.epub").read_text() == "book"
+
+
+def test_backup_does_not_share_the_merged_file(resolution, library, monkeypatch):
+    session = resolution.session
+    keep = _book(session, library, 1, ["EPUB"])
+    duplicate = _book(session, library, 2, ["EPUB", "PDF"])
+    monkeypatch.setattr(resolution, "fcntl", None)
+
+    result = resolution.DuplicateResolver(_CwaDB(), "merge").resolve(
+        [_plan(resolution, "group", keep, [duplicate], strategy="merge")])
+
+    merged = library / "Frank Herbert/Dune (1)/Dune - Frank Herbert.pdf"
+    backup = next(pathlib.Path(resolution.DUPLICATE_RESOLUTION_BACKUP_DIR).glob("*/book_2/*.pdf"))
+    assert result["report"]["copy_modes"]["hardlink"] == 1
+    assert backup.stat().st_ino != merged.stat().st_ino
+    merged.write_text("edited")
+    assert backup.read_text() == "2-PDF"
+
+
+def test_failed_folder_removal_stays_pending_and_cleanup_still_runs(resolution, library):
+    session = resolution.session
+    plans = [
+        _plan(resolution, "first", _book(session, library, 1, ["EPUB"]), [_book(session, library, 2, ["EPUB"])]),
+        _plan(resolution, "second", _book(session, library, 3, ["EPUB"]), [_book(session, library, 4, ["EPUB"])]),
+    ]
+    resolution.unremovable.add(2)
+    cwa_db = _CwaDB()
+
+    result = resolution.DuplicateResolver(cwa_db, "newest").resolve(plans)
+
+    assert result["resolved_count"] == 2 and result["report"]["pending_removals"] == 1
+    assert not (library / "Frank Herbert/Dune (4)").exists()
+    assert resolution.deleted_keys == [[2, 4]]
+    assert [entry["kept_book_id"] for entry in cwa_db.resolutions] == [1, 3]
+    checkpoint = json.loads(pathlib.Path(resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE).read_text())
+    assert checkpoint["pending_removals"] == [{"id": 2, "path": "Frank Herbert/Dune (2)"}]
+    assert checkpoint["pending_after_commit"] == []
+
+
+def test_interrupted_cleanup_is_finished_by_the_next_run(resolution, library):
+    session = resolution.session
+    keep = _book(session, library, 1, ["EPUB"])
+    duplicate = _book(session, library, 2, ["EPUB"])
+    plan = _plan(resolution, "group", keep, [duplicate])
+    # A previous run removed the folder but stopped before the index and audit cleanup
+    session.books.pop(2)
+    shutil.rmtree(library / duplicate.path)
+    pathlib.Path(resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE).write_text(json.dumps({
+        "completed": [plan.checkpoint_key],
+        "pending_removals": [],
+        "pending_after_commit": [{"group_hash": "group", "title": "Dune", "author": "Frank Herbert",
+                                  "keep_id": 1, "deletions": [{"id": 2, "path": duplicate.path}]}],
+    }))
+    cwa_db = _CwaDB()
+
+    result = resolution.DuplicateResolver(cwa_db, "newest").resolve([plan])
+
+    assert result["report"]["resumed"] is True
+    assert resolution.deleted_keys == [[2]]
+    assert [entry["deleted_book_ids"] for entry in cwa_db.resolutions] == [[2]]
+    assert not pathlib.Path(resolution.DUPLICATE_RESOLUTION_CHECKPOINT_FILE).exists()
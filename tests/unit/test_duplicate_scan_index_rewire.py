@@ -157,6 +157,8 @@ def _load_duplicate_scan_module(monkeypatch, calls):
             "CalibreTask": _CalibreTask,
             "STAT_CANCELLED": "cancelled",
             "STAT_ENDED": "ended",
+            "LANE_IO": "io",
+            "PRIORITY_LOW": 10,
         },
     )
     _install_stub("cps.ub", {"init_db_thread": lambda: None})
@@ -51,6 +51,7 @@ class _SettingsCwaDB:
         "duplicate_scan_enabled": 1,
         "duplicate_scan_frequency": "after_import",
         "duplicate_scan_debounce_seconds": 60,
+        "duplicate_detection_similarity": 0,
         "koreader_sync_enabled": 0,
     }
 
@@ -97,6 +98,7 @@ def _load_cwa_functions(monkeypatch, request):
     _install_stub("cps.render_template", {"render_title_template": lambda *args, **kwargs: {"template": args[0]}})
     _install_stub("cps.cw_login", {"current_user": SimpleNamespace(id=7), "login_user": None, "logout_user": None})
     _install_stub("cps.web", {"cwa_get_num_books_in_library": lambda: 0})
+    _install_stub("cps.cwa_stats_service", {"stats_service": SimpleNamespace()})
     _install_stub("cps.services")
     _install_stub("cps.services.background_scheduler", {"BackgroundScheduler": lambda: None, "DateTrigger": object})
     worker_module = _install_stub(
@@ -294,3 +296,21 @@ def test_cwa_settings_unchanged_criteria_does_not_mark_pending(monkeypatch):
     module.set_cwa_settings()
 
     assert pending_reasons == []
+
+
+def test_cwa_settings_keep_the_submitted_similarity_threshold(monkeypatch):
+    for submitted, stored in (("0", 0), ("85", 85)):
+        request = SimpleNamespace(
+            method="POST",
+            form={
+                "submit_button": "Submit",
+                "auto_convert_target_format": "epub",
+                "duplicate_detection_similarity": submitted,
+            },
+        )
+        module = _load_cwa_functions(monkeypatch, request)
+        _SettingsCwaDB.instances = []
+
+        module.set_cwa_settings()
+
+        assert _SettingsCwaDB.instances[0].updated_settings["duplicate_detection_similarity"] == stored
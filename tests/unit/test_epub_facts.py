@@ -0,0 +1,99 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the persisted EPUB facts used by Kobo sync"""
+
+import os
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cps import epub_facts, ub
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+OPF = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="{version}">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>Test</dc:title>
+    {meta}
+  </metadata>
+</package>"""
+
+
+def _write_epub(path, version="3.0", layout=None, body=b"chapter"):
+    meta = '<meta property="rendition:layout">{}</meta>'.format(layout) if layout else ''
+    with zipfile.ZipFile(path, 'w') as epub:
+        epub.writestr('mimetype', 'application/epub+zip')
+        epub.writestr('META-INF/container.xml', CONTAINER)
+        epub.writestr('OEBPS/content.opf', OPF.format(version=version, meta=meta))
+        epub.writestr('OEBPS/chapter.xhtml', body)
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(epub_facts.config, 'get_book_path', lambda: str(tmp_path))
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    ub.EpubFormatInfo.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    book = SimpleNamespace(id=1, path='Author/Book (1)')
+    book_data = SimpleNamespace(name='Book', format='EPUB')
+    os.makedirs(tmp_path / book.path)
+    return SimpleNamespace(session=session, book=book, data=book_data,
+                           file=str(tmp_path / book.path / 'Book.epub'))
+
+
+@pytest.mark.unit
+class TestReadEpubFacts:
+    def test_reads_layout_version_and_size(self, tmp_path):
+        path = str(tmp_path / 'fixed.epub')
+        _write_epub(path, layout='pre-paginated', body=b'x' * 1000)
+        facts = epub_facts.read_epub_facts(path)
+        assert facts.is_valid and facts.layout == 'pre-paginated' and facts.opf_version == '3.0'
+        with zipfile.ZipFile(path) as epub:
+            assert facts.uncompressed_size == sum(info.file_size for info in epub.infolist())
+
+    def test_reflowable_and_broken_files(self, tmp_path):
+        path = str(tmp_path / 'plain.epub')
+        _write_epub(path, version='2.0')
+        assert epub_facts.read_epub_facts(path).layout is None
+
+        broken = tmp_path / 'broken.epub'
+        broken.write_bytes(b'not a zip')
+        assert not epub_facts.read_epub_facts(str(broken)).is_valid
+
+
+@pytest.mark.unit
+class TestStoredEpubFacts:
+    def test_file_is_parsed_once(self, library, monkeypatch):
+        _write_epub(library.file, layout='pre-paginated')
+        first = epub_facts.get_epub_facts(library.book, library.data, session=library.session)
+
+        monkeypatch.setattr(epub_facts, 'read_epub_facts', lambda path: pytest.fail('file parsed again'))
+        assert epub_facts.get_epub_facts(library.book, library.data, session=library.session) == first
+        known = epub_facts.load_epub_facts([1], library.session)
+        assert epub_facts.get_epub_facts(library.book, library.data, known=known) == first
+
+    def test_changed_file_is_parsed_again(self, library):
+        _write_epub(library.file)
+        assert epub_facts.get_epub_facts(library.book, library.data, session=library.session).layout is None
+
+        _write_epub(library.file, layout='pre-paginated', body=b'longer chapter')
+        stat = os.stat(library.file)
+        os.utime(library.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        facts = epub_facts.get_epub_facts(library.book, library.data, session=library.session)
+        assert facts.layout == 'pre-paginated'
+        assert library.session.query(ub.EpubFormatInfo).count() == 1
+
+    def test_missing_file(self, library):
+        assert epub_facts.get_epub_facts(library.book, library.data, session=library.session) is None
@@ -0,0 +1,155 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the persistent Hardcover outbox and its sender"""
+
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+from cps import hardcover_outbox as outbox_module
+from cps.services import hardcover
+from cwa_db import CWA_DB
+
+SCHEMA = Path(__file__).resolve().parents[2] / 'scripts' / 'cwa_schema.sql'
+
+
+def _outbox_db():
+    cwa_db = CWA_DB.__new__(CWA_DB)
+    cwa_db.con = sqlite3.connect(':memory:', check_same_thread=False)
+    cwa_db.cur = cwa_db.con.cursor()
+    ddl = re.search(r'CREATE TABLE IF NOT EXISTS hardcover_outbox\(.*?\);\n(?:CREATE .*?;\n)+',
+                    SCHEMA.read_text(), re.S).group(0)
+    cwa_db.con.executescript(ddl)
+    return cwa_db
+
+
+class _Client:
+    def __init__(self, calls, failures, rejected):
+        self.calls = calls
+        self.failures = failures
+        self.rejected = rejected
+
+    def update_reading_progress(self, identifiers, progress_percent):
+        if self.rejected:
+            self.rejected.pop()
+            raise hardcover.MissingHardcoverToken('Hardcover API token was rejected')
+        if self.failures:
+            self.failures.pop()
+            raise ConnectionError('Hardcover is down')
+        self.calls.append(('progress', identifiers, progress_percent))
+
+    def get_user_book(self, identifiers):
+        self.calls.append(('lookup', identifiers))
+        return None
+
+    def add_book(self, identifiers):
+        self.calls.append(('add', identifiers))
+
+
+def _outbox(cwa_db, calls, fail=0, tokens=None, created=None, rejected=None):
+    tokens = tokens if tokens is not None else {1: 'token'}
+    failures = [None] * fail
+    created = created if created is not None else []
+    rejected = rejected if rejected is not None else []
+
+    def client(token, user_book_cache):
+        if not token:
+            raise hardcover.MissingHardcoverToken('Hardcover API token is required')
+        created.append(token)
+        return _Client(calls, failures, rejected)
+    outbox = outbox_module.HardcoverOutbox(db_factory=lambda: cwa_db, client_factory=client,
+                                           token_lookup=tokens.get)
+    # The tests drain by hand instead of running the sender thread
+    outbox.start = lambda: None
+    return outbox
+
+
+@pytest.mark.unit
+class TestHardcoverOutbox:
+    def test_progress_updates_of_a_book_are_collapsed_to_the_latest(self):
+        cwa_db, calls = _outbox_db(), []
+        outbox = _outbox(cwa_db, calls)
+        identifiers = {'hardcover-id': '101', 'isbn': '9780441013593'}
+
+        for percent in (10, 20, 35):
+            outbox.push_progress(1, 7, identifiers, percent)
+        outbox.push_add_book(1, 7, identifiers)
+        outbox.push_progress(1, 8, {'isbn': '123'}, 50)
+        # Stored by the request thread itself, before the sender runs
+        assert cwa_db.get_hardcover_outbox_stats()['depth'] == 2
+
+        assert outbox.drain(cwa_db) == outbox_module.HARDCOVER_OUTBOX_IDLE
+        assert ('progress', {'hardcover-id': '101'}, 35) in calls
+        assert [call[0] for call in calls].count('progress') == 1
+        assert ('add', {'hardcover-id': '101'}) in calls
+        assert cwa_db.get_hardcover_outbox_stats()['depth'] == 0 and outbox.sent == 2
+
+    def test_failed_writes_are_retried_with_backoff(self):
+        cwa_db, calls = _outbox_db(), []
+        outbox = _outbox(cwa_db, calls, fail=1)
+        outbox.push_progress(1, 7, {'hardcover-id': '101'}, 40)
+
+        delay = outbox.drain(cwa_db)
+
+        assert calls == [] and outbox.failures == 1
+        assert outbox_module.HARDCOVER_OUTBOX_RETRY_BASE - 1 < delay <= outbox_module.HARDCOVER_OUTBOX_RETRY_BASE
+        stats = cwa_db.get_hardcover_outbox_stats()
+        assert stats['depth'] == 1 and stats['retrying'] == 1 and 'Hardcover is down' in stats['last_error']
+        assert outbox_module.retry_delay(3) == 4 * outbox_module.HARDCOVER_OUTBOX_RETRY_BASE
+        assert outbox_module.retry_delay(50) == outbox_module.HARDCOVER_OUTBOX_RETRY_MAX
+
+        cwa_db.cur.execute("UPDATE hardcover_outbox SET next_attempt_at = ?", (time.time() - 1,))
+        outbox.drain(cwa_db)
+        assert calls == [('progress', {'hardcover-id': '101'}, 40)]
+        assert cwa_db.get_hardcover_outbox_stats()['depth'] == 0
+
+    def test_newer_progress_survives_a_send_of_the_older_one(self):
+        cwa_db = _outbox_db()
+        cwa_db.hardcover_outbox_put(1, 7, outbox_module.KIND_PROGRESS, '{"identifiers": {}, "progress_percent": 10}')
+        row = cwa_db.hardcover_outbox_due(time.time())[0]
+        cwa_db.hardcover_outbox_put(1, 7, outbox_module.KIND_PROGRESS, '{"identifiers": {}, "progress_percent": 60}')
+
+        assert not cwa_db.hardcover_outbox_done(row['id'], row['version'])
+        pending = cwa_db.hardcover_outbox_due(time.time())
+        assert len(pending) == 1 and '60' in pending[0]['payload'] and pending[0]['version'] == 2
+
+    def test_writes_of_users_without_token_are_dropped(self):
+        cwa_db, calls = _outbox_db(), []
+        outbox = _outbox(cwa_db, calls, tokens={})
+        outbox.push_progress(2, 7, {'hardcover-id': '101'}, 40)
+
+        outbox.drain(cwa_db)
+
+        assert calls == [] and outbox.dropped == 1
+        assert cwa_db.get_hardcover_outbox_stats()['depth'] == 0
+
+    def test_clients_are_kept_across_drains_until_the_token_changes(self):
+        cwa_db, calls, created, rejected = _outbox_db(), [], [], []
+        tokens = {1: 'token'}
+        outbox = _outbox(cwa_db, calls, tokens=tokens, created=created, rejected=rejected)
+
+        for percent in (10, 20):
+            outbox.push_progress(1, 7, {'hardcover-id': '101'}, percent)
+            outbox.drain(cwa_db)
+        assert created == ['token'] and len(calls) == 2
+
+        tokens[1] = 'new-token'
+        outbox.push_progress(1, 7, {'hardcover-id': '101'}, 30)
+        outbox.drain(cwa_db)
+        assert created == ['token', 'new-token']
+
+        # A rejected token drops the write and the client, the next write builds a new one
+        rejected.append(None)
+        outbox.push_progress(1, 7, {'hardcover-id': '101'}, 40)
+        outbox.drain(cwa_db)
+        outbox.push_progress(1, 7, {'hardcover-id': '101'}, 50)
+        outbox.drain(cwa_db)
+        assert outbox.dropped == 1 and created == ['token', 'new-token', 'new-token']
+        assert calls[-1] == ('progress', {'hardcover-id': '101'}, 50)
@@ -0,0 +1,137 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the cached Hardcover user_book lookups against a stub GraphQL server"""
+
+import json
+import re
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from cps import hardcover_outbox, http_client
+from cps.services import hardcover
+from cwa_db import CWA_DB
+
+SCHEMA = Path(__file__).resolve().parents[2] / 'scripts' / 'cwa_schema.sql'
+USER_BOOK = {
+    'id': 500, 'status_id': hardcover.STATUS_READING, 'book_id': 101,
+    'book': {'slug': 'dune', 'title': 'Dune'},
+    'edition': {'id': 9, 'pages': 200},
+    'user_book_reads': [{'id': 77, 'started_at': '2026-10-01', 'finished_at': None, 'edition_id': 9,
+                         'progress_pages': 0}],
+}
+
+
+class _GraphQLHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    operations = []
+    # Read ids the stub no longer knows, e.g. finished or deleted on the website
+    gone_reads = set()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        query, variables = payload['query'], payload['variables']
+        if 'update_user_book_read' in query:
+            _GraphQLHandler.operations.append(('update_read', variables['readId'], variables['pages']))
+            read = None if variables['readId'] in self.gone_reads else {'id': variables['readId']}
+            data = {'update_user_book_read': read}
+        elif 'update_user_book(' in query:
+            _GraphQLHandler.operations.append(('status', variables['status_id']))
+            data = {'update_user_book': {'user_book': dict(USER_BOOK, status_id=variables['status_id'])}}
+        elif 'user_books' in query:
+            _GraphQLHandler.operations.append(('lookup', variables.get('query')))
+            data = {'me': [{'user_books': [USER_BOOK]}]}
+        else:
+            data = {'me': [{'id': 42, 'account_privacy_setting_id': 1}]}
+        body = json.dumps({'data': data}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _cwa_db():
+    cwa_db = CWA_DB.__new__(CWA_DB)
+    cwa_db.con = sqlite3.connect(':memory:', check_same_thread=False)
+    cwa_db.cur = cwa_db.con.cursor()
+    ddl = re.search(r'CREATE TABLE IF NOT EXISTS hardcover_user_book_cache\(.*?\);\n', SCHEMA.read_text(), re.S)
+    cwa_db.con.executescript(ddl.group(0))
+    return cwa_db
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _GraphQLHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _GraphQLHandler.operations = []
+    _GraphQLHandler.gone_reads = set()
+    monkeypatch.setattr(hardcover, 'GRAPHQL_ENDPOINT', 'http://127.0.0.1:{}/'.format(server.server_port))
+    monkeypatch.setattr(hardcover, 'get_http_session',
+                        lambda name: http_client.get_http_session('hardcover-stub', validate=False))
+    yield _GraphQLHandler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+class TestHardcoverUserBookCache:
+    def test_steady_state_progress_costs_one_mutation(self, stub):
+        cache = hardcover_outbox.UserBookCache(_cwa_db())
+        client = hardcover.HardcoverClient('token', user_book_cache=cache)
+        ids = {'hardcover-id': '101'}
+
+        client.update_reading_progress(ids, 10)
+        stub.operations.clear()
+        client.update_reading_progress(ids, 25)
+        hardcover.HardcoverClient('token', user_book_cache=cache).update_reading_progress(ids, 30)
+
+        assert stub.operations == [('update_read', 77, 50), ('update_read', 77, 60)]
+        assert cache.hits == 2
+        assert cache.get(42, 'hardcover-id:101')['user_book_id'] == 500
+
+    def test_gone_reads_and_expired_entries_are_looked_up_again(self, stub):
+        cwa_db = _cwa_db()
+        cache = hardcover_outbox.UserBookCache(cwa_db)
+        client = hardcover.HardcoverClient('token', user_book_cache=cache)
+        ids = {'hardcover-id': '101'}
+        cache.put(42, 'hardcover-id:101', {'user_book_id': 500, 'status_id': 2, 'edition_id': 9, 'pages': 200,
+                                           'read_id': 66, 'read_started_at': '2026-09-01'})
+        stub.gone_reads.add(66)
+
+        client.update_reading_progress(ids, 50)
+
+        assert stub.operations == [('update_read', 66, 100), ('lookup', '101'), ('update_read', 77, 100)]
+        assert cache.get(42, 'hardcover-id:101')['read_id'] == 77
+
+        stub.operations.clear()
+        client.user_book_cache = hardcover_outbox.UserBookCache(cwa_db, ttl=-1)
+        client.update_reading_progress(ids, 60)
+        assert stub.operations == [('lookup', '101'), ('update_read', 77, 120)]
+
+    def test_finishing_or_editing_identifiers_drops_the_entry(self, stub, monkeypatch):
+        cwa_db = _cwa_db()
+        cache = hardcover_outbox.UserBookCache(cwa_db)
+        client = hardcover.HardcoverClient('token', user_book_cache=cache)
+        client.update_reading_progress({'hardcover-id': '101'}, 10)
+        assert cache.get(42, 'hardcover-id:101')
+
+        stub.operations.clear()
+        client.update_reading_progress({'hardcover-id': '101'}, 100)
+        assert stub.operations == [('lookup', '101'), ('status', hardcover.STATUS_READ), ('update_read', 77, 200)]
+        assert cache.get(42, 'hardcover-id:101') is None
+
+        client.update_reading_progress({'hardcover-id': '101'}, 10)
+        monkeypatch.setattr(hardcover_outbox, 'CWA_DB', lambda: cwa_db)
+        hardcover_outbox.forget_user_books({'hardcover-id': '101', 'isbn': '9780441013593'})
+        assert cache.get(42, 'hardcover-id:101') is None
@@ -0,0 +1,113 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the shared HTTP sessions, their retries and their metrics"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cps import http_client
+from cps.cw_advocate.exceptions import UnacceptableAddressException
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Status codes answered before falling back to 200
+    statuses = []
+    hits = 0
+    retry_after = '0'
+
+    def _answer(self):
+        _Handler.hits += 1
+        status = _Handler.statuses.pop(0) if _Handler.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        if status == 503:
+            self.send_header('Retry-After', _Handler.retry_after)
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _Handler.statuses = []
+    _Handler.hits = 0
+    _Handler.retry_after = '0'
+    monkeypatch.setattr(http_client, '_sessions', {})
+    monkeypatch.setattr(http_client, 'http_metrics', http_client.HttpMetrics())
+    monkeypatch.setattr(http_client, 'getproxies', lambda: {})
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+class TestHttpClient:
+    def test_sessions_are_shared_and_keep_connections_alive(self, server):
+        session = http_client.get_http_session('local', headers={'User-Agent': 'test'}, validate=False)
+
+        for __ in range(4):
+            assert session.get(server + '/', timeout=5).status_code == 200
+
+        assert http_client.get_http_session('local') is session
+        assert session.headers['User-Agent'] == 'test'
+        host = http_client.http_metrics.snapshot()['hosts']['127.0.0.1']
+        assert host['requests'] == 4 and host['connections'] == 1
+        assert host['reuse_ratio'] == 0.75
+        assert sum(host['latency_ms'].values()) == 4
+
+    def test_idempotent_requests_are_retried_on_overload(self, server, monkeypatch):
+        monkeypatch.setattr(http_client.HTTP_RETRY, 'backoff_factor', 0)
+        session = http_client.get_http_session('local', validate=False)
+
+        _Handler.statuses = [503, 502]
+        assert session.get(server + '/', timeout=5).status_code == 200
+        assert _Handler.hits == 3
+
+        _Handler.statuses = [503]
+        assert session.post(server + '/', timeout=5).status_code == 503
+        assert _Handler.hits == 4
+        assert http_client.http_metrics.snapshot()['hosts']['127.0.0.1']['errors'] == 1
+
+    def test_retry_after_is_capped(self, server, monkeypatch):
+        monkeypatch.setattr(http_client, 'HTTP_RETRY_AFTER_MAX', 0.2)
+        session = http_client.get_http_session('local', validate=False)
+
+        _Handler.statuses = [503]
+        _Handler.retry_after = '3600'
+        start = time.perf_counter()
+        assert session.get(server + '/', timeout=5).status_code == 200
+        assert time.perf_counter() - start < 2
+        assert _Handler.hits == 2
+
+    def test_validated_sessions_refuse_local_addresses(self, server):
+        session = http_client.get_http_session('public')
+
+        with pytest.raises(UnacceptableAddressException):
+            session.get(server + '/', timeout=5)
+        assert _Handler.hits == 0
+        assert http_client.http_metrics.snapshot()['hosts']['127.0.0.1']['errors'] == 1
+
+    def test_proxy_settings_skip_the_address_validation(self, server, monkeypatch):
+        monkeypatch.setattr(http_client, 'getproxies', lambda: {'https': 'http://proxy:3128'})
+
+        session = http_client.get_http_session('proxied')
+
+        assert isinstance(session.get_adapter('https://example.com'), http_client.MeteredHTTPAdapter)
+        assert not isinstance(session.get_adapter('https://example.com'),
+                              http_client.MeteredValidatingHTTPAdapter)
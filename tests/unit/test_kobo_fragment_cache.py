@@ -0,0 +1,94 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the cached Kobo entitlement and metadata fragments"""
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from cps import kobo
+from cps.kobo_fragment_cache import KoboFragmentCache
+
+
+def _book(last_modified=datetime(2026, 3, 1, 12, 0), formats=('EPUB',)):
+    return SimpleNamespace(
+        id=7, uuid='0d7c6f7e-8d5b-4d8e-9a59-0d5a4a7f0c11', path='Author/Book (7)', title='Book',
+        timestamp=datetime(2026, 1, 1), pubdate=datetime(2020, 1, 1), last_modified=last_modified,
+        series_index=2.0, comments=[], authors=[SimpleNamespace(name='Author')], publishers=[], languages=[],
+        series=[SimpleNamespace(name='Saga')],
+        data=[SimpleNamespace(format=f, name='Book', uncompressed_size=100) for f in formats])
+
+
+@pytest.fixture
+def fragments(monkeypatch, tmp_path):
+    cache = KoboFragmentCache()
+    builds = []
+    build = kobo._build_metadata_fragment
+
+    def counting_build(book, known_facts=None):
+        builds.append(book.id)
+        return build(book, known_facts)
+
+    monkeypatch.setattr(kobo, 'fragment_cache', cache)
+    monkeypatch.setattr(kobo, '_build_metadata_fragment', counting_build)
+    monkeypatch.setattr(kobo, 'get_epub_facts', lambda book, data, known=None: None)
+    monkeypatch.setattr(kobo.config, 'config_use_google_drive', False, raising=False)
+    monkeypatch.setattr(kobo.config, 'get_book_path', lambda: str(tmp_path))
+    token = SimpleNamespace(value='user-a')
+    monkeypatch.setattr(kobo, 'get_download_url_for_book',
+                        lambda book_id, book_format: '/kobo/{}/download/{}/{}'.format(
+                            token.value, book_id, book_format.lower()))
+    return SimpleNamespace(cache=cache, builds=builds, token=token)
+
+
+@pytest.mark.unit
+class TestKoboFragments:
+    def test_metadata_is_built_once_and_urls_are_per_user(self, fragments):
+        book = _book()
+        first = kobo.get_metadata(book)
+        fragments.token.value = 'user-b'
+        second = kobo.get_metadata(book)
+
+        assert fragments.builds == [7]
+        assert first['DownloadUrls'][0]['Url'] == '/kobo/user-a/download/7/epub'
+        assert second['DownloadUrls'][0]['Url'] == '/kobo/user-b/download/7/epub'
+        assert [u['Format'] for u in second['DownloadUrls']] == ['EPUB3', 'EPUB']
+        assert first['Series'] == second['Series']
+
+    def test_entitlement_patches_archive_state(self, fragments):
+        book = _book()
+        archived = kobo.create_book_entitlement(book, archived=True)
+        active = kobo.create_book_entitlement(book, archived=False)
+        assert archived['IsRemoved'] is True and active['IsRemoved'] is False
+        assert 'ActivePeriod' in active
+        assert fragments.builds == [7]
+
+    def test_changed_book_cover_or_formats_rebuild(self, fragments, tmp_path):
+        kobo.get_metadata(_book())
+        kobo.get_metadata(_book(last_modified=datetime(2026, 3, 2)))
+        assert len(fragments.builds) == 2
+
+        kobo.get_metadata(_book(last_modified=datetime(2026, 3, 2), formats=('EPUB', 'KEPUB')))
+        assert len(fragments.builds) == 3
+
+        (tmp_path / 'Author' / 'Book (7)').mkdir(parents=True)
+        (tmp_path / 'Author' / 'Book (7)' / 'cover.jpg').write_bytes(b'jpg')
+        metadata = kobo.get_metadata(_book(last_modified=datetime(2026, 3, 2), formats=('EPUB', 'KEPUB')))
+        assert len(fragments.builds) == 4
+        assert [u['Format'] for u in metadata['DownloadUrls']] == ['KEPUB']
+        assert len(fragments.cache) == 1
+
+
+@pytest.mark.unit
+def test_fragment_cache_is_bounded():
+    cache = KoboFragmentCache(max_entries=2)
+    for book_id in range(3):
+        cache.put(book_id, 'rev', {'id': book_id})
+    assert cache.get(0, 'rev') is None
+    assert cache.get(2, 'rev') == {'id': 2}
+    assert cache.get(2, 'other-rev') is None
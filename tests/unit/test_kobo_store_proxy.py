@@ -0,0 +1,94 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the concurrent Kobo store proxy, against a local stand-in for the store"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import Flask
+
+from cps import kobo
+
+STORE_DELAY = 0.3
+
+
+class _StoreHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_GET(self):
+        time.sleep(STORE_DELAY)
+        _StoreHandler.connections.add(self.client_address)
+        body = json.dumps([{'NewEntitlement': {'Store': self.path}}]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-kobo-synctoken', 'store-token')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def store(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StoreHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _StoreHandler.connections = set()
+    monkeypatch.setattr(kobo, 'KOBO_STOREAPI_URL', 'http://127.0.0.1:{}'.format(server.server_port))
+    monkeypatch.setattr(kobo, '_kobo_store_session', None)
+    yield _StoreHandler
+    server.shutdown()
+    server.server_close()
+
+
+def _request_context():
+    return Flask(__name__).test_request_context('/kobo/abc/v1/library/sync', headers={'Host': 'cwa.local'})
+
+
+@pytest.mark.unit
+class TestKoboStoreProxy:
+    def test_store_request_overlaps_local_work(self, store):
+        with _request_context():
+            start = time.perf_counter()
+            kobo.make_request_to_kobo_store().json()
+            time.sleep(STORE_DELAY)  # local entitlement assembly
+            serial = time.perf_counter() - start
+
+            start = time.perf_counter()
+            future = kobo.start_request_to_kobo_store()
+            time.sleep(STORE_DELAY)
+            response = future.result()
+            concurrent = time.perf_counter() - start
+
+        assert response.json() == [{'NewEntitlement': {'Store': '/v1/library/sync'}}]
+        assert serial >= 2 * STORE_DELAY
+        assert concurrent < serial - STORE_DELAY / 2
+
+    def test_session_keeps_connections_alive(self, store):
+        with _request_context():
+            for __ in range(3):
+                kobo.make_request_to_kobo_store()
+        assert len(store.connections) == 1
+
+    def test_sync_token_is_forwarded(self, store):
+        class Token:
+            raw_kobo_store_token = 'device-token'
+
+            def set_kobo_store_header(self, headers):
+                headers.set('x-kobo-synctoken', self.raw_kobo_store_token)
+
+        with _request_context():
+            __, url, headers, __ = kobo._kobo_store_request_args(Token())
+        assert url.endswith('/v1/library/sync')
+        assert headers.get('x-kobo-synctoken') == 'device-token'
+        assert 'Host' not in headers
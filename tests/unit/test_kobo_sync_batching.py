@@ -0,0 +1,138 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the batched Kobo sync helpers"""
+
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cps import helper, kobo, kobo_sync_status, ub
+from cps.services import worker
+from cps.tasks.mail import TaskEmail
+
+
+@pytest.fixture
+def app_session(monkeypatch, collected_modules):
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    ub.Base.metadata.create_all(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    user = SimpleNamespace(id=1, name='reader')
+    monkeypatch.setattr(ub, 'session', session)
+    monkeypatch.setattr(kobo, 'current_user', user)
+    monkeypatch.setattr(kobo_sync_status, 'current_user', user)
+    yield SimpleNamespace(session=session, statements=statements)
+    session.remove()
+
+
+def _book(book_id, formats):
+    return SimpleNamespace(id=book_id, data=[SimpleNamespace(format=f) for f in formats])
+
+
+@pytest.mark.unit
+class TestBulkReadingStates:
+    def test_creates_missing_states_with_constant_queries(self, app_session):
+        existing = ub.ReadBook(user_id=1, book_id=2)
+        existing.kobo_reading_state = ub.KoboReadingState(user_id=1, book_id=2)
+        existing.kobo_reading_state.current_bookmark = ub.KoboBookmark(progress_percent=40)
+        existing.kobo_reading_state.statistics = ub.KoboStatistics()
+        app_session.session.add(existing)
+        app_session.session.commit()
+
+        for count in (10, 60):
+            app_session.statements.clear()
+            states = kobo.get_or_create_reading_states(list(range(1, count + 1)))
+            assert sorted(states) == list(range(1, count + 1))
+            assert states[2].current_bookmark.progress_percent == 40
+            assert all(state.statistics is not None for state in states.values())
+            selects = [s for s in app_session.statements if s.lstrip().upper().startswith('SELECT')]
+            assert len(selects) <= 8
+
+        assert app_session.session.query(ub.KoboReadingState).count() == 60
+
+    def test_synced_book_ids_are_added_once(self, app_session):
+        kobo_sync_status.add_synced_book_ids([3, 4])
+        kobo_sync_status.add_synced_book_ids([4, 5, 5])
+        rows = app_session.session.query(ub.KoboSyncedBooks.book_id).order_by(ub.KoboSyncedBooks.book_id).all()
+        assert [row.book_id for row in rows] == [3, 4, 5]
+
+
+@pytest.mark.unit
+class TestKepubConversionPending:
+    @pytest.fixture(autouse=True)
+    def conversions(self, monkeypatch, collected_modules):
+        queued = []
+        active = set()
+        monkeypatch.setattr(kobo.config, 'config_kepubifypath', '/usr/bin/kepubify', raising=False)
+        monkeypatch.setattr(kobo.config, 'get_book_path', lambda: '/books')
+        monkeypatch.setattr(kobo, 'current_user', SimpleNamespace(id=1, name='reader'))
+        monkeypatch.setattr(kobo, '_kepub_requests', dict())
+
+        def convert(book_id, *args, **kwargs):
+            queued.append(book_id)
+            active.add(book_id)
+
+        monkeypatch.setattr(kobo.helper, 'convert_book_format', convert)
+        monkeypatch.setattr(kobo, '_kepub_conversion_active', lambda book_id: book_id in active)
+        return SimpleNamespace(queued=queued, active=active)
+
+    def test_books_with_kepub_or_without_epub_are_not_held(self, conversions):
+        assert not kobo.kepub_conversion_pending(_book(1, ['EPUB', 'KEPUB']))
+        assert not kobo.kepub_conversion_pending(_book(2, ['PDF']))
+        assert conversions.queued == []
+
+    def test_conversion_is_queued_once_and_book_waits(self, conversions):
+        book = _book(1, ['EPUB'])
+        assert kobo.kepub_conversion_pending(book)
+        assert kobo.kepub_conversion_pending(book)
+        assert conversions.queued == [1]
+
+        # Conversion ended without producing a KEPUB, the EPUB is synced and not converted again
+        conversions.active.clear()
+        assert not kobo.kepub_conversion_pending(book)
+        assert conversions.queued == [1]
+
+    def test_wait_is_bounded(self, conversions, monkeypatch):
+        book = _book(1, ['EPUB'])
+        assert kobo.kepub_conversion_pending(book)
+        monkeypatch.setattr(kobo, 'KEPUB_CONVERSION_WAIT', 0)
+        assert not kobo.kepub_conversion_pending(book)
+
+
+@pytest.mark.unit
+def test_sync_conversion_starts_after_mails_and_requested_conversions(monkeypatch, tmp_path, collected_modules):
+    (tmp_path / 'book').mkdir()
+    (tmp_path / 'book' / 'Book.epub').write_bytes(b'epub')
+    lane = worker.TaskQueue()
+    added = []
+
+    def add(user, task, hidden=False):
+        added.append(task)
+        lane.put_task(worker.QueuedTask(len(added), user, None, task, hidden), task.priority)
+
+    monkeypatch.setattr(worker.WorkerThread, 'add', add)
+    monkeypatch.setattr(helper, 'calibre_db', SimpleNamespace(
+        get_book=lambda book_id: SimpleNamespace(id=book_id, path='book', title='Book'),
+        get_book_format=lambda book_id, book_format: SimpleNamespace(name='Book')))
+    monkeypatch.setattr(helper, 'url_for', lambda endpoint, **kwargs: '/book')
+    monkeypatch.setattr(helper.config, 'config_use_google_drive', False, raising=False)
+    monkeypatch.setattr(kobo.config, 'config_kepubifypath', '/usr/bin/kepubify', raising=False)
+    monkeypatch.setattr(kobo.config, 'get_book_path', lambda: str(tmp_path))
+    monkeypatch.setattr(kobo, 'current_user', SimpleNamespace(id=1, name='reader'))
+    monkeypatch.setattr(kobo, '_kepub_requests', dict())
+    monkeypatch.setattr(kobo, '_kepub_conversion_active', lambda book_id: False)
+
+    assert kobo.kepub_conversion_pending(_book(1, ['EPUB']))
+    helper.convert_book_format(1, str(tmp_path), 'EPUB', 'AZW3', 'reader')
+    worker.WorkerThread.add('reader', TaskEmail('Book', None, None, {}, 'reader@example.com', 'Send to eReader', ''))
+
+    sync_conversion, requested_conversion, mail = added
+    assert [lane.get_task().task for __ in added] == [mail, requested_conversion, sync_conversion]
@@ -0,0 +1,66 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the paging of the book table, sorted by multi valued columns"""
+
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, literal, true
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cps import db, web
+
+BOOK_TAGS = {1: ['Adventure', 'Biography'], 2: ['Cooking'], 3: ['Drama']}
+
+
+@pytest.fixture
+def books_table(monkeypatch):
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+    @event.listens_for(engine, 'connect')
+    def attach(connection, record):
+        connection.execute("ATTACH DATABASE ':memory:' AS calibre")
+
+    db.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    tags = dict()
+    for book_id, names in BOOK_TAGS.items():
+        session.execute(db.Books.__table__.insert().values(id=book_id, title='Book {}'.format(book_id),
+                                                           path='book{}'.format(book_id)))
+        for name in names:
+            tag = tags.setdefault(name, db.Tags(name))
+            session.add(tag)
+            session.flush()
+            session.execute(db.books_tags_link.insert().values(book=book_id, tag=tag.id))
+    session.commit()
+
+    calibre_db = SimpleNamespace(
+        generate_linked_query=lambda read_column, database: (session.query(database, literal(None), literal(None))
+                                                             .select_from(db.Books)),
+        common_filters=lambda allow_show_archived=False: true())
+    monkeypatch.setattr(web, 'calibre_db', calibre_db)
+    monkeypatch.setattr(web, 'config', SimpleNamespace(config_read_column=0))
+    yield
+    session.close()
+    engine.dispose()
+
+
+def _page(off, limit, order):
+    join = db.books_tags_link, db.Books.id == db.books_tags_link.c.book, db.Tags
+    return [entry[0] for entry in web._list_books_page(off, limit, order, *join)]
+
+
+@pytest.mark.unit
+class TestListBooksPaging:
+    def test_books_with_several_tags_fill_a_page_once(self, books_table):
+        order = [db.Tags.name.asc()]
+        assert _page(0, 2, order) == [1, 2]
+        assert _page(2, 2, order) == [3]
+
+    def test_descending_sort_uses_the_last_value(self, books_table):
+        assert _page(0, 3, [db.Tags.name.desc()]) == [3, 2, 1]
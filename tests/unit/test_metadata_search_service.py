@@ -0,0 +1,109 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the shared metadata provider search pool and its result cache"""
+
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from cps.metadata_search_service import (
+    STATUS_ERROR,
+    STATUS_OK,
+    STATUS_TIMEOUT,
+    MetadataSearchService,
+)
+from cps.services.Metadata import Metadata
+
+
+class _Provider(Metadata):
+    def __init__(self, provider_id, delay=0.0, error=None, deadline=None):
+        super().__init__()
+        self.__id__ = provider_id
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        if deadline:
+            self.SEARCH_DEADLINE = deadline
+
+    def search(self, query, generic_cover="", locale="en"):
+        self.calls.append((query, locale))
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [f"{self.__id__}:{query}", None]
+
+
+@pytest.mark.unit
+class TestMetadataSearchService:
+    def test_results_stream_in_completion_order(self):
+        service = MetadataSearchService(max_workers=4)
+        slow, fast = _Provider("slow", delay=0.3), _Provider("fast")
+
+        start = time.perf_counter()
+        first = next(service.search([slow, fast], "Dune", "", "en"))
+
+        assert first == (fast, ["fast:Dune"], STATUS_OK)
+        assert time.perf_counter() - start < 0.25
+
+    def test_repeated_searches_are_served_from_the_cache(self):
+        service = MetadataSearchService()
+        provider = _Provider("google")
+
+        list(service.search([provider], "Dune", "", "en"))
+        results = list(service.search([provider], "  dune ", "", "en"))
+        list(service.search([provider], "Dune", "", "de"))
+
+        assert results == [(provider, ["google:Dune"], STATUS_OK)]
+        assert provider.calls == [("Dune", "en"), ("Dune", "de")]
+        assert service.debug_info()["hits"] == 1
+
+    def test_slow_provider_misses_its_deadline_and_fills_the_cache_later(self):
+        service = MetadataSearchService(deadline=5)
+        slow = _Provider("slow", delay=0.3, deadline=0.05)
+        failing = _Provider("failing", error=RuntimeError("down"))
+
+        statuses = {provider.__id__: status for provider, __, status in service.search([slow, failing], "Dune")}
+        time.sleep(0.4)
+
+        assert statuses == {"slow": STATUS_TIMEOUT, "failing": STATUS_ERROR}
+        assert service.search_one(slow, "Dune") == ["slow:Dune"]
+        assert len(slow.calls) == 1
+        assert service.debug_info()["timeouts"] == 1 and service.debug_info()["failures"] == 1
+
+    def test_concurrent_identical_searches_share_one_call(self):
+        service = MetadataSearchService()
+        provider = _Provider("kobo", delay=0.2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.search_one(provider, "Dune")))
+                   for __ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == [["kobo:Dune"]] * 3
+        assert len(provider.calls) == 1
+
+    def test_search_one_raises_after_the_deadline(self):
+        service = MetadataSearchService()
+        with pytest.raises(TimeoutError):
+            service.search_one(_Provider("slow", delay=0.3), "Dune", timeout=0.05)
+
+
+@pytest.mark.unit
+def test_fetch_details_keeps_item_order_and_drops_failures():
+    def fetch(index, delay):
+        time.sleep(delay)
+        if index == 2:
+            raise ValueError("broken page")
+        return index
+
+    results = Metadata.fetch_details(fetch, [(0, 0.1), (1, 0.0), (2, 0.0), (3, 0.5)], timeout=0.3)
+
+    assert results == [0, 1, None, None]
@@ -0,0 +1,89 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the cache of rendered OPDS feeds"""
+
+import pytest
+from flask import Flask, make_response
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cps import opds, ub
+from cps.feed_cache import FeedCache
+
+
+@pytest.fixture
+def feed(monkeypatch, collected_modules):
+    cache = FeedCache()
+    library = {'marker': 1}
+    renders = []
+    monkeypatch.setattr(opds, 'feed_cache', cache)
+    monkeypatch.setattr(opds, 'feed_cache_key', lambda ttl=None: ('opds.feed_new', library['marker']))
+
+    app = Flask(__name__)
+
+    @app.route('/opds/new')
+    @opds.cached_feed()
+    def feed_new():
+        renders.append(1)
+        response = make_response('<feed>{}</feed>'.format(len(renders)))
+        response.headers['Content-Type'] = 'application/atom+xml; charset=utf-8'
+        return response
+
+    @app.route('/opds/missing')
+    @opds.cached_feed()
+    def feed_missing():
+        renders.append(1)
+        return make_response('', 404)
+
+    return app.test_client(), library, renders
+
+
+@pytest.mark.unit
+class TestCachedFeed:
+    def test_feed_is_rendered_once_and_revalidated(self, feed):
+        client, library, renders = feed
+        first = client.get('/opds/new')
+        second = client.get('/opds/new')
+        assert first.data == second.data == b'<feed>1</feed>'
+        assert first.headers['Content-Type'] == 'application/atom+xml; charset=utf-8'
+        assert len(renders) == 1
+
+        not_modified = client.get('/opds/new', headers={'If-None-Match': first.headers['ETag']})
+        assert not_modified.status_code == 304 and not_modified.data == b''
+
+        library['marker'] = 2
+        changed = client.get('/opds/new', headers={'If-None-Match': first.headers['ETag']})
+        assert changed.status_code == 200 and changed.data == b'<feed>2</feed>'
+        assert changed.headers['ETag'] != first.headers['ETag']
+
+    def test_errors_are_not_cached(self, feed):
+        client, __, renders = feed
+        assert client.get('/opds/missing').status_code == 404
+        assert client.get('/opds/missing').status_code == 404
+        assert len(renders) == 2
+
+
+@pytest.mark.unit
+def test_app_db_writes_to_shelves_invalidate(monkeypatch, collected_modules):
+    cache = FeedCache()
+    cache.put('key', b'<feed/>', {})
+    monkeypatch.setattr('cps.feed_cache.feed_cache', cache)
+    engine = create_engine('sqlite://')
+    ub.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    session.add(ub.Thumbnail(entity_id=1))
+    session.commit()
+    assert cache.generation == 0 and len(cache) == 1
+
+    session.add(ub.Shelf(name='Favourites', user_id=1))
+    session.commit()
+    assert cache.generation == 1 and len(cache) == 0
+
+    session.query(ub.BookShelf).filter(ub.BookShelf.book_id == 5).delete()
+    session.commit()
+    assert cache.generation == 2
@@ -0,0 +1,123 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the incremental series thumbnail task"""
+
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cps import constants, db, ub
+from cps.tasks import thumbnail as thumbnail_task
+from cps.thumbnail_index import ThumbnailIndex
+
+SMALL = constants.COVER_THUMBNAIL_SMALL
+MEDIUM = constants.COVER_THUMBNAIL_MEDIUM
+
+
+def _library():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+    @event.listens_for(engine, 'connect')
+    def attach(connection, __):
+        connection.execute("attach database ':memory:' as calibre")
+
+    db.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    books = []
+    # Series 1 has five covered books, series 2 three covered and one without cover
+    for book_id in range(1, 10):
+        books.append(dict(id=book_id, title='Book', sort='Book', author_sort='A', path='book{}'.format(book_id),
+                          series_index=book_id, has_cover=0 if book_id == 9 else 1, uuid=str(book_id),
+                          timestamp=datetime(2026, 1, 1), pubdate=datetime(2026, 1, 1),
+                          last_modified=datetime(2026, 1, book_id)))
+    session.execute(db.Books.__table__.insert(), books)
+    session.execute(db.books_series_link.insert(),
+                    [dict(book=book_id, series=1 if book_id <= 5 else 2) for book_id in range(1, 10)])
+    session.commit()
+    return session
+
+
+@pytest.fixture
+def series_task(monkeypatch, tmp_path, collected_modules):
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    ub.Base.metadata.create_all(engine)
+    app_session = scoped_session(sessionmaker(bind=engine))
+    calibre_session = _library()
+    index = ThumbnailIndex()
+    index._entries = {}
+    (tmp_path / 'cache').mkdir()
+    cache = SimpleNamespace(
+        get_cache_file_path=lambda filename, cache_type: str(tmp_path / 'cache' / filename),
+        get_cache_file_exists=lambda filename, cache_type: os.path.isfile(tmp_path / 'cache' / filename),
+        delete_cache_file=lambda filename, cache_type: None)
+    monkeypatch.setattr(ub, 'get_new_session_instance', lambda: app_session)
+    monkeypatch.setattr(thumbnail_task.db, 'CalibreDB', lambda **kwargs: SimpleNamespace(session=calibre_session))
+    monkeypatch.setattr(thumbnail_task.fs, 'FileSystem', lambda: cache)
+    monkeypatch.setattr(thumbnail_task, 'thumbnail_index', index)
+    monkeypatch.setattr(thumbnail_task.config, 'config_use_google_drive', False, raising=False)
+    monkeypatch.setattr(thumbnail_task.config, 'get_book_path', lambda: str(tmp_path))
+    task = thumbnail_task.TaskGenerateSeriesThumbnails()
+    yield SimpleNamespace(task=task, app_session=app_session, index=index, cache=tmp_path / 'cache',
+                          library=tmp_path)
+    app_session.remove()
+
+
+def _series_thumbnail(session, cache, resolution, generated_at):
+    thumbnail = ub.Thumbnail(type=constants.THUMBNAIL_TYPE_SERIES, entity_id=1, resolution=resolution,
+                             format='webp', generated_at=generated_at)
+    session.add(thumbnail)
+    session.commit()
+    (cache / thumbnail.filename).write_bytes(b'webp')
+    return thumbnail
+
+
+@pytest.mark.unit
+class TestSeriesThumbnails:
+    def test_membership_is_loaded_in_one_query(self, series_task):
+        series_books = series_task.task.get_series_books()
+        assert list(series_books) == [1]
+        assert [book.id for book in series_books[1]] == [1, 2, 3, 4, 5]
+
+    def test_only_dirty_series_are_regenerated(self, series_task):
+        task = series_task.task
+        series_books = task.get_series_books()
+        # Missing thumbnails
+        assert task.get_dirty_series(series_books, task.get_series_thumbnails()) == [
+            (1, series_books[1], [(SMALL, None), (MEDIUM, None)])]
+
+        small = _series_thumbnail(series_task.app_session, series_task.cache, SMALL, datetime(2026, 1, 6))
+        medium = _series_thumbnail(series_task.app_session, series_task.cache, MEDIUM, datetime(2026, 1, 4))
+        dirty = task.get_dirty_series(series_books, task.get_series_thumbnails())
+        assert dirty == [(1, series_books[1], [(MEDIUM, medium)])]
+
+        os.remove(series_task.cache / small.filename)
+        dirty = task.get_dirty_series(series_books, task.get_series_thumbnails())
+        assert [resolution for resolution, __ in dirty[0][2]] == [SMALL, MEDIUM]
+
+    def test_current_cover_thumbnails_are_used_as_tiles(self, series_task):
+        task = series_task.task
+        book = task.get_series_books()[1][2]
+        (series_task.library / book.path).mkdir()
+        (series_task.library / book.path / 'cover.jpg').write_bytes(b'jpg')
+        assert task.get_tile_source(book, MEDIUM) == str(series_task.library / book.path / 'cover.jpg')
+
+        thumbnail = ub.Thumbnail(type=constants.THUMBNAIL_TYPE_COVER, entity_id=book.id, resolution=MEDIUM,
+                                 format='jpg', filename='book_3_r2.jpg', generated_at=datetime(2026, 2, 1))
+        (series_task.cache / thumbnail.filename).write_bytes(b'jpg')
+        series_task.index.add(thumbnail)
+        assert task.get_tile_source(book, SMALL) == str(series_task.cache / thumbnail.filename)
+        assert task.get_tile_source(book, MEDIUM) == str(series_task.cache / thumbnail.filename)
+
+        # A thumbnail older than the book's last change isn't used
+        thumbnail.generated_at = datetime(2026, 1, 2)
+        series_task.index.add(thumbnail)
+        assert task.get_tile_source(book, SMALL).endswith('cover.jpg')
@@ -0,0 +1,103 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the in-memory thumbnail index and the cover resolver using it"""
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cps import constants, helper, ub
+from cps.thumbnail_index import ThumbnailIndex
+
+COVER = constants.THUMBNAIL_TYPE_COVER
+SMALL = constants.COVER_THUMBNAIL_SMALL
+
+
+def _thumbnail(entity_id, fmt, resolution=SMALL, thumbnail_type=COVER):
+    return ub.Thumbnail(type=thumbnail_type, entity_id=entity_id, resolution=resolution, format=fmt,
+                        filename='book_{}_r{}.{}'.format(entity_id, resolution, fmt),
+                        generated_at=datetime(2026, 3, 1))
+
+
+@pytest.mark.unit
+class TestThumbnailIndex:
+    def test_loads_once_and_follows_tasks(self):
+        engine = create_engine('sqlite://')
+        ub.Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add_all([_thumbnail(1, 'webp'), _thumbnail(1, 'jpg'), _thumbnail(2, 'webp')])
+        session.commit()
+
+        index = ThumbnailIndex()
+        index.load(session)
+        assert len(index) == 3
+        assert index.get(COVER, 1, SMALL, 'webp')[0] == 'book_1_r1.webp'
+        assert index.get(COVER, 3, SMALL, 'webp') is None
+
+        index.add(_thumbnail(3, 'webp'))
+        index.discard(COVER, 1)
+        assert index.get(COVER, 3, SMALL, 'webp')
+        assert index.get(COVER, 1, SMALL, 'jpg') is None
+        index.clear(COVER)
+        assert len(index) == 0
+
+    def test_add_before_load_is_left_to_the_load(self):
+        index = ThumbnailIndex()
+        index.add(_thumbnail(1, 'webp'))
+        index.discard(COVER, 1)
+        assert len(index) == 0
+
+
+@pytest.fixture
+def covers(monkeypatch, tmp_path, collected_modules):
+    index = ThumbnailIndex()
+    index._entries = {}
+    (tmp_path / 'thumbnails').mkdir()
+    (tmp_path / 'Author' / 'Book (1)').mkdir(parents=True)
+    (tmp_path / 'Author' / 'Book (1)' / 'cover.jpg').write_bytes(b'original')
+    monkeypatch.setattr(helper, 'thumbnail_index', index)
+    monkeypatch.setattr(helper, 'use_IM', False)
+    monkeypatch.setattr(helper.fs, 'FileSystem', lambda: SimpleNamespace(
+        get_cache_file_dir=lambda filename, cache_type: str(tmp_path / 'thumbnails')))
+    monkeypatch.setattr(helper.config, 'config_use_google_drive', False, raising=False)
+    monkeypatch.setattr(helper.config, 'get_book_path', lambda: str(tmp_path))
+    app = Flask(__name__)
+    with app.test_request_context('/cover/1/sm?c=1'):
+        yield SimpleNamespace(index=index, thumbnails=tmp_path / 'thumbnails')
+
+
+@pytest.mark.unit
+class TestCoverResolver:
+    book = SimpleNamespace(id=1, has_cover=True, path='Author/Book (1)')
+
+    def test_serves_preferred_format_with_immutable_headers(self, covers):
+        for fmt in ('webp', 'jpg'):
+            thumbnail = _thumbnail(1, fmt)
+            (covers.thumbnails / thumbnail.filename).write_bytes(fmt.encode())
+            covers.index.add(thumbnail)
+
+        response = helper.get_book_cover_internal(self.book, SMALL, versioned=True)
+        response.direct_passthrough = False
+        assert response.get_data() == b'webp'
+        assert response.cache_control.immutable and response.cache_control.max_age == 365 * 24 * 3600
+
+        response = helper.get_book_cover_internal(self.book, SMALL, for_kobo=True)
+        response.direct_passthrough = False
+        assert response.get_data() == b'jpg'
+        assert not response.cache_control.immutable
+
+    def test_missing_file_falls_back_to_cover(self, covers):
+        covers.index.add(_thumbnail(1, 'webp'))
+        response = helper.get_book_cover_internal(self.book, SMALL, versioned=True)
+        response.direct_passthrough = False
+        assert response.get_data() == b'original'
+        assert not response.cache_control.immutable
+        assert covers.index.get(COVER, 1, SMALL, 'webp') is None
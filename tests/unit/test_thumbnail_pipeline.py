@@ -0,0 +1,141 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for cover thumbnail generation through the render pool"""
+
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from cps import constants, ub
+from cps.services.worker import STAT_CANCELLED, STAT_FINISH_SUCCESS
+from cps.tasks import thumbnail as thumbnail_task
+from cps.thumbnail_index import ThumbnailIndex
+import thumbnail_render
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path, collected_modules):
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    ub.Base.metadata.create_all(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    index = ThumbnailIndex()
+    index._entries = {}
+    renders = []
+    books = [SimpleNamespace(id=book_id, path='book{}'.format(book_id), last_modified=datetime(2026, 1, 1))
+             for book_id in range(1, 6)]
+    for book in books:
+        (tmp_path / book.path).mkdir()
+        (tmp_path / book.path / 'cover.jpg').write_bytes(b'jpg')
+    (tmp_path / 'cache').mkdir()
+
+    def render(cover, outputs):
+        renders.append((cover, outputs))
+        for __, __, filename in outputs:
+            with open(filename, 'wb') as f:
+                f.write(b'thumb')
+        return [(filename, None) for __, __, filename in outputs]
+
+    cache = SimpleNamespace(
+        get_cache_file_path=lambda filename, cache_type: str(tmp_path / 'cache' / filename),
+        get_cache_file_exists=lambda filename, cache_type: os.path.isfile(tmp_path / 'cache' / filename),
+        delete_cache_file=lambda filename, cache_type: None)
+    monkeypatch.setattr(ub, 'get_new_session_instance', lambda: session)
+    monkeypatch.setattr(thumbnail_task, 'use_IM', True)
+    monkeypatch.setattr(thumbnail_task, 'render_cover_thumbnails', render)
+    monkeypatch.setattr(thumbnail_task, 'thumbnail_index', index)
+    monkeypatch.setattr(thumbnail_task, 'create_render_pool', lambda workers: ThreadPoolExecutor(workers))
+    monkeypatch.setattr(thumbnail_task.fs, 'FileSystem', lambda: cache)
+    monkeypatch.setattr(thumbnail_task.config, 'config_use_google_drive', False, raising=False)
+    monkeypatch.setattr(thumbnail_task.config, 'get_book_path', lambda: str(tmp_path))
+    monkeypatch.setattr(thumbnail_task.constants, 'THUMBNAIL_WORKERS', 2)
+    monkeypatch.setattr(thumbnail_task.TaskGenerateCoverThumbnails, 'get_cover_sources', lambda self: books)
+    yield SimpleNamespace(session=session, index=index, renders=renders, books=books)
+    session.remove()
+
+
+@pytest.mark.unit
+class TestThumbnailPipeline:
+    def test_each_cover_is_decoded_once_for_all_sizes(self, pipeline):
+        task = thumbnail_task.TaskGenerateCoverThumbnails()
+        task.run(None)
+
+        assert task.stat == STAT_FINISH_SUCCESS and task.progress == 1
+        assert len(pipeline.renders) == 5
+        assert all(len(outputs) == 6 for __, outputs in pipeline.renders)
+        assert pipeline.session.query(ub.Thumbnail).count() == 30
+        assert len(pipeline.index) == 30
+        assert pipeline.index.get(constants.THUMBNAIL_TYPE_COVER, 3, constants.COVER_THUMBNAIL_LARGE, 'jpg')
+
+        # Nothing left to render on the next run
+        pipeline.renders.clear()
+        task = thumbnail_task.TaskGenerateCoverThumbnails()
+        task.run(None)
+        assert pipeline.renders == [] and task.self_cleanup
+
+    def test_replaced_cover_is_cleared_and_regenerated_by_one_task(self, pipeline):
+        thumbnail_task.TaskGenerateCoverThumbnails().run(None)
+        pipeline.renders.clear()
+
+        task = thumbnail_task.TaskGenerateCoverThumbnails(1, replace=True)
+        task.run(None)
+
+        assert task.stat == STAT_FINISH_SUCCESS
+        assert len(pipeline.renders) == 1 and 'book1' in pipeline.renders[0][0]
+        assert pipeline.session.query(ub.Thumbnail).count() == 30
+        assert pipeline.index.get(constants.THUMBNAIL_TYPE_COVER, 1, constants.COVER_THUMBNAIL_LARGE, 'jpg')
+
+    def test_failed_render_reports_error_and_is_not_indexed(self, pipeline, monkeypatch):
+        def broken(cover, outputs):
+            raise ValueError('corrupt cover')
+
+        monkeypatch.setattr(thumbnail_task, 'render_cover_thumbnails', broken)
+        monkeypatch.setattr(thumbnail_task.constants, 'THUMBNAIL_WORKERS', 1)
+        task = thumbnail_task.TaskGenerateCoverThumbnails()
+        task.run(None)
+        assert 'corrupt cover' in task.error
+        assert len(pipeline.index) == 0
+
+    def test_cancellation_stops_the_scan(self, pipeline, monkeypatch):
+        task = thumbnail_task.TaskGenerateCoverThumbnails()
+        plan = task.create_book_cover_thumbnails
+
+        def cancel_after_first(book):
+            task.stat = STAT_CANCELLED
+            return plan(book)
+
+        monkeypatch.setattr(task, 'create_book_cover_thumbnails', cancel_after_first)
+        task.run(None)
+        assert task.stat == STAT_CANCELLED
+        assert len(pipeline.renders) <= 1
+
+
+@pytest.mark.unit
+class TestRenderPool:
+    def test_spawned_worker_renders_without_the_app(self):
+        pool = thumbnail_render.create_render_pool(1)
+        try:
+            assert pool.submit(thumbnail_render.get_resize_width, 1, 400, 600).result(timeout=120) == 170
+            assert pool.submit(eval, "'cps' in __import__('sys').modules").result(timeout=120) is False
+        finally:
+            pool.shutdown()
+
+    def test_entry_script_imports_the_app_only_as_main(self):
+        # What a spawned worker does with the main module of the server
+        script = ("import runpy, sys; runpy.run_path({!r}, run_name='__mp_main__'); "
+                  "print('cps' in sys.modules)").format(os.path.join(ROOT, 'cps.py'))
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=120)
+        assert result.stdout.strip() == 'False', result.stderr
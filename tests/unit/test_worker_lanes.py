@@ -0,0 +1,155 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Unit tests for the worker lanes of the background task worker"""
+
+import threading
+import time
+
+import pytest
+
+from cps.services import worker
+from cps.services.worker import (CalibreTask, WorkerThread, LANE_CPU, LANE_INTERACTIVE, LANE_IO, PRIORITY_HIGH,
+                                 PRIORITY_LOW, STAT_CANCELLED, STAT_FINISH_SUCCESS)
+
+
+class _Task(CalibreTask):
+    def __init__(self, label, started, lane=LANE_INTERACTIVE, priority=worker.PRIORITY_NORMAL, gate=None,
+                 book_id=None):
+        super(_Task, self).__init__(label)
+        self.label = label
+        self.started = started
+        self.lane = lane
+        self.priority = priority
+        self.gate = gate
+        self.book_id = book_id
+        self.done = threading.Event()
+
+    def run(self, worker_thread):
+        self.started.append(self.label)
+        if self.gate:
+            self.gate.wait(5)
+        self._handleSuccess()
+        self.done.set()
+
+    @property
+    def name(self):
+        return self.label
+
+    @property
+    def is_cancellable(self):
+        return True
+
+
+@pytest.fixture
+def lanes():
+    return WorkerThread({LANE_INTERACTIVE: 1, LANE_IO: 1, LANE_CPU: 1})
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.unit
+class TestWorkerLanes:
+    def test_long_task_does_not_block_other_lanes(self, lanes):
+        started = []
+        gate = threading.Event()
+        thumbnails = _Task('thumbnails', started, lane=LANE_CPU, gate=gate)
+        lanes.enqueue(None, thumbnails)
+        assert _wait_for(lambda: started == ['thumbnails'])
+        mail = _Task('mail', started)
+        lanes.enqueue('admin', mail)
+        try:
+            assert mail.done.wait(2)
+            assert not thumbnails.done.is_set()
+        finally:
+            gate.set()
+
+    def test_priority_within_lane(self, lanes):
+        started = []
+        gate = threading.Event()
+        blocker = _Task('blocker', started, lane=LANE_IO, gate=gate)
+        lanes.enqueue(None, blocker)
+        assert _wait_for(lambda: started == ['blocker'])
+        lanes.enqueue(None, _Task('backup', started, lane=LANE_IO, priority=PRIORITY_LOW))
+        lanes.enqueue(None, _Task('scan', started, lane=LANE_IO, priority=PRIORITY_LOW))
+        urgent = _Task('urgent', started, lane=LANE_IO, priority=PRIORITY_HIGH)
+        lanes.enqueue(None, urgent)
+        gate.set()
+        assert _wait_for(lambda: len(started) == 4)
+        assert started == ['blocker', 'urgent', 'backup', 'scan']
+
+    def test_tasks_and_cancellation_span_lanes(self, lanes):
+        started = []
+        gates = [threading.Event(), threading.Event()]
+        lanes.enqueue(None, _Task('io blocker', started, lane=LANE_IO, gate=gates[0]))
+        lanes.enqueue(None, _Task('cpu blocker', started, lane=LANE_CPU, gate=gates[1]))
+        assert _wait_for(lambda: len(started) == 2)
+        waiting = [_Task('hardcover', started, lane=LANE_IO, book_id=7),
+                   _Task('thumbnail', started, lane=LANE_CPU, book_id=7),
+                   _Task('other book', started, lane=LANE_CPU, book_id=8)]
+        for task in waiting:
+            lanes.enqueue(None, task)
+        try:
+            assert [item.task.label for item in lanes.tasks] == [
+                'io blocker', 'cpu blocker', 'hardcover', 'thumbnail', 'other book']
+            assert lanes.cancel_tasks_for_book(7) == 2
+            assert [task.stat for task in waiting[:2]] == [STAT_CANCELLED, STAT_CANCELLED]
+        finally:
+            for gate in gates:
+                gate.set()
+        assert waiting[2].done.wait(2)
+        assert 'hardcover' not in started and 'thumbnail' not in started
+
+    def test_exclusive_task_runs_alone_across_lanes(self, lanes):
+        started = []
+        gates = [threading.Event(), threading.Event()]
+        blocker = _Task('io blocker', started, lane=LANE_IO, gate=gates[0])
+        lanes.enqueue(None, blocker)
+        assert _wait_for(lambda: started == ['io blocker'])
+        reconnect = _Task('reconnect', started, gate=gates[1])
+        reconnect.exclusive = True
+        lanes.enqueue(None, reconnect)
+        time.sleep(0.2)
+        thumbnails = _Task('thumbnails', started, lane=LANE_CPU)
+        lanes.enqueue(None, thumbnails)
+        try:
+            time.sleep(0.3)
+            assert started == ['io blocker']
+            gates[0].set()
+            assert _wait_for(lambda: started == ['io blocker', 'reconnect'])
+            time.sleep(0.2)
+            assert not thumbnails.done.is_set()
+        finally:
+            for gate in gates:
+                gate.set()
+        assert thumbnails.done.wait(2) and started[-1] == 'thumbnails'
+
+    def test_idle_worker_starts_tasks_immediately(self, lanes):
+        time.sleep(1.2)  # lanes are idle and waited at least one get timeout
+        started = []
+        task = _Task('mail', started)
+        added = time.monotonic()
+        lanes.enqueue(None, task)
+        assert task.done.wait(2)
+        assert task.stat == STAT_FINISH_SUCCESS
+        assert time.monotonic() - added < 0.5
+
+
+@pytest.mark.unit
+def test_lane_concurrency_defaults_to_one_task_per_lane(monkeypatch):
+    monkeypatch.delenv('CWA_WORKER_LANES', raising=False)
+    assert worker.get_lane_concurrency() == {LANE_INTERACTIVE: 1, LANE_IO: 1, LANE_CPU: 1}
+
+
+@pytest.mark.unit
+def test_lane_concurrency_from_environment(monkeypatch):
+    monkeypatch.setenv('CWA_WORKER_LANES', 'interactive=3, cpu=0, io=x, unknown=2')
+    assert worker.get_lane_concurrency() == {LANE_INTERACTIVE: 3, LANE_IO: 1, LANE_CPU: 1}
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2026 Calibre-Web contributors
+# Copyright (C) 2024-2026 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""Rendering of cover thumbnails, run in worker processes.
+
+Spawned workers import this module by name and re-run cps.py as __mp_main__. The module lives outside the
+cps package and only needs Wand, and cps.py imports the app only when run as __main__, so the workers stay
+free of the application. A cover is decoded once, every resolution is derived from the next larger one and
+written in every requested format.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from wand.image import Image
+except (ImportError, RuntimeError):
+    Image = None
+
+THUMBNAIL_QUALITY = 82
+
+
+def get_resize_height(resolution):
+    return int(255 * resolution)
+
+
+def get_resize_width(resolution, original_width, original_height):
+    height = get_resize_height(resolution)
+    percent = (height / float(original_height))
+    width = int((float(original_width) * float(percent)))
+    return width if width % 2 == 0 else width + 1
+
+
+def render_cover_thumbnails(cover, outputs):
+    """Writes thumbnails of one cover.
+
+    cover is the path of the cover file or its content, outputs a list of (resolution, format, filename).
+    Returns a list of (filename, error), error is None for written files. A cover that can't be decoded
+    raises.
+    """
+    by_resolution = dict()
+    for resolution, fmt, filename in outputs:
+        by_resolution.setdefault(resolution, []).append((fmt, filename))
+
+    results = list()
+    with (Image(blob=cover) if isinstance(cover, bytes) else Image(filename=cover)) as source:
+        original_height = source.height
+        original_width = source.width
+        current = source
+        try:
+            for resolution in sorted(by_resolution, reverse=True):
+                img = current.clone()
+                height = get_resize_height(resolution)
+                if img.height > height:
+                    width = get_resize_width(resolution, original_width, original_height)
+                    img.resize(width=width, height=height, filter='lanczos')
+                if current is not source:
+                    current.close()
+                current = img
+                for fmt, filename in by_resolution[resolution]:
+                    try:
+                        img.format = fmt
+                        try:
+                            img.compression_quality = THUMBNAIL_QUALITY
+                        except Exception:
+                            pass
+                        img.save(filename=filename)
+                        results.append((filename, None))
+                    except Exception as ex:
+                        results.append((filename, str(ex)))
+        finally:
+            if current is not source:
+                current.close()
+    return results
+
+
+def create_render_pool(workers):
+    # Spawned instead of forked, the worker thread shares the process with the web server's threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))